@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# vim: set tabstop=4:softtabstop=4:shiftwidth=4:expandtab:textwidth=120
+
+"""Add user balances
+
+Revision ID: a00000000017
+Revises: a00000000016
+Create Date: 2020-02-03 10:24:51.102384
+
+"""
+
+from alembic import op
+
+# Revision identifiers, used by Alembic.
+revision = 'a00000000017'
+down_revision = 'a00000000016'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    conn = op.get_bind()
+
+    conn.execute(""" CREATE TABLE IF NOT EXISTS user_balances (
+                                    user_id                   BIGINT NOT NULL PRIMARY KEY,
+                                    balance                   BIGINT NOT NULL DEFAULT 0
+                            )""")
+
+    # The balances are updated once per statement and per user, so the bulk inserts of the billing stay cheap
+    conn.execute("""CREATE OR REPLACE FUNCTION update_user_balances() RETURNS TRIGGER AS $$
+                    BEGIN
+                        IF TG_OP = 'INSERT' THEN
+                            INSERT INTO user_balances (user_id, balance)
+                                 SELECT user_id, SUM(amount) FROM new_rows GROUP BY user_id
+                            ON CONFLICT (user_id) DO UPDATE SET balance = user_balances.balance + EXCLUDED.balance;
+                        ELSIF TG_OP = 'DELETE' THEN
+                            UPDATE user_balances AS ub SET balance = ub.balance - d.amount
+                              FROM (SELECT user_id, SUM(amount) AS amount FROM old_rows GROUP BY user_id) AS d
+                             WHERE ub.user_id = d.user_id;
+                        ELSE
+                            INSERT INTO user_balances (user_id, balance)
+                                 SELECT user_id, SUM(amount)
+                                   FROM (SELECT user_id, amount FROM new_rows
+                                          UNION ALL
+                                         SELECT user_id, amount * -1 FROM old_rows) AS d
+                                  GROUP BY user_id
+                            ON CONFLICT (user_id) DO UPDATE SET balance = user_balances.balance + EXCLUDED.balance;
+                        END IF;
+                        RETURN NULL;
+                    END;
+                    $$ LANGUAGE plpgsql""")
+
+    conn.execute("""LOCK TABLE user_accounts IN SHARE MODE""")
+    conn.execute("""CREATE TRIGGER trg_ua_balances_insert AFTER INSERT ON user_accounts
+                        REFERENCING NEW TABLE AS new_rows
+                        FOR EACH STATEMENT EXECUTE PROCEDURE update_user_balances()""")
+    conn.execute("""CREATE TRIGGER trg_ua_balances_update AFTER UPDATE ON user_accounts
+                        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+                        FOR EACH STATEMENT EXECUTE PROCEDURE update_user_balances()""")
+    conn.execute("""CREATE TRIGGER trg_ua_balances_delete AFTER DELETE ON user_accounts
+                        REFERENCING OLD TABLE AS old_rows
+                        FOR EACH STATEMENT EXECUTE PROCEDURE update_user_balances()""")
+    conn.execute("""INSERT INTO user_balances (user_id, balance)
+                         SELECT user_id, SUM(amount) FROM user_accounts GROUP BY user_id""")
+
+    # Used to find the end of the last computing period of a job
+    conn.execute(""" CREATE INDEX IF NOT EXISTS idx_ua_job_id_computing_end ON user_accounts(job_id, computing_end)
+                     WHERE computing_end IS NOT NULL""")
+
+
+def downgrade():
+    conn = op.get_bind()
+    conn.execute("""DROP INDEX IF EXISTS idx_ua_job_id_computing_end""")
+    conn.execute("""DROP TRIGGER IF EXISTS trg_ua_balances_delete ON user_accounts""")
+    conn.execute("""DROP TRIGGER IF EXISTS trg_ua_balances_update ON user_accounts""")
+    conn.execute("""DROP TRIGGER IF EXISTS trg_ua_balances_insert ON user_accounts""")
+    conn.execute("""DROP FUNCTION IF EXISTS update_user_balances()""")
+    conn.execute("""DROP TABLE user_balances""")
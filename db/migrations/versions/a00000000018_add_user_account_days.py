@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+# vim: set tabstop=4:softtabstop=4:shiftwidth=4:expandtab:textwidth=120
+
+"""Add user account days
+
+Revision ID: a00000000018
+Revises: a00000000017
+Create Date: 2020-02-05 16:41:12.530917
+
+"""
+
+from alembic import op
+
+# Revision identifiers, used by Alembic.
+revision = 'a00000000018'
+down_revision = 'a00000000017'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    conn = op.get_bind()
+
+    # Daily rollup of user_accounts. job_id is 0 for the transactions without job
+    conn.execute(""" CREATE TABLE IF NOT EXISTS user_account_days (
+                                    day                       DATE NOT NULL,
+                                    user_id                   BIGINT NOT NULL,
+                                    job_id                    BIGINT NOT NULL DEFAULT 0,
+                                    description               TEXT NOT NULL,
+                                    amount                    BIGINT NOT NULL DEFAULT 0,
+                                    nbr_transactions          INTEGER NOT NULL DEFAULT 0,
+                                    last_date                 TIMESTAMP NOT NULL,
+                                    PRIMARY KEY (day, user_id, job_id, description)
+                            )""")
+    conn.execute(""" CREATE INDEX IF NOT EXISTS idx_uad_user_id_day ON user_account_days(user_id, day) """)
+    conn.execute(""" CREATE INDEX IF NOT EXISTS idx_ua_date ON user_accounts(date) """)
+
+    conn.execute("""CREATE OR REPLACE FUNCTION update_user_account_days() RETURNS TRIGGER AS $$
+                    BEGIN
+                        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                            UPDATE user_account_days AS uad
+                               SET amount = uad.amount - d.amount,
+                                   nbr_transactions = uad.nbr_transactions - d.nbr_transactions
+                              FROM (SELECT date::date AS day, user_id, COALESCE(job_id, 0) AS job_id, description,
+                                           SUM(amount) AS amount, COUNT(*) AS nbr_transactions
+                                      FROM old_rows
+                                     GROUP BY 1, 2, 3, 4) AS d
+                             WHERE uad.day = d.day
+                               AND uad.user_id = d.user_id
+                               AND uad.job_id = d.job_id
+                               AND uad.description = d.description;
+                            DELETE FROM user_account_days AS uad
+                             USING (SELECT DISTINCT date::date AS day, user_id, COALESCE(job_id, 0) AS job_id,
+                                           description
+                                      FROM old_rows) AS d
+                             WHERE uad.day = d.day
+                               AND uad.user_id = d.user_id
+                               AND uad.job_id = d.job_id
+                               AND uad.description = d.description
+                               AND uad.nbr_transactions <= 0;
+                            UPDATE user_account_days AS uad
+                               SET last_date = (SELECT MAX(ua.date)
+                                                  FROM user_accounts AS ua
+                                                 WHERE ua.date >= uad.day
+                                                   AND ua.date < uad.day + 1
+                                                   AND ua.user_id = uad.user_id
+                                                   AND COALESCE(ua.job_id, 0) = uad.job_id
+                                                   AND ua.description = uad.description)
+                              FROM (SELECT DISTINCT date::date AS day, user_id, COALESCE(job_id, 0) AS job_id,
+                                           description
+                                      FROM old_rows) AS d
+                             WHERE uad.day = d.day
+                               AND uad.user_id = d.user_id
+                               AND uad.job_id = d.job_id
+                               AND uad.description = d.description;
+                        END IF;
+                        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                            INSERT INTO user_account_days (day, user_id, job_id, description, amount,
+                                                           nbr_transactions, last_date)
+                                 SELECT date::date, user_id, COALESCE(job_id, 0), description, SUM(amount), COUNT(*),
+                                        MAX(date)
+                                   FROM new_rows
+                                  GROUP BY 1, 2, 3, 4
+                            ON CONFLICT (day, user_id, job_id, description) DO UPDATE
+                                    SET amount = user_account_days.amount + EXCLUDED.amount,
+                                        nbr_transactions = user_account_days.nbr_transactions
+                                                           + EXCLUDED.nbr_transactions,
+                                        last_date = GREATEST(user_account_days.last_date, EXCLUDED.last_date);
+                        END IF;
+                        RETURN NULL;
+                    END;
+                    $$ LANGUAGE plpgsql""")
+
+    conn.execute("""LOCK TABLE user_accounts IN SHARE MODE""")
+    conn.execute("""CREATE TRIGGER trg_ua_days_insert AFTER INSERT ON user_accounts
+                        REFERENCING NEW TABLE AS new_rows
+                        FOR EACH STATEMENT EXECUTE PROCEDURE update_user_account_days()""")
+    conn.execute("""CREATE TRIGGER trg_ua_days_update AFTER UPDATE ON user_accounts
+                        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+                        FOR EACH STATEMENT EXECUTE PROCEDURE update_user_account_days()""")
+    conn.execute("""CREATE TRIGGER trg_ua_days_delete AFTER DELETE ON user_accounts
+                        REFERENCING OLD TABLE AS old_rows
+                        FOR EACH STATEMENT EXECUTE PROCEDURE update_user_account_days()""")
+    conn.execute("""INSERT INTO user_account_days (day, user_id, job_id, description, amount, nbr_transactions,
+                                                   last_date)
+                         SELECT date::date, user_id, COALESCE(job_id, 0), description, SUM(amount), COUNT(*), MAX(date)
+                           FROM user_accounts
+                          GROUP BY 1, 2, 3, 4""")
+
+
+def downgrade():
+    conn = op.get_bind()
+    conn.execute("""DROP TRIGGER IF EXISTS trg_ua_days_delete ON user_accounts""")
+    conn.execute("""DROP TRIGGER IF EXISTS trg_ua_days_update ON user_accounts""")
+    conn.execute("""DROP TRIGGER IF EXISTS trg_ua_days_insert ON user_accounts""")
+    conn.execute("""DROP FUNCTION IF EXISTS update_user_account_days()""")
+    conn.execute("""DROP INDEX IF EXISTS idx_ua_date""")
+    conn.execute("""DROP TABLE user_account_days""")
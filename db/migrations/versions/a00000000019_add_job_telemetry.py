@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# vim: set tabstop=4:softtabstop=4:shiftwidth=4:expandtab:textwidth=120
+
+"""Add job telemetry
+
+Revision ID: a00000000019
+Revises: a00000000018
+Create Date: 2020-02-07 11:02:46.318204
+
+"""
+
+from alembic import op
+
+# Revision identifiers, used by Alembic.
+revision = 'a00000000019'
+down_revision = 'a00000000018'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    conn = op.get_bind()
+
+    # Resource samples of the worker, as written by the worker runner (csv)
+    conn.execute("""ALTER TABLE jobs ADD COLUMN IF NOT EXISTS telemetry TEXT DEFAULT NULL""")
+
+
+def downgrade():
+    conn = op.get_bind()
+    conn.execute("""ALTER TABLE jobs DROP COLUMN IF EXISTS telemetry""")
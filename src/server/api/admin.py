@@ -9,6 +9,7 @@ import logging
 import json
 import collections
 import datetime
+import time
 
 # Specific libs
 from flask import Blueprint, g, jsonify, request, abort
@@ -23,6 +24,7 @@ from lib import error_util
 from lib import date_util
 from core import api_util
 from core import web_util
+import core.worker_pool
 import models.users
 import models.projects
 import models.provider_config
@@ -471,6 +473,22 @@ def user_change_rank():
 
 # ----------------------- Providers -------------------------------------------
 
+@api_admin.route('/users/auth_cache/', methods=['GET', 'POST'])
+def users_auth_cache():
+    stats = models.users.get_auth_cache_stats()
+    hits = stats["local_hits"] + stats["redis_hits"]
+    total = hits + stats["misses"]
+    duration = max(1, int(time.time()) - stats["start_time"])
+    return resp({
+        "local_hits": stats["local_hits"],
+        "redis_hits": stats["redis_hits"],
+        "misses": stats["misses"],
+        "hit_ratio": float(hits) / total if total else 0.0,
+        "saved_queries_per_second": float(hits) / duration,
+        "start_time": datetime.datetime.utcfromtimestamp(stats["start_time"])
+    })
+
+
 @api_admin.route('/providers/list/', methods=['GET', 'POST'])
 def provider_list():
     # Check params
@@ -1110,6 +1128,33 @@ def computation_list():
     return resp(results, jobs.full_count)
 
 
+@api_admin.route('/computations/executor/', methods=['GET', 'POST'])
+def computation_executor():
+    stats = models.jobs.get_executor_stats()
+    if stats is None:
+        return resp({"running": False})
+    return resp({
+        "running": True,
+        "queued_jobs": stats.get("queued", 0),
+        "running_jobs": stats.get("running", 0),
+        "max_jobs": stats.get("max_jobs", 0),
+        "update_time": datetime.datetime.utcfromtimestamp(stats["update_time"]) if "update_time" in stats else None
+    })
+
+
+@api_admin.route('/computations/worker_pools/', methods=['GET', 'POST'])
+def computation_worker_pools():
+    results = []
+    for stats in core.worker_pool.get_all_pool_stats():
+        stats = dict(stats)
+        if stats["update_time"] is not None:
+            stats["update_time"] = datetime.datetime.utcfromtimestamp(stats["update_time"])
+        stats["idle_seconds"] = int(stats["idle_seconds"])
+        stats["arrival_rate"] = round(stats["arrival_rate"], 2)
+        results.append(stats)
+    return resp(results)
+
+
 @api_admin.route('/computations/show/', methods=['GET', 'POST'])
 def computation_show():
     # Check params
@@ -1175,6 +1220,7 @@ def computation_show():
         "toolchain_specific": toolchain_specific,
         "computation_consumption": api_util.price_to_float(float(computation_consumption)*-1.0),
         "storage_consumption": api_util.price_to_float(storage_consumption),
+        "telemetry": models.jobs.get_job_telemetry(job['id']),
     }
     return resp(result)
 
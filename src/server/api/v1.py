@@ -75,7 +75,7 @@ def before_request():
     if ":" not in key:
         abort(401)
     login, password = key.split(":", 1)
-    user_data = models.users.authenticate(login, password)
+    user_data = models.users.authenticate_with_cache(request.headers['Authorization'], login, password)
     if not user_data:
         abort(401)
 
@@ -1052,70 +1052,41 @@ def calculation_show():
     if not web_util.check_request_params(request, "project_codename", "calculation_name"):
         abort(400)
     params = web_util.get_req_params(request)
-    project = models.projects.get_project(g.user['id'], params['project_codename'])
-    if not project:
-        abort(404, "unknown project " + str(params["project_codename"]))
-    calc = models.calc.get_calc_by_name(g.user['id'], params['project_codename'], params['calculation_name'])
+    calc = models.calc.get_calc_details(g.user['id'], params['project_codename'], params['calculation_name'])
     if not calc:
+        abort(404, "unknown project " + str(params["project_codename"]))
+    if calc['id'] is None:
         abort(404, "unknown calculation " + str(params["calculation_name"]))
 
     # Real work
-    storage = g.storages[project["storage"]]
+    storage_name = calc["project_storage"]
+    storage = g.storages[storage_name]
+
+    def get_url(filename):
+        if storage.type == "local_filesystem":
+            return url_for('public.local_file', storage_name=storage_name, subpath=filename, _external=True,
+                           _scheme='https')
+        return storage.get_file_url(filename)
+
     follow_url = None
     follow_date = None
     if calc['status_file_id'] is not None:
-        follow_file = models.projects.get_file_by_id(g.user['id'], params['project_codename'], calc['status_file_id'])
-        if not follow_file:
+        if not calc['status_filename']:
             log.warning("calculation status file is missing for calculation "+str(calc['id']))
         else:
-            follow_date = follow_file['change_date']
-            if storage.type == "local_filesystem":
-                follow_url = url_for('public.local_file', storage_name=project["storage"],
-                                     subpath=follow_file['filename'], _external=True, _scheme='https')
-            else:
-                follow_url = storage.get_file_url(follow_file['filename'])
+            follow_date = calc['status_change_date']
+            follow_url = get_url(calc['status_filename'])
 
     result_url = None
     if calc['result_file_id'] is not None:
-        result_file = models.projects.get_file_by_id(g.user['id'], params['project_codename'], calc['result_file_id'])
-        if not result_file:
+        if not calc['result_filename']:
             log.warning("calculation result file is missing for calculation "+str(calc['id']))
-        elif storage.type == "local_filesystem":
-            result_url = url_for('public.local_file', storage_name=project["storage"],
-                                 subpath=result_file['filename'], _external=True, _scheme='https')
-        else:
-            result_url = storage.get_file_url(result_file['filename'])
-
-    iterations_url = None
-    if calc['iterations_file_id'] is not None:
-        iterations_file = models.projects.get_file_by_id(g.user['id'], params['project_codename'],
-                                                         calc['iterations_file_id'])
-        if not iterations_file:
-            # log.warning("calculation iterations file is missing for calculation " + str(calc['id']))
-            pass
-        elif storage.type == "local_filesystem":
-            iterations_url = url_for('public.local_file', storage_name=project["storage"],
-                                     subpath=iterations_file['filename'], _external=True, _scheme='https')
-        else:
-            iterations_url = storage.get_file_url(iterations_file['filename'])
-
-    reduce_url = None
-    if calc['iterations_file_id'] is not None:
-        reduce_file = models.projects.get_file_by_id(g.user['id'], params['project_codename'], calc['reduce_file_id'])
-        if not reduce_file:
-            # log.warning("calculation iterations file is missing for calculation " + str(calc['id']))
-            pass
-        elif storage.type == "local_filesystem":
-            reduce_url = url_for('public.local_file', storage_name=project["storage"],
-                                 subpath=reduce_file['filename'], _external=True, _scheme='https')
         else:
-            reduce_url = storage.get_file_url(reduce_file['filename'])
+            result_url = get_url(calc['result_filename'])
 
-    nbr_coins = 0
-    if calc['job_id']:
-        job = models.jobs.get_job(int(calc['job_id']))
-        if job:
-            nbr_coins = api_util.price_to_float(models.jobs.get_job_consume(job['id'])) * -1
+    iterations_url = get_url(calc['iterations_filename']) if calc['iterations_filename'] else None
+    reduce_url = get_url(calc['reduce_filename']) if calc['reduce_filename'] else None
+    nbr_coins = api_util.price_to_float(calc['job_consume']) * -1 if calc['job_id'] else 0
 
     return resp({
         "calculation_id": calc['id'],
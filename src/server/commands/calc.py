@@ -2,7 +2,6 @@
 # vim: set tabstop=4:softtabstop=4:shiftwidth=4:expandtab:textwidth=120
 
 # Python libs
-import time
 import logging
 import os
 import datetime
@@ -24,6 +23,7 @@ from core import storages
 API_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
 COMMAND_NAME = "calc"
 STATUS_FETCHING_DELAY = 120
+STOP_CHECKING_DELAY = 5
 DO_NOT_KILL_INSTANCES = False
 IS_TOOLCHAIN_SECURED = True
 REMOVE_RESULTS_ON_ERROR = True
@@ -106,7 +106,7 @@ def run(api_name, server_name, job_id, project_codename, mesh_name, calc_id, cal
             os.remove(calc_param_file)
 
 
-def fetch_progress(conn, user_id, project_codename, calc_name, calc_id, storage, tmp_folder):
+def fetch_progress(conn, user_id, project_codename, calc_name, calc_id, storage, tmp_folder, status_snapshot=None):
     """
     Check if a progress file has been created on the main worker and save it if it exists
 
@@ -124,6 +124,9 @@ def fetch_progress(conn, user_id, project_codename, calc_name, calc_id, storage,
     :type storage:                  core.ssh.Storage
     :param tmp_folder:              A temporary folder to use
     :type tmp_folder:               str
+    :param status_snapshot:         The local copy of the status files, updated incrementally. Optional, default None
+                                    If not provided, the whole status file is generated again on the worker
+    :type status_snapshot:          cmd_util.CalcStatusSnapshot|None
     :return:                        True if success, False if no file is found or a failure happens
     :rtype:                         bool
     """
@@ -144,16 +147,26 @@ def fetch_progress(conn, user_id, project_codename, calc_name, calc_id, storage,
         zipper_command = util.path_join(api_util.WORKER_WORK_PATH, "ZephyTOOLS", "APPLI", "TMP",
                                         "CFD_CALC_ZIP_STATUS.py")
         old_status_file = models.calc.get_calc_status_file(user_id, project_codename, calc_id)
-        status_file_path = util.path_join(api_util.WORKER_OUTPUT_PATH, status_file_name)
-        conn.run(["python", zipper_command, "-i", calc_dir, "-o", status_file_path])
-
-        worker_out_storage = storages.SshStorage(conn, api_util.WORKER_OUTPUT_PATH, IS_TOOLCHAIN_SECURED)
-        if not status_file.exists(worker_out_storage):
-            log.warning("Unable to get calculation status file: file not found")
-            return False
-        status_file.save_on_storage(worker_out_storage, storage, tmp_folder)
+        if status_snapshot is not None:
+            status_snapshot.fetch(conn, zipper_command, calc_dir, tmp_folder)
+            if not status_snapshot.changed and old_status_file:
+                return True  # The saved status file is up to date
+            with file_util.temp_filename(dir=tmp_folder, suffix=".zip") as tmp:
+                status_snapshot.make_zip(tmp)
+                status_file.save_local_file_on_storage(tmp, storage)
+        else:
+            status_file_path = util.path_join(api_util.WORKER_OUTPUT_PATH, status_file_name)
+            conn.run(["python", zipper_command, "-i", calc_dir, "-o", status_file_path])
+
+            worker_out_storage = storages.SshStorage(conn, api_util.WORKER_OUTPUT_PATH, IS_TOOLCHAIN_SECURED)
+            if not status_file.exists(worker_out_storage):
+                log.warning("Unable to get calculation status file: file not found")
+                return False
+            status_file.save_on_storage(worker_out_storage, storage, tmp_folder)
         file_id = status_file.save_in_database(user_id)
         models.calc.save_status_file(user_id, project_codename, calc_id, file_id)
+        if status_snapshot is not None:
+            status_snapshot.mark_saved()
     except error_util.all_errors as e:
         with error_util.saved_stack() as error_stack:
             status_file.delete_from_distant(storage)
@@ -252,6 +265,10 @@ def calculate(api_name, server_name, job, project, mesh, calculation, calc_param
     if split_results:
         iterations_file = cmd_util.ResultFile(project_codename, result_name + "_iterations.zip")
         reduce_file = cmd_util.ResultFile(project_codename, result_name + "_reduce.zip")
+    result_files = [result_file, internal_file] + ([iterations_file, reduce_file] if split_results else [])
+    direct_upload = cmd_util.is_direct_upload_enabled(storage)
+    status_snapshot = cmd_util.CalcStatusSnapshot(tmp_folder)
+    pipeline = None
 
     # Uploading file on cloud storage
     log.info("Uploading param file to storage")
@@ -261,8 +278,18 @@ def calculate(api_name, server_name, job, project, mesh, calculation, calc_param
         with cmd_util.using_workers(api_name, provider, job_id, machine, nbr_machines, tags,
                                     debug_keep_instances_alive=DO_NOT_KILL_INSTANCES) as workers:
             # Launch main script
-            with cmd_util.TaskProcess(job_id, job["project_uid"], "calc", workers, [split_results]) as task_proc:
+            with cmd_util.TaskProcess(job_id, job["project_uid"], "calc", workers, [split_results],
+                                      direct_upload=direct_upload) as task_proc:
                 conn = workers.ssh_connection
+                worker_out_storage = storages.SshStorage(conn, api_util.WORKER_OUTPUT_PATH, IS_TOOLCHAIN_SECURED)
+                pipeline = cmd_util.ResultPipeline(result_files, worker_out_storage, storage, tmp_folder)
+                task_proc.set_event_handler("result_ready", pipeline.on_result_ready)
+                if direct_upload:
+                    task_proc.set_event_handler("upload_targets",
+                                                lambda _: cmd_util.send_upload_targets(conn, result_files, storage))
+                    task_proc.set_event_handler("upload_parts",
+                                                lambda value: cmd_util.send_upload_target_extension(
+                                                    conn, result_files, storage, value))
                 # Charge user
                 end_time = models.users.charge_user_computing(user_id, job_id, "Cloud computation cost")
                 if models.users.get_credit(user_id) <= 0:
@@ -285,6 +312,7 @@ def calculate(api_name, server_name, job, project, mesh, calculation, calc_param
                 log.info("Starting the computation")
                 task_proc.start()
                 last_fetched_progress_time = datetime.datetime.utcfromtimestamp(0)
+                last_stop_check_time = datetime.datetime.utcfromtimestamp(0)
                 is_stopped = False
                 while True:
                     task_status = task_proc.check_status()
@@ -301,10 +329,12 @@ def calculate(api_name, server_name, job, project, mesh, calculation, calc_param
                         break
                     if (datetime.datetime.utcnow() - last_fetched_progress_time).seconds > STATUS_FETCHING_DELAY:
                         fetch_progress(conn, user_id, project_codename, calculation['name'], calculation['id'], storage,
-                                       tmp_folder)
+                                       tmp_folder, status_snapshot)
                         last_fetched_progress_time = datetime.datetime.utcnow()
 
-                    if not is_stopped:
+                    stop_check_age = (datetime.datetime.utcnow() - last_stop_check_time).total_seconds()
+                    if not is_stopped and stop_check_age >= STOP_CHECKING_DELAY:
+                        last_stop_check_time = datetime.datetime.utcnow()
                         calculation = models.calc.get_calc(user_id, project['uid'], calculation['id'])
                         if not calculation:
                             raise api_util.ToolchainError("Calculation " + str(calc_id) + " disappeared")
@@ -312,47 +342,20 @@ def calculate(api_name, server_name, job, project, mesh, calculation, calc_param
                             log.info("Stopping computation")
                             stop_calc(conn, project_codename)
                             is_stopped = True
-                    time.sleep(1)
+                    task_proc.wait_for_event(1)
 
                 # Checking if the machine is still here
                 if not conn.ping():
                     models.jobs.save_job_text(job_id, "Worker instance disappeared")
                     raise api_util.ToolchainError("Worker instance disappeared")
 
-                # Fetching computed data
+                # Fetching computed data, the files already announced by the worker are being saved
                 log.info("Saving results")
-                worker_out_storage = storages.SshStorage(conn, api_util.WORKER_OUTPUT_PATH, IS_TOOLCHAIN_SECURED)
-                log_file = util.path_join(api_util.WORKER_OUTPUT_PATH, "worker.log")
-                if conn.file_exists(log_file):
-                    with file_util.temp_filename(dir=tmp_folder) as tmp:
-                        conn.get_file(log_file, tmp)
-                        models.jobs.save_job_log(job_id, tmp)
-                else:
-                    log.warning("No worker log file")
-
-                if not result_file.exists(worker_out_storage):
-                    log.error("Unable to find file " + str(result_file) + " on worker")
-                    raise api_util.ToolchainError("Task failed, no result file")
-                result_file.save_on_storage(worker_out_storage, storage, tmp_folder)
-
-                if split_results:
-                    if not iterations_file.exists(worker_out_storage):
-                        log.error("Unable to find file " + str(iterations_file) + " on worker")
-                        raise api_util.ToolchainError("Task failed, no result file")
-                    iterations_file.save_on_storage(worker_out_storage, storage, tmp_folder)
-
-                    if not reduce_file.exists(worker_out_storage):
-                        log.error("Unable to find file " + str(reduce_file) + " on worker")
-                        raise api_util.ToolchainError("Task failed, no result file")
-                    reduce_file.save_on_storage(worker_out_storage, storage, tmp_folder)
-
-                if internal_file.exists(worker_out_storage):
-                    internal_file.save_on_storage(worker_out_storage, storage, tmp_folder)
-                else:
-                    log.warning("No internal files found on server")
-
-                fetch_progress(conn, user_id, project_codename, calculation['name'], calculation['id'], storage,
-                               tmp_folder)
+                pipeline.run_in_background(cmd_util.save_worker_log, conn, job_id, tmp_folder)
+                pipeline.run_in_background(fetch_progress, conn, user_id, project_codename, calculation['name'],
+                                           calculation['id'], storage, tmp_folder, status_snapshot)
+                required_files = [result_file] + ([iterations_file, reduce_file] if split_results else [])
+                pipeline.finish(required_files, [internal_file])
                 log.info("Computation result fetched")
 
                 # Signaling all output was fetched
@@ -375,10 +378,14 @@ def calculate(api_name, server_name, job, project, mesh, calculation, calc_param
                                           None, None, internal_file_id)
     except error_util.all_errors:
         with error_util.before_raising():
+            if pipeline is not None:
+                pipeline.close()
             if REMOVE_RESULTS_ON_ERROR:
                 internal_file.delete_from_distant(storage)
                 result_file.delete_from_distant(storage)
                 if split_results:
                     iterations_file.delete_from_distant(storage)
                     reduce_file.delete_from_distant(storage)
+    finally:
+        status_snapshot.close()
     log.info("Results saved")
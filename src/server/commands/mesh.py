@@ -2,14 +2,11 @@
 # vim: set tabstop=4:softtabstop=4:shiftwidth=4:expandtab:textwidth=120
 
 # Python libs
-import time
 import logging
 import os
 import datetime
 
 # Project Specific libs
-from lib import util
-from lib import file_util
 from lib import error_util
 import models.jobs
 import models.projects
@@ -144,12 +141,16 @@ def compute_mesh(api_name, server_name, job, project, mesh_param_file, mesh_name
     }
 
     models.users.charge_user_fix_price(user_id, job_id, "Mesh storage cost")
+    pipeline = None
     try:
         with cmd_util.using_workers(api_name, provider, job_id, machine, nbr_machines, tags,
                                     debug_keep_instances_alive=DO_NOT_KILL_INSTANCES) as workers:
             # Launching aziugo process launcher
             with cmd_util.TaskProcess(job_id, job["project_uid"], "mesh", workers) as task_proc:
                 conn = workers.ssh_connection
+                worker_out_storage = storages.SshStorage(conn, api_util.WORKER_OUTPUT_PATH, IS_TOOLCHAIN_SECURED)
+                pipeline = cmd_util.ResultPipeline([mesh_file, preview_file], worker_out_storage, storage, tmp_folder)
+                task_proc.set_event_handler("result_ready", pipeline.on_result_ready)
                 # Charge user
                 end_time = models.users.charge_user_computing(user_id, job_id, "Cloud computation cost")
                 if models.users.get_credit(user_id) <= 0:
@@ -181,32 +182,17 @@ def compute_mesh(api_name, server_name, job, project, mesh_param_file, mesh_name
                     if task_status != models.jobs.JOB_STATUS_RUNNING:
                         log.info("Computation finished with status: " + models.jobs.job_status_to_str(task_status))
                         break
-                    time.sleep(5)
+                    task_proc.wait_for_event(5)
 
                 # Checking if the machine is still here
                 if not conn.ping():
                     models.jobs.save_job_text(job_id, "Worker instance disappeared")
                     raise api_util.ToolchainError("Worker instance disappeared")
 
-                # Fetching computed data
+                # Fetching computed data, the files already announced by the worker are being saved
                 log.info("Fetching results")
-                log_file = util.path_join(api_util.WORKER_OUTPUT_PATH, "worker.log")
-                if conn.file_exists(log_file):
-                    with file_util.temp_filename(dir=tmp_folder) as tmp:
-                        conn.get_file(log_file, tmp)
-                        models.jobs.save_job_log(job_id, tmp)
-                else:
-                    log.warning("No worker log file")
-
-                worker_out_storage = storages.SshStorage(conn, api_util.WORKER_OUTPUT_PATH, IS_TOOLCHAIN_SECURED)
-                if not mesh_file.exists(worker_out_storage):
-                    log.error("Unable to find file " + str(mesh_file) + " on worker")
-                    raise api_util.ToolchainError("Task failed, no result file")
-                mesh_file.save_on_storage(worker_out_storage, storage, tmp_folder)
-                if preview_file.exists(worker_out_storage):
-                    preview_file.save_on_storage(worker_out_storage, storage, tmp_folder)
-                else:
-                    log.warning("No preview found on server")
+                pipeline.run_in_background(cmd_util.save_worker_log, conn, job_id, tmp_folder)
+                pipeline.finish([mesh_file], [preview_file])
 
                 # Signaling all output was fetched
                 task_proc.stop_and_wait()
@@ -221,6 +207,8 @@ def compute_mesh(api_name, server_name, job, project, mesh_param_file, mesh_name
         models.meshes.save_mesh_files(user_id, project_codename, mesh_name, mesh_file.file_id, preview_file_id)
     except error_util.all_errors:
         with error_util.before_raising():
+            if pipeline is not None:
+                pipeline.close()
             if REMOVE_RESULTS_ON_ERROR:
                 mesh_file.delete_from_distant(storage)
                 preview_file.delete_from_distant(storage)
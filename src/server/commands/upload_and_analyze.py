@@ -2,7 +2,6 @@
 # vim: set tabstop=4:softtabstop=4:shiftwidth=4:expandtab:textwidth=120
 
 # Python libs
-import time
 import logging
 import os
 import datetime
@@ -176,7 +175,7 @@ def analyse(api_name, server_name, job, project, storage_name, project_file, pro
                     if task_status != models.jobs.JOB_STATUS_RUNNING:
                         log.info("Computation finished with status: " + models.jobs.job_status_to_str(task_status))
                         break
-                    time.sleep(5)
+                    task_proc.wait_for_event(5)
 
                 # Checking if the machine is still here
                 if not conn.ping():
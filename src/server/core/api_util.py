@@ -122,10 +122,15 @@ def addr(obj):
 class DatabaseContext(object):
     _thread_local = threading.local()
     _dsn = None
+    _pool = None
+    _pool_size = pg_util.ConnectionPool.MAX_SIZE
+    _pool_timeout = pg_util.ConnectionPool.TIMEOUT
+    _pool_lock = threading.Lock()
 
     @staticmethod
     def set_dsn(dsn):
         DatabaseContext._dsn = dsn
+        DatabaseContext._reset_pool()
 
     @staticmethod
     def get_dsn():
@@ -147,13 +152,44 @@ class DatabaseContext(object):
         dsn += "port='" + str(port) + "' "
         dsn += "user='" + user + "' "
         dsn += "password='" + password + "' "
-        DatabaseContext._dsn = dsn
+        if conf.has_option("database", "pool_size"):
+            DatabaseContext._pool_size = conf.getint("database", "pool_size")
+        if conf.has_option("database", "pool_timeout"):
+            DatabaseContext._pool_timeout = conf.getfloat("database", "pool_timeout")
+        DatabaseContext.set_dsn(dsn)
+
+    @staticmethod
+    def get_pool():
+        """
+        Get the connection pool shared by all the threads of the process
+
+        :return:        The connection pool, or None if pooling is disabled (pool_size <= 0)
+        :rtype:         pg_util.ConnectionPool|None
+        """
+        if DatabaseContext._pool_size <= 0:
+            return None
+        with DatabaseContext._pool_lock:
+            if DatabaseContext._pool is None:
+                DatabaseContext._pool = pg_util.ConnectionPool(DatabaseContext.get_dsn(),
+                                                               max_size=DatabaseContext._pool_size,
+                                                               timeout=DatabaseContext._pool_timeout)
+            return DatabaseContext._pool
+
+    @staticmethod
+    def _reset_pool():
+        with DatabaseContext._pool_lock:
+            if DatabaseContext._pool is not None:
+                DatabaseContext._pool.close_all()
+            DatabaseContext._pool = None
 
     @staticmethod
     def get_conn():
         if not hasattr(DatabaseContext._thread_local, "conn"):
-            dsn = DatabaseContext.get_dsn()
-            DatabaseContext._thread_local.conn = pg_util.ConnectionWrapper(dsn=dsn)
+            pool = DatabaseContext.get_pool()
+            if pool is not None:
+                DatabaseContext._thread_local.conn = pg_util.PooledConnectionWrapper(pool)
+            else:
+                DatabaseContext._thread_local.conn = pg_util.ConnectionWrapper(dsn=DatabaseContext.get_dsn())
         return DatabaseContext._thread_local.conn
 
     @staticmethod
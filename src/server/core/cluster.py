@@ -8,7 +8,7 @@ import time
 import os
 import subprocess
 import logging
-import copy
+import collections
 
 # Project libs
 from lib import ssh
@@ -23,6 +23,19 @@ import api_util
 log = logging.getLogger("aziugo")
 
 
+def get_setup_max_parallel():
+    """
+    Get the maximum number of cluster bring-up steps (instance creation, node setup) running at the same time
+
+    :return:        The maximum number of parallel steps. Default 16
+    :rtype:         int
+    """
+    conf = api_util.get_conf()
+    if not conf.has_option("general", "cluster_setup_max_parallel"):
+        return 16
+    return max(1, conf.getint("general", "cluster_setup_max_parallel"))
+
+
 class Cluster(object):
     """
     Aws cluster
@@ -38,12 +51,16 @@ class Cluster(object):
 
             cluster.add_slaves(2)
             ssh_conn.run(["launch", "compute"])
+
+    With nbr_slaves, the master and the slaves are created at the same time and set up as soon as each one is up:
+        with Cluster(provider, "aziugo", 8, nbr_slaves=7, machine="c4.2xlarge") as cluster:
+            ssh_conn = SshConnection(ip=cluster.ip, user=cluster.user)
     """
 
     # --------------------------------------- Public section section ---------------------------------------------------
 
     def __init__(self, provider, ssh_user, nbr_cores, job_id=None, tags=None,
-                 _debug_no_terminate=False, **creation_options):
+                 _debug_no_terminate=False, nbr_slaves=0, **creation_options):
         """
         Create a cluster, reserving master instance and initialising it
         Warning: this method can be really long
@@ -54,6 +71,8 @@ class Cluster(object):
         :type job_id:                   str|None
         :param _debug_no_terminate:     Tell the cluster to never kill the instances. Optional, default False
         :type _debug_no_terminate:      bool
+        :param nbr_slaves:              The number of slaves to create with the master. Optional, default 0
+        :type nbr_slaves:               int
         :param creation_options:        The workers creation options> See Cloud.create_workers for more details
         :type creation_options:         any
         """
@@ -72,12 +91,14 @@ class Cluster(object):
         self._worker_group = None
         self._worker_cores = nbr_cores
         self._tags = tags if tags else {}
+        self._nbr_slaves = int(nbr_slaves)
+        self._timings = collections.OrderedDict()
 
     def init(self):
         try:
             self._worker_group = self._provider.generate_worker_group(self.job_id)
             self._worker_group.init()
-            self._add_master()
+            self._bring_up(self._nbr_slaves)
         except error_util.all_errors:
             with error_util.before_raising():
                 self.clean()
@@ -91,33 +112,7 @@ class Cluster(object):
         :param nbr_slaves:      The number of slaves computer you want the cluster to create
         :type nbr_slaves:       int
         """
-        self._init_cluster()
-        new_workers = self._provider.create_workers(nbr_slaves, worker_group=self._worker_group,
-                                                    **self._creation_options)
-        try:
-            slave_index = len(self._slaves)
-            for worker in new_workers:
-                tags = {}
-                for key, val in self._tags.items():
-                    if key.startswith("%master%_"):
-                        continue
-                    if key.startswith("%slave%_"):
-                        key = key[len("%slave%_"):]
-                    if type_util.is_string(val):
-                        tags[key] = val.replace("%slave_index%", str(slave_index+1))
-                    else:
-                        tags[key] = val
-                self._provider.tag_workers([worker], tags)
-                slave_index += 1
-            self._prepare_slaves_instances(new_workers)
-            self._allow_slave_ssh_hosts(new_workers)
-            self._update_openfoam_config(new_workers)
-        except error_util.all_errors:
-            with error_util.before_raising():
-                if not self._no_clean or not new_workers:
-                    self._try_cleaning(new_workers)
-        # finally, all works fine, so we can save the new information
-        self._slaves.extend(new_workers)
+        self._bring_up(nbr_slaves)
 
     @property
     def job_id(self):
@@ -193,6 +188,14 @@ class Cluster(object):
         """
         return os.path.join(self.user_home, "machines")
 
+    @property
+    def timings(self):
+        """
+        :return:    The duration of each bring-up phase, in seconds, summed over all the bring-ups of the cluster
+        :rtype:     dict[str, float]
+        """
+        return collections.OrderedDict(self._timings)
+
     @property
     def workers(self):
         """
@@ -269,9 +272,58 @@ class Cluster(object):
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.clean()
 
+    def _bring_up(self, nbr_slaves):
+        """
+        Create the missing instances and set them up, each step starting as soon as its dependencies are done:
+        the master and the slaves are created at the same time, each node is set up with a single ssh command
+        as soon as it is joinable, and the master is finally told about the new slaves.
+        Warning: this method can be really long, especially with spot instances
+
+        :param nbr_slaves:      The number of slaves to add
+        :type nbr_slaves:       int
+        """
+        new_slaves = []
+        graph = _BringUpGraph(get_setup_max_parallel())
+        master_deps = []
+        if self._master is None:
+            graph.add("create master", "create_master", [], self._add_master)
+            master_deps.append("create master")
+        if nbr_slaves > 0:
+            graph.add("create slaves", "create_slaves", [], self._create_slaves, nbr_slaves, new_slaves)
+            slave_deps = []
+            if not self._cluster_inited:
+                graph.add("ssh key", "ssh_key", [], self._generate_ssh_key)
+                graph.add("master setup", "master_setup", master_deps + ["ssh key"], self._prepare_master)
+                slave_deps = ["ssh key", "master setup"]
+            first_index = len(self._slaves)
+            for i in range(nbr_slaves):
+                connect_step = "slave " + str(first_index + i + 1) + " connection"
+                setup_step = "slave " + str(first_index + i + 1) + " setup"
+                graph.add(connect_step, "slaves_connection", ["create slaves"], self._wait_for_slave, new_slaves, i)
+                graph.add(setup_step, "slaves_setup", slave_deps + [connect_step], self._prepare_slave, new_slaves, i)
+            graph.add("master update", "master_update", [n for n in graph.step_names if n.endswith(" setup")],
+                      self._update_master, new_slaves)
+
+        start = time.time()
+        try:
+            graph.run()
+        except error_util.all_errors:
+            with error_util.before_raising():
+                if new_slaves and not self._no_clean:
+                    self._try_cleaning(new_slaves)
+        finally:
+            for phase, duration in graph.timings.items():
+                self._timings[phase] = self._timings.get(phase, 0) + duration
+        # finally, all works fine, so we can save the new information
+        self._slaves.extend(new_slaves)
+        if nbr_slaves > 0:
+            log.info("Cluster of " + str(self.nbr_instances) + " instances ready in %.1fs (%s)" %
+                     (time.time() - start, ", ".join("%s: %.1fs" % (phase, duration)
+                                                     for phase, duration in graph.timings.items())))
+
     def _add_master(self):
         """
-        Create master master instance and initialising it
+        Create master master instance and tag it
         Warning: this method can be really long
         """
         new_workers = []
@@ -286,17 +338,39 @@ class Cluster(object):
                     key = key[len("%master%_"):]
                 tags[key] = val
             self._provider.tag_workers(new_workers, tags)
+            log.info("Main worker launched, with id " + str(self.master_id))
         except error_util.all_errors:
             with error_util.before_raising():
                 if new_workers:
                     self._try_cleaning(new_workers)
 
-    def _init_cluster(self):
-        if self._cluster_inited:
-            return
-        self._generate_ssh_key()
-        self._prepare_master()
-        self._cluster_inited = True
+    def _create_slaves(self, nbr_slaves, new_slaves):
+        """
+        Create the slave instances and tag them
+
+        :param nbr_slaves:      The number of slaves to create
+        :type nbr_slaves:       int
+        :param new_slaves:      The list to fill with the created slaves, for the next steps and the cleaning
+        :type new_slaves:       list[worker.Worker]
+        """
+        log.info("Launching " + str(nbr_slaves) + " slave workers...")
+        new_slaves.extend(self._provider.create_workers(nbr_slaves, worker_group=self._worker_group,
+                                                        **self._creation_options))
+        slave_index = len(self._slaves)
+        for worker in new_slaves:
+            tags = {}
+            for key, val in self._tags.items():
+                if key.startswith("%master%_"):
+                    continue
+                if key.startswith("%slave%_"):
+                    key = key[len("%slave%_"):]
+                if type_util.is_string(val):
+                    tags[key] = val.replace("%slave_index%", str(slave_index+1))
+                else:
+                    tags[key] = val
+            self._provider.tag_workers([worker], tags)
+            slave_index += 1
+        log.info("Slave workers launched")
 
     def _try_cleaning(self, new_workers):
         try:
@@ -331,191 +405,266 @@ class Cluster(object):
             with open(key_file_path+".pub", 'r') as content_file:
                 self._cluster_pubkey = content_file.read()
 
-    def _prepare_slaves_instances(self, workers):
-        """
-        Launch all the instances initialisation in parallel (using sub-processes) and kill them all if one fail
-
-        :param workers:             The details of the instances to prepare
-        :type workers:              list[worker.Worker]
-        """
-        running_threads = set([])
-        all_threads = set([])
-
-        # starting sub-process for parallel instance initialisation
-        slave_index = len(self._slaves)
-        for worker in workers:
-            slave_ip = worker.public_ip if worker.public_ip else worker.private_ip
-            slave_initializer_thread = _SlaveInitializer(self, slave_ip, slave_index)
-            running_threads.add(slave_initializer_thread)
-            all_threads.add(slave_initializer_thread)
-            slave_initializer_thread.start()
-            slave_index += 1
-
-        failed_thread = None
-        # waiting for all process to finish or for the first to fail
-        while failed_thread is None and len(running_threads) > 0:
-            time.sleep(0.1)
-            for thread in copy.copy(running_threads):
-                if thread.is_alive():
-                    continue
-                running_threads.discard(thread)
-                if not thread.succeed() != 0:
-                    log.error("Slave initialization failed with exit code " + str(thread.get_exception()))
-                    failed_thread = thread
-                    break
-
-        if failed_thread is not None:
-            failed_thread.reraise()
-
-        for thread in all_threads:
-            thread.join()
+    def _get_ssh_setup_script(self):
+        """
+        Get the shell commands installing the cluster ssh keys for the cluster user
+
+        :return:        The shell commands
+        :rtype:         str
+        """
+        user_auth_file = proc_util.shell_quote(self.user_home + "/.ssh/authorized_keys")
+        ssh_folder = proc_util.shell_quote(self.user_home + "/.ssh")
+        owner = proc_util.shell_quote(self.user + ":" + self.user)
+        return "\n".join([
+            "mkdir -p " + proc_util.shell_quote(self.work_folder),
+            "chown -R " + owner + " " + proc_util.shell_quote(self.work_folder),
+            "mkdir -p " + ssh_folder,
+            "touch " + user_auth_file,
+            "sed -i '/cluster_/d' " + user_auth_file,
+            "echo '' >> " + user_auth_file,
+            "echo " + proc_util.shell_quote(self._cluster_pubkey) + " >> " + user_auth_file,
+            "cat > " + ssh_folder + "/id_rsa << 'CLUSTER_KEY_EOF'",
+            self._cluster_privkey.rstrip("\n"),
+            "CLUSTER_KEY_EOF",
+            "cat > " + ssh_folder + "/id_rsa.pub << 'CLUSTER_KEY_EOF'",
+            self._cluster_pubkey.rstrip("\n"),
+            "CLUSTER_KEY_EOF",
+            "chmod 600 " + ssh_folder + "/id_rsa",
+            "chmod 644 " + ssh_folder + "/id_rsa.pub",
+            "chown -R " + owner + " " + ssh_folder
+        ])
 
     def _prepare_master(self):
         """
-        Protected, Prepare the master instance, installing ssh keys, updating software and preparing nfs share folder
+        Protected, Prepare the master instance, installing ssh keys and preparing nfs share folder
         """
+        ssh_conn = ssh.SshConnection(self.ip, "root", self._root_key)
         try:
-            ssh_conn = ssh.SshConnection(self.ip, "root", self._root_key)
-            try:
-                log.info("Waiting for master to be ready")
-                ssh_conn.wait_for_connection()
-            except error_util.abort_errors: raise
-            except error_util.all_errors as e:
-                raise RuntimeError("Unable to connect to master instance (ip = " + self.ip + "): "+e.message)
-            log.info("Start cluster master initialization")
-
-            ssh_conn.run(["mkdir", "-p", self.work_folder])
-            ssh_conn.run(["chown", "-R", self.user+":"+self.user, self.work_folder])
-
-            # SSh config
-            ssh_conn.run(["mkdir", "-p", self.user_home + "/.ssh"])
-            user_auth_file = self.user_home + "/.ssh/authorized_keys"
-            ssh_conn.run(["sed", "-i", "/cluster_/d", user_auth_file])
-            ssh_conn.run("echo '' >> " + proc_util.shell_quote(user_auth_file), shell=True)
-            ssh_conn.run("echo " + proc_util.shell_quote(self._cluster_pubkey) + " >> " +
-                         proc_util.shell_quote(user_auth_file), shell=True)
-            with file_util.temp_file(self._cluster_privkey) as priv_key:
-                ssh_conn.send_file(priv_key, self.user_home + "/.ssh/id_rsa")
-            with file_util.temp_file(self._cluster_pubkey) as pub_key:
-                ssh_conn.send_file(pub_key, self.user_home + "/.ssh/id_rsa.pub")
-            ssh_conn.run(["chmod", "600", self.user_home + "/.ssh/id_rsa"])
-            ssh_conn.run(["chmod", "644", self.user_home + "/.ssh/id_rsa.pub"])
-            ssh_conn.run(["chown", "-R", self.user + ":" + self.user, self.user_home + "/.ssh"])
-
-            if self._provider.type == "docker":
-                return  # no need for this
-            ssh_conn.run(["sed", "-i", "/"+self.work_folder.replace("/", "\\/")+"/d", '/etc/exports'])
-            ssh_conn.run(["sh", "-c", "echo '"+self.work_folder+"  *(rw,sync,no_subtree_check)' >> /etc/exports"])
-            ssh_conn.run("exportfs -ra")
-            ssh_conn.run("service nfs-kernel-server start")
-            ssh_conn.run("echo '"+str(self.ip) + "' > '" + self.machines_file_path + "'", shell=True)
-            log.info("Master initialized")
-        except error_util.abort_errors: return
+            log.info("Waiting for master to be ready")
+            ssh_conn.wait_for_connection()
+        except error_util.abort_errors: raise
+        except error_util.all_errors as e:
+            raise RuntimeError("Unable to connect to master instance (ip = " + self.ip + "): "+str(e))
+        log.info("Start cluster master initialization")
+
+        script = ["set -e", self._get_ssh_setup_script()]
+        if self._provider.type != "docker":
+            work_folder = proc_util.shell_quote(self.work_folder)
+            script.extend([
+                "sed -i " + proc_util.shell_quote("/" + self.work_folder.replace("/", "\\/") + "/d") + " /etc/exports",
+                "echo " + proc_util.shell_quote(self.work_folder + "  *(rw,sync,no_subtree_check)") + " >> /etc/exports",
+                "exportfs -ra",
+                "service nfs-kernel-server start",
+                "echo " + proc_util.shell_quote(str(self.ip)) + " > " + proc_util.shell_quote(self.machines_file_path)
+            ])
+        try:
+            ssh_conn.run_script("\n".join(script) + "\n")
+        except error_util.abort_errors: raise
         except error_util.all_errors as e:
             with error_util.before_raising():
                 error_util.log_error(log, e)
+        self._cluster_inited = True
+        log.info("Master initialized")
 
-    def _prepare_slave(self, slave_ip, slave_index):
+    def _wait_for_slave(self, new_slaves, index):
         """
-        Protected, Prepare the slave instance, allowing ssh access, updating software and mounting nfs share folder
+        Protected, Wait until a new slave instance accepts ssh connections
 
-        :param slave_ip:         The public ip of the slave to prepare, used to establish ssh connection
-        :type slave_ip:          str
-        :param slave_index:      The index of the new slave (used for logs)
-        :type slave_index:       int
+        :param new_slaves:      The new slaves
+        :type new_slaves:       list[worker.Worker]
+        :param index:           The index of the slave to wait for in new_slaves
+        :type index:            int
         """
+        slave = new_slaves[index]
+        slave_ip = slave.public_ip if slave.public_ip else slave.private_ip
         try:
-            ssh_conn = ssh.SshConnection(slave_ip, "root", self._root_key)
-            try:
-                ssh_conn.wait_for_connection()
-            except error_util.abort_errors: raise
-            except error_util.all_errors as e:
-                raise RuntimeError("Unable to connect to slave instance (ip = " + self.ip + "): "+e.message)
-            log.info("Start slave " + str(slave_index + 1) + " initialisation")
-
-            ssh_conn.run(["umount", self.work_folder], can_fail=True)
-            ssh_conn.run(["mkdir", "-p", self.work_folder])
-            ssh_conn.run(["chown", "-R", self.user + ":" + self.user, self.work_folder])
-
-            # SSh config
-            ssh_conn.run(["mkdir", "-p", self.user_home + "/.ssh"])
-            user_auth_file = self.user_home + "/.ssh/authorized_keys"
-            ssh_conn.run(["sed", "-i", "/cluster_/d", user_auth_file])
-            ssh_conn.run("echo '' >> " + proc_util.shell_quote(user_auth_file), shell=True)
-            ssh_conn.run("echo " + proc_util.shell_quote(self._cluster_pubkey) + " >> " +
-                         proc_util.shell_quote(user_auth_file), shell=True)
-            with file_util.temp_file(self._cluster_privkey) as priv_key:
-                ssh_conn.send_file(priv_key, self.user_home + "/.ssh/id_rsa")
-            with file_util.temp_file(self._cluster_pubkey) as pub_key:
-                ssh_conn.send_file(pub_key, self.user_home + "/.ssh/id_rsa.pub")
-            ssh_conn.run(["chmod", "600", self.user_home + "/.ssh/id_rsa"])
-            ssh_conn.run(["chmod", "644", self.user_home + "/.ssh/id_rsa.pub"])
-            ssh_conn.run(["chown", "-R", self.user + ":" + self.user, self.user_home + "/.ssh"])
-
-            if self._provider.type == "docker":
-                return  # no need for this
-            master_ip = self._master.private_ip if self._master.private_ip else self._master.public_ip
-            ssh_conn.run(["find", self.work_folder, "-mindepth", "1", "-delete"])
-            ssh_conn.run(["mount", "-t", "nfs", master_ip+":"+self.work_folder, self.work_folder])
-            log.info("Slave "+str(slave_index+1)+" initialized")
-        except error_util.abort_errors: return
+            ssh.SshConnection(slave_ip, "root", self._root_key).wait_for_connection()
+        except error_util.abort_errors: raise
         except error_util.all_errors as e:
-            with error_util.before_raising():
-                log.error("Slave "+str(slave_index+1)+" initialisation failed: " + str(e))
+            raise RuntimeError("Unable to connect to slave instance (ip = " + slave_ip + "): "+str(e))
 
-    def _allow_slave_ssh_hosts(self, workers):
+    def _prepare_slave(self, new_slaves, index):
         """
-        Protected, ensure the master instance can establish ssh connection to the new slaves smoothly
+        Protected, Prepare a new slave instance, allowing ssh access and mounting nfs share folder
 
-        :param workers:         The details of the instances to prepare
-        :type workers:          list[worker.Worker]
+        :param new_slaves:      The new slaves
+        :type new_slaves:       list[worker.Worker]
+        :param index:           The index of the slave to prepare in new_slaves
+        :type index:            int
         """
-        new_private_ips = map(lambda x: x.private_ip if x.private_ip else x.public_ip, workers)
-        ssh_conn = ssh.SshConnection(self.ip, "root", self._root_key)
-        # adding new instance ssh identity to allow smooth ssh connection from master
-        for private_ip in new_private_ips:
-            ssh_conn.run(["touch", "/root/.ssh/known_hosts"])
-            ssh_conn.run(["ssh-keygen", "-R", private_ip])
-            ssh_conn.run("ssh-keyscan -H '" + private_ip + "' >> '/root/.ssh/known_hosts'", shell=True)
-
-        ssh_conn = ssh.SshConnection(self.ip, self._user, self._user_key)
-        # adding new instance ssh identity to allow smooth ssh connection from master
-        for private_ip in new_private_ips:
-            ssh_conn.run(["touch", self.user_home + "/.ssh/known_hosts"])
-            ssh_conn.run(["ssh-keygen", "-R", private_ip])
-            ssh_conn.run("ssh-keyscan -H '" + private_ip + "' >> '" + self.user_home + "/.ssh/known_hosts'", shell=True)
+        slave_index = len(self._slaves) + index
+        slave = new_slaves[index]
+        slave_ip = slave.public_ip if slave.public_ip else slave.private_ip
+        log.info("Start slave " + str(slave_index + 1) + " initialisation")
+        work_folder = proc_util.shell_quote(self.work_folder)
+        script = ["umount " + work_folder + " || true", "set -e", self._get_ssh_setup_script()]
+        if self._provider.type != "docker":
+            master_ip = self._master.private_ip if self._master.private_ip else self._master.public_ip
+            script.extend([
+                "find " + work_folder + " -mindepth 1 -delete",
+                "mount -t nfs " + proc_util.shell_quote(master_ip + ":" + self.work_folder) + " " + work_folder
+            ])
+        try:
+            ssh.SshConnection(slave_ip, "root", self._root_key).run_script("\n".join(script) + "\n")
+        except error_util.abort_errors: raise
+        except error_util.all_errors as e:
+            with error_util.before_raising():
+                log.error("Slave "+str(slave_index+1)+" initialisation failed: " + str(e))
+        log.info("Slave "+str(slave_index+1)+" initialized")
 
-    def _update_openfoam_config(self, new_workers):
+    def _update_master(self, new_slaves):
         """
-        Protected, Generate a new instance list on the master instance for OpenFoam to use it
+        Protected, With a single ssh command, ensure the master can establish ssh connections to the new slaves
+        smoothly, and generate a new instance list for OpenFoam to use it
 
-        :param new_workers:         The details of the instances to prepare
-        :type new_workers:          list[worker.Worker]
+        :param new_slaves:      The new slaves
+        :type new_slaves:       list[worker.Worker]
         """
-
+        new_private_ips = [x.private_ip if x.private_ip else x.public_ip for x in new_slaves]
         machines_file_content = str(self._master.private_ip if self._master.private_ip else self._master.public_ip)
         machines_file_content += " slots="+str(self._worker_cores - 1)+" max-slots="+str(self._worker_cores - 1)+"\n"
-        for worker in self._slaves:
-            machines_file_content += str(worker.private_ip if worker.private_ip else worker.public_ip)
-            machines_file_content += " slots=" + str(self._worker_cores) + " max-slots=" + str(self._worker_cores)+"\n"
-        for worker in new_workers:
+        for worker in self._slaves + new_slaves:
             machines_file_content += str(worker.private_ip if worker.private_ip else worker.public_ip)
             machines_file_content += " slots=" + str(self._worker_cores) + " max-slots=" + str(self._worker_cores)+"\n"
 
-        ssh_conn = ssh.SshConnection(self.ip, "root", self._root_key)
-        with file_util.temp_file(machines_file_content) as machine_file:
-            ssh_conn.send_file(machine_file, self.machines_file_path)
-        ssh_conn.run(["chmod", "644", self.machines_file_path])
-        ssh_conn.run("sync")
+        user_known_hosts = proc_util.shell_quote(self.user_home + "/.ssh/known_hosts")
+        quoted_ips = " ".join(proc_util.shell_quote(ip) for ip in new_private_ips)
+        machines_file = proc_util.shell_quote(self.machines_file_path)
+        script = "\n".join([
+            "set -e",
+            "touch /root/.ssh/known_hosts " + user_known_hosts,
+            "for ip in " + quoted_ips + "; do",
+            "    ssh-keygen -R \"$ip\" -f /root/.ssh/known_hosts",
+            "    ssh-keygen -R \"$ip\" -f " + user_known_hosts,
+            "done",
+            "host_keys=$(ssh-keyscan -H " + quoted_ips + ")",
+            "echo \"$host_keys\" >> /root/.ssh/known_hosts",
+            "echo \"$host_keys\" >> " + user_known_hosts,
+            "chown " + proc_util.shell_quote(self.user + ":" + self.user) + " " + user_known_hosts + "*",
+            "cat > " + machines_file + " << 'MACHINES_EOF'",
+            machines_file_content.rstrip("\n"),
+            "MACHINES_EOF",
+            "chmod 644 " + machines_file,
+            "sync"
+        ]) + "\n"
+        ssh.SshConnection(self.ip, "root", self._root_key).run_script(script)
+
+
+class _BringUpStep(async_util.AbstractThread):
+    """ A step of a cluster bring-up, which signals its end on a queue """
+
+    def __init__(self, name, func, args, done_queue):
+        super(_BringUpStep, self).__init__()
+        self.step_name = name
+        self.start_time = None
+        self.end_time = None
+        self._func = func
+        self._args = args
+        self._done_queue = done_queue
+
+    def run(self, *args, **kargs):
+        self.start_time = time.time()
+        try:
+            super(_BringUpStep, self).run(*args, **kargs)
+        finally:
+            self.end_time = time.time()
+            self._done_queue.put(self)
 
+    def work(self):
+        self._func(*self._args)
 
-class _SlaveInitializer(async_util.AbstractThread):
-    def __init__(self, cluster, slave_ip, slave_index):
-        super(_SlaveInitializer, self).__init__()
-        self._cluster = cluster
-        self._slave_ip = slave_ip
-        self._slave_index = slave_index
 
-    def work(self):
-        cluster = self._cluster
-        cluster._prepare_slave(self._slave_ip, self._slave_index)
+class _BringUpGraph(object):
+    """
+    Run the steps of a cluster bring-up as soon as their dependencies are done, with a bounded number of threads.
+    The first failure stops the scheduling of new steps, waits for the running ones and is raised.
+    The duration of each phase is measured from the start of its first step to the end of its last step.
+    """
+
+    def __init__(self, max_parallel):
+        """
+        :param max_parallel:    The maximum number of steps running at the same time
+        :type max_parallel:     int
+        """
+        super(_BringUpGraph, self).__init__()
+        self._max_parallel = max(1, int(max_parallel))
+        self._steps = collections.OrderedDict()
+        self._phases = collections.OrderedDict()
+
+    @property
+    def step_names(self):
+        return list(self._steps.keys())
+
+    @property
+    def timings(self):
+        """
+        :return:    The duration of each phase, in seconds
+        :rtype:     dict[str, float]
+        """
+        return collections.OrderedDict((phase, end - start) for phase, (start, end) in self._phases.items()
+                                       if start is not None)
+
+    def add(self, name, phase, dependencies, func, *args):
+        """
+        Add a step to the graph
+
+        :param name:            The unique name of the step
+        :type name:             str
+        :param phase:           The phase of the step, used for timings
+        :type phase:            str
+        :param dependencies:    The names of the steps which should succeed before this one starts
+        :type dependencies:     list[str]
+        :param func:            The function to run
+        :type func:             callable
+        :param args:            The function arguments
+        :type args:             any
+        """
+        for dependency in dependencies:
+            if dependency not in self._steps:
+                raise RuntimeError("Unknown bring-up step " + repr(dependency))
+        self._steps[name] = (phase, list(dependencies), func, args)
+        self._phases.setdefault(phase, (None, None))
+
+    def run(self):
+        """ Run all the steps and wait for them. The first error, if any, is raised """
+        done_queue = async_util.create_thread_queue()
+        pending = list(self._steps.keys())
+        done = set()
+        running = {}
+        failed = None
+        try:
+            while pending or running:
+                if failed is None:
+                    for name in list(pending):
+                        if len(running) >= self._max_parallel:
+                            break
+                        phase, dependencies, func, args = self._steps[name]
+                        if all(dependency in done for dependency in dependencies):
+                            pending.remove(name)
+                            running[name] = _BringUpStep(name, func, args, done_queue)
+                            running[name].start()
+                if not running:
+                    break
+                try:
+                    step = done_queue.get(True, 1)
+                except async_util.QueueEmpty:
+                    continue
+                del running[step.step_name]
+                self._record_timing(step)
+                if step.get_exception() is not None:
+                    if failed is None:
+                        failed = step
+                else:
+                    done.add(step.step_name)
+        finally:
+            for step in running.values():
+                step.join()
+                self._record_timing(step)
+        if failed is not None:
+            failed.reraise()
+
+    def _record_timing(self, step):
+        phase = self._steps[step.step_name][0]
+        start, end = self._phases[phase]
+        self._phases[phase] = (step.start_time if start is None else min(start, step.start_time),
+                               step.end_time if end is None else max(end, step.end_time))
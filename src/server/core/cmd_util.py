@@ -10,6 +10,11 @@ import os
 import uuid
 import copy
 import subprocess
+import time
+import shutil
+import tempfile
+import zipfile
+import threading
 
 # Third party libs
 from flask import g, url_for
@@ -24,6 +29,7 @@ from lib import ssh
 from lib import async_util
 import api_util
 import core.cluster
+import core.worker_pool
 import models.jobs
 import models.provider_config
 import models.projects
@@ -32,17 +38,134 @@ import models.projects
 API_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
 log = logging.getLogger("aziugo")
 
+WARM_WORKER_CONNECTION_TIMEOUT = 30  # in seconds
+
+
+class WorkerEventsThread(async_util.AbstractThread):
+    """
+    Follow the events file written by the worker runner (aziugo_start.py) with a single long-lived ssh command.
+    Each line of this file is an event "<name> <value>", for example "progress 0.42" or "status success".
+    If the stream breaks, it reconnects and resume from the last received line.
+    """
+
+    RECONNECT_DELAY = 5  # in seconds
+
+    def __init__(self, conn, events_file):
+        """
+        :param conn:            The ssh connection to the worker
+        :type conn:             lib.ssh.SshConnection
+        :param events_file:     The distant events file
+        :type events_file:      str
+        """
+        super(WorkerEventsThread, self).__init__()
+        self._conn = conn
+        self._events_file = events_file
+        self._events = async_util.create_thread_queue()
+        self._line_count = 0
+        self._connected = False
+        self._stream_proc = None
+
+    @property
+    def is_connected(self):
+        return self._connected
+
+    def work(self, *args, **kwargs):
+        while not self.should_stop():
+            try:
+                with self._conn.follow_file(self._events_file, self._line_count + 1) as proc:
+                    self._stream_proc = proc
+                    self._connected = True
+                    for line in iter(proc.stdout.readline, ''):
+                        if self.should_stop():
+                            return
+                        if not line.endswith("\n"):
+                            break  # Incomplete line, the stream has been cut
+                        self._line_count += 1
+                        parts = line.strip().split(None, 1)
+                        if len(parts) == 2:
+                            self._events.put((parts[0], parts[1]))
+            except error_util.abort_errors:
+                raise
+            except error_util.all_errors as e:
+                if not self.should_stop():
+                    log.warning("Worker events stream failed: " + str(e))
+            finally:
+                self._connected = False
+                self._stream_proc = None
+            try:
+                self._stop_queue.get(True, WorkerEventsThread.RECONNECT_DELAY)
+                return
+            except async_util.QueueEmpty:
+                pass  # This is normal, it means the main loop didn't ask us to stop
+
+    def stop(self):
+        super(WorkerEventsThread, self).stop()
+        proc = self._stream_proc
+        if proc is not None:
+            try:
+                proc.terminate()
+            except OSError:
+                pass  # Already stopped
+
+    def get_event(self, timeout=None):
+        """
+        Get the next received event
+
+        :param timeout:     The maximum number of seconds to wait for an event. None or 0 means no wait.
+                            Optional, default None
+        :type timeout:      int|float|None
+        :return:            The event name and its value, or None if there is no event
+        :rtype:             tuple[str, str]|None
+        """
+        try:
+            if timeout:
+                return self._events.get(True, timeout)
+            return self._events.get(False)
+        except async_util.QueueEmpty:
+            return None
+
 
 class TaskProcess(object):
-    def __init__(self, job_id, project_codename, command, running_workers, params=None):
+    """
+    Run a task on a worker and follow its status.
+    Status and progress are pushed by the worker through its events file, so the remote files and
+    the database are only polled at low rate, as a fallback.
+    """
+
+    DB_CHECKING_DELAY = 1           # in seconds, default of general.job_db_checking_delay
+    FALLBACK_CHECKING_DELAY = 60    # in seconds
+
+    def __init__(self, job_id, project_codename, command, running_workers, params=None, direct_upload=False):
+        """
+        :param job_id:              The id of the job
+        :type job_id:               int
+        :param project_codename:    The project uid
+        :type project_codename:     str
+        :param command:             The toolchain to run
+        :type command:              str
+        :param running_workers:     The workers running the task
+        :type running_workers:      RunningWorkers
+        :param params:              The toolchain parameters. Optional, default None
+        :type params:               list|None
+        :param direct_upload:       Does the worker upload the results by itself, on targets sent by the server?
+                                    Optional, default False
+        :type direct_upload:        bool
+        """
         self._job_id = int(job_id)
         self._project_uid = project_codename
         self._command = str(command)
         self._running_worker = running_workers
         self._proc = None
+        self._events_thread = None
+        self._progress = None
+        self._next_db_check = datetime.datetime.utcfromtimestamp(0)
+        self._next_fallback_check = datetime.datetime.utcfromtimestamp(0)
         self._status = models.jobs.JOB_STATUS_LAUNCHING
         self._creation_time = datetime.datetime.utcnow()
         self._params = params if params else []
+        self._direct_upload = direct_upload
+        self._event_handlers = {}
+        self._db_checking_delay = get_job_db_checking_delay()
         conf = api_util.get_conf()
         self._api_name = conf.get("general", "api_name")
         self._server_name = conf.get("general", "server")
@@ -63,12 +186,27 @@ class TaskProcess(object):
     def conn(self):
         return self._running_worker.ssh_connection
 
+    def set_event_handler(self, name, handler):
+        """
+        Call a function each time the worker sends a given event, other than 'status' and 'progress'
+
+        :param name:        The event name
+        :type name:         str
+        :param handler:     The function to call, with the event value as only argument
+        :type handler:      callable
+        """
+        self._event_handlers[name] = handler
+
     def start(self):
-        self.conn.run(["rm", "-f", util.path_join(api_util.WORKER_OUTPUT_PATH, "task_end.txt")])
+        events_file = util.path_join(api_util.WORKER_OUTPUT_PATH, "events.log")
+        self.conn.run(["rm", "-f", util.path_join(api_util.WORKER_OUTPUT_PATH, "task_end.txt"), events_file])
+        self._events_thread = WorkerEventsThread(self.conn, events_file)
+        self._events_thread.start()
         self.conn.run("echo '1' > '" + util.path_join(api_util.WORKER_INPUT_PATH, "start_task")+"'", shell=True)
         self._status = models.jobs.JOB_STATUS_RUNNING
 
     def stop_and_wait(self):
+        self._stop_events_thread()
         self.conn.run("echo '1' > '" + util.path_join(api_util.WORKER_INPUT_PATH, "output_fetched")+"'", shell=True)
         try:
             proc_util.wait_for_proc_and_streams(self._proc, 2)
@@ -77,26 +215,77 @@ class TaskProcess(object):
         self._proc = None
 
     def check_status(self):
-        if not self._running_worker.is_debug:
-            if models.jobs.is_shutdown_disabled(self._job_id):
-                self._running_worker.disable_shutdown()
-        if self.is_canceled():
-            self._status = models.jobs.JOB_STATUS_CANCELED
-            raise api_util.ToolchainCanceled()
+        now = datetime.datetime.utcnow()
+        if now >= self._next_db_check:
+            # Cancellation is usually notified by a signal, this is only a safety net. Its delay is also the time
+            # needed to notice a cancellation without signal, so it stays short by default
+            self._next_db_check = now + datetime.timedelta(seconds=self._db_checking_delay)
+            if not self._running_worker.is_debug:
+                if models.jobs.is_shutdown_disabled(self._job_id):
+                    self._running_worker.disable_shutdown()
+            if self.is_canceled():
+                self._status = models.jobs.JOB_STATUS_CANCELED
+                raise api_util.ToolchainCanceled()
 
+        self._handle_events()
+        if self._status != models.jobs.JOB_STATUS_RUNNING:
+            return self._status
+
+        if self._events_thread is None or not self._events_thread.is_connected or now >= self._next_fallback_check:
+            self._next_fallback_check = now + datetime.timedelta(seconds=TaskProcess.FALLBACK_CHECKING_DELAY)
+            self._poll_status()
+        return self._status
+
+    def wait_for_event(self, timeout):
+        """
+        Wait until the worker send an event, or until timeout is reached.
+        The event is handled immediately, the next call to check_status will return the updated status.
+
+        :param timeout:     The maximum number of seconds to wait
+        :type timeout:      int|float
+        """
+        if self._events_thread is None or not self._events_thread.is_alive():
+            time.sleep(timeout)
+            return
+        event = self._events_thread.get_event(timeout)
+        if event is not None:
+            self._handle_event(*event)
+            self._handle_events()
+
+    def _handle_events(self):
+        """ Handle all the events already received from the worker """
+        if self._events_thread is None:
+            return
+        event = self._events_thread.get_event()
+        while event is not None:
+            self._handle_event(*event)
+            event = self._events_thread.get_event()
+
+    def _handle_event(self, name, value):
+        """
+        Update the task according to a worker event
+
+        :param name:        The event name, 'status' or 'progress'
+        :type name:         str
+        :param value:       The event value
+        :type value:        str
+        """
+        if name == "status":
+            self._status = self._to_job_status(value)
+        elif name == "progress":
+            self._set_progress(value)
+        elif name in self._event_handlers:
+            self._event_handlers[name](value)
+        else:
+            log.warning("Unknown worker event " + repr(name))
+
+    def _poll_status(self):
+        """ Get the status and the progress by reading the worker files """
         status_file = util.path_join(api_util.WORKER_OUTPUT_PATH, "task_end.txt")
         code, out, err = self.conn.run(["cat", status_file], can_fail=True)
         if code == 0:
-            task_status = out.strip()
-            if task_status == "success":
-                self._status = models.jobs.JOB_STATUS_FINISHED
-            elif task_status == "cancel":
-                self._status = models.jobs.JOB_STATUS_CANCELED
-            elif task_status == "error":
-                self._status = models.jobs.JOB_STATUS_KILLED
-            else:
-                raise RuntimeError("Unknown worker task result: " + repr(task_status))
-            return self._status
+            self._status = self._to_job_status(out.strip())
+            return
 
         # Ensure the proc is still running
         if not self._proc.is_running():
@@ -104,9 +293,45 @@ class TaskProcess(object):
 
         # Load progress
         exit_code, out, _ = self.conn.run(["cat", api_util.WORKER_WORK_PATH + "/progress.txt"], can_fail=True)
-        if exit_code == 0 and type_util.ll_float(out.strip()):
-            models.jobs.set_job_progress(self._job_id, max(0.0, min(1.0, float(out))))
-        return self._status
+        if exit_code == 0:
+            self._set_progress(out)
+
+    def _set_progress(self, value):
+        """
+        Save the job progress, only if it changed
+
+        :param value:       The progress, between 0 and 1
+        :type value:        str
+        """
+        if not type_util.ll_float(value.strip()):
+            return
+        progress = max(0.0, min(1.0, float(value.strip())))
+        if progress != self._progress:
+            models.jobs.set_job_progress(self._job_id, progress)
+            self._progress = progress
+
+    @staticmethod
+    def _to_job_status(task_status):
+        """
+        Convert the result of the worker task to a job status
+
+        :param task_status:     The worker task result: 'success', 'cancel' or 'error'
+        :type task_status:      str
+        :return:                The job status
+        :rtype:                 int
+        """
+        if task_status == "success":
+            return models.jobs.JOB_STATUS_FINISHED
+        elif task_status == "cancel":
+            return models.jobs.JOB_STATUS_CANCELED
+        elif task_status == "error":
+            return models.jobs.JOB_STATUS_KILLED
+        raise RuntimeError("Unknown worker task result: " + repr(task_status))
+
+    def _stop_events_thread(self):
+        if self._events_thread is not None:
+            self._events_thread.stop()
+            self._events_thread = None
 
     def is_canceled(self):
         job = models.jobs.get_job(self._job_id)
@@ -136,7 +361,9 @@ class TaskProcess(object):
                 "project_uid": self._project_uid,
                 "toolchain": self._command,
                 "params": json.dumps(self._params),
-                "shutdown": "0" if self._running_worker.is_debug else "1"
+                "shutdown": "0" if self._running_worker.is_debug else "1",
+                "direct_upload": "1" if self._direct_upload else "0",
+                "telemetry_interval": str(get_worker_telemetry_interval())
             }
             with file_util.temp_file(json.dumps(task_params)) as tmp_filepath:
                 self.conn.send_file(tmp_filepath, task_params_file)
@@ -159,6 +386,7 @@ class TaskProcess(object):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stop_events_thread()
         if self._proc:
             proc_util.ensure_kill_proc(self._proc)
         return False
@@ -269,6 +497,19 @@ class KeepAliveClusterThread(async_util.RecurringThread):
             conn.run(["touch", api_util.WORKER_INPUT_PATH.rstrip("/")+"/worker_ping"])
 
 
+def is_ssh_multiplexing_enabled():
+    """
+    Check if the ssh connections to the workers should share a single master connection per worker
+
+    :return:        True if ssh multiplexing is enabled. Default True
+    :rtype:         bool
+    """
+    conf = api_util.get_conf()
+    if not conf.has_option("general", "ssh_multiplexing"):
+        return True
+    return type_util.to_bool(conf.get("general", "ssh_multiplexing"))
+
+
 @contextlib.contextmanager
 def using_workers(api_name, provider, job_id, machine, nbr_machines, tags, debug_keep_instances_alive=False):
     machine_cost = models.provider_config.get_machine_provider_cost(provider.name, machine)
@@ -277,31 +518,48 @@ def using_workers(api_name, provider, job_id, machine, nbr_machines, tags, debug
     instance_price = api_util.price_to_float(machine_cost["cost_per_sec"]) * 3600  # In $/h, for aws spots
     nbr_machines = int(nbr_machines)
     alive_thread = None
+    conn = None
+    multiplexed = is_ssh_multiplexing_enabled()
     if nbr_machines == 1:
         workers = []
         try:
-            log.info("Launching worker on provider " + str(provider.name))
-            workers = provider.create_workers(int(nbr_machines), machine=machine, spot_price=instance_price)
-            log.info("worker created")
-            main_worker = workers[0]
-            if main_worker.specific_cost:
-                models.jobs.set_job_specific_cost(job_id, provider.name, machine, main_worker.specific_cost,
-                                                  machine_cost["currency"], machine_cost["sec_granularity"],
-                                                  machine_cost["min_sec_granularity"])
-
-            # Tag instance
-            provider.tag_workers(workers, {'Name': api_name + "_worker/job_" + str(job_id), "type": "worker"})
-            if not debug_keep_instances_alive:
-                debug_keep_instances_alive = models.jobs.is_shutdown_disabled(job_id)
-            tags = copy.copy(tags)
-            tags['debug'] = "true" if debug_keep_instances_alive else "false"
-            provider.tag_workers(workers, tags)
-
-            # Connect to the worker
-            ip = main_worker.public_ip if main_worker.public_ip else main_worker.private_ip
-            log.info("Waiting for worker ssh connection to " + str(ip) + " ...")
-            conn = ssh.SshConnection(ip, "aziugo", provider.get_key_path())
-            conn.wait_for_connection()
+            warm_worker = core.worker_pool.claim_worker(provider, machine)
+            while True:
+                if warm_worker:
+                    log.info("Using idle worker " + str(warm_worker.worker_id) + " from the warm pool")
+                    workers = [warm_worker]
+                else:
+                    log.info("Launching worker on provider " + str(provider.name))
+                    workers = provider.create_workers(int(nbr_machines), machine=machine, spot_price=instance_price)
+                    log.info("worker created")
+                main_worker = workers[0]
+                if main_worker.specific_cost:
+                    models.jobs.set_job_specific_cost(job_id, provider.name, machine, main_worker.specific_cost,
+                                                      machine_cost["currency"], machine_cost["sec_granularity"],
+                                                      machine_cost["min_sec_granularity"])
+
+                # Tag instance
+                provider.tag_workers(workers, {'Name': api_name + "_worker/job_" + str(job_id), "type": "worker"})
+                if not debug_keep_instances_alive:
+                    debug_keep_instances_alive = models.jobs.is_shutdown_disabled(job_id)
+                job_tags = copy.copy(tags)
+                job_tags['debug'] = "true" if debug_keep_instances_alive else "false"
+                provider.tag_workers(workers, job_tags)
+
+                # Connect to the worker
+                ip = main_worker.public_ip if main_worker.public_ip else main_worker.private_ip
+                log.info("Waiting for worker ssh connection to " + str(ip) + " ...")
+                conn = ssh.SshConnection(ip, "aziugo", provider.get_key_path(), multiplexed=multiplexed)
+                if warm_worker and not conn.wait_for_connection(WARM_WORKER_CONNECTION_TIMEOUT, can_fail=True):
+                    log.warning("Idle worker " + str(warm_worker.worker_id) + " is not reachable, launching a new one")
+                    conn.close()
+                    conn = None
+                    provider.terminate_workers(workers)
+                    workers = []
+                    warm_worker = None
+                    continue
+                conn.wait_for_connection()
+                break
             log.info("Connection with worker established")
             alive_thread = KeepAliveWorkerThread(conn)
             alive_thread.start()
@@ -311,6 +569,8 @@ def using_workers(api_name, provider, job_id, machine, nbr_machines, tags, debug
             if alive_thread:
                 alive_thread.stop()
                 alive_thread.join()
+            if conn:
+                conn.close()
 
             if workers and provider:
                 if not debug_keep_instances_alive:
@@ -361,18 +621,13 @@ def using_workers(api_name, provider, job_id, machine, nbr_machines, tags, debug
         })
         log.info("Launching worker on provider " + str(provider.name))
         with core.cluster.Cluster(provider, "aziugo", nbr_cores, str(job_id), machine=machine,
-                                  spot_price=instance_price, tags=cluster_tags,
+                                  spot_price=instance_price, tags=cluster_tags, nbr_slaves=nbr_machines - 1,
                                   debug_no_terminate=debug_keep_instances_alive) as cluster:
             try:
-                log.info("Main worker launched, with id " + str(cluster.master_id))
-
-                log.info("Launching " + str(nbr_machines - 1) + " slave workers...")
-                cluster.add_slaves(nbr_machines - 1)
-                log.info("Slave workers launched")
 
                 # Connect to the worker
                 log.info("Waiting for worker ssh connection to "+str(cluster.ip)+" ...")
-                conn = ssh.SshConnection(cluster.ip, "aziugo", provider.get_key_path())
+                conn = ssh.SshConnection(cluster.ip, "aziugo", provider.get_key_path(), multiplexed=multiplexed)
                 conn.wait_for_connection()
                 log.info("Connection with worker established")
                 alive_thread = KeepAliveClusterThread(cluster)
@@ -382,6 +637,8 @@ def using_workers(api_name, provider, job_id, machine, nbr_machines, tags, debug
                 if alive_thread:
                     alive_thread.stop()
                     alive_thread.join()
+                if conn:
+                    conn.close()
 
                 if not debug_keep_instances_alive:
                     try:
@@ -450,6 +707,7 @@ class ResultFile(object):
         self._dest_filename = project_codename+"-"+str(uuid.uuid4())+file_extension
         self._file_size = -1
         self._file_id = None
+        self._upload_target = None
 
     def exists(self, worker_out_storage):
         """
@@ -473,10 +731,75 @@ class ResultFile(object):
         :param tmp_folder:              A temporary folder, required if local swapping is needed
         :type tmp_folder:               tmp
         """
+        if self._upload_target is not None and self._complete_direct_upload(worker_out_storage, dest_storage):
+            self._saved = True
+            return
         self._file_size = worker_out_storage.get_file_size(self._worker_filename)
         worker_out_storage.copy_to_storage(dest_storage, self._worker_filename, self._dest_filename, tmp_folder)
         self._saved = True
 
+    def create_upload_target(self, dest_storage):
+        """
+        Create a target where the worker will upload the file by itself.
+        save_on_storage will then only check the uploaded file, and relay it only if the worker upload failed.
+
+        :param dest_storage:            The external destination storage
+        :type dest_storage:             core.storage.Storage
+        :return:                        The target description, to send to the worker
+        :rtype:                         dict[str, any]
+        """
+        self._upload_target = dest_storage.create_upload_target(self._dest_filename)
+        return self._upload_target
+
+    def extend_upload_target(self, dest_storage, nbr_parts):
+        """
+        Let the worker upload more parts than planned on the upload target, for a big file
+
+        :param dest_storage:            The external destination storage
+        :type dest_storage:             core.storage.Storage
+        :param nbr_parts:               The number of parts of the file
+        :type nbr_parts:                int
+        :return:                        The target extension, to send to the worker
+        :rtype:                         dict[str, any]
+        """
+        if self._upload_target is None:
+            raise RuntimeError("No upload target for file " + self._worker_filename)
+        return dest_storage.extend_upload_target(self._dest_filename, self._upload_target, nbr_parts)
+
+    def _complete_direct_upload(self, worker_out_storage, dest_storage):
+        """
+        Check and save the file the worker uploaded on the upload target, using the manifest it left next to the file
+
+        :param worker_out_storage:      The worker internal storage
+        :type worker_out_storage:       core.storage.SshStorage
+        :param dest_storage:            The external destination storage
+        :type dest_storage:             core.storage.Storage
+        :return:                        True if the file is saved, False if it should be relayed
+        :rtype:                         bool
+        """
+        target, self._upload_target = self._upload_target, None
+        manifest_filename = self._worker_filename + ".upload.json"
+        try:
+            if not worker_out_storage.file_exists(manifest_filename):
+                log.warning("File " + self._worker_filename + " was not uploaded by the worker")
+                dest_storage.abort_upload_target(self._dest_filename, target)
+                return False
+            with worker_out_storage.open_read(manifest_filename) as fh:
+                manifest = json.loads(fh.read())
+        except error_util.abort_errors: raise
+        except error_util.all_errors as e:
+            log.warning("Unable to read upload manifest of " + self._worker_filename + ": " + str(e))
+            dest_storage.abort_upload_target(self._dest_filename, target)
+            return False
+        try:
+            self._file_size = dest_storage.complete_upload_target(self._dest_filename, target, manifest)
+        except error_util.abort_errors: raise
+        except error_util.all_errors as e:
+            log.warning("Upload of " + self._worker_filename + " by the worker is invalid: " + str(e))
+            return False
+        log.info("File " + self._worker_filename + " uploaded by the worker and verified")
+        return True
+
     def save_in_database(self, user_id, key=None):
         if not self.saved:
             raise RuntimeError("The file is not saved on distant storage")
@@ -502,10 +825,557 @@ class ResultFile(object):
             raise RuntimeError("File is not saved in database")
         return self._file_id
 
+    def save_local_file_on_storage(self, local_path, dest_storage):
+        """
+        Save a file generated on this server, instead of the worker one, on an external storage
+
+        :param local_path:              The local file to save
+        :type local_path:               str
+        :param dest_storage:            The external destination storage
+        :type dest_storage:             core.storage.Storage
+        """
+        self._file_size = os.path.getsize(local_path)
+        dest_storage.upload_file(local_path, self._dest_filename)
+        self._saved = True
+
+    def cancel_upload_target(self, dest_storage):
+        """
+        Cancel the upload target of this file, if any
+
+        :param dest_storage:            The external destination storage
+        :type dest_storage:             core.storage.Storage
+        """
+        if self._upload_target is not None:
+            dest_storage.abort_upload_target(self._dest_filename, self._upload_target)
+            self._upload_target = None
+
     def delete_from_distant(self, storage):
+        self.cancel_upload_target(storage)
         if not self._saved:
             return
         storage.delete_file(self._dest_filename)
 
     def __str__(self):
         return self._worker_filename
+
+
+class ResultFileSaver(async_util.AbstractThread):
+    """
+    Save result files taken from a shared queue, until the queue is empty or the thread is stopped.
+    If a closed event is given, an empty queue only stops the thread once this event is set.
+    """
+    def __init__(self, file_queue, worker_out_storage, dest_storage, tmp_folder, closed_event=None, *args, **kwargs):
+        """
+        :param file_queue:              The queue of the result files to save
+        :type file_queue:               Queue.Queue
+        :param worker_out_storage:      The worker internal storage
+        :type worker_out_storage:       core.storage.SshStorage
+        :param dest_storage:            The external destination storage
+        :type dest_storage:             core.storage.Storage
+        :param tmp_folder:              A temporary folder, required if local swapping is needed
+        :type tmp_folder:               str
+        :param closed_event:            Set when no more files will be added to the queue. Optional, default None
+        :type closed_event:             threading.Event|None
+        """
+        super(ResultFileSaver, self).__init__(*args, **kwargs)
+        self._queue = file_queue
+        self._worker_out_storage = worker_out_storage
+        self._dest_storage = dest_storage
+        self._tmp_folder = tmp_folder
+        self._closed_event = closed_event
+
+    def work(self, *args, **kwargs):
+        while not self.should_stop():
+            try:
+                if self._closed_event is None:
+                    result_file = self._queue.get(False)
+                else:
+                    result_file = self._queue.get(True, 0.2)
+            except async_util.QueueEmpty:
+                if self._closed_event is None:
+                    return
+                if self._closed_event.is_set() and self._queue.empty():
+                    return
+                continue
+            result_file.save_on_storage(self._worker_out_storage, self._dest_storage, self._tmp_folder)
+
+
+def save_result_files(result_files, worker_out_storage, dest_storage, tmp_folder, max_parallel=None):
+    """
+    Save several result files on an external storage at the same time.
+    When this function returns, all the transfers are finished. The first error, if any, is raised.
+
+    :param result_files:            The files to save
+    :type result_files:             list[ResultFile]
+    :param worker_out_storage:      The worker internal storage
+    :type worker_out_storage:       core.storage.SshStorage
+    :param dest_storage:            The external destination storage
+    :type dest_storage:             core.storage.Storage
+    :param tmp_folder:              A temporary folder, required if local swapping is needed
+    :type tmp_folder:               str
+    :param max_parallel:            The maximum number of simultaneous transfers.
+                                    Optional, default general.result_files_max_parallel in config (4)
+    :type max_parallel:             int|None
+    """
+    if max_parallel is None:
+        max_parallel = get_result_files_max_parallel()
+    result_files = list(result_files)
+    if len(result_files) <= 1 or max_parallel <= 1:
+        for result_file in result_files:
+            result_file.save_on_storage(worker_out_storage, dest_storage, tmp_folder)
+        return
+
+    file_queue = async_util.create_thread_queue()
+    for result_file in result_files:
+        file_queue.put(result_file)
+    threads = []
+    try:
+        for _ in range(min(max_parallel, len(result_files))):
+            thread = ResultFileSaver(file_queue, worker_out_storage, dest_storage, tmp_folder)
+            threads.append(thread)
+            thread.start()
+        while any(thread.is_alive() for thread in threads):
+            if any(thread.get_exception() is not None for thread in threads):
+                break  # No need to save the other files
+            time.sleep(0.1)
+    finally:
+        for thread in threads:
+            thread.stop()
+        for thread in threads:
+            thread.join()
+    for thread in threads:
+        thread.reraise()
+
+
+def get_result_files_max_parallel():
+    """
+    :return:        The maximum number of result files saved at the same time, general.result_files_max_parallel in
+                    config. Default 4
+    :rtype:         int
+    """
+    conf = api_util.get_conf()
+    if conf.has_option("general", "result_files_max_parallel"):
+        return conf.getint("general", "result_files_max_parallel")
+    return 4
+
+
+def get_job_db_checking_delay():
+    """
+    :return:        The time between two checks of the job cancellation and shutdown flags in database, in seconds,
+                    general.job_db_checking_delay in config. Default TaskProcess.DB_CHECKING_DELAY (1)
+    :rtype:         float
+    """
+    conf = api_util.get_conf()
+    if conf.has_option("general", "job_db_checking_delay"):
+        return max(0.0, conf.getfloat("general", "job_db_checking_delay"))
+    return float(TaskProcess.DB_CHECKING_DELAY)
+
+
+def get_worker_telemetry_interval():
+    """
+    :return:        The time between two resource samples on the workers, in seconds, general.worker_telemetry_interval
+                    in config. 0 disables the sampling. Default 10
+    :rtype:         float
+    """
+    conf = api_util.get_conf()
+    if conf.has_option("general", "worker_telemetry_interval"):
+        return conf.getfloat("general", "worker_telemetry_interval")
+    return 10.0
+
+
+class FinishingTask(async_util.AbstractThread):
+    """ Run a function in background, with its own database connection """
+    def __init__(self, func, *args):
+        """
+        :param func:        The function to run
+        :type func:         callable
+        :param args:        The function arguments
+        :type args:         any
+        """
+        super(FinishingTask, self).__init__()
+        self._func = func
+        self._args = args
+
+    def work(self, *args, **kwargs):
+        with api_util.DatabaseContext.using_conn():
+            self._func(*self._args)
+
+
+class ResultPipeline(object):
+    """
+    Save the result files of a task while it finishes.
+    Each file is saved as soon as the worker announces it with a 'result_ready' event, and the other finishing
+    steps (log and progress fetching) run at the same time, so the workers are released as soon as possible.
+
+    Usage:
+        pipeline = ResultPipeline([result_file, preview_file], worker_out_storage, storage, tmp_folder)
+        task_proc.set_event_handler("result_ready", pipeline.on_result_ready)
+        try:
+            ... # wait for the task end
+            pipeline.run_in_background(save_worker_log, conn, job_id, tmp_folder)
+            pipeline.finish([result_file], [preview_file])
+        except:
+            pipeline.close()
+            raise
+    """
+
+    def __init__(self, result_files, worker_out_storage, dest_storage, tmp_folder, max_parallel=None):
+        """
+        :param result_files:            All the files the worker may announce
+        :type result_files:             list[ResultFile]
+        :param worker_out_storage:      The worker internal storage
+        :type worker_out_storage:       core.storage.SshStorage
+        :param dest_storage:            The external destination storage
+        :type dest_storage:             core.storage.Storage
+        :param tmp_folder:              A temporary folder, required if local swapping is needed
+        :type tmp_folder:               str
+        :param max_parallel:            The maximum number of simultaneous transfers.
+                                        Optional, default general.result_files_max_parallel in config (4)
+        :type max_parallel:             int|None
+        """
+        self._files = dict((str(result_file), result_file) for result_file in result_files)
+        self._started = set()
+        self._worker_out_storage = worker_out_storage
+        self._dest_storage = dest_storage
+        self._tmp_folder = tmp_folder
+        self._max_parallel = max(1, max_parallel if max_parallel is not None else get_result_files_max_parallel())
+        self._queue = async_util.create_thread_queue()
+        self._closed = threading.Event()
+        self._lock = threading.Lock()
+        self._savers = []
+        self._tasks = []
+
+    def on_result_ready(self, worker_filename):
+        """
+        Start saving a file announced by the worker
+
+        :param worker_filename:     The name of the file in the worker output folder
+        :type worker_filename:      str
+        """
+        result_file = self._files.get(worker_filename.strip())
+        if result_file is None:
+            log.warning("Unexpected result file " + repr(worker_filename))
+            return
+        self._save(result_file)
+
+    def run_in_background(self, func, *args):
+        """
+        Run another finishing step while the files are saved
+
+        :param func:        The function to run
+        :type func:         callable
+        :param args:        The function arguments
+        :type args:         any
+        """
+        task = FinishingTask(func, *args)
+        self._tasks.append(task)
+        task.start()
+
+    def finish(self, required_files, optional_files=None):
+        """
+        Save the files which were not announced, then wait for all the transfers and background steps.
+        The first error, if any, is raised.
+
+        :param required_files:      The files the worker must have produced
+        :type required_files:       list[ResultFile]
+        :param optional_files:      The files to save only if they exist. Optional, default None
+        :type optional_files:       list[ResultFile]|None
+        """
+        start = time.time()
+        try:
+            for result_file in required_files:
+                if str(result_file) not in self._started:
+                    if not result_file.exists(self._worker_out_storage):
+                        log.error("Unable to find file " + str(result_file) + " on worker")
+                        raise api_util.ToolchainError("Task failed, no result file")
+                    self._save(result_file)
+            for result_file in optional_files or []:
+                if str(result_file) not in self._started:
+                    if result_file.exists(self._worker_out_storage):
+                        self._save(result_file)
+                    else:
+                        log.warning("No file " + str(result_file) + " found on worker")
+                        result_file.cancel_upload_target(self._dest_storage)
+            with self._lock:
+                self._closed.set()
+                threads = self._savers + self._tasks
+            while any(thread.is_alive() for thread in threads):
+                if any(thread.get_exception() is not None for thread in threads):
+                    break  # No need to wait for the other threads
+                time.sleep(0.1)
+        finally:
+            self.close()
+        for thread in self._savers + self._tasks:
+            thread.reraise()
+        log.info("Results saved %.1fs after the end of the task" % (time.time() - start))
+
+    def close(self):
+        """ Stop the transfers and the background steps, and wait for them. Errors are not raised """
+        self._closed.set()
+        for thread in self._savers + self._tasks:
+            thread.stop()
+        for thread in self._savers + self._tasks:
+            thread.join()
+
+    def _save(self, result_file):
+        # Called from the main thread only: by the 'result_ready' handler, which TaskProcess runs from check_status
+        # and wait_for_event, and by finish. The savers never call it. The lock only keeps the savers list and the
+        # queue consistent if the pipeline is ever fed from another thread
+        with self._lock:
+            if str(result_file) in self._started:
+                return
+            self._started.add(str(result_file))
+            self._queue.put(result_file)
+            self._savers = [saver for saver in self._savers if saver.is_alive() or saver.get_exception() is not None]
+            if len(self._savers) < self._max_parallel:
+                saver = ResultFileSaver(self._queue, self._worker_out_storage, self._dest_storage, self._tmp_folder,
+                                        self._closed)
+                self._savers.append(saver)
+                saver.start()
+
+
+def save_worker_log(conn, job_id, tmp_folder):
+    """
+    Fetch the log and the resource telemetry of the worker runner and save them with the job
+
+    :param conn:            The ssh connection to the worker
+    :type conn:             lib.ssh.SshConnection
+    :param job_id:          The id of the job
+    :type job_id:           int
+    :param tmp_folder:      A temporary folder
+    :type tmp_folder:       str
+    """
+    log_file = util.path_join(api_util.WORKER_OUTPUT_PATH, "worker.log")
+    if conn.file_exists(log_file):
+        with file_util.temp_filename(dir=tmp_folder) as tmp:
+            conn.get_file(log_file, tmp)
+            models.jobs.save_job_log(job_id, tmp)
+    else:
+        log.warning("No worker log file")
+    telemetry_file = util.path_join(api_util.WORKER_OUTPUT_PATH, "telemetry.csv")
+    if conn.file_exists(telemetry_file):
+        with file_util.temp_filename(dir=tmp_folder) as tmp:
+            conn.get_file(telemetry_file, tmp)
+            models.jobs.save_job_telemetry(job_id, tmp)
+
+
+def is_direct_upload_enabled(dest_storage):
+    """
+    Check if the workers should upload their results by themselves on the given storage
+
+    :param dest_storage:    The storage where the results will be saved
+    :type dest_storage:     core.storage.Storage
+    :return:                True if general.direct_result_upload is enabled and the storage supports it. Default False
+    :rtype:                 bool
+    """
+    conf = api_util.get_conf()
+    if not conf.has_option("general", "direct_result_upload"):
+        return False
+    return type_util.to_bool(conf.get("general", "direct_result_upload")) and dest_storage.supports_upload_targets
+
+
+def send_upload_targets(conn, result_files, dest_storage):
+    """
+    Create an upload target for each result file and send them to the worker, in the file upload_targets.json
+    of its input folder. The worker waits for this file after asking for it with an 'upload_targets' event.
+
+    :param conn:            The ssh connection to the worker
+    :type conn:             lib.ssh.SshConnection
+    :param result_files:    The files the worker will upload
+    :type result_files:     list[ResultFile]
+    :param dest_storage:    The storage where the results will be saved
+    :type dest_storage:     core.storage.Storage
+    """
+    # Errors are only logged: without targets, the worker times out and the server fetches the results itself
+    try:
+        targets = {}
+        for result_file in result_files:
+            targets[str(result_file)] = result_file.create_upload_target(dest_storage)
+        targets_file = util.path_join(api_util.WORKER_INPUT_PATH, "upload_targets.json")
+        with file_util.temp_file(json.dumps(targets)) as tmp_filepath:
+            conn.send_file(tmp_filepath, targets_file + ".tmp")
+        conn.run(["mv", "-f", targets_file + ".tmp", targets_file])
+        log.info("Upload targets sent to the worker")
+    except error_util.abort_errors: raise
+    except error_util.all_errors as e:
+        log.warning("Unable to send the upload targets, the results will be relayed: " + str(e))
+        for result_file in result_files:
+            result_file.cancel_upload_target(dest_storage)
+
+
+def send_upload_target_extension(conn, result_files, dest_storage, request):
+    """
+    Answer to an 'upload_parts' event of the worker, sent when a file is bigger than what its upload target covers.
+    The extension is sent in the file upload_parts/<worker filename>.json of the worker input folder.
+
+    :param conn:            The ssh connection to the worker
+    :type conn:             lib.ssh.SshConnection
+    :param result_files:    The files the worker will upload
+    :type result_files:     list[ResultFile]
+    :param dest_storage:    The storage where the results will be saved
+    :type dest_storage:     core.storage.Storage
+    :param request:         The event value: the worker filename and its number of parts, separated by a space
+    :type request:          str
+    """
+    # Errors are only logged: the worker times out, and the server fetches the file itself
+    try:
+        worker_filename, nbr_parts = request.strip().split()
+        result_file = [f for f in result_files if str(f) == worker_filename][0]
+        extension = result_file.extend_upload_target(dest_storage, int(nbr_parts))
+        parts_folder = util.path_join(api_util.WORKER_INPUT_PATH, "upload_parts")
+        parts_file = util.path_join(parts_folder, worker_filename + ".json")
+        conn.run(["mkdir", "-p", parts_folder])
+        with file_util.temp_file(json.dumps(extension)) as tmp_filepath:
+            conn.send_file(tmp_filepath, parts_file + ".tmp")
+        conn.run(["mv", "-f", parts_file + ".tmp", parts_file])
+        log.info("Upload of " + str(nbr_parts) + " parts of " + worker_filename + " allowed")
+    except error_util.abort_errors: raise
+    except error_util.all_errors as e:
+        log.warning("Unable to extend the upload target " + repr(request) + ", it will be relayed: " + str(e))
+
+
+class CalcStatusSnapshot(object):
+    """
+    Server side copy of the status files of a running calculation.
+    It is kept up to date with the deltas generated by `CFD_CALC_ZIP_STATUS.py --delta-state` on the worker,
+    so each refresh only transfers the data written since the previous one.
+    The clients still get a single status zip: it is only rebuilt when a delta changed the copy since it was last
+    saved (see `changed` and `mark_saved`).
+    """
+
+    ZIP_ROOT = "CVG"
+
+    def __init__(self, tmp_folder):
+        """
+        :param tmp_folder:      The folder where the local copy will be created
+        :type tmp_folder:       str
+        """
+        self._tmp_folder = tmp_folder
+        self._folder = None
+        self._changed = False
+
+    @property
+    def changed(self):
+        """
+        :return:        True if a delta changed the local copy since the last call to mark_saved
+        :rtype:         bool
+        """
+        return self._changed
+
+    def mark_saved(self):
+        """ Tell the zip of the current local copy has been saved, so it is not rebuilt until the next change """
+        self._changed = False
+
+    @property
+    def is_empty(self):
+        """
+        :return:        True if no delta has been applied yet, so a full delta is required
+        :rtype:         bool
+        """
+        return self._folder is None
+
+    def reset(self):
+        """ Forget the local copy. The next delta should be a full one """
+        if self._folder is not None and os.path.exists(self._folder):
+            shutil.rmtree(self._folder)
+        self._folder = None
+        self._changed = False
+
+    def close(self):
+        self.reset()
+
+    def fetch(self, conn, zipper_command, calc_dir, tmp_folder):
+        """
+        Generate a delta on the worker, apply it and acknowledge it
+
+        :param conn:                The ssh connection to the main worker
+        :type conn:                 ssh.SshConnection
+        :param zipper_command:      The path of CFD_CALC_ZIP_STATUS.py on the worker
+        :type zipper_command:       str
+        :param calc_dir:            The calculation folder on the worker
+        :type calc_dir:             str
+        :param tmp_folder:          A temporary folder to use
+        :type tmp_folder:           str
+        :return:                    True if the delta changed the local copy
+        :rtype:                     bool
+        """
+        state_path = util.path_join(api_util.WORKER_OUTPUT_PATH, "status_state.json")
+        delta_path = util.path_join(api_util.WORKER_OUTPUT_PATH, "status_delta.zip")
+        if self.is_empty:
+            conn.run(["rm", "-f", state_path])
+        conn.run(["python", zipper_command, "-i", calc_dir, "-o", delta_path, "--delta-state", state_path])
+        with file_util.temp_filename(dir=tmp_folder, suffix=".zip") as tmp:
+            conn.get_file(delta_path, tmp)
+            changed = self.apply_delta(tmp)
+        conn.run(["mv", "-f", state_path + ".new", state_path])
+        return changed
+
+    def apply_delta(self, delta_file):
+        """
+        Merge a delta zip in the local copy.
+        In case of error, the local copy is reset, so the next delta should be a full one.
+
+        :param delta_file:      The delta zip generated on the worker
+        :type delta_file:       str
+        :return:                True if the delta changed the local copy
+        :rtype:                 bool
+        """
+        if self._folder is None:
+            if not os.path.exists(self._tmp_folder):
+                os.makedirs(self._tmp_folder)
+            self._folder = tempfile.mkdtemp(dir=self._tmp_folder)
+        try:
+            with contextlib.closing(zipfile.ZipFile(delta_file, 'r')) as delta_zip:
+                manifest = json.loads(delta_zip.read("delta.json"))
+                for entry in manifest['files']:
+                    local_path = self._get_local_path(entry['path'])
+                    offset = int(entry['offset'])
+                    local_size = os.path.getsize(local_path) if os.path.exists(local_path) else 0
+                    if offset > local_size:
+                        raise RuntimeError("Invalid status delta: " + str(entry['path']) + " is " + str(local_size) +
+                                           " bytes long, delta starts at " + str(offset))
+                    if not os.path.exists(os.path.dirname(local_path)):
+                        os.makedirs(os.path.dirname(local_path))
+                    with open(local_path, "r+b" if offset > 0 else "wb") as fh:
+                        fh.seek(offset)
+                        fh.truncate()
+                        with contextlib.closing(delta_zip.open(entry['data'])) as data:
+                            shutil.copyfileobj(data, fh)
+                for status_path in manifest.get('deleted', []):
+                    local_path = self._get_local_path(status_path)
+                    if os.path.exists(local_path):
+                        os.remove(local_path)
+        except error_util.all_errors:
+            with error_util.before_raising():
+                self.reset()
+        changed = bool(manifest['files'] or manifest.get('deleted'))
+        self._changed = self._changed or changed
+        return changed
+
+    def make_zip(self, output_file):
+        """
+        Zip the local copy, with the same layout than CFD_CALC_ZIP_STATUS.py full mode
+
+        :param output_file:     The zip file to generate
+        :type output_file:      str
+        """
+        if self._folder is None:
+            raise RuntimeError("No status delta applied yet")
+        with contextlib.closing(zipfile.ZipFile(output_file, 'w', zipfile.ZIP_DEFLATED, allowZip64=True)) as fzip:
+            for root, _, files in os.walk(self._folder):
+                for filename in files:
+                    file_path = os.path.join(root, filename)
+                    rel_path = os.path.relpath(file_path, self._folder)
+                    fzip.write(file_path, CalcStatusSnapshot.ZIP_ROOT + "/" + rel_path.replace(os.sep, "/"))
+
+    def _get_local_path(self, status_path):
+        local_path = os.path.normpath(os.path.join(self._folder, status_path))
+        if not local_path.startswith(self._folder.rstrip(os.sep) + os.sep):
+            raise RuntimeError("Invalid status file path " + repr(status_path))
+        return local_path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
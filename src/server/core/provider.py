@@ -11,9 +11,11 @@ import datetime
 import subprocess
 import re
 import math
+import threading
 
 # Third party libs
 import boto3
+import boto3.session
 import botocore.exceptions
 
 # Project Specific libs
@@ -275,9 +277,7 @@ class AwsProvider(Provider):
         location = self._get_config(conf, section_name, 'location')
         super(AwsProvider, self).__init__(name, location)
 
-        self._ec2_conn = None
-        self._cw_conn = None
-        self._sns_conn = None
+        self._local = threading.local()     # boto3 sessions and resources are not thread safe
 
         # Init fields from config
         self._api_name = conf.get("general", "api_name")
@@ -656,37 +656,47 @@ class AwsProvider(Provider):
     @property
     def conn(self):
         """
-        :return:        The boto connection instance
+        :return:        The boto connection instance of the current thread
         :rtype:         boto3.resources.factory.ec2.ServiceResource
         """
-        if self._ec2_conn is None:
-            self._ec2_conn = boto3.resource("ec2", region_name=self._region, aws_access_key_id=self._access_key_id,
-                                            aws_secret_access_key=self._access_key_secret)
-        return self._ec2_conn
+        return self._get_resource("ec2")
 
     @property
     def cw_conn(self):
         """
-        :return:        The boto connection instance
+        :return:        The boto connection instance of the current thread
         :rtype:         boto3.resources.factory.cloudwatch.ServiceResource
         """
-        if self._cw_conn is None:
-            self._cw_conn = boto3.resource("cloudwatch", region_name=self._region,
-                                           aws_access_key_id=self._access_key_id,
-                                           aws_secret_access_key=self._access_key_secret)
-        return self._cw_conn
+        return self._get_resource("cloudwatch")
 
     @property
     def sns_conn(self):
         """
-        :return:        The boto connection instance
+        :return:        The boto connection instance of the current thread
         :rtype:         boto3.resources.factory.sns.ServiceResource
         """
-        if self._sns_conn is None:
-            self._sns_conn = boto3.resource("sns", region_name=self._region,
-                                            aws_access_key_id=self._access_key_id,
+        return self._get_resource("sns")
+
+    def _get_resource(self, service_name):
+        """
+        Get a resource of the provider credentials.
+        Each thread gets its own session and resources, so they shouldn't be passed to another thread
+
+        :param service_name:    The name of the AWS service, ex: 'ec2'
+        :type service_name:     str
+        :return:                The resource of the service
+        :rtype:                 boto3.resources.base.ServiceResource
+        """
+        resources = getattr(self._local, "resources", None)
+        if resources is None:
+            session = boto3.session.Session(region_name=self._region, aws_access_key_id=self._access_key_id,
                                             aws_secret_access_key=self._access_key_secret)
-        return self._sns_conn
+            resources = {}
+            self._local.session = session
+            self._local.resources = resources
+        if service_name not in resources:
+            resources[service_name] = self._local.session.resource(service_name)
+        return resources[service_name]
 
     def _get_sec_goup_id(self, group_name):
         filters=[{"Name": 'group-name', "Values": [group_name]}]
@@ -1192,6 +1202,7 @@ class DockerProvider(Provider):
     def __init__(self, conf, name, tmp_folder):
         location = conf.get("provider_"+name, "location")
         self._tag_file = os.path.join(tmp_folder, name+".tags")
+        self._tags_lock = threading.Lock()  # The master and the slaves of a cluster are tagged in parallel
         if not os.path.exists(tmp_folder):
             os.makedirs(tmp_folder)
         if not os.path.exists(self._tag_file):
@@ -1247,7 +1258,8 @@ class DockerProvider(Provider):
         :return:                The list of workers
         :rtype:                 list[worker.Worker]
         """
-        all_tags = self._load_tags()
+        with self._tags_lock:
+            all_tags = self._load_tags()
 
         results = []
         cmd = ["docker", "ps", "-q",
@@ -1370,12 +1382,9 @@ class DockerProvider(Provider):
         :param workers:         The worker you want to stop
         :type workers:          list[worker.Worker]|list[str]
         """
-        all_tags = self._load_tags()
         worker_id_list = []
         for worker_param in workers:
             worker_id = worker_param if type_util.is_string(worker_param) else worker_param.worker_id
-            if worker_id in all_tags.keys():
-                del all_tags[worker_id]
             worker_id_list.append(str(worker_id))
         if worker_id_list:
             cmd = ["docker", "container", "stop"]+worker_id_list
@@ -1384,7 +1393,12 @@ class DockerProvider(Provider):
                 child_proc = subprocess.Popen(["docker", "container", "rm", worker_id])
                 if child_proc.poll() is None:
                     child_proc.wait()
-        self._save_tags(all_tags)
+        with self._tags_lock:
+            all_tags = self._load_tags()
+            for worker_id in worker_id_list:
+                if worker_id in all_tags.keys():
+                    del all_tags[worker_id]
+            self._save_tags(all_tags)
 
     def tag_workers(self, workers, tags):
         """
@@ -1394,16 +1408,17 @@ class DockerProvider(Provider):
         :param tags:            values to tag
         :type tags:             dict[str:str]
         """
-        all_tags = self._load_tags()
-        for worker_param in workers:
-            worker_id = worker_param if type_util.is_string(worker_param) else worker_param.worker_id
-            if worker_id not in all_tags.keys():
-                all_tags[worker_id] = {}
-            all_tags[worker_id].update(tags)
-            if "Name" in tags.keys():
-                container_name = re.sub(r"\.+", ".", re.sub(r"[^a-zA-Z0-9_.-]+", ".", tags['Name']))
-                subprocess.check_output(['docker', 'rename', worker_id, container_name])
-        self._save_tags(all_tags)
+        with self._tags_lock:
+            all_tags = self._load_tags()
+            for worker_param in workers:
+                worker_id = worker_param if type_util.is_string(worker_param) else worker_param.worker_id
+                if worker_id not in all_tags.keys():
+                    all_tags[worker_id] = {}
+                all_tags[worker_id].update(tags)
+                if "Name" in tags.keys():
+                    container_name = re.sub(r"\.+", ".", re.sub(r"[^a-zA-Z0-9_.-]+", ".", tags['Name']))
+                    subprocess.check_output(['docker', 'rename', worker_id, container_name])
+            self._save_tags(all_tags)
 
     def list_artefacts(self):
         """
@@ -11,6 +11,9 @@ import shutil
 import logging
 import tempfile
 import contextlib
+import hashlib
+import threading
+import time
 
 # Third party libs
 # import boto3      # this is imported at runtime
@@ -25,6 +28,8 @@ from lib import file_util
 
 log = logging.getLogger("aziugo")
 
+STREAM_CHUNK_SIZE = 8 * 1024 * 1024  # in bytes
+
 
 class FileMissingError(RuntimeError):
     pass
@@ -224,6 +229,143 @@ class Storage(object):
         """
         pass
 
+    def list_files_info(self):
+        """
+        List all files on the distant storage, with their creation date.
+        Storages should override it to fetch everything at once.
+
+        :return:                The creation date (naive utc datetime) of each file, by filename
+        :rtype:                 dict[str, datetime.datetime]
+        """
+        result = {}
+        for filename in self.list_files():
+            try:
+                result[filename] = self.get_file_creation_date(filename)
+            except FileMissingError:
+                continue  # Deleted in the meantime
+        return result
+
+    def delete_files(self, filenames):
+        """
+        Remove several files from distant storage.
+        Storages should override it to remove the files in batches.
+
+        :param filenames:       The names of the files on the cloud storage
+        :type filenames:        list[str]
+        """
+        for filename in filenames:
+            self.delete_file(filename)
+
+    @property
+    def supports_upload_targets(self):
+        """
+        :return:        True if the storage can give upload targets, so a worker can upload files directly
+        :rtype:         bool
+        """
+        return False
+
+    def create_upload_target(self, filename, expire=None):
+        """
+        Create a short-lived target where a worker can upload a file by itself, without any credential
+
+        :param filename:        The name the file will have on the storage
+        :type filename:         str
+        :param expire:          The validity of the target, in seconds. Optional, default depends on the storage
+        :type expire:           int|None
+        :return:                The target description, to send to the worker
+        :rtype:                 dict[str, any]
+        """
+        raise NotImplementedError("Storage " + str(self.name) + " doesn't support upload targets")
+
+    def extend_upload_target(self, filename, target, nbr_parts, expire=None):
+        """
+        Give a worker what it needs to upload a bigger file than the one planned by create_upload_target
+
+        :param filename:        The name the file will have on the storage
+        :type filename:         str
+        :param target:          The target created by create_upload_target
+        :type target:           dict[str, any]
+        :param nbr_parts:       The number of parts of the file the worker will upload
+        :type nbr_parts:        int
+        :param expire:          The validity of the target, in seconds. Optional, default depends on the storage
+        :type expire:           int|None
+        :return:                The target extension, to send to the worker
+        :rtype:                 dict[str, any]
+        """
+        raise NotImplementedError("Storage " + str(self.name) + " doesn't support upload targets")
+
+    def complete_upload_target(self, filename, target, manifest):
+        """
+        Check the file uploaded by a worker on a target matches what the worker sent, and save it
+
+        :param filename:        The name the file will have on the storage
+        :type filename:         str
+        :param target:          The target created by create_upload_target
+        :type target:           dict[str, any]
+        :param manifest:        The description of the upload sent back by the worker
+        :type manifest:         dict[str, any]
+        :return:                The size of the saved file, in bytes
+        :rtype:                 int
+        """
+        raise NotImplementedError("Storage " + str(self.name) + " doesn't support upload targets")
+
+    def abort_upload_target(self, filename, target):
+        """
+        Cancel an upload target, discarding anything uploaded on it
+
+        :param filename:        The name the file would have had on the storage
+        :type filename:         str
+        :param target:          The target created by create_upload_target
+        :type target:           dict[str, any]
+        """
+        raise NotImplementedError("Storage " + str(self.name) + " doesn't support upload targets")
+
+    @abc.abstractmethod
+    def open_read(self, filename):
+        """
+        Read a stored file as a stream, without downloading it first.
+        This is a context manager: the stream is closed, and errors are checked, when leaving the context.
+
+        :param filename:        The name of the file on the cloud storage
+        :type filename:         str
+        :return:                A readable file-like object
+        :rtype:                 file
+        """
+        pass
+
+    @abc.abstractmethod
+    def open_write(self, filename):
+        """
+        Write a stored file as a stream, without a local file.
+        This is a context manager: the file is only saved when leaving the context without error,
+        otherwise the partially written data are discarded.
+
+        :param filename:        The name of the file on the cloud storage
+        :type filename:         str
+        :return:                A writable file-like object
+        :rtype:                 file
+        """
+        pass
+
+    def upload_stream(self, reader, dest_filename, chunk_size=None):
+        """
+        Save the content of a readable stream on this storage, without a local file
+
+        :param reader:          The stream to read until its end
+        :type reader:           file
+        :param dest_filename:   The name of the file on the storage
+        :type dest_filename:    str
+        :param chunk_size:      The size of the read blocks, in bytes. Optional, default STREAM_CHUNK_SIZE
+        :type chunk_size:       int|None
+        """
+        chunk_size = int(chunk_size) if chunk_size else STREAM_CHUNK_SIZE
+        with self.open_write(dest_filename) as writer:
+            while True:
+                chunk = reader.read(chunk_size)
+                if not chunk:
+                    break
+                writer.write(chunk)
+
     @abc.abstractmethod
     def serialize(self):
         """
@@ -415,6 +557,46 @@ class LocalFsStorage(Storage):
             os.makedirs(full_dest_dir)
         shutil.copy(local_src, os.path.join(self._path, dest_filename))
 
+    @contextlib.contextmanager
+    def open_read(self, filename):
+        """
+        Read a stored file as a stream
+
+        :param filename:        The name of the file on the storage
+        :type filename:         str
+        :return:                A readable file-like object
+        :rtype:                 file
+        """
+        full_path = os.path.join(self._path, filename.lstrip("/"))
+        if not os.path.exists(full_path):
+            raise FileMissingError("file "+str(filename)+" doesn't exists")
+        with open(full_path, "rb") as fh:
+            yield fh
+
+    @contextlib.contextmanager
+    def open_write(self, filename):
+        """
+        Write a stored file as a stream. The data go to a temporary file which replaces the destination at the end
+
+        :param filename:        The name of the file on the storage
+        :type filename:         str
+        :return:                A writable file-like object
+        :rtype:                 file
+        """
+        full_path = os.path.join(self._path, filename.lstrip("/"))
+        full_dest_dir = os.path.dirname(full_path)
+        if not os.path.exists(full_dest_dir):
+            os.makedirs(full_dest_dir)
+        fd, tmp_path = tempfile.mkstemp(dir=full_dest_dir, prefix="." + os.path.basename(full_path), suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                yield fh
+            os.rename(tmp_path, full_path)
+        except error_util.all_errors:
+            with error_util.before_raising():
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
     def file_exists(self, filename):
         """
         Check if a file exists on distant storage
@@ -501,6 +683,28 @@ class LocalFsStorage(Storage):
         """
         return [f for f in os.listdir(self.path) if os.path.isfile(os.path.join(self.path, f))]
 
+    def list_files_info(self):
+        """
+        List all files on the distant storage, with their creation date.
+
+        :return:                The creation date (naive utc datetime) of each file, by filename
+        :rtype:                 dict[str, datetime.datetime]
+        """
+        result = {}
+        for filename in os.listdir(self.path):
+            try:
+                stats = os.stat(os.path.join(self.path, filename))
+            except OSError:
+                continue  # Deleted in the meantime
+            if not os.path.isfile(os.path.join(self.path, filename)):
+                continue
+            creation_time = stats.st_ctime
+            modification_time = stats.st_mtime
+            if modification_time > 0 and (creation_time == 0 or modification_time < creation_time):
+                creation_time = modification_time
+            result[filename] = datetime.datetime.utcfromtimestamp(creation_time)
+        return result
+
     def serialize(self):
         """
         Generate a string representation so you can recreate the storage using storage_factory.unserialize
@@ -534,7 +738,18 @@ class S3Storage(Storage):
     """
 
     MULTIPART_LIMIT = 104857600
+    TRANSFER_PART_SIZE = 16 * 1024 * 1024   # in bytes
+    TRANSFER_MAX_CONCURRENCY = 10
+    UPLOAD_TARGET_PART_SIZE = 64 * 1024 * 1024      # in bytes
+    UPLOAD_TARGET_MAX_SIZE = 64 * 1024 * 1024 * 1024    # in bytes
+    UPLOAD_TARGET_INITIAL_PARTS = 4                     # the other parts are presigned on request
+    UPLOAD_TARGET_EXPIRE = 3600                         # in seconds
+    DELETE_BATCH_SIZE = 1000    # S3 limit for delete_objects
+    URL_CACHE_TTL = 60          # in seconds
+    URL_CACHE_MAX_SIZE = 10000
     __bucket_cache = {}
+    __url_cache = {}
+    __url_cache_lock = threading.Lock()
 
     @staticmethod
     def unserialize(conf):
@@ -554,7 +769,8 @@ class S3Storage(Storage):
         if conf['type'] != 's3':
             raise RuntimeError("invalid s3storage config: type should be 's3', but is actually '"+str(conf['type'])+"'")
         return S3Storage(conf['bucket'], conf['path'], conf['location'], conf['region'], conf['access_key_id'],
-                         conf['access_key_secret'], conf['expire'])
+                         conf['access_key_secret'], conf['expire'], transfer_config=conf.get('transfer'),
+                         endpoint_url=conf.get('endpoint_url'))
 
     @staticmethod
     def load(conf, name):
@@ -589,9 +805,18 @@ class S3Storage(Storage):
         expire = conf.get(section, 'link_expire_delay', None)
         if not expire:
             expire = conf.get("asw_default", 'link_expire_delay', 0)
-        return S3Storage(bucket, path, location, region, access_key_id, access_key_secret, int(expire))
-
-    def __init__(self, bucket_name, path, location, aws_region, access_key_id, access_key_secret, expire=0):
+        transfer_config = {}
+        for key in ("part_size", "max_concurrency", "max_bandwidth"):
+            for conf_section in (section, "asw_default"):
+                if conf.has_option(conf_section, "transfer_" + key):
+                    transfer_config[key] = conf.getint(conf_section, "transfer_" + key)
+                    break
+        endpoint_url = conf.get(section, 'endpoint_url') if conf.has_option(section, 'endpoint_url') else None
+        return S3Storage(bucket, path, location, region, access_key_id, access_key_secret, int(expire),
+                         transfer_config=transfer_config, endpoint_url=endpoint_url)
+
+    def __init__(self, bucket_name, path, location, aws_region, access_key_id, access_key_secret, expire=0,
+                 transfer_config=None, endpoint_url=None):
         """
         :param bucket_name:             The bucket name
         :type bucket_name:              str
@@ -607,6 +832,14 @@ class S3Storage(Storage):
         :type access_key_secret:        str
         :param expire:                  The link expiration limit, in seconds. Optional, default 0
         :type expire:                   int
+        :param transfer_config:         The transfer parameters: 'part_size' (in bytes), 'max_concurrency' (number of
+                                        parallel requests by transfer) and 'max_bandwidth' (in bytes per second).
+                                        Optional, default None (TRANSFER_PART_SIZE, TRANSFER_MAX_CONCURRENCY and
+                                        no bandwidth limit)
+                                        A zero or None 'max_bandwidth' means no limit.
+        :type transfer_config:          dict[str, int]|None
+        :param endpoint_url:            An alternative S3 endpoint, for S3 compatible servers. Optional, default None
+        :type endpoint_url:             str|None
         """
         super(S3Storage, self).__init__('s3_'+location, location)
         self._bucket_name = bucket_name
@@ -615,8 +848,17 @@ class S3Storage(Storage):
         self._key_id = access_key_id
         self._key_secret = access_key_secret
         self._expire_delay = expire
-        self._conn = None
+        self._transfer_params = {
+            "part_size": S3Storage.TRANSFER_PART_SIZE,
+            "max_concurrency": S3Storage.TRANSFER_MAX_CONCURRENCY,
+            "max_bandwidth": None
+        }
+        if transfer_config:
+            self._transfer_params.update(dict((k, v) for k, v in transfer_config.items() if v is not None))
+        self._endpoint_url = endpoint_url
+        self._local = threading.local()     # boto3 sessions and resources are not thread safe
         self._anonymous_conn = None
+        self._anonymous_conn_lock = threading.Lock()
 
     @property
     def type(self):
@@ -646,22 +888,49 @@ class S3Storage(Storage):
         :type local_dest:           str
         """
         full_src = self._get_s3_filename(src_filename)
-        self.bucket.Object(full_src).download_file(local_dest)
+        self.bucket.Object(full_src).download_file(local_dest, Config=self.transfer_config)
 
     @property
     def conn(self):
         """
-        Get the resource object corresponding to the s3 storage credentials
+        Get the resource object corresponding to the s3 storage credentials.
+        Each thread gets its own session and resource, so it shouldn't be passed to another thread
 
         :return:            The AWS S3 Resource object
         :rtype:             boto3.resources.factory.s3.ServiceResource
         """
-        import boto3
+        import boto3.session
 
-        if self._conn is None:
-            self._conn = boto3.resource("s3", region_name=self.aws_region, aws_access_key_id=self._key_id,
-                                        aws_secret_access_key=self._key_secret)
-        return self._conn
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            session = boto3.session.Session(region_name=self.aws_region, aws_access_key_id=self._key_id,
+                                            aws_secret_access_key=self._key_secret)
+            conn = session.resource("s3", endpoint_url=self._endpoint_url)
+            self._local.conn = conn
+        return conn
+
+    @property
+    def transfer_params(self):
+        """
+        :return:        The transfer parameters: 'part_size', 'max_concurrency' and 'max_bandwidth'
+        :rtype:         dict[str, int|None]
+        """
+        return dict(self._transfer_params)
+
+    @property
+    def transfer_config(self):
+        """
+        Get the configuration of the managed transfers (upload_file, download_file)
+
+        :return:        The boto3 transfer configuration
+        :rtype:         boto3.s3.transfer.TransferConfig
+        """
+        import boto3.s3.transfer
+
+        return boto3.s3.transfer.TransferConfig(multipart_threshold=self._transfer_params["part_size"],
+                                                multipart_chunksize=self._transfer_params["part_size"],
+                                                max_concurrency=self._transfer_params["max_concurrency"],
+                                                max_bandwidth=self._transfer_params["max_bandwidth"] or None)
 
     @property
     def bucket(self):
@@ -687,12 +956,68 @@ class S3Storage(Storage):
         if not dest_filename:
             dest_filename = os.path.basename(local_src)
         full_dest = self._get_s3_filename(dest_filename)
-        if self._expire_delay == 0:
-            self.bucket.upload_file(local_src, full_dest, ExtraArgs={'ACL': 'public-read'})
-            # object_acl = self.conn.ObjectAcl(self.bucket_name, full_dest)
-            # object_acl.put(ACL='public-read')
+        extra_args = {'ACL': 'public-read'} if self._expire_delay == 0 else None
+        self.bucket.upload_file(local_src, full_dest, ExtraArgs=extra_args, Config=self.transfer_config)
         return self.get_file_url(dest_filename)
 
+    @contextlib.contextmanager
+    def open_read(self, filename):
+        """
+        Read a stored file as a stream
+
+        :param filename:        The name of the file on the cloud storage
+        :type filename:         str
+        :return:                A readable file-like object
+        :rtype:                 botocore.response.StreamingBody
+        """
+        import botocore.exceptions
+
+        full_filename = self._get_s3_filename(filename)
+        try:
+            body = self.bucket.Object(full_filename).get()["Body"]
+        except botocore.exceptions.ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                raise FileMissingError("file " + str(filename) + " doesn't exists")
+            raise
+        try:
+            yield body
+        finally:
+            body.close()
+
+    @contextlib.contextmanager
+    def open_write(self, filename):
+        """
+        Write a stored file as a stream, using a multipart upload for big files
+
+        :param filename:        The name of the file on the cloud storage
+        :type filename:         str
+        :return:                A writable file-like object
+        :rtype:                 S3MultipartWriter
+        """
+        writer = S3MultipartWriter(self, self._get_s3_filename(filename), self._transfer_params["part_size"])
+        try:
+            yield writer
+            writer.close()
+        except error_util.all_errors:
+            with error_util.before_raising():
+                writer.abort()
+
+    def upload_stream(self, reader, dest_filename, chunk_size=None):
+        """
+        Save the content of a readable stream on this storage, without a local file.
+        The parts are sent concurrently, with the transfer configuration of the storage.
+
+        :param reader:          The stream to read until its end
+        :type reader:           file
+        :param dest_filename:   The name of the file on the cloud storage
+        :type dest_filename:    str
+        :param chunk_size:      Unused, the stream is read by parts of the transfer configuration
+        :type chunk_size:       int|None
+        """
+        extra_args = {'ACL': 'public-read'} if self._expire_delay == 0 else None
+        self.bucket.upload_fileobj(reader, self._get_s3_filename(dest_filename), ExtraArgs=extra_args,
+                                   Config=self.transfer_config)
+
     def file_exists(self, filename):
         """
         Check if a file exists on distant storage
@@ -718,12 +1043,32 @@ class S3Storage(Storage):
         :rtype:                 bool|str
         """
         full_filename = self._get_s3_filename(filename)
+        cache_key = (self.name, self.bucket_name, full_filename, self._expire_delay)
+        now = time.time()
+        with S3Storage.__url_cache_lock:
+            cached = S3Storage.__url_cache.get(cache_key)
+        if cached and cached[1] > now:
+            return cached[0]
+
         params = {'Bucket': self.bucket_name, 'Key': full_filename}
         if self._expire_delay == 0:
-            return self.anonymous_conn.generate_presigned_url('get_object', ExpiresIn=0, Params=params)
+            url = self.anonymous_conn.generate_presigned_url('get_object', ExpiresIn=0, Params=params)
+            ttl = S3Storage.URL_CACHE_TTL
         else:
-            return self.conn.meta.client.generate_presigned_url('get_object', ExpiresIn=self._expire_delay,
-                                                                Params=params)
+            url = self.conn.meta.client.generate_presigned_url('get_object', ExpiresIn=self._expire_delay,
+                                                               Params=params)
+            # Cached links should stay valid long enough to be used
+            ttl = min(S3Storage.URL_CACHE_TTL, self._expire_delay / 2)
+
+        with S3Storage.__url_cache_lock:
+            if len(S3Storage.__url_cache) >= S3Storage.URL_CACHE_MAX_SIZE:
+                for key in [k for k, v in S3Storage.__url_cache.items() if v[1] <= now]:
+                    del S3Storage.__url_cache[key]
+                if len(S3Storage.__url_cache) >= S3Storage.URL_CACHE_MAX_SIZE:
+                    S3Storage.__url_cache.clear()
+            if ttl > 0:
+                S3Storage.__url_cache[cache_key] = (url, now + ttl)
+        return url
 
     def delete_file(self, filename):
         """
@@ -767,18 +1112,21 @@ class S3Storage(Storage):
 
     def get_file_md5(self, filename):
         """
-        Get the md5 of a file
-        WARNING: may not work for big files
+        Get the md5 of a file, from its ETag.
+        The ETag of a multipart upload, or of an object encrypted with SSE-KMS, is not the md5 of the file
 
         :param filename:    The name of the file
         :type filename:     str
-        :return:            The md5 of the file. Throw error if it doesn't exists
-        :rtype:             str
+        :return:            The md5 of the file, or None if its ETag is not an md5. Throw error if it doesn't exists
+        :rtype:             str|None
         """
         if not self.file_exists(filename):
             raise FileMissingError("file " + str(filename) + " doesn't exists")
-        full_filename = self._get_s3_filename(filename)
-        return self.bucket.Object(full_filename).etag[1:-1]
+        s3_object = self.bucket.Object(self._get_s3_filename(filename))
+        etag = s3_object.etag[1:-1]
+        if "-" in etag or str(s3_object.server_side_encryption or "").startswith("aws:kms"):
+            return None
+        return etag
 
     def list_files(self):
         """
@@ -793,6 +1141,43 @@ class S3Storage(Storage):
             result.append(str(obj.key)[len(prefix):])
         return result
 
+    def list_files_info(self):
+        """
+        List all files on the distant storage, with their creation date.
+        The dates come from the listing itself, so there is only one request per 1000 files.
+
+        :return:                The creation date (naive utc datetime) of each file, by filename
+        :rtype:                 dict[str, datetime.datetime]
+        """
+        result = {}
+        prefix = self.path + "/" if self.path else ''
+        for obj in self.bucket.objects.filter(Prefix=prefix):
+            last_modified = obj.last_modified
+            if last_modified.tzinfo is not None:
+                last_modified = (last_modified - last_modified.utcoffset()).replace(tzinfo=None)
+            result[str(obj.key)[len(prefix):]] = last_modified
+        return result
+
+    def delete_files(self, filenames):
+        """
+        Remove several files from distant storage, by batches of DELETE_BATCH_SIZE files.
+        Missing files are ignored.
+
+        :param filenames:       The names of the files on the cloud storage
+        :type filenames:        list[str]
+        """
+        filenames = list(filenames)
+        for i in range(0, len(filenames), S3Storage.DELETE_BATCH_SIZE):
+            batch = filenames[i:i + S3Storage.DELETE_BATCH_SIZE]
+            response = self.bucket.delete_objects(Delete={
+                "Objects": [{"Key": self._get_s3_filename(filename)} for filename in batch],
+                "Quiet": True
+            })
+            errors = response.get("Errors", []) if response else []
+            if errors:
+                raise IOError("Unable to delete " + str(len(errors)) + " files from storage " + self.name +
+                              ", first error: " + str(errors[0].get("Key")) + ": " + str(errors[0].get("Message")))
+
     def serialize(self):
         """
         Generate a string representation so you can recreate the storage using storage_factory.unserialize
@@ -807,7 +1192,9 @@ class S3Storage(Storage):
                            'region': self.aws_region,
                            'access_key_id': self._key_id,
                            'access_key_secret': self._key_secret,
-                           'expire': self._expire_delay})
+                           'expire': self._expire_delay,
+                           'transfer': self._transfer_params,
+                           'endpoint_url': self._endpoint_url})
 
     @property
     def bucket_name(self):
@@ -836,12 +1223,141 @@ class S3Storage(Storage):
         import boto3
         import botocore.client
 
-        if self._anonymous_conn is None:
-            config = botocore.client.Config()
-            config.signature_version = botocore.UNSIGNED
-            self._anonymous_conn = boto3.client("s3", region_name="eu-west-1", config=config)
+        # Clients are thread safe once created, but the default session isn't
+        with self._anonymous_conn_lock:
+            if self._anonymous_conn is None:
+                config = botocore.client.Config()
+                config.signature_version = botocore.UNSIGNED
+                self._anonymous_conn = boto3.session.Session().client("s3", region_name="eu-west-1", config=config,
+                                                                      endpoint_url=self._endpoint_url)
         return self._anonymous_conn
 
+    @property
+    def supports_upload_targets(self):
+        return True
+
+    def create_upload_target(self, filename, expire=None):
+        """
+        Start a multipart upload and presign the upload of its first UPLOAD_TARGET_INITIAL_PARTS parts.
+        The worker can only send parts of this object, for 'expire' seconds. It asks for the urls of the next parts
+        only if its file is bigger (see extend_upload_target).
+
+        :param filename:        The name the file will have on the storage
+        :type filename:         str
+        :param expire:          The validity of the presigned urls, in seconds. Optional, default UPLOAD_TARGET_EXPIRE
+        :type expire:           int|None
+        :return:                The target description: 'type', 'upload_id', 'part_size', 'max_parts',
+                                'etag_is_md5' and 'urls', the url of the first parts, in order
+        :rtype:                 dict[str, any]
+        """
+        client = self.conn.meta.client
+        full_dest = self._get_s3_filename(filename)
+        extra_args = {'ACL': 'public-read'} if self._expire_delay == 0 else {}
+        response = client.create_multipart_upload(Bucket=self.bucket_name, Key=full_dest, **extra_args)
+        max_parts = -(-S3Storage.UPLOAD_TARGET_MAX_SIZE // S3Storage.UPLOAD_TARGET_PART_SIZE)
+        target = {
+            "type": "s3_multipart",
+            "upload_id": response["UploadId"],
+            "part_size": S3Storage.UPLOAD_TARGET_PART_SIZE,
+            "max_parts": max_parts,
+            # With SSE-KMS, the ETag of a part is not its md5
+            "etag_is_md5": not str(response.get("ServerSideEncryption", "")).startswith("aws:kms"),
+            "urls": []
+        }
+        try:
+            target["urls"] = self._presign_upload_parts(full_dest, target, 1,
+                                                        min(max_parts, S3Storage.UPLOAD_TARGET_INITIAL_PARTS), expire)
+        except error_util.all_errors:
+            with error_util.before_raising():
+                self.abort_upload_target(filename, target)
+        return target
+
+    def extend_upload_target(self, filename, target, nbr_parts, expire=None):
+        """
+        Presign the upload of the parts not covered by the target yet
+
+        :param filename:        The name the file will have on the storage
+        :type filename:         str
+        :param target:          The target created by create_upload_target
+        :type target:           dict[str, any]
+        :param nbr_parts:       The number of parts of the file the worker will upload
+        :type nbr_parts:        int
+        :param expire:          The validity of the presigned urls, in seconds. Optional, default UPLOAD_TARGET_EXPIRE
+        :type expire:           int|None
+        :return:                The 'first_part' number and the 'urls' of the parts from this one to nbr_parts
+        :rtype:                 dict[str, any]
+        """
+        if nbr_parts > target["max_parts"]:
+            raise RuntimeError("File " + filename + " is too big for its upload target: " + str(nbr_parts) + " parts")
+        first_part = len(target["urls"]) + 1
+        urls = self._presign_upload_parts(self._get_s3_filename(filename), target, first_part, nbr_parts, expire)
+        target["urls"].extend(urls)
+        return {"first_part": first_part, "urls": urls}
+
+    def _presign_upload_parts(self, full_dest, target, first_part, last_part, expire=None):
+        client = self.conn.meta.client
+        urls = []
+        for part_number in range(first_part, last_part + 1):
+            params = {"Bucket": self.bucket_name, "Key": full_dest, "UploadId": target["upload_id"],
+                      "PartNumber": part_number}
+            urls.append(client.generate_presigned_url("upload_part", Params=params,
+                                                      ExpiresIn=expire or S3Storage.UPLOAD_TARGET_EXPIRE))
+        return urls
+
+    def complete_upload_target(self, filename, target, manifest):
+        """
+        Compare the parts received by S3 with the ones the worker declared, then complete the multipart upload.
+        The worker sends the md5 of each part in its Content-MD5 header, and S3 rejects the parts which don't match it.
+        When the ETag of the parts is their md5 (no SSE-KMS), the md5 are also compared, so the data are checked
+        without reading them again.
+        On mismatch, the upload is aborted and an IOError is raised.
+
+        :param filename:        The name the file will have on the storage
+        :type filename:         str
+        :param target:          The target created by create_upload_target
+        :type target:           dict[str, any]
+        :param manifest:        The worker description of the upload: 'size' and 'parts', a list of dict
+                                with 'number', 'size' and 'md5'
+        :type manifest:         dict[str, any]
+        :return:                The size of the saved file, in bytes
+        :rtype:                 int
+        """
+        client = self.conn.meta.client
+        full_dest = self._get_s3_filename(filename)
+        try:
+            received = {}
+            paginator = client.get_paginator("list_parts")
+            for page in paginator.paginate(Bucket=self.bucket_name, Key=full_dest, UploadId=target["upload_id"]):
+                for part in page.get("Parts", []):
+                    received[int(part["PartNumber"])] = part
+            declared = dict((int(part["number"]), part) for part in manifest["parts"])
+            if not declared or set(declared.keys()) != set(received.keys()):
+                raise IOError("Parts of " + filename + " don't match: " + str(len(received)) + " received, " +
+                              str(len(declared)) + " declared")
+            for number, part in declared.items():
+                if int(received[number]["Size"]) != int(part["size"]):
+                    raise IOError("Part " + str(number) + " of " + filename + " is corrupted")
+                if target["etag_is_md5"] and received[number]["ETag"].strip('"') != part["md5"]:
+                    raise IOError("Part " + str(number) + " of " + filename + " is corrupted")
+            size = sum(int(part["Size"]) for part in received.values())
+            if size != int(manifest["size"]):
+                raise IOError("Size of " + filename + " doesn't match: " + str(size) + " received, " +
+                              str(manifest["size"]) + " declared")
+            parts = [{"ETag": received[number]["ETag"], "PartNumber": number} for number in sorted(received.keys())]
+            client.complete_multipart_upload(Bucket=self.bucket_name, Key=full_dest, UploadId=target["upload_id"],
+                                             MultipartUpload={"Parts": parts})
+        except error_util.all_errors:
+            with error_util.before_raising():
+                self.abort_upload_target(filename, target)
+        return size
+
+    def abort_upload_target(self, filename, target):
+        try:
+            self.conn.meta.client.abort_multipart_upload(Bucket=self.bucket_name, Key=self._get_s3_filename(filename),
+                                                         UploadId=target["upload_id"])
+        except error_util.all_errors as e:
+            log.warning("Unable to abort upload of " + filename + ": " + str(e))
+
     def _get_s3_filename(self, filename):
         """
         Get the path on the destination bucket
@@ -878,7 +1394,107 @@ class S3Storage(Storage):
         return True
 
 
+class S3MultipartWriter(object):
+    """
+    Writable file-like object saving an S3 object.
+    The data are sent by parts, so the memory used stays bounded whatever the size of the file.
+    Small files are sent with a single request.
+
+    Usage:
+        writer = S3MultipartWriter(storage, key)
+        try:
+            writer.write(data)
+            writer.close()
+        except:
+            writer.abort()
+    """
+
+    PART_SIZE = 16 * 1024 * 1024       # in bytes
+    MIN_PART_SIZE = 5 * 1024 * 1024    # in bytes, S3 refuses smaller parts, except for the last one
+
+    def __init__(self, storage, key, part_size=None):
+        """
+        :param storage:         The destination storage
+        :type storage:          S3Storage
+        :param key:             The full key of the object in the bucket
+        :type key:              str
+        :param part_size:       The size of each uploaded part. Optional, default PART_SIZE
+        :type part_size:        int|None
+        """
+        super(S3MultipartWriter, self).__init__()
+        self._storage = storage
+        self._key = key
+        self._part_size = max(S3MultipartWriter.MIN_PART_SIZE, int(part_size or S3MultipartWriter.PART_SIZE))
+        self._buffer = []
+        self._buffer_size = 0
+        self._upload_id = None
+        self._parts = []
+        self._closed = False
+
+    def write(self, data):
+        if self._closed:
+            raise ValueError("I/O operation on closed writer")
+        if not data:
+            return
+        self._buffer.append(data)
+        self._buffer_size += len(data)
+        while self._buffer_size >= self._part_size:
+            data = b"".join(self._buffer)
+            self._buffer = [data[self._part_size:]]
+            self._buffer_size = len(self._buffer[0])
+            self._send_part(data[:self._part_size])
+
+    def close(self):
+        """ Send the remaining data and finish the upload """
+        if self._closed:
+            return
+        self._closed = True
+        data = b"".join(self._buffer)
+        self._buffer = []
+        self._buffer_size = 0
+        client = self._storage.conn.meta.client
+        if self._upload_id is None:
+            client.put_object(Bucket=self._storage.bucket_name, Key=self._key, Body=data, **self._get_extra_args())
+            return
+        if data:
+            self._send_part(data)
+        client.complete_multipart_upload(Bucket=self._storage.bucket_name, Key=self._key, UploadId=self._upload_id,
+                                         MultipartUpload={"Parts": self._parts})
+
+    def abort(self):
+        """ Cancel the upload. Nothing will be saved """
+        self._closed = True
+        self._buffer = []
+        self._buffer_size = 0
+        if self._upload_id is None:
+            return
+        try:
+            self._storage.conn.meta.client.abort_multipart_upload(Bucket=self._storage.bucket_name, Key=self._key,
+                                                                  UploadId=self._upload_id)
+        except error_util.all_errors as e:
+            log.warning("Unable to abort multipart upload of " + self._key + ": " + str(e))
+        self._upload_id = None
+
+    def _get_extra_args(self):
+        if self._storage._expire_delay == 0:
+            return {"ACL": "public-read"}
+        return {}
+
+    def _send_part(self, data):
+        client = self._storage.conn.meta.client
+        if self._upload_id is None:
+            response = client.create_multipart_upload(Bucket=self._storage.bucket_name, Key=self._key,
+                                                      **self._get_extra_args())
+            self._upload_id = response["UploadId"]
+        part_number = len(self._parts) + 1
+        response = client.upload_part(Bucket=self._storage.bucket_name, Key=self._key, UploadId=self._upload_id,
+                                      PartNumber=part_number, Body=data)
+        self._parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+
+
 class SshStorage(Storage):
+    DELETE_BATCH_SIZE = 500
+
     @staticmethod
     def unserialize(conf):
         import lib.ssh
@@ -940,6 +1556,16 @@ class SshStorage(Storage):
     def upload_file(self, local_src, dest_filename):
         self._conn.send_file(local_src, os.path.join(self._path, dest_filename))
 
+    @contextlib.contextmanager
+    def open_read(self, filename):
+        with self._conn.read_file_pipe(os.path.join(self._path, filename)) as fh:
+            yield fh
+
+    @contextlib.contextmanager
+    def open_write(self, filename):
+        with self._conn.send_file_pipe(os.path.join(self._path, filename)) as fh:
+            yield fh
+
     def get_file_url(self, filename):
         return None
 
@@ -990,9 +1616,36 @@ class SshStorage(Storage):
         :return:                A list oof filenames
         :rtype:                 list[str]
         """
-        code, out, err = self.conn.run(['find', self.path, "-maxdepth", "1", "-type", "f", "-print", '%f\\n'])
+        code, out, err = self.conn.run(['find', self.path, "-maxdepth", "1", "-type", "f", "-printf", '%f\\n'])
         return out.strip().splitlines()
 
+    def list_files_info(self):
+        """
+        List all files on the distant storage, with their creation date, using a single command.
+        As for SshConnection.get_file_creation_date, the modification date is used if the birth date is unknown.
+
+        :return:                The creation date (naive utc datetime) of each file, by filename
+        :rtype:                 dict[str, datetime.datetime]
+        """
+        code, out, err = self.conn.run(['find', self.path, "-maxdepth", "1", "-type", "f", "-printf", '%T@ %f\\n'])
+        result = {}
+        for line in out.strip().splitlines():
+            timestamp, filename = line.split(" ", 1)
+            result[filename] = datetime.datetime.utcfromtimestamp(int(float(timestamp)))
+        return result
+
+    def delete_files(self, filenames):
+        """
+        Remove several files from distant storage, with one command per DELETE_BATCH_SIZE files
+
+        :param filenames:       The names of the files on the cloud storage
+        :type filenames:        list[str]
+        """
+        filenames = list(filenames)
+        for i in range(0, len(filenames), SshStorage.DELETE_BATCH_SIZE):
+            batch = filenames[i:i + SshStorage.DELETE_BATCH_SIZE]
+            self._conn.run(["rm", "-f", "--"] + [os.path.join(self._path, filename) for filename in batch])
+
     def serialize(self):
         return json.dumps({'type': 'ssh',
                            'conn': self._conn.serialize(),
@@ -1032,14 +1685,11 @@ def copy_storage_to_storage(src_store, src_filename, dest_store, dest_filename,
     :param dest_filename:       The name of the file will have on destination storage. Optional
                                 If not provided, it will be the same has in the source storage
     :type dest_filename:        str
-    :param tmp_folder:          A folder to use on local machine to work as swap folder
+    :param tmp_folder:          Not used anymore, files are streamed from a storage to the other
     :type tmp_folder:           str|None
     :return:                    The url of the file on the destination storage, if any
     :rtype:                     str|None
     """
-    if not tmp_folder:
-        tmp_folder = tempfile.gettempdir()
-
     # The file is already there
     if src_store == dest_store and src_filename == dest_filename:
         if src_store.type == "s3":
@@ -1082,6 +1732,7 @@ def copy_storage_to_storage(src_store, src_filename, dest_store, dest_filename,
                 src_store.conn.run(["cp", "-f", full_src, full_dest])
             else:
                 src_store.conn.run(["cp", "-f", full_src, full_dest], as_user=dest_store.conn.client_user)
+            return
 
     # We copy to local so no temp swapping copy is required
     if dest_store.type == "local_filesystem":
@@ -1112,11 +1763,7 @@ def copy_storage_to_storage(src_store, src_filename, dest_store, dest_filename,
                 object_acl.put(ACL='public-read')
             return dest_store.get_file_url(dest_filename)
         else:
-            log.debug("SAM: using SSH proxy for upload")
-            bucket = dest_store.bucket.object()
-            with src_store.conn.read_file_pipe(full_src) as fh:
-                bucket.Object(full_dest).upload_fileobj(fh)
-            return dest_store.get_file_url(dest_filename)
+            return stream_storage_to_storage(src_store, src_filename, dest_store, dest_filename)
 
     # Rely common case, so here an optimized version
     if src_store.type == "s3" and dest_store.type == "ssh":
@@ -1133,14 +1780,80 @@ def copy_storage_to_storage(src_store, src_filename, dest_store, dest_filename,
                 raise RuntimeError("upload to ssh failed")
             return
         else:
-            log.debug("SAM: using SSH proxy for download")
-            s3_file = src_store.bucket.Object(full_src)
-            with dest_store.conn.send_file_pipe(full_dest) as fh:
-                s3_file.upload_fileobj(fh)
-            return
+            return stream_storage_to_storage(src_store, src_filename, dest_store, dest_filename)
+
+    # Generic case: stream the file from a storage to the other
+    return stream_storage_to_storage(src_store, src_filename, dest_store, dest_filename)
+
 
-    log.debug("SAM: default tranfert: "+str(src_store.type)+" to "+str(dest_store.type))
-    # Generic case: download to a temporary folder and then push up to the new store
-    with file_util.temp_filename(dir=tmp_folder) as tmp_filename:
-        src_store.download_file(src_filename, tmp_filename)
-        dest_store.upload_file(tmp_filename, dest_filename)
+def stream_storage_to_storage(src_store, src_filename, dest_store, dest_filename, verify=True, chunk_size=None):
+    """
+    Copy a file between two storages by streaming it: the data never touch the local disk and the memory used
+    is bounded by the chunk size (and by the part size for s3 destinations).
+    The number of transferred bytes is always checked against the source file size.
+
+    :param src_store:           The storage where the file is
+    :type src_store:            Storage
+    :param src_filename:        The name of the file on the source storage
+    :type src_filename:         str
+    :param dest_store:          The storage where the file will be copied
+    :type dest_store:           Storage
+    :param dest_filename:       The name the file will have on destination storage
+    :type dest_filename:        str
+    :param verify:              Check the md5 of the transferred data against the destination file, or its size when
+                                the destination storage doesn't know the md5 of the file. Optional, default True
+    :type verify:               bool
+    :param chunk_size:          The size of the read blocks, in bytes. Optional, default STREAM_CHUNK_SIZE
+    :type chunk_size:           int|None
+    :return:                    The url of the file on the destination storage, if any
+    :rtype:                     str|None
+    """
+    expected_size = src_store.get_file_size(src_filename)
+    with src_store.open_read(src_filename) as src_reader:
+        reader = DigestReader(src_reader)
+        dest_store.upload_stream(reader, dest_filename, chunk_size)
+    if reader.size != expected_size:
+        dest_store.delete_file(dest_filename)
+        raise IOError("Incomplete transfer of " + str(src_filename) + ": " + str(reader.size) +
+                      " bytes received, " + str(expected_size) + " expected")
+
+    if verify:
+        dest_md5 = dest_store.get_file_md5(dest_filename)
+        if dest_md5 is None:
+            expected, result = expected_size, dest_store.get_file_size(dest_filename)
+        else:
+            expected, result = reader.hexdigest(), dest_md5
+        if result != expected:
+            dest_store.delete_file(dest_filename)
+            raise IOError("Checksum mismatch for " + str(dest_filename) + " on storage " + str(dest_store.name) +
+                          ": got " + str(result) + ", expected " + str(expected))
+    return dest_store.get_file_url(dest_filename)
+
+
+class DigestReader(object):
+    """
+    Readable file-like object computing the md5 and the size of the data read from another stream
+    """
+
+    def __init__(self, reader):
+        """
+        :param reader:      The stream to read
+        :type reader:       file
+        """
+        super(DigestReader, self).__init__()
+        self._reader = reader
+        self._md5 = hashlib.md5()
+        self.size = 0
+
+    def read(self, size=-1):
+        data = self._reader.read(size) if size is not None and size >= 0 else self._reader.read()
+        self._md5.update(data)
+        self.size += len(data)
+        return data
+
+    def hexdigest(self):
+        """
+        :return:        The md5 of the data read so far
+        :rtype:         str
+        """
+        return self._md5.hexdigest()
@@ -16,6 +16,8 @@ API_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
 
 
 class WorkerObserver(object):
+    PROBE_TIMEOUT = 30  # in seconds
+
     def __init__(self, worker, provider, api_name, server_name, launcher_name):
         """
         :param worker:              The base worker
@@ -46,12 +48,16 @@ class WorkerObserver(object):
         self._shutdown_time = provider.get_shutdown_time()
         self._provider_key_path = provider.get_key_path()
 
-    def update(self, worker):
+    def update(self, worker, timeout=None):
         """
         Fetch all the information of this instance worker object and then try to connect using ssh
 
         :param worker:       The related worker
         :type worker:        Worker
+        :param timeout:      The maximum duration of the ssh probe, in seconds. Optional, default PROBE_TIMEOUT
+        :type timeout:       int|float|None
+        :return:             True if the instance has been joined, False if not, None if it has not been probed
+        :rtype:              bool|None
         """
         self._worker = worker
         if self._killing_date is None and worker.status == Worker.Status.SHUTTING_DOWN:
@@ -66,21 +72,21 @@ class WorkerObserver(object):
                 ip = worker.public_ip if worker.public_ip else worker.private_ip
                 self._conn = ssh.SshConnection(ip, "aziugo", self._provider_key_path)
 
+            # Liveness and process check in a single ssh call
             found_proc = False
-            joinable = self._conn.ping()
-            if joinable:
-                cmd = "ps aux | grep -v defunct | grep -v grep"
-                code, out, err = self._conn.run(cmd, shell=True, can_fail=True, max_retry=0)
-            else:
-                code = 256
-            if code == 0:
+            cmd = "echo ssh_ping; ps aux | grep -v defunct | grep -v grep"
+            joinable, code, out = self._conn.probe(cmd, timeout if timeout else WorkerObserver.PROBE_TIMEOUT)
+            joinable = joinable and out.startswith("ssh_ping")
+            if joinable and code == 0:
                 found_proc = self._launcher_name in out
-            if code == 0 or joinable:
+            if joinable:
                 self._last_contact_date = datetime.datetime.utcnow()
                 self.drop_probation(Motive.NOT_JOINABLE)
             if found_proc:
                 self._last_job_working_date = datetime.datetime.utcnow()
                 self.drop_probation(Motive.NOT_WORKING)
+            return joinable
+        return None
 
     @property
     def worker_id(self):
@@ -125,6 +131,9 @@ class WorkerObserver(object):
     def is_cluster_slave(self):
         return self._worker.get_tag("type") == "cluster slave"
 
+    def is_warm_pool_worker(self):
+        return self._worker.get_tag("type") == "warm pool"
+
     def add_probation(self, sentence):
         """
         Add probation sentence motive in order to not send email twice for the same motive and instance
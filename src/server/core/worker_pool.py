@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+# vim: set tabstop=4:softtabstop=4:shiftwidth=4:expandtab:textwidth=120
+
+"""
+Warm pools of idle workers, one per (provider, machine type), configured with general.warm_worker_pools.
+The idle workers are shared through redis: the api server keeps each pool filled (see WorkerPoolKeeper) and the
+jobs claim a worker from it instead of creating one (see cmd_util.using_workers).
+"""
+
+# Python core libs
+import json
+import logging
+import math
+import time
+import datetime
+
+# Project specific libs
+from lib import error_util
+from lib import async_util
+from lib import ssh
+import api_util
+import worker
+import models.jobs
+import models.provider_config
+
+
+log = logging.getLogger("aziugo")
+
+WARM_POOL_TYPE = "warm pool"  # The 'type' tag of the idle workers
+
+
+def get_pool_names():
+    """
+    Get the configured warm pools
+
+    :return:        The list of (provider name, machine code) having a warm pool
+    :rtype:         list[tuple[str, str]]
+    """
+    conf = api_util.get_conf()
+    if not conf.has_option("general", "warm_worker_pools"):
+        return []
+    results = []
+    for pool_name in json.loads(conf.get("general", "warm_worker_pools")):
+        if "/" not in pool_name:
+            log.warning("Invalid warm worker pool " + repr(pool_name) + ", it should be 'provider/machine'")
+            continue
+        provider_name, machine = pool_name.split("/", 1)
+        results.append((provider_name.strip(), machine.strip()))
+    return results
+
+
+def get_pool_settings():
+    """
+    Get the sizing rules shared by all the warm pools
+
+    :return:        The 'min_size', 'max_size', 'max_idle_time' (in seconds) and 'rate_window' (in seconds) settings
+    :rtype:         dict[str, int]
+    """
+    conf = api_util.get_conf()
+    settings = {"min_size": 0, "max_size": 2, "max_idle_time": 1800, "rate_window": 3600}
+    for key in settings.keys():
+        if conf.has_option("general", "warm_pool_" + key):
+            settings[key] = max(0, conf.getint("general", "warm_pool_" + key))
+    settings["max_size"] = max(settings["min_size"], settings["max_size"])
+    return settings
+
+
+def get_max_worker_age():
+    """
+    Get the age after which an idle worker of a warm pool is no longer protected from the garbage collector.
+    The pool keeper recycles them way before, so only the workers of a removed pool should reach it.
+
+    :return:        The maximum age of an idle worker
+    :rtype:         datetime.timedelta
+    """
+    return datetime.timedelta(seconds=2 * get_pool_settings()["max_idle_time"] + 3600)
+
+
+def claim_worker(provider, machine):
+    """
+    Take an idle worker from the warm pool of a machine type, if any
+
+    :param provider:        The provider of the worker
+    :type provider:         core.provider.Provider
+    :param machine:         The machine type
+    :type machine:          str
+    :return:                The claimed worker, or None if the pool doesn't exist or is empty
+    :rtype:                 core.worker.Worker|None
+    """
+    if (provider.name, machine) not in get_pool_names():
+        return None
+    try:
+        return WorkerPool(provider.name, machine).claim()
+    except error_util.abort_errors: raise
+    except error_util.all_errors as e:
+        log.warning("Unable to claim a warm worker: " + str(e))
+        return None
+
+
+def get_all_pool_stats():
+    """
+    Get the state and the counters of all the configured warm pools
+
+    :return:        The statistics of each pool, see WorkerPool.get_stats
+    :rtype:         list[dict[str, any]]
+    """
+    return [WorkerPool(provider_name, machine).get_stats() for provider_name, machine in get_pool_names()]
+
+
+class WorkerPool(object):
+    """
+    The idle workers of a (provider, machine type) pair, stored in redis.
+    Each idle worker is a hash entry, so a worker can only be claimed once, by the process deleting the entry.
+    """
+
+    COUNTERS = ("hits", "misses", "created", "recycled")
+
+    def __init__(self, provider_name, machine):
+        """
+        :param provider_name:       The name of the provider
+        :type provider_name:        str
+        :param machine:             The machine type
+        :type machine:              str
+        """
+        super(WorkerPool, self).__init__()
+        self._provider_name = provider_name
+        self._machine = machine
+        base_key = "worker_pool:" + provider_name + ":" + machine
+        self._idle_key = api_util.RedisContext.get_channel(base_key + ":idle")
+        self._stats_key = api_util.RedisContext.get_channel(base_key + ":stats")
+
+    @property
+    def provider_name(self):
+        return self._provider_name
+
+    @property
+    def machine(self):
+        return self._machine
+
+    def add(self, new_worker, cost_per_sec, currency):
+        """
+        Add a ready worker to the pool
+
+        :param new_worker:      The idle worker
+        :type new_worker:       core.worker.Worker
+        :param cost_per_sec:    The provider cost of the worker, in internal price format
+        :type cost_per_sec:     int
+        :param currency:        The currency of the cost
+        :type currency:         str
+        """
+        now = time.time()
+        record = {
+            "worker": new_worker.serialize(),
+            "specific_cost": new_worker.specific_cost,
+            "specific_cost_currency": new_worker.specific_cost_currency,
+            "cost_per_sec": cost_per_sec,
+            "currency": currency,
+            "created": now,
+            "idle_since": now
+        }
+        with api_util.RedisContext.using_data_conn() as r:
+            r.hset(self._idle_key, new_worker.worker_id, json.dumps(record))
+            r.hincrby(self._stats_key, "created", 1)
+
+    def list_idle(self):
+        """
+        Get the idle workers of the pool
+
+        :return:        The records of the idle workers, by worker id, the oldest first
+        :rtype:         list[tuple[str, dict[str, any]]]
+        """
+        with api_util.RedisContext.using_data_conn() as r:
+            records = r.hgetall(self._idle_key)
+        results = [(worker_id, json.loads(record)) for worker_id, record in records.items()]
+        return sorted(results, key=lambda item: item[1]["idle_since"])
+
+    def claim(self):
+        """
+        Take the oldest idle worker of the pool
+
+        :return:        The claimed worker, or None if the pool is empty
+        :rtype:         core.worker.Worker|None
+        """
+        for worker_id, record in self.list_idle():
+            if self.remove(worker_id, record):
+                self.incr("hits")
+                claimed = worker.Worker.unserialize(record["worker"])
+                if record.get("specific_cost"):
+                    claimed.set_specific_cost(record["specific_cost"], record["specific_cost_currency"])
+                return claimed
+        self.incr("misses")
+        return None
+
+    def remove(self, worker_id, record):
+        """
+        Remove a worker from the pool, and account for the time it spent idle
+
+        :param worker_id:       The id of the worker to remove
+        :type worker_id:        str
+        :param record:          The record of the worker, as returned by list_idle
+        :type record:           dict[str, any]
+        :return:                False if the worker was already removed by someone else
+        :rtype:                 bool
+        """
+        with api_util.RedisContext.using_data_conn() as r:
+            if not r.hdel(self._idle_key, worker_id):
+                return False
+            idle_seconds = max(0.0, time.time() - record["idle_since"])
+            pipe = r.pipeline()
+            pipe.hincrbyfloat(self._stats_key, "idle_seconds", idle_seconds)
+            pipe.hincrbyfloat(self._stats_key, "idle_cost", idle_seconds * get_record_cost(record))
+            pipe.hset(self._stats_key, "currency", record["currency"])
+            pipe.execute()
+        return True
+
+    def incr(self, counter):
+        """
+        Increment a pool counter
+
+        :param counter:     The counter name, one of WorkerPool.COUNTERS
+        :type counter:      str
+        """
+        with api_util.RedisContext.using_data_conn() as r:
+            r.hincrby(self._stats_key, counter, 1)
+
+    def set_target(self, target_size, arrival_rate):
+        """
+        Save the sizing decision of the pool keeper
+
+        :param target_size:     The number of idle workers the pool should have
+        :type target_size:      int
+        :param arrival_rate:    The recent arrival rate of the jobs, in jobs per hour
+        :type arrival_rate:     float
+        """
+        with api_util.RedisContext.using_data_conn() as r:
+            r.hmset(self._stats_key, {"target_size": target_size, "arrival_rate": arrival_rate,
+                                      "update_time": int(time.time())})
+
+    def get_stats(self):
+        """
+        Get the state and the counters of the pool.
+        The idle time and cost include the time spent by the currently idle workers.
+
+        :return:        The statistics of the pool
+        :rtype:         dict[str, any]
+        """
+        idle_workers = self.list_idle()
+        with api_util.RedisContext.using_data_conn() as r:
+            stats = r.hgetall(self._stats_key)
+        now = time.time()
+        current_seconds = sum(max(0.0, now - record["idle_since"]) for _, record in idle_workers)
+        current_cost = sum(max(0.0, now - record["idle_since"]) * get_record_cost(record)
+                           for _, record in idle_workers)
+        currency = stats.get("currency")
+        if not currency and idle_workers:
+            currency = idle_workers[0][1]["currency"]
+        result = {
+            "provider": self._provider_name,
+            "machine": self._machine,
+            "idle_workers": len(idle_workers),
+            "target_size": int(stats.get("target_size", 0)),
+            "arrival_rate": float(stats.get("arrival_rate", 0)),
+            "idle_seconds": float(stats.get("idle_seconds", 0)) + current_seconds,
+            "idle_cost": float(stats.get("idle_cost", 0)) + current_cost,
+            "currency": currency,
+            "update_time": int(stats["update_time"]) if "update_time" in stats else None
+        }
+        for counter in WorkerPool.COUNTERS:
+            result[counter] = int(stats.get(counter, 0))
+        return result
+
+
+def get_record_cost(record):
+    """
+    Get the cost per second of an idle worker
+
+    :param record:      The record of the idle worker
+    :type record:       dict[str, any]
+    :return:            The cost per second, as a float
+    :rtype:             float
+    """
+    if record.get("specific_cost"):
+        return api_util.price_to_float(record["specific_cost"])
+    return api_util.price_to_float(record["cost_per_sec"])
+
+
+class WorkerPoolKeeper(async_util.RecurringThread):
+    """
+    Keep the warm pool of a machine type filled, according to the recent arrival rate of the jobs:
+    the pool holds the number of jobs expected during the creation of a worker, between the configured limits.
+    Dead workers and workers idle for too long are terminated and replaced.
+    """
+
+    CONNECTION_TIMEOUT = 600    # in seconds
+    PROBE_TIMEOUT = 30          # in seconds
+
+    def __init__(self, api_name, provider, machine, *args, **kwargs):
+        """
+        :param api_name:        The name of current API
+        :type api_name:         str
+        :param provider:        The provider of the workers
+        :type provider:         core.provider.Provider
+        :param machine:         The machine type
+        :type machine:          str
+        """
+        super(WorkerPoolKeeper, self).__init__(*args, **kwargs)
+        self._api_name = api_name
+        self._provider = provider
+        self._machine = machine
+
+    @property
+    def delay(self):
+        return datetime.timedelta(seconds=60)
+
+    def work(self, *args, **kwargs):
+        try:
+            if self.should_stop():
+                return
+            pool = WorkerPool(self._provider.name, self._machine)
+            settings = get_pool_settings()
+            target_size = self._compute_target_size(pool, settings)
+
+            idle_workers = []
+            for worker_id, record in pool.list_idle():
+                too_old = time.time() - record["idle_since"] > settings["max_idle_time"]
+                if too_old or not self._is_alive(record):
+                    self._recycle(pool, worker_id, record)
+                else:
+                    idle_workers.append((worker_id, record))
+            for worker_id, record in idle_workers[:max(0, len(idle_workers) - target_size)]:
+                self._recycle(pool, worker_id, record)
+
+            missing = target_size - len(pool.list_idle())
+            if missing > 0 and not self.should_stop():
+                self._create_workers(pool, missing)
+        except error_util.abort_errors: raise
+        except error_util.all_errors as e:
+            error_util.log_error(log, e)
+
+    def _compute_target_size(self, pool, settings):
+        window = datetime.timedelta(seconds=max(60, settings["rate_window"]))
+        since = datetime.datetime.utcnow() - window
+        nbr_jobs = models.jobs.count_created_jobs(self._provider.name, self._machine, since)
+        arrival_rate = nbr_jobs / window.total_seconds()  # in jobs per second
+        expected_jobs = arrival_rate * self._provider.get_startup_time().total_seconds()
+        target_size = min(settings["max_size"], max(settings["min_size"], int(math.ceil(expected_jobs))))
+        pool.set_target(target_size, arrival_rate * 3600)
+        return target_size
+
+    def _is_alive(self, record):
+        idle_worker = worker.Worker.unserialize(record["worker"])
+        ip = idle_worker.public_ip if idle_worker.public_ip else idle_worker.private_ip
+        conn = ssh.SshConnection(ip, "aziugo", self._provider.get_key_path())
+        try:
+            return conn.wait_for_connection(WorkerPoolKeeper.PROBE_TIMEOUT, can_fail=True)
+        finally:
+            conn.close()
+
+    def _recycle(self, pool, worker_id, record):
+        if not pool.remove(worker_id, record):
+            return  # Claimed by a job in the meantime
+        pool.incr("recycled")
+        log.info("Terminating idle worker " + str(worker_id) + " of warm pool " + self._provider.name + "/" +
+                 self._machine)
+        self._provider.terminate_workers([worker.Worker.unserialize(record["worker"])])
+
+    def _create_workers(self, pool, nbr_workers):
+        machine_cost = models.provider_config.get_machine_provider_cost(self._provider.name, self._machine)
+        if not machine_cost:
+            raise RuntimeError("Unable to get the cost for provider " + str(self._provider.name))
+        instance_price = api_util.price_to_float(machine_cost["cost_per_sec"]) * 3600  # In $/h, for aws spots
+        log.info("Creating " + str(nbr_workers) + " idle workers for warm pool " + self._provider.name + "/" +
+                 self._machine)
+        new_workers = self._provider.create_workers(nbr_workers, machine=self._machine, spot_price=instance_price)
+        try:
+            self._provider.tag_workers(new_workers, {"Name": self._api_name + "_worker/warm_pool",
+                                                     "type": WARM_POOL_TYPE, "debug": "false"})
+            for new_worker in new_workers:
+                ip = new_worker.public_ip if new_worker.public_ip else new_worker.private_ip
+                conn = ssh.SshConnection(ip, "aziugo", self._provider.get_key_path())
+                try:
+                    conn.wait_for_connection(WorkerPoolKeeper.CONNECTION_TIMEOUT)
+                finally:
+                    conn.close()
+        except error_util.all_errors:
+            with error_util.before_raising():
+                self._provider.terminate_workers(new_workers)
+        for new_worker in new_workers:
+            pool.add(new_worker, machine_cost["cost_per_sec"], machine_cost["currency"])
@@ -32,6 +32,7 @@ import models.jobs
 from core import api_util
 import core.provider
 import core.storages
+import core.worker_pool
 from core.worker_observer import WorkerObserver
 from core.worker import Worker
 from core.lifetime_rules import Sentence, Penalty, Motive, LifetimeRules
@@ -165,7 +166,7 @@ class ClusterList(object):
         return False
 
 
-def judge_worker(observer, lifetime_rules, cluster_list, now=None):
+def judge_worker(observer, lifetime_rules, cluster_list, now=None, warm_pool_max_age=None):
     """
     Judge what to do with the instance
 
@@ -177,6 +178,9 @@ def judge_worker(observer, lifetime_rules, cluster_list, now=None):
     :type cluster_list:     ClusterList
     :param now:             The instant we could use to check
     :type now:              datetime.datetime|None
+    :param warm_pool_max_age:   The age until which the idle workers of the warm pools are left to the pool keeper.
+                                Optional, default None, meaning they are judged like any other worker
+    :type warm_pool_max_age:    datetime.timedelta|None
     :return:                The sentence for current instance, or None
     :rtype:                 Sentence|None
     """
@@ -198,6 +202,10 @@ def judge_worker(observer, lifetime_rules, cluster_list, now=None):
 
     if observer.has_immunity():
         return None
+    # The idle workers of the warm pools are handled by the pool keeper, as long as they are not too old
+    if (warm_pool_max_age is not None and observer.is_warm_pool_worker() and
+            now - observer.creation_date < warm_pool_max_age):
+        return None
 
     # We start to check fatal limits
     rules = lifetime_rules.get_rules(Penalty.DEATH)
@@ -252,11 +260,48 @@ def judge_worker(observer, lifetime_rules, cluster_list, now=None):
     return None
 
 
+class WorkerProber(async_util.AbstractThread):
+    """
+    Probe the workers taken from a shared queue, until the queue is empty or the thread is stopped
+    """
+    def __init__(self, probe_queue, timeout, on_done, *args, **kwargs):
+        """
+        :param probe_queue:     The queue of the observers to update, with their worker
+        :type probe_queue:      Queue.Queue[tuple[WorkerObserver, Worker]]
+        :param timeout:         The maximum duration of each probe, in seconds
+        :type timeout:          int
+        :param on_done:         Called after each probe with the worker id and the result, None meaning an error
+        :type on_done:          callable
+        """
+        super(WorkerProber, self).__init__(*args, **kwargs)
+        self._queue = probe_queue
+        self._timeout = timeout
+        self._on_done = on_done
+
+    def work(self, *args, **kwargs):
+        while not self.should_stop():
+            try:
+                observer, worker = self._queue.get(False)
+            except async_util.QueueEmpty:
+                return
+            result = None
+            try:
+                result = observer.update(worker, self._timeout)
+                if result is None:
+                    result = True  # Not probed, so not a failure
+            except error_util.abort_errors: raise
+            except error_util.all_errors as e:
+                log.warning("GC: Unable to probe worker " + str(worker.worker_id) + ": " + str(e))
+            finally:
+                self._on_done(worker.worker_id, result)
+
+
 class WorkerCollector(async_util.RecurringThread):
     """
     Kills worker stuck for various reasons
     """
     EMAIL_MSG = "Strange behaviour for instance %s: %s\n%s\nWorker description:\n%s\n"
+    MAX_PROBERS = 20
 
     def __init__(self, provider, api_name, server_name, running_jobs, running_workers, *args, **kwargs):
         """
@@ -280,6 +325,15 @@ class WorkerCollector(async_util.RecurringThread):
         self._observers = {}        # :type: dict[str, core.worker_observer.WorkerObserver]
         self._running_jobs = running_jobs
         self._running_workers = running_workers
+        conf = api_util.get_conf()
+        if conf.has_option("garbage_collection", "max_parallel_probes"):
+            self._max_probers = conf.getint("garbage_collection", "max_parallel_probes")
+        else:
+            self._max_probers = WorkerCollector.MAX_PROBERS
+        self._probing = set([])     # Workers still probed, maybe by a previous pass. type: set[str]
+        self._probe_failures = 0
+        self._probe_lock = threading.Lock()
+        self._last_metrics = None
         if GC_DEBUG_MODE:
             self._dirty_kill_workers = set([])
             self._dirty_warning_workers = set([])
@@ -288,29 +342,28 @@ class WorkerCollector(async_util.RecurringThread):
     def delay(self):
         return datetime.timedelta(seconds=120)
 
+    @property
+    def last_metrics(self):
+        """
+        :return:        The counters and duration (in seconds) of the last probing pass, or None
+        :rtype:         dict[str, int|float]|None
+        """
+        return copy.copy(self._last_metrics)
+
     def work(self, *args, **kwargs):
         try:
             now = datetime.datetime.utcnow()
 
             # fetching data about running workers
-            thread_list = []
             workers = async_util.run_proc(WorkerCollector._list_workers, self._provider.name)
             self._running_workers.set_list(workers, now)
             for worker in workers:
-                if self.should_stop():
-                    return
                 if worker.worker_id not in self._observers.keys():
                     self._observers[worker.worker_id] = WorkerObserver(worker, self._provider, self._api_name,
                                                                        self._server_name, WORKER_PROCESS_LAUNCHER)
-                thread = threading.Thread(target=WorkerCollector._update_worker,
-                                          args=(self._observers[worker.worker_id], worker))
-                thread.start()
-                thread_list.append(thread)
-
-            for thread in thread_list:
-                if self.should_stop():
-                    return
-                thread.join()
+            self._probe_workers(workers)
+            if self.should_stop():
+                return
 
             # Listing active jobs, and grouping cluster
             job_list = []
@@ -327,11 +380,12 @@ class WorkerCollector(async_util.RecurringThread):
                         cluster_list.append_slave(observer)
             self._running_jobs.set_list(job_list, now)
 
+            warm_pool_max_age = core.worker_pool.get_max_worker_age()
             for worker in workers:
                 if self.should_stop():
                     return
                 observer = self._observers[worker.worker_id]
-                sentence = judge_worker(observer, self._rules, cluster_list, now)
+                sentence = judge_worker(observer, self._rules, cluster_list, now, warm_pool_max_age)
                 if sentence is None:
                     continue
                 if sentence.penalty == Penalty.DEATH:
@@ -361,17 +415,67 @@ class WorkerCollector(async_util.RecurringThread):
         except error_util.all_errors as e:
             error_util.log_error(log, e)
 
-    @staticmethod
-    def _update_worker(observer, worker):
+    def _probe_workers(self, workers):
+        """
+        Update the observers of the workers, with at most max_parallel_probes ssh probes at the same time.
+        The pass stops before the next one should start. Workers still probed by a previous pass are skipped.
+
+        :param workers:     The workers to probe
+        :type workers:      list[Worker]
+        """
+        pass_start = time.time()
+        probe_queue = async_util.create_thread_queue()
+        probed_count = 0
+        skipped_count = 0
+        with self._probe_lock:
+            self._probe_failures = 0
+            for worker in workers:
+                if worker.worker_id in self._probing:
+                    skipped_count += 1
+                    continue
+                self._probing.add(worker.worker_id)
+                probe_queue.put((self._observers[worker.worker_id], worker))
+                probed_count += 1
+
+        deadline = pass_start + self.delay.total_seconds() * 0.75
+        probers = []
+        for _ in range(min(self._max_probers, probed_count)):
+            prober = WorkerProber(probe_queue, WorkerObserver.PROBE_TIMEOUT, self._on_probe_done)
+            probers.append(prober)
+            prober.start()
+        for prober in probers:
+            while prober.is_alive() and time.time() < deadline and not self.should_stop():
+                prober.join(1)
+        for prober in probers:
+            prober.stop()  # The running probes will finish in background, their workers are skipped until then
+
+        with self._probe_lock:
+            metrics = {
+                "workers": len(workers),
+                "probed": probed_count,
+                "skipped": skipped_count,
+                "failures": self._probe_failures,
+                "unfinished": len(self._probing),
+                "duration": time.time() - pass_start
+            }
+        self._last_metrics = metrics
+        log.info("GC: workers probe pass on " + self._provider.name + ": " +
+                 ", ".join(k + "=" + (("%.2fs" % v) if isinstance(v, float) else str(v))
+                           for k, v in sorted(metrics.items())))
+
+    def _on_probe_done(self, worker_id, joined):
         """
-        Make the observer observe a worker
+        Called by the probers after each probe
 
-        :param observer:    The observer
-        :type observer:     WorkerObserver
-        :param worker:      The worker information
-        :type worker:       Worker
+        :param worker_id:   The id of the probed worker
+        :type worker_id:    str
+        :param joined:      Has the worker been joined ? None in case of error
+        :type joined:       bool|None
         """
-        observer.update(worker)
+        with self._probe_lock:
+            self._probing.discard(worker_id)
+            if not joined:
+                self._probe_failures += 1
 
     @staticmethod
     def _list_workers(provider_name):
@@ -615,8 +719,9 @@ class FileCollector(async_util.RecurringThread):
 
 class StorageCollector(async_util.RecurringThread):
     """
-    Remove old uploaded files which haven't been removed for one day
-
+    Reconcile a storage with the project files known in database:
+    remove the stored files older than one week which are unknown in database, and report the missing ones.
+    Everything is done in bulk: one listing of the storage, one query, and batched deletions.
     """
     def __init__(self, storage, *args, **kwargs):
         """
@@ -625,6 +730,7 @@ class StorageCollector(async_util.RecurringThread):
         """
         super(StorageCollector, self).__init__(*args, **kwargs)
         self._storage = storage
+        self._last_metrics = None
         if GC_DEBUG_MODE:
             self._dirty_files = set([])
             self._missing_files = set([])
@@ -633,72 +739,81 @@ class StorageCollector(async_util.RecurringThread):
     def delay(self):
         return datetime.timedelta(days=1)
 
+    @property
+    def last_metrics(self):
+        """
+        :return:        The counters and durations (in seconds) of the last pass, or None
+        :rtype:         dict[str, int|float]|None
+        """
+        return copy.copy(self._last_metrics)
+
     def work(self, *args, **kwargs):
-        # Check if all files in a storage should exists
+        metrics = {"stored": 0, "known": 0, "orphans": 0, "deleted": 0, "missing": 0,
+                   "list_duration": 0.0, "query_duration": 0.0, "delete_duration": 0.0}
+        pass_start = time.time()
         try:
-            a_week_ago = datetime.datetime.utcnow() - datetime.timedelta(days=7)
-            files = async_util.run_proc(StorageCollector._list_files, self._storage.name)
-            for filename in files:
-                if self.should_stop():
-                    return
-                if models.projects.file_exists(filename):
-                    continue
-                try:
-                    creation_date = async_util.run_proc(StorageCollector._get_file_creation_date,
-                                                        self._storage.name, filename)
-                except core.storages.FileMissingError:
-                    continue  # The file has been already deleted
-                if creation_date > a_week_ago:
-                    continue
-                if GC_DEBUG_MODE:
-                    if filename in self._dirty_files:
-                        continue
-                    self._dirty_files.add(filename)
-                    gc_debug("Removing old file " + filename + " on storage " + self._storage.name)
-                else:
-                    log.warning("GC: Removing old file " + filename + " on storage " + self._storage.name)
-                    async_util.run_proc(StorageCollector._delete_file, self._storage.name, filename)
-        except error_util.abort_errors: raise
-        except error_util.all_errors as e:
-            error_util.log_error(log, e)
+            start = time.time()
+            stored_files = async_util.run_proc(StorageCollector._list_files_info, self._storage.name)
+            metrics["list_duration"] = time.time() - start
+            metrics["stored"] = len(stored_files)
+            if self.should_stop():
+                return
 
-        # Check if there is a missing file
-        try:
-            files = models.projects.list_files_on_storage(self._storage.name)
-            for file_info in files:
-                filename = file_info['filename']
-                if async_util.run_proc(StorageCollector._file_exists, self._storage.name, filename):
-                    continue
-                if GC_DEBUG_MODE:
-                    if filename in self._missing_files:
-                        continue
-                    self._missing_files.add(filename)
-                    gc_debug("Missing file " + filename + " on storage " + self._storage.name)
-                else:
-                    log.error("GC: Missing file " + filename + " on storage " + self._storage.name)
+            start = time.time()
+            known_files = models.projects.list_all_filenames()
+            storage_files = set(f['filename'] for f in models.projects.list_files_on_storage(self._storage.name))
+            metrics["query_duration"] = time.time() - start
+            metrics["known"] = len(storage_files)
+            if self.should_stop():
+                return
+
+            # Check if all files in a storage should exists
+            a_week_ago = datetime.datetime.utcnow() - datetime.timedelta(days=7)
+            orphans = [f for f in set(stored_files.keys()) - known_files if stored_files[f] <= a_week_ago]
+            metrics["orphans"] = len(orphans)
+            if GC_DEBUG_MODE:
+                new_orphans = sorted(set(orphans) - self._dirty_files)
+                if new_orphans:
+                    self._dirty_files.update(new_orphans)
+                    gc_debug("Removing " + str(len(new_orphans)) + " old files on storage " + self._storage.name +
+                             ": " + ", ".join(new_orphans))
+            elif orphans:
+                log.warning("GC: Removing " + str(len(orphans)) + " old files on storage " + self._storage.name +
+                            ": " + ", ".join(sorted(orphans)))
+                start = time.time()
+                async_util.run_proc(StorageCollector._delete_files, self._storage.name, orphans)
+                metrics["delete_duration"] = time.time() - start
+                metrics["deleted"] = len(orphans)
+
+            # Check if there is a missing file
+            missing_files = sorted(storage_files - set(stored_files.keys()))
+            metrics["missing"] = len(missing_files)
+            if GC_DEBUG_MODE:
+                new_missing = [f for f in missing_files if f not in self._missing_files]
+                if new_missing:
+                    self._missing_files.update(new_missing)
+                    gc_debug("Missing files on storage " + self._storage.name + ": " + ", ".join(new_missing))
+            elif missing_files:
+                log.error("GC: Missing files on storage " + self._storage.name + ": " + ", ".join(missing_files))
         except error_util.abort_errors: raise
         except error_util.all_errors as e:
             error_util.log_error(log, e)
+        finally:
+            metrics["total_duration"] = time.time() - pass_start
+            self._last_metrics = metrics
+            log.info("GC: storage " + self._storage.name + " pass: " +
+                     ", ".join(k + "=" + (("%.2fs" % v) if isinstance(v, float) else str(v))
+                               for k, v in sorted(metrics.items())))
 
     @staticmethod
-    def _list_files(storage_name):
-        storage = api_util.get_storage(storage_name)
-        return storage.list_files()
-
-    @staticmethod
-    def _get_file_creation_date(storage_name, filename):
-        storage = api_util.get_storage(storage_name)
-        return storage.get_file_creation_date(filename)
-
-    @staticmethod
-    def _delete_file(storage_name, filename):
+    def _list_files_info(storage_name):
         storage = api_util.get_storage(storage_name)
-        storage.delete_file(filename)
+        return storage.list_files_info()
 
     @staticmethod
-    def _file_exists(storage_name, filename):
+    def _delete_files(storage_name, filenames):
         storage = api_util.get_storage(storage_name)
-        return storage.file_exists(filename)
+        storage.delete_files(filenames)
 
 
 class ProviderArtefactCollector(async_util.RecurringThread):
@@ -136,9 +136,12 @@ class RecurringThread(AbstractThread):
                 self.work(*args, **kargs)
 
                 next_run = next_run + self.delay
+                now = datetime.datetime.utcnow()
+                if next_run < now:
+                    next_run = now  # The work took longer than the delay: skip the missed rounds, don't pile up
                 try:
-                    to_wait = next_run - datetime.datetime.utcnow()
-                    self._stop_queue.get(True, max(1, to_wait.seconds - 1))
+                    to_wait = next_run - now
+                    self._stop_queue.get(True, max(1, to_wait.total_seconds() - 1))
                     self._succeed = True
                     return
                 except Queue.Empty:
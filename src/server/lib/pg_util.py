@@ -11,6 +11,9 @@ import json
 import uuid
 import decimal
 import logging
+import os
+import time
+import threading
 
 # Third party lib
 import psycopg2
@@ -179,6 +182,205 @@ class OpenConnectionWrapper(ConnectionWrapper):
         pass
 
 
+class PooledConnectionWrapper(ConnectionWrapper):
+    """
+    A connection wrapper which borrow its connection from a ConnectionPool the first time it is needed,
+    and give it back when closed
+    """
+
+    def __init__(self, pool):
+        """
+        :param pool:        The pool to borrow the connection from
+        :type pool:         ConnectionPool
+        """
+        super(PooledConnectionWrapper, self).__init__()
+        self._pool = pool
+
+    def close(self):
+        if self._cursor:
+            if DEBUG_WRAPPER:
+                print "conn " + str(id(self)) + ": closing default cursor"
+            try:
+                self._cursor.close()
+            except psycopg2.Error:
+                pass  # The connection is broken, the pool will discard it
+            self._cursor = None
+        if self._conn:
+            conn = self._conn
+            self._conn = None
+            try:
+                in_trans = not conn.closed and conn.get_transaction_status() in ConnectionWrapper.IN_TRANS
+                if in_trans and not conn.autocommit:
+                    if DEBUG_WRAPPER:
+                        print "conn "+str(id(self))+": commit because of close"
+                    conn.commit()
+            finally:
+                if DEBUG_WRAPPER:
+                    print "conn " + str(id(self)) + ": giving back connection"
+                self._pool.give_back(conn)
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            if DEBUG_WRAPPER:
+                print "conn " + str(id(self)) + ": borrow conn"
+            self._conn = self._pool.borrow()
+        return self._conn
+
+
+class ConnectionPool(object):
+    """
+    A bounded and thread-safe pool of database connections.
+    Connections are checked before being lent and their transaction state is reset when given back.
+
+    Usage:
+        pool = ConnectionPool(dsn, max_size=10, timeout=10)
+        conn = PooledConnectionWrapper(pool)
+        conn.execute("SELECT 1")
+        conn.close()  # The connection goes back to the pool
+
+    Note: A forked process never reuses the connections of its parent, it fills its own pool
+    """
+
+    MAX_SIZE = 10
+    TIMEOUT = 10                # in seconds
+    LIVENESS_CHECK_DELAY = 30   # in seconds, idle time after which we ping a connection before lending it
+
+    def __init__(self, dsn, max_size=None, timeout=None):
+        """
+        :param dsn:         The connection string
+        :type dsn:          str
+        :param max_size:    The maximum number of opened connections. Optional, default MAX_SIZE
+        :type max_size:     int|None
+        :param timeout:     The number of seconds we wait for a free connection before raising
+                            util.TimeoutError. Optional, default TIMEOUT
+        :type timeout:      int|float|None
+        """
+        super(ConnectionPool, self).__init__()
+        self._dsn = dsn
+        self._max_size = max(1, int(max_size)) if max_size is not None else ConnectionPool.MAX_SIZE
+        self._timeout = float(timeout) if timeout is not None else ConnectionPool.TIMEOUT
+        self._cond = threading.Condition(threading.Lock())
+        self._idle = []             # list of (connection, time it was given back)
+        self._lent = 0
+        self._pid = os.getpid()
+        self._parent_conns = []     # Connections inherited from the parent process, never used nor closed
+
+    @property
+    def max_size(self):
+        return self._max_size
+
+    def borrow(self):
+        """
+        Get a working connection, waiting for one to be available if the pool is full
+
+        :return:        An opened connection, not in a transaction
+        :rtype:         psycopg2.extensions.connection
+        """
+        time_limit = time.time() + self._timeout
+        while True:
+            with self._cond:
+                self._check_fork()
+                conn, last_used = None, None
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                elif self._lent >= self._max_size:
+                    remaining = time_limit - time.time()
+                    if remaining <= 0:
+                        raise util.TimeoutError("No database connection available after " +
+                                                str(self._timeout) + " seconds")
+                    self._cond.wait(remaining)
+                    continue
+                self._lent += 1
+
+            if conn is not None and self._is_alive(conn, last_used):
+                return conn
+            if conn is not None:
+                self._discard(conn)
+            try:
+                return self._connect()
+            except error_util.all_errors:
+                with error_util.before_raising():
+                    self._release_slot()
+
+    def give_back(self, conn):
+        """
+        Reset a connection and put it back in the pool.
+
+        :param conn:    A connection got from borrow
+        :type conn:     psycopg2.extensions.connection
+        """
+        with self._cond:
+            if os.getpid() != self._pid:
+                self._parent_conns.append(conn)
+                return  # Borrowed before a fork, it doesn't belong to this process
+        reusable = False
+        try:
+            if not conn.closed:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                if conn.autocommit:
+                    conn.autocommit = False
+                reusable = conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        except psycopg2.Error as e:
+            log.warning("Discarding database connection: " + str(e))
+        if not reusable:
+            self._discard(conn)
+            self._release_slot()
+            return
+        with self._cond:
+            self._idle.append((conn, time.time()))
+            self._lent = max(0, self._lent - 1)
+            self._cond.notify()
+
+    def close_all(self):
+        """ Close all the idle connections. Lent connections will be closed when given back """
+        with self._cond:
+            idle = self._idle
+            self._idle = []
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def _connect(self):
+        conn = psycopg2.connect(self._dsn, cursor_factory=psycopg2.extras.DictCursor)
+        conn.set_client_encoding("utf8")
+        return conn
+
+    def _is_alive(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.time() - last_used < ConnectionPool.LIVENESS_CHECK_DELAY:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            if not conn.autocommit:
+                conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass  # Already broken
+
+    def _release_slot(self):
+        with self._cond:
+            self._lent = max(0, self._lent - 1)
+            self._cond.notify()
+
+    def _check_fork(self):
+        """ Forget the connections of the parent process. Should be called with the lock held """
+        if os.getpid() == self._pid:
+            return
+        self._parent_conns.extend([conn for conn, _ in self._idle])
+        self._idle = []
+        self._lent = 0
+        self._pid = os.getpid()
+
+
 class CursorWrapper(object):
     def __init__(self, conn, *args, **kwargs):
         super(CursorWrapper, self).__init__()
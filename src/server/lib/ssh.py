@@ -10,6 +10,11 @@ import contextlib
 import json
 import signal
 import datetime
+import threading
+import hashlib
+import tempfile
+import collections
+import logging
 
 # Project specific libs
 import util
@@ -18,6 +23,9 @@ import error_util
 from proc_util import shell_quote
 
 
+log = logging.getLogger("aziugo")
+
+
 class SshConnection(object):
     """ Utility class to manage an ssh connection to another computer
         Usage:
@@ -28,6 +36,8 @@ class SshConnection(object):
             ssh_conn.run(["echo", "hello"])
 
         Note: You can run or copy files as another user, but only if your ssh user is a sudoer without password
+        Note: With multiplexed=True, all the commands to the same host share a single ssh connection,
+              see ControlMasterPool
 
     """
     # FIXME LATER: port this to Windows
@@ -58,9 +68,9 @@ class SshConnection(object):
         for field in ("ip", "user", "key_file"):
             if field not in data.keys():
                 raise RuntimeError("Invalid ssh serialization, not field "+field+" defined")
-        return SshConnection(data['ip'], data['user'], data["key_file"])
+        return SshConnection(data['ip'], data['user'], data["key_file"], data.get("multiplexed", False))
 
-    def __init__(self, ip, user, key_file="id_rsa"):
+    def __init__(self, ip, user, key_file="id_rsa", multiplexed=False):
         """
         Create an ssh connection
         Usage:
@@ -73,6 +83,8 @@ class SshConnection(object):
         :param key_file:    Optional, the name of the private key file. Default: id_rsa
                             It should be located in $HOME/.ssh if not absolute
         :type key_file:     str
+        :param multiplexed: Should we reuse a shared master connection for all commands. Optional, default False
+        :type multiplexed:  bool
         """
         self._priv_key_path = str(key_file)
         if not os.path.exists(self._priv_key_path):
@@ -86,9 +98,11 @@ class SshConnection(object):
             raise RuntimeError("Invalid ssh user")
         if not ip:
             raise RuntimeError("Invalid ssh ip")
+        self._multiplexed = bool(multiplexed)
 
     def serialize(self):
-        return json.dumps({'ip': self._ip, "user": self._user, "key_file": self._priv_key_path})
+        return json.dumps({'ip': self._ip, "user": self._user, "key_file": self._priv_key_path,
+                           "multiplexed": self._multiplexed})
 
     @property
     def client_ip(self):
@@ -98,6 +112,33 @@ class SshConnection(object):
     def client_user(self):
         return self._user
 
+    @property
+    def multiplexed(self):
+        return self._multiplexed
+
+    def close(self):
+        """ Close the shared master connection to the server, if any """
+        if self._multiplexed:
+            control_masters.close(self._user, self._ip, self._priv_key_path)
+
+    @contextlib.contextmanager
+    def _using_ssh_args(self):
+        """
+        Get the arguments of ssh and scp commands, reserving a channel on the shared master connection if possible
+
+        :return:        The ssh arguments, including the private key
+        :rtype:         list[str]
+        """
+        ssh_args = list(SshConnection.SSH_ARGS)
+        ssh_args.extend(['-i', self._priv_key_path])
+        if not self._multiplexed:
+            yield ssh_args
+            return
+        with control_masters.using_channel(self._user, self._ip, self._priv_key_path) as control_path:
+            if control_path:
+                ssh_args.extend(['-o', 'ControlMaster=no', '-o', 'ControlPath=' + control_path])
+            yield ssh_args
+
     def ping(self):
         """
         Try to establish a ssh connection. No multiple retry
@@ -123,6 +164,45 @@ class SshConnection(object):
         except subprocess.CalledProcessError:
             return False
 
+    def probe(self, cmd, timeout=30):
+        """
+        Run a shell command once, with a deadline, without raising if the server can't be joined.
+        It allows to check both the server liveness and something on it with a single ssh connection.
+
+        :param cmd:         The shell command to run
+        :type cmd:          str
+        :param timeout:     The maximum duration of the whole call, connection included, in seconds. Optional, default 30
+        :type timeout:      int|float
+        :return:            True if the server has been joined, the return code of the command (None if not joined)
+                            and the output of the command
+        :rtype:             tuple[bool, int|None, str]
+        """
+        timed_out = []
+
+        def _kill_proc(proc):
+            if proc.poll() is None:
+                timed_out.append(True)
+                proc.kill()
+
+        new_env = os.environ.copy()
+        new_env["LC_ALL"] = "en_US.UTF-8"
+        with self._using_ssh_args() as ssh_args:
+            ssh_cmd = ['ssh']
+            ssh_cmd.extend(ssh_args)
+            ssh_cmd.extend(["-o", "ConnectTimeout=" + str(max(1, int(timeout)))])
+            ssh_cmd.extend([self._user + "@" + self._ip, cmd])
+            child_proc = subprocess.Popen(ssh_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=new_env)
+            timer = threading.Timer(timeout, _kill_proc, [child_proc])
+            timer.daemon = True
+            timer.start()
+            try:
+                std_out, _ = child_proc.communicate()
+            finally:
+                timer.cancel()
+        if timed_out or child_proc.returncode == 255:  # 255 is the ssh error code
+            return False, None, std_out
+        return True, child_proc.returncode, std_out
+
     def __nonzero__(self):
         return self.ping()
 
@@ -186,19 +266,17 @@ class SshConnection(object):
         if os.path.isdir(src):
             raise RuntimeError(src + " is a folder, please use send_folder instead")
 
-        cmd = "test -d '"+dest+"' && echo D || (test -f '"+dest+"' && echo F || echo N)"
+        # Check and prepare the destination in one round-trip
+        cmd = "if test -d " + shell_quote(dest) + "; then echo D; "
+        cmd += "elif test -f " + shell_quote(dest) + "; then rm -f " + shell_quote(dest) + " && echo F; "
+        cmd += "else mkdir -p " + shell_quote(os.path.dirname(dest)) + " && echo N; fi"
         code, out, err = self.run(cmd, max_retry=max_retry, delay=delay, shell=True, as_user=as_user)
         out = out.strip()
         if out == "D":  # it's a folder on destination
             # if the dest name is not complete, we recall this method with the complete destination name
             return self.send_file(src, os.path.join(dest, os.path.basename(src)), mode=mode,
                                   max_retry=max_retry, delay=delay, as_user=as_user)
-
-        if out == "F":  # it's a file on destination
-            self.run(["rm", "-f", dest], max_retry=max_retry, delay=delay, as_user=as_user)
-        elif out == "N":  # it doesn't exists on destination
-            self.run(["mkdir", "-p", os.path.dirname(dest)], max_retry=max_retry, delay=delay, as_user=as_user)
-        else:
+        if out not in ("F", "N"):
             raise RuntimeError("Unknown testing response: "+str(out)+" stderr is "+repr(err))
 
         dest_file = dest if not as_user else self.run(["mktemp"], max_retry=max_retry, delay=delay)[1]
@@ -208,13 +286,13 @@ class SshConnection(object):
         while True:
             try:
 
-                cmd = ['scp']
-                cmd.extend(SshConnection.SSH_ARGS)
-                cmd.extend(['-i', self._priv_key_path])
-                cmd.extend([src, self._user + "@" + self._ip + ":" + dest_file])
-                new_env = os.environ.copy()
-                new_env["LC_ALL"] = "en_US.UTF-8"
-                subprocess.check_call(cmd, stderr=subprocess.STDOUT, env=new_env)
+                with self._using_ssh_args() as ssh_args:
+                    cmd = ['scp']
+                    cmd.extend(ssh_args)
+                    cmd.extend([src, self._user + "@" + self._ip + ":" + dest_file])
+                    new_env = os.environ.copy()
+                    new_env["LC_ALL"] = "en_US.UTF-8"
+                    subprocess.check_call(cmd, stderr=subprocess.STDOUT, env=new_env)
                 if as_user:
                     self.run(["mv", dest_file, dest], max_retry=max_retry, delay=delay, as_user=as_user)
                 if mode is not None:
@@ -288,13 +366,13 @@ class SshConnection(object):
         i = 0
         while True:
             try:
-                cmd = ['scp', '-r']
-                cmd.extend(SshConnection.SSH_ARGS)
-                cmd.extend(['-i', self._priv_key_path])
-                cmd.extend([src, self._user + "@" + self._ip + ":" + dest_folder])
-                new_env = os.environ.copy()
-                new_env["LC_ALL"] = "en_US.UTF-8"
-                subprocess.check_call(cmd, stderr=subprocess.STDOUT, env=new_env)
+                with self._using_ssh_args() as ssh_args:
+                    cmd = ['scp', '-r']
+                    cmd.extend(ssh_args)
+                    cmd.extend([src, self._user + "@" + self._ip + ":" + dest_folder])
+                    new_env = os.environ.copy()
+                    new_env["LC_ALL"] = "en_US.UTF-8"
+                    subprocess.check_call(cmd, stderr=subprocess.STDOUT, env=new_env)
                 if as_user:
                     tmp_path = util.path_join(dest_folder, os.path.basename(dest))
                     self.run(["mv", tmp_path, dest], max_retry=max_retry, delay=delay, as_user=as_user)
@@ -405,13 +483,13 @@ class SshConnection(object):
         i = 0
         while True:
             try:
-                cmd = ['scp']
-                cmd.extend(SshConnection.SSH_ARGS)
-                cmd.extend(['-i', self._priv_key_path])
-                cmd.extend([self._user + "@" + self._ip + ":" + remote_src, local_dest])
-                new_env = os.environ.copy()
-                new_env["LC_ALL"] = "en_US.UTF-8"
-                subprocess.check_call(cmd, stderr=subprocess.STDOUT, env=new_env)
+                with self._using_ssh_args() as ssh_args:
+                    cmd = ['scp']
+                    cmd.extend(ssh_args)
+                    cmd.extend([self._user + "@" + self._ip + ":" + remote_src, local_dest])
+                    new_env = os.environ.copy()
+                    new_env["LC_ALL"] = "en_US.UTF-8"
+                    subprocess.check_call(cmd, stderr=subprocess.STDOUT, env=new_env)
                 return True
             except (subprocess.CalledProcessError, RuntimeError):
                 with error_util.saved_stack() as err:
@@ -450,8 +528,6 @@ class SshConnection(object):
         i = 0
         while True:
             ssh_cmd = ['ssh']
-            ssh_cmd.extend(SshConnection.SSH_ARGS)
-            ssh_cmd.extend(['-i', self._priv_key_path, self._user + "@" + self._ip])
             if type(cmd) in (list, tuple) and shell:
                 extended_cmd = " ".join(cmd)
             elif type(cmd) in (list, tuple):
@@ -473,17 +549,19 @@ class SshConnection(object):
                 else:
                     extended_cmd = "sudo -u '" + as_user + "' " + extended_cmd
 
-            ssh_cmd.append(extended_cmd)
             new_env = os.environ.copy()
             new_env["LC_ALL"] = "en_US.UTF-8"
-            child_proc = subprocess.Popen(ssh_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=False,
-                                          env=new_env)
-            std_out, std_err = child_proc.communicate()
-            ret_code = child_proc.returncode
-            if ret_code is None:
-                ret_code = child_proc.wait()
+            with self._using_ssh_args() as ssh_args:
+                ssh_cmd.extend(ssh_args)
+                ssh_cmd.extend([self._user + "@" + self._ip, extended_cmd])
+                child_proc = subprocess.Popen(ssh_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=False,
+                                              env=new_env)
+                std_out, std_err = child_proc.communicate()
+                ret_code = child_proc.returncode
                 if ret_code is None:
-                    return 257, std_out, std_err
+                    ret_code = child_proc.wait()
+            if ret_code is None:
+                return 257, std_out, std_err
             if int(ret_code) == 0:
                 return int(ret_code), std_out, std_err
             elif can_fail:
@@ -518,6 +596,48 @@ class SshConnection(object):
         force_root = "root" if self._user != "root" else None
         return self.run(cmd, max_retry, delay, can_fail, ensure_not_killed, shell, as_user=force_root)
 
+    def run_script(self, script, max_retry=None, delay=None, can_fail=False):
+        """
+        Run a bash script on the server with a single ssh command.
+        The script is sent on the standard input, so its content (keys, ...) never appears in a command line.
+        In case of retry, the whole script is run again, so it should be idempotent.
+
+        :param script:              The content of the script
+        :type script:               str
+        :param max_retry:           Number of retry in case of failure, default: SshConnection.MAX_ATTEMPT
+        :type max_retry:            int|None
+        :param delay:               The sleep time before a new retry, in ms, default: SshConnection.RETRY_DELAY
+        :type delay:                int|None
+        :param can_fail:            Should we skip in case of failure ? default: False
+                                    Warning: imply no retry or delay
+        :type can_fail:             bool
+        :return:                    return code, stdout, and stderr
+        :rtype:                     Tuple[int, str, str]
+        """
+        max_retry = max_retry if max_retry is not None else SshConnection.MAX_ATTEMPT
+        delay = delay if delay is not None else SshConnection.RETRY_DELAY
+
+        i = 0
+        while True:
+            ssh_cmd = ['ssh']
+            new_env = os.environ.copy()
+            new_env["LC_ALL"] = "en_US.UTF-8"
+            with self._using_ssh_args() as ssh_args:
+                ssh_cmd.extend(ssh_args)
+                ssh_cmd.extend([self._user + "@" + self._ip, "bash -s"])
+                child_proc = subprocess.Popen(ssh_cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                              stderr=subprocess.PIPE, shell=False, env=new_env)
+                std_out, std_err = child_proc.communicate(script)
+                ret_code = child_proc.returncode
+            if ret_code is None:
+                return 257, std_out, std_err
+            if int(ret_code) == 0 or can_fail:
+                return int(ret_code), std_out, std_err
+            i += 1
+            if i >= max_retry:
+                raise subprocess.CalledProcessError(int(ret_code), ssh_cmd, std_out+std_err)
+            time.sleep(delay / 1000)
+
     def run_async(self, cmd, shell=False, as_user=None):
         """
         Run a detached command on the server
@@ -531,9 +651,6 @@ class SshConnection(object):
         :return:                    The process created so you can wait for it or kill it
         :rtype:                     AsyncProc
         """
-        ssh_cmd = ['ssh']
-        ssh_cmd.extend(SshConnection.SSH_ARGS)
-        ssh_cmd.extend(['-i', self._priv_key_path, self._user + "@" + self._ip])
         if type(cmd) in (list, tuple) and shell:
             extended_cmd = " ".join(cmd)
         elif type(cmd) in (list, tuple):
@@ -552,16 +669,19 @@ class SshConnection(object):
         if as_user:
             extended_cmd = "sudo -u '"+as_user+"' "+extended_cmd
 
-        ssh_cmd.append(extended_cmd)
         new_env = os.environ.copy()
         new_env["LC_ALL"] = "en_US.UTF-8"
-        child_proc = subprocess.Popen(ssh_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=new_env)
-        std_out, std_err = child_proc.communicate()
-        ret_code = child_proc.returncode
-        if ret_code is None:
-            ret_code = child_proc.wait()
+        with self._using_ssh_args() as ssh_args:
+            ssh_cmd = ['ssh']
+            ssh_cmd.extend(ssh_args)
+            ssh_cmd.extend([self._user + "@" + self._ip, extended_cmd])
+            child_proc = subprocess.Popen(ssh_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=new_env)
+            std_out, std_err = child_proc.communicate()
+            ret_code = child_proc.returncode
             if ret_code is None:
-                ret_code = 257
+                ret_code = child_proc.wait()
+        if ret_code is None:
+            ret_code = 257
         if int(ret_code) != 0:
             raise RuntimeError("Unable to launch command: "+str(std_out)+str(std_err))
         pid = int(str(std_out).strip())
@@ -582,48 +702,128 @@ class SshConnection(object):
 
     @contextlib.contextmanager
     def send_file_pipe(self, output_file, as_user=None):
-        dest = output_file
-        code, out, err = self.run("test -d '"+dest+"' && echo D || (test -f '"+dest+"' && echo F || echo N)",
-                                  shell=True, as_user=as_user)
-        out = out.strip()
-        if out == "F":  # it's a file on destination
-            raise RuntimeError(dest + " is a file on target server "+self._ip+", it can't contains anything")
-        if not os.path.dirname(dest):
-            raise RuntimeError(dest + " should be an absolute path")
-
-        if out == "N":  # it doesn't exists on destination
-            self.run(["mkdir", "-p", os.path.dirname(dest)], as_user=as_user)
-        else:  # out == "D":  it's a folder on destination
-            self.run(["rm", "-rf", dest], as_user=as_user)
-
-        dest_folder = dest if not as_user else self.run(["mktemp", "-d"])[1]
-        dest_folder = dest_folder.strip()
-
-        cmd = ['ssh']
-        cmd.extend(SshConnection.SSH_ARGS)
-        cmd.extend(['-i', self._priv_key_path])
-        cmd.extend([self._user + "@" + self._ip, 'cat > "' + dest + '"'])
+        """
+        Write a distant file as a stream. The data are written in a temporary file, which replace the destination
+        only if everything went well, so the destination is never partially written.
+
+        :param output_file:     The absolute path of the distant file
+        :type output_file:      str
+        :param as_user:         Write the file as specific user, default None
+        :type as_user:          str|None
+        :return:                A writable stream
+        :rtype:                 file
+        """
+        if not output_file.startswith("/"):
+            raise RuntimeError(output_file + " should be an absolute path")
+        tmp_file = output_file + ".part"
+        code, out, err = self.run("mkdir -p " + shell_quote(os.path.dirname(output_file)) + " && " +
+                                  "test ! -d " + shell_quote(output_file), shell=True, as_user=as_user, can_fail=True)
+        if code != 0:
+            raise RuntimeError(output_file + " is a folder on target server " + self._ip + " or can't be created")
+
+        distant_cmd = "cat > " + shell_quote(tmp_file)
+        if as_user:
+            distant_cmd = "sudo -u '" + as_user + "' sh -c " + shell_quote(distant_cmd)
         new_env = os.environ.copy()
         new_env["LC_ALL"] = "en_US.UTF-8"
-        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.STDOUT, env=new_env)
-        yield proc.stdin
+        with self._using_ssh_args() as ssh_args:
+            cmd = ['ssh']
+            cmd.extend(ssh_args)
+            cmd.extend([self._user + "@" + self._ip, distant_cmd])
+            with open(os.devnull, "w") as dev_null:
+                proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=dev_null, stderr=subprocess.PIPE,
+                                        env=new_env)
+            try:
+                yield proc.stdin
+                proc.stdin.close()
+                ret_code = proc.wait()
+                if ret_code != 0:
+                    raise IOError("Unable to write " + output_file + " on " + self._ip + ": " +
+                                  str(proc.stderr.read()).strip())
+            except error_util.all_errors:
+                with error_util.before_raising():
+                    _stop_pipe_proc(proc)
+                    self.run(["rm", "-f", tmp_file], as_user=as_user, can_fail=True)
+        self.run(["mv", "-f", tmp_file, output_file], as_user=as_user)
 
     @contextlib.contextmanager
     def read_file_pipe(self, src_file, as_user=None):
-        code, out, err = self.run("test -d '" + src_file + "' && echo D || (test -f '" + src_file + "' && echo F || echo N)",
-                                  shell=True, as_user=as_user)
-        out = out.strip()
-        if out != "F":  # it's a file on destination
+        """
+        Read a distant file as a stream.
+        When leaving the context, an IOError is raised if the distant file was not read successfully
+
+        :param src_file:        The path of the distant file
+        :type src_file:         str
+        :param as_user:         Read the file as specific user, default None
+        :type as_user:          str|None
+        :return:                A readable stream
+        :rtype:                 file
+        """
+        code, _, _ = self.run(["test", "-f", src_file], as_user=as_user, can_fail=True)
+        if code != 0:
             raise RuntimeError(src_file + " doesn't exists")
 
-        cmd = ['ssh']
-        cmd.extend(SshConnection.SSH_ARGS)
-        cmd.extend(['-i', self._priv_key_path])
-        cmd.extend([self._user + "@" + self._ip, 'cat "' + src_file + '"'])
+        distant_cmd = "cat " + shell_quote(src_file)
+        if as_user:
+            distant_cmd = "sudo -u '" + as_user + "' " + distant_cmd
+        new_env = os.environ.copy()
+        new_env["LC_ALL"] = "en_US.UTF-8"
+        with self._using_ssh_args() as ssh_args:
+            cmd = ['ssh']
+            cmd.extend(ssh_args)
+            cmd.extend([self._user + "@" + self._ip, distant_cmd])
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=new_env)
+            try:
+                yield proc.stdout
+                if proc.stdout.read(1):
+                    # The consumer stopped early: stop the transfer instead of reading the rest of the file
+                    _stop_pipe_proc(proc)
+                    return
+                ret_code = proc.wait()
+                if ret_code != 0:
+                    raise IOError("Unable to read " + src_file + " on " + self._ip + ": " +
+                                  str(proc.stderr.read()).strip())
+            except error_util.all_errors:
+                with error_util.before_raising():
+                    _stop_pipe_proc(proc)
+
+    @contextlib.contextmanager
+    def follow_file(self, file_path, from_line=1, as_user=None):
+        """
+        Follow a distant file as it grows, with a single long-lived ssh command ('tail -F').
+        The file may not exist yet, lines will come as soon as it is created.
+        The distant command is stopped when leaving the context.
+
+        :param file_path:       The distant file to follow
+        :type file_path:        str
+        :param from_line:       The first line to read, starting at 1. Optional, default 1
+        :type from_line:        int
+        :param as_user:         Read the file as specific user, default None
+        :type as_user:          str|None
+        :return:                The local ssh process. Read its stdout to get the lines of the file
+        :rtype:                 subprocess.Popen
+        """
+        distant_cmd = "tail -n +" + str(max(1, int(from_line))) + " -F " + shell_quote(file_path) + " 2>/dev/null"
+        if as_user:
+            distant_cmd = "sudo -u '" + as_user + "' " + distant_cmd
+
         new_env = os.environ.copy()
         new_env["LC_ALL"] = "en_US.UTF-8"
-        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=new_env)
-        yield proc.stdout
+        with self._using_ssh_args() as ssh_args:
+            cmd = ['ssh']
+            cmd.extend(ssh_args)
+            cmd.extend([self._user + "@" + self._ip, distant_cmd])
+            with open(os.devnull, "w") as dev_null:
+                proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=dev_null, env=new_env)
+            try:
+                yield proc
+            finally:
+                try:
+                    if proc.poll() is None:
+                        proc.terminate()
+                    proc.wait()
+                except OSError:
+                    pass  # Already stopped
 
     def get_file_size(self, file_path, as_user=None):
         code, out, err = self.run(['stat', '--printf=%s', file_path], as_user=as_user)
@@ -695,6 +895,21 @@ class SshConnection(object):
         return True
 
 
+def _stop_pipe_proc(proc):
+    """
+    Stop a local ssh process used as a pipe, ignoring errors
+
+    :param proc:        The ssh process
+    :type proc:         subprocess.Popen
+    """
+    try:
+        if proc.poll() is None:
+            proc.terminate()
+        proc.wait()
+    except OSError:
+        pass  # Already stopped
+
+
 class AsyncProc(object):
     def __init__(self, pid, command, conn):
         """
@@ -756,3 +971,242 @@ class AsyncProc(object):
 
     def __str__(self):
         return "<AsyncProc (pid:"+str(self._pid)+")>"
+
+
+class ControlMasterPool(object):
+    """
+    Keep a bounded set of OpenSSH master connections (ControlMaster), one per distant host.
+    Every multiplexed SshConnection to the same host sends its ssh and scp commands through the master socket,
+    so only the first command pays the tcp and ssh handshake.
+    Usage:
+        from lib import ssh
+
+        conn = ssh.SshConnection(ip, user, multiplexed=True)
+        conn.run(["echo", "hello"])       # Start the master connection
+        conn.run(["echo", "world"])       # Reuse it
+        conn.close()                      # Stop the master connection
+
+        Note: If no master can be started, or if all its channels are busy, commands silently fall back to
+              a classic ssh connection
+    """
+
+    MAX_MASTERS = 64
+    MAX_CHANNELS = 8            # Should stay under the MaxSessions value of the distant sshd (default 10)
+    PERSIST_DELAY = 600         # in seconds, idle masters are stopped by ssh itself after this delay
+    HEALTH_CHECK_DELAY = 30     # in seconds
+    CONNECT_TIMEOUT = 10        # in seconds
+
+    def __init__(self, max_masters=None, max_channels=None, socket_folder=None):
+        """
+        :param max_masters:     The maximum number of master connections kept open. Optional, default MAX_MASTERS
+        :type max_masters:      int|None
+        :param max_channels:    The maximum number of concurrent commands on a master connection.
+                                Optional, default MAX_CHANNELS
+        :type max_channels:     int|None
+        :param socket_folder:   Where to create the control sockets. Optional, default: the temp folder
+        :type socket_folder:    str|None
+        """
+        super(ControlMasterPool, self).__init__()
+        self._max_masters = max_masters if max_masters is not None else ControlMasterPool.MAX_MASTERS
+        self._max_channels = max_channels if max_channels is not None else ControlMasterPool.MAX_CHANNELS
+        self._socket_folder = socket_folder if socket_folder else tempfile.gettempdir()
+        self._lock = threading.RLock()
+        self._masters = collections.OrderedDict()   # (user, ip, key_path) => time of the last health check
+        self._failures = {}                         # (user, ip, key_path) => time of the last failed start
+        self._channels = {}                         # (user, ip, key_path) => number of used channels
+        self._key_locks = {}                        # (user, ip, key_path) => lock held while starting or stopping
+
+    @contextlib.contextmanager
+    def using_channel(self, user, ip, key_path):
+        """
+        Reserve a channel on the master connection of a host, starting the master if needed.
+        Masters are started and checked without the pool lock, so a slow host doesn't block the other ones.
+
+        :param user:        The ssh user
+        :type user:         str
+        :param ip:          The ip of the distant host
+        :type ip:           str
+        :param key_path:    The path of the private key
+        :type key_path:     str
+        :return:            The control socket path to use, or None if a direct connection should be used
+        :rtype:             str|None
+        """
+        key = (user, ip, key_path)
+        with self._lock:
+            if self._channels.get(key, 0) >= self._max_channels:
+                key_lock = None
+            else:
+                # The channel is reserved before the master is ready, so the master can't be evicted meanwhile
+                self._channels[key] = self._channels.get(key, 0) + 1
+                key_lock = self._key_locks.setdefault(key, threading.Lock())
+        control_path = None
+        try:
+            if key_lock is not None:
+                with key_lock:
+                    control_path = self._acquire(key)
+            yield control_path
+        finally:
+            if key_lock is not None:
+                with self._lock:
+                    self._channels[key] = max(0, self._channels.get(key, 1) - 1)
+
+    def close(self, user, ip, key_path):
+        """
+        Stop the master connection of a host, if any
+
+        :param user:        The ssh user
+        :type user:         str
+        :param ip:          The ip of the distant host
+        :type ip:           str
+        :param key_path:    The path of the private key
+        :type key_path:     str
+        """
+        key = (user, ip, key_path)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                self._failures.pop(key, None)
+                started = self._masters.pop(key, None) is not None
+            if started:
+                self._stop(key)
+
+    def close_host(self, ip):
+        """
+        Stop all the master connections to a host, whatever the user
+
+        :param ip:          The ip of the distant host
+        :type ip:           str
+        """
+        with self._lock:
+            keys = [k for k in self._masters.keys() if k[1] == ip]
+        for key in keys:
+            self.close(*key)
+
+    def close_all(self):
+        """ Stop all the master connections """
+        with self._lock:
+            keys = list(self._masters.keys())
+        for key in keys:
+            self.close(*key)
+
+    def _acquire(self, key):
+        """
+        Get a healthy master connection, starting it if needed.
+        Must be called with the lock of the key held, and without the pool lock
+
+        :param key:         The master identifier: (user, ip, key_path)
+        :type key:          tuple[str, str, str]
+        :return:            The control socket path, or None if no master is available
+        :rtype:             str|None
+        """
+        now = time.time()
+        control_path = self._get_control_path(key)
+        with self._lock:
+            last_check = self._masters.get(key, None)
+            last_failure = self._failures.get(key, None)
+        if last_check is not None and now - last_check >= ControlMasterPool.HEALTH_CHECK_DELAY:
+            if self._check(key):
+                last_check = now
+            else:
+                log.debug("Ssh master connection to " + key[1] + " is broken, restarting it")
+                self._stop(key)
+                last_check = None
+                with self._lock:
+                    self._masters.pop(key, None)
+        if last_check is not None:
+            with self._lock:
+                self._masters.pop(key, None)
+                self._masters[key] = last_check  # Also mark it as the most recently used
+            return control_path
+
+        if last_failure is not None and now - last_failure < ControlMasterPool.HEALTH_CHECK_DELAY:
+            return None
+        if not self._start(key):
+            with self._lock:
+                self._failures[key] = now
+            return None
+        with self._lock:
+            self._failures.pop(key, None)
+            self._masters[key] = now
+            evicted = self._pop_evictable(key)
+        for old_key, old_lock in evicted:
+            try:
+                self._stop(old_key)
+            finally:
+                old_lock.release()
+        return control_path
+
+    def _pop_evictable(self, current_key):
+        """
+        Remove the least recently used masters above the limit, skipping the ones with used channels.
+        Must be called with the pool lock held. The locks of the returned keys are held, the caller should stop the
+        masters then release them.
+
+        :param current_key:     The master which was just started, never evicted
+        :type current_key:      tuple[str, str, str]
+        :return:                The evicted masters and their locks
+        :rtype:                 list[tuple[tuple[str, str, str], threading.Lock]]
+        """
+        evicted = []
+        nbr_extra = len(self._masters) - self._max_masters
+        for old_key in list(self._masters.keys()):
+            if nbr_extra <= 0:
+                break
+            if old_key == current_key or self._channels.get(old_key, 0) > 0:
+                continue
+            old_lock = self._key_locks.setdefault(old_key, threading.Lock())
+            if not old_lock.acquire(False):  # Someone is starting or stopping it
+                continue
+            del self._masters[old_key]
+            evicted.append((old_key, old_lock))
+            nbr_extra -= 1
+        return evicted
+
+    def _get_control_path(self, key):
+        # Unix sockets paths are limited to ~100 characters, so we hash the host description
+        return os.path.join(self._socket_folder, "aziugo_ssh_" + hashlib.md5("|".join(key)).hexdigest()[:16])
+
+    def _control_cmd(self, key, *args):
+        user, ip, key_path = key
+        cmd = ['ssh']
+        cmd.extend(SshConnection.SSH_ARGS)
+        cmd.extend(['-i', key_path, '-o', 'ControlPath=' + self._get_control_path(key)])
+        cmd.extend(args)
+        cmd.append(user + "@" + ip)
+        return cmd
+
+    def _run_control_cmd(self, cmd):
+        new_env = os.environ.copy()
+        new_env["LC_ALL"] = "en_US.UTF-8"
+        with open(os.devnull, "r+") as devnull:
+            return subprocess.call(cmd, stdin=devnull, stdout=devnull, stderr=devnull, env=new_env) == 0
+
+    def _start(self, key):
+        control_path = self._get_control_path(key)
+        if os.path.exists(control_path):
+            if self._check(key):
+                return True
+            self._stop(key)
+        cmd = self._control_cmd(key, '-M', '-N', '-f',
+                                '-o', 'ControlPersist=' + str(ControlMasterPool.PERSIST_DELAY),
+                                '-o', 'ConnectTimeout=' + str(ControlMasterPool.CONNECT_TIMEOUT),
+                                '-o', 'ServerAliveInterval=15',
+                                '-o', 'ServerAliveCountMax=3')
+        return self._run_control_cmd(cmd)
+
+    def _check(self, key):
+        return self._run_control_cmd(self._control_cmd(key, '-O', 'check'))
+
+    def _stop(self, key):
+        self._run_control_cmd(self._control_cmd(key, '-O', 'exit'))
+        control_path = self._get_control_path(key)
+        try:
+            if os.path.exists(control_path):
+                os.remove(control_path)
+        except OSError:
+            pass
+
+
+# Shared by all the multiplexed connections of the current process
+control_masters = ControlMasterPool()
@@ -101,38 +101,105 @@ def get_calc_by_name(user_id, project_codename, calc_name, include_deleted=False
 
 
 @core.api_util.need_db_context
-def charge_all(last_charge_limit):
+def get_calc_details(user_id, project_codename, calc_name):
+    """
+    Get a calculation with its project storage, the names of its files and the credits consumed by its job,
+    in a single query
+
+    :param user_id:             The id of the calculation owner
+    :type user_id:              int
+    :param project_codename:    The project uuid
+    :type project_codename:     str
+    :param calc_name:           The name of the calculation
+    :type calc_name:            str
+    :return:                    None if the project doesn't exists. Otherwise the calculation fields (all None if the
+                                calculation doesn't exists), plus 'project_storage', 'status_filename',
+                                'status_change_date', 'result_filename', 'iterations_filename', 'reduce_filename' and
+                                'job_consume'
+    :rtype:                     dict[str, any]|None
+    """
+    g_db = core.api_util.DatabaseContext.get_conn()
+    result = g_db.execute("""SELECT c.*, p.storage AS project_storage,
+                                    sf.filename AS status_filename, sf.change_date AS status_change_date,
+                                    rf.filename AS result_filename, itf.filename AS iterations_filename,
+                                    rdf.filename AS reduce_filename,
+                                    (SELECT COALESCE(SUM(ua.amount), 0)
+                                       FROM user_accounts AS ua
+                                      WHERE ua.job_id = c.job_id) AS job_consume
+                               FROM projects AS p
+                               LEFT JOIN calculations AS c
+                                      ON c.project_uid = p.uid
+                                     AND c.name = %s
+                                     AND c.delete_date IS NULL
+                               LEFT JOIN project_files AS sf
+                                      ON sf.id = c.status_file_id
+                                     AND sf.project_uid = p.uid
+                                     AND sf.delete_date IS NULL
+                               LEFT JOIN project_files AS rf
+                                      ON rf.id = c.result_file_id
+                                     AND rf.project_uid = p.uid
+                                     AND rf.delete_date IS NULL
+                               LEFT JOIN project_files AS itf
+                                      ON itf.id = c.iterations_file_id
+                                     AND itf.project_uid = p.uid
+                                     AND itf.delete_date IS NULL
+                               LEFT JOIN project_files AS rdf
+                                      ON rdf.id = c.reduce_file_id
+                                     AND rdf.project_uid = p.uid
+                                     AND rdf.delete_date IS NULL
+                              WHERE p.user_id = %s
+                                AND p.uid = %s""", [calc_name, user_id, project_codename]).fetchone()
+    return pg_util.row_to_dict(result)
+
+
+@core.api_util.need_db_context
+def charge_all(last_charge_limit, batch_size=500):
+    """
+    Charge the storage of the calculations computed more than 7 days ago and not charged since, by batches.
+    Each batch is committed on its own, so the user accounts are never locked for long
+
+    :param last_charge_limit:   Only charge the calculations whose last storage charge is older than this date
+    :type last_charge_limit:    datetime.datetime
+    :param batch_size:          The maximum number of calculations charged by batch. Optional, default 500
+    :type batch_size:           int
+    :return:                    The number of charged calculations
+    :rtype:                     int
+    """
     query = """INSERT INTO user_accounts (user_id, amount, description, job_id, price_snapshot)
-                SELECT p.user_id AS user_id, o.fixed_cost * -1 AS amount, %s AS description, j.id AS job_id, 
+                SELECT p.user_id AS user_id, o.fixed_cost * -1 AS amount, %s AS description, j.id AS job_id,
                        ua.price_snapshot AS price_snapshot
-                  FROM jobs AS j 
-                  LEFT JOIN operations_history AS o ON j.operation_id = o.id 
-                  LEFT JOIN calculations AS c ON c.job_id = j.id
-                  LEFT JOIN projects AS p ON c.project_uid = p.uid
-                  LEFT JOIN (
-                             SELECT ua.* 
-                              FROM user_accounts AS ua
-                              RIGHT JOIN (
-                                   SELECT ua.job_id, MAX(date) AS date
-                                     FROM user_accounts AS ua
-                                    WHERE ua.job_id IS NOT NULL
-                                      AND ua.price_snapshot->'fix_price' IS NOT NULL
-                                    GROUP BY ua.job_id
-                              ) AS ua2 ON ua2.job_id = ua.job_id AND ua2.date = ua.date
-                  ) AS ua ON ua.job_id = j.id
-                 WHERE j.status = %s 
+                  FROM jobs AS j
+                  JOIN operations_history AS o ON j.operation_id = o.id
+                  JOIN calculations AS c ON c.job_id = j.id
+                  JOIN projects AS p ON c.project_uid = p.uid
+                  JOIN LATERAL (
+                        SELECT ua.date, ua.price_snapshot
+                          FROM user_accounts AS ua
+                         WHERE ua.job_id = j.id
+                           AND ua.price_snapshot->'fix_price' IS NOT NULL
+                         ORDER BY ua.date DESC
+                         LIMIT 1
+                  ) AS ua ON TRUE
+                 WHERE j.status = %s
                    AND c.status = %s
-                   AND j.operation_id IS NOT NULL
                    AND o.operation_name = %s
                    AND c.delete_date IS NULL
                    AND ua.date < %s
                    AND ua.date < now() - INTERVAL '7 DAYS'
+                 ORDER BY j.id
+                 LIMIT %s
     """
-    user_id_list = set([])
+    total = 0
     g_db = core.api_util.DatabaseContext.get_conn()
-    with g_db.cursor() as cur:
-        cur.execute(query, ["Calculation storage cost", jobs.JOB_STATUS_FINISHED, STATUS_COMPUTED, 'calc',
-                            last_charge_limit])
+    while True:
+        with g_db.cursor() as cur:
+            cur.execute(query, ["Calculation storage cost", jobs.JOB_STATUS_FINISHED, STATUS_COMPUTED, 'calc',
+                                last_charge_limit, batch_size])
+            charged = cur.rowcount
+        g_db.commit()
+        total += charged
+        if charged < batch_size:
+            return total
 
 
 @core.api_util.need_db_context
@@ -3,6 +3,7 @@
 
 # Python core api
 import logging
+import csv
 
 # Project specific libs
 from lib import pg_util
@@ -244,6 +245,85 @@ def save_job_text(job_id, text):
     g_db.execute("UPDATE jobs SET logs = %s WHERE id = %s ", [text, int(job_id)])
 
 
+@core.api_util.need_db_context
+def save_job_telemetry(job_id, telemetry_file):
+    """
+    Save the resource samples of a job, as written by the worker
+
+    :param job_id:              The id of the job
+    :type job_id:               int
+    :param telemetry_file:      The path of the csv file containing the samples
+    :type telemetry_file:       str
+    """
+    with open(telemetry_file, "r") as fh:
+        telemetry = fh.read()
+    g_db = core.api_util.DatabaseContext.get_conn()
+    g_db.execute("UPDATE jobs SET telemetry = %s WHERE id = %s ", [telemetry, int(job_id)])
+
+
+@core.api_util.need_db_context
+def get_job_telemetry(job_id):
+    """
+    Get the resource samples of a job, and their summary per stage
+
+    :param job_id:          The id of the job
+    :type job_id:           int
+    :return:                The samples and the stages, or None if the job has no telemetry
+    :rtype:                 dict[str, list[dict[str, any]]]|None
+    """
+    g_db = core.api_util.DatabaseContext.get_conn()
+    row = g_db.execute("SELECT telemetry FROM jobs WHERE id = %s", [job_id]).fetchone()
+    if not row or not row[0]:
+        return None
+    return parse_telemetry(row[0])
+
+
+def parse_telemetry(telemetry):
+    """
+    Parse the resource samples written by the worker, and summarize them per stage.
+    The stage of a sample is the toolchain operation running during its interval, or 'worker' outside of the toolchain.
+
+    :param telemetry:       The csv content of the telemetry file
+    :type telemetry:        str
+    :return:                The samples, and for each stage its duration, its cpu usage, its peak memory and its
+                            amount of disk and network transfers
+    :rtype:                 dict[str, list[dict[str, any]]]
+    """
+    samples = []
+    stages = {}
+    last_time = 0.0
+    for line in csv.DictReader(telemetry.splitlines()):
+        try:
+            sample = {key: float(value) if key != "stage" and value != "" else value for key, value in line.items()}
+        except (ValueError, TypeError):
+            continue  # Truncated line
+        if sample["progress"] == "":
+            sample["progress"] = None
+        samples.append(sample)
+
+        duration = max(sample["time"] - last_time, 0.0)
+        last_time = sample["time"]
+        if sample["stage"] not in stages:
+            stages[sample["stage"]] = {"stage": sample["stage"], "duration": 0.0, "avg_cpu_percent": 0.0,
+                                       "max_cpu_percent": 0.0, "max_rss_mb": 0.0, "disk_read_mb": 0.0,
+                                       "disk_write_mb": 0.0, "net_recv_mb": 0.0, "net_sent_mb": 0.0}
+        stage = stages[sample["stage"]]
+        stage["duration"] += duration
+        stage["avg_cpu_percent"] += sample["cpu_percent"] * duration
+        stage["max_cpu_percent"] = max(stage["max_cpu_percent"], sample["cpu_percent"])
+        stage["max_rss_mb"] = max(stage["max_rss_mb"], sample["rss_mb"])
+        for direction in ("disk_read", "disk_write", "net_recv", "net_sent"):
+            stage[direction + "_mb"] += sample[direction + "_mbps"] * duration
+
+    for stage in stages.values():
+        if stage["duration"] > 0:
+            stage["avg_cpu_percent"] = round(stage["avg_cpu_percent"] / stage["duration"], 1)
+    return {
+        "samples": samples,
+        "stages": sorted(stages.values(), key=lambda s: s["duration"], reverse=True)
+    }
+
+
 @core.api_util.need_db_context
 def list_tasks():
     """
@@ -329,6 +409,21 @@ def push_task(job_id, task, **params):
             log.warning("Unable to connect to redis server: "+str(e))
 
 
+def get_executor_stats():
+    """
+    Get the statistics of the job executor of the server, published by run_job.py
+
+    :return:        The number of queued and running jobs, the maximum number of running jobs and the last
+                    update timestamp, or None if the executor is not running
+    :rtype:         dict[str, int]|None
+    """
+    with core.api_util.RedisContext.using_data_conn() as r:
+        stats = r.hgetall(core.api_util.RedisContext.get_channel("job_executor"))
+    if not stats:
+        return None
+    return dict((key, int(value)) for key, value in stats.items())
+
+
 @core.api_util.need_db_context
 def get_job(job_id, include_log=False):
     """
@@ -480,6 +575,34 @@ def get_running_machines_list(provider_code):
     return results
 
 
+@core.api_util.need_db_context
+def count_created_jobs(provider_code, machine_code, since):
+    """
+    Count the single worker jobs created for a machine type since a given date
+
+    :param provider_code:       The code of the provider (ex: "aws_eu_spot")
+    :type provider_code:        str
+    :param machine_code:        The code of the machine (ex: "c4.2x")
+    :type machine_code:         str
+    :param since:               The beginning of the period
+    :type since:                datetime.datetime
+    :return:                    The number of created jobs
+    :rtype:                     int
+    """
+    query = """SELECT COUNT(j.id)
+                 FROM jobs AS j
+                 JOIN machine_prices_history AS mp
+                   ON j.machine_price_id = mp.id
+                 JOIN machines AS m
+                   ON mp.machine_uid = m.uid
+                WHERE m.machine_code = %s
+                  AND m.provider_code = %s
+                  AND j.nbr_machines = 1
+                  AND j.create_date >= %s"""
+    g_db = core.api_util.DatabaseContext.get_conn()
+    return int(g_db.execute(query, [machine_code, provider_code, since]).fetchval())
+
+
 @core.api_util.need_db_context
 def disable_shutdown(job_id):
     g_db = core.api_util.DatabaseContext.get_conn()
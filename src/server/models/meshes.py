@@ -104,37 +104,53 @@ def get_project_meshes(user_id, project_codename, include_deleted=False, offset=
 
 
 @core.api_util.need_db_context
-def charge_all(last_charge_limit):
+def charge_all(last_charge_limit, batch_size=500):
+    """
+    Charge the storage of the meshes computed more than 7 days ago and not charged since, by batches.
+    Each batch is committed on its own, so the user accounts are never locked for long
+
+    :param last_charge_limit:   Only charge the meshes whose last storage charge is older than this date
+    :type last_charge_limit:    datetime.datetime
+    :param batch_size:          The maximum number of meshes charged by batch. Optional, default 500
+    :type batch_size:           int
+    :return:                    The number of charged meshes
+    :rtype:                     int
+    """
     query = """INSERT INTO user_accounts (user_id, amount, description, job_id, price_snapshot)
-                SELECT p.user_id AS user_id, o.fixed_cost * -1 AS amount, %s AS description, j.id AS job_id, 
+                SELECT p.user_id AS user_id, o.fixed_cost * -1 AS amount, %s AS description, j.id AS job_id,
                        ua.price_snapshot AS price_snapshot
-                  FROM jobs AS j 
-                  LEFT JOIN operations_history AS o ON j.operation_id = o.id 
-                  LEFT JOIN meshes AS m ON m.job_id = j.id
-                  LEFT JOIN projects AS p ON m.project_uid = p.uid
-                  LEFT JOIN (
-                             SELECT ua.* 
-                              FROM user_accounts AS ua
-                              RIGHT JOIN (
-                                   SELECT ua.job_id, MAX(date) AS date
-                                     FROM user_accounts AS ua
-                                    WHERE ua.job_id IS NOT NULL
-                                      AND ua.price_snapshot->'fix_price' IS NOT NULL
-                                    GROUP BY ua.job_id
-                              ) AS ua2 ON ua2.job_id = ua.job_id AND ua2.date = ua.date
-                  ) AS ua ON ua.job_id = j.id
-                 WHERE j.status = %s 
+                  FROM jobs AS j
+                  JOIN operations_history AS o ON j.operation_id = o.id
+                  JOIN meshes AS m ON m.job_id = j.id
+                  JOIN projects AS p ON m.project_uid = p.uid
+                  JOIN LATERAL (
+                        SELECT ua.date, ua.price_snapshot
+                          FROM user_accounts AS ua
+                         WHERE ua.job_id = j.id
+                           AND ua.price_snapshot->'fix_price' IS NOT NULL
+                         ORDER BY ua.date DESC
+                         LIMIT 1
+                  ) AS ua ON TRUE
+                 WHERE j.status = %s
                    AND m.status = %s
-                   AND j.operation_id IS NOT NULL
                    AND o.operation_name = %s
                    AND m.delete_date IS NULL
                    AND ua.date < %s
                    AND ua.date < now() - INTERVAL '7 DAYS'
+                 ORDER BY j.id
+                 LIMIT %s
     """
-    user_id_list = set([])
+    total = 0
     g_db = core.api_util.DatabaseContext.get_conn()
-    with g_db.cursor() as cur:
-        cur.execute(query, ['Mesh storage cost', jobs.JOB_STATUS_FINISHED, STATUS_COMPUTED, 'mesh', last_charge_limit])
+    while True:
+        with g_db.cursor() as cur:
+            cur.execute(query, ['Mesh storage cost', jobs.JOB_STATUS_FINISHED, STATUS_COMPUTED, 'mesh', last_charge_limit,
+                                batch_size])
+            charged = cur.rowcount
+        g_db.commit()
+        total += charged
+        if charged < batch_size:
+            return total
 
 
 @core.api_util.need_db_context
@@ -254,44 +254,56 @@ def append_file_to_project(user_id, project_codename, file_path, filename=None,
 
 
 @core.api_util.need_db_context
-def charge_all(last_charge_limit):
+def charge_all(last_charge_limit, batch_size=500):
+    """
+    Charge the storage of the projects analysed more than 7 days ago and not charged since, by batches.
+    Each batch is committed on its own, so the user accounts are never locked for long
+
+    :param last_charge_limit:   Only charge the projects whose last storage charge is older than this date
+    :type last_charge_limit:    datetime.datetime
+    :param batch_size:          The maximum number of projects charged by batch. Optional, default 500
+    :type batch_size:           int
+    :return:                    The number of charged projects
+    :rtype:                     int
+    """
     query = """INSERT INTO user_accounts (user_id, amount, description, job_id, price_snapshot)
-                SELECT p.user_id AS user_id, j.fixed_cost * -1 AS amount, %s AS description, j.id AS job_id, 
+                SELECT p.user_id AS user_id, j.fixed_cost * -1 AS amount, %s AS description, j.id AS job_id,
                        ua.price_snapshot AS price_snapshot
-                  FROM projects AS p 
-                  RIGHT JOIN (
-                        SELECT j.id, j.project_uid, o.fixed_cost
+                  FROM (
+                        SELECT DISTINCT ON (j.project_uid) j.id, j.project_uid, o.fixed_cost
                           FROM jobs AS j
-                          RIGHT JOIN (
-                                  SELECT j.project_uid, MAX(j.start_time) as start_time
-                                    FROM jobs AS j
-                                    LEFT JOIN operations_history AS o ON j.operation_id = o.id
-                                   WHERE j.status = %s
-                                     AND j.operation_id IS NOT NULL
-                                     AND o.operation_name = %s
-                                   GROUP BY project_uid
-                          ) AS j2 ON j2.project_uid = j.project_uid AND j2.start_time = j.start_time
-                          LEFT JOIN operations_history AS o ON j.operation_id = o.id
-                  ) AS j ON p.uid = j.project_uid 
-                  RIGHT JOIN (
-                         SELECT ua.* 
+                          JOIN operations_history AS o ON j.operation_id = o.id
+                         WHERE j.status = %s
+                           AND o.operation_name = %s
+                           AND j.start_time IS NOT NULL
+                         ORDER BY j.project_uid, j.start_time DESC
+                  ) AS j
+                  JOIN projects AS p ON p.uid = j.project_uid
+                  JOIN LATERAL (
+                        SELECT ua.date, ua.price_snapshot
                           FROM user_accounts AS ua
-                          RIGHT JOIN (
-                               SELECT ua.job_id, MAX(date) AS date
-                                 FROM user_accounts AS ua
-                                WHERE ua.job_id IS NOT NULL
-                                  AND ua.price_snapshot->'fix_price' IS NOT NULL
-                                GROUP BY ua.job_id
-                          ) AS ua2 ON ua2.job_id = ua.job_id AND ua2.date = ua.date
-                    ) AS ua ON ua.job_id = j.id
+                         WHERE ua.job_id = j.id
+                           AND ua.price_snapshot->'fix_price' IS NOT NULL
+                         ORDER BY ua.date DESC
+                         LIMIT 1
+                  ) AS ua ON TRUE
                  WHERE p.status = %s
                    AND ua.date < %s
                    AND ua.date < now() - INTERVAL '7 DAYS'
+                 ORDER BY j.id
+                 LIMIT %s
     """
+    total = 0
     g_db = core.api_util.DatabaseContext.get_conn()
-    with g_db.cursor() as cur:
-        cur.execute(query, ["Project storage cost", jobs.JOB_STATUS_FINISHED, 'anal', PROJECT_STATUS_ANALYSED,
-                            last_charge_limit])
+    while True:
+        with g_db.cursor() as cur:
+            cur.execute(query, ["Project storage cost", jobs.JOB_STATUS_FINISHED, 'anal', PROJECT_STATUS_ANALYSED,
+                                last_charge_limit, batch_size])
+            charged = cur.rowcount
+        g_db.commit()
+        total += charged
+        if charged < batch_size:
+            return total
 
 
 @contextlib.contextmanager
@@ -372,6 +384,23 @@ def file_exists(filename, include_deleted=False):
     return True if result else False
 
 
+@core.api_util.need_db_context
+def list_all_filenames(include_deleted=False):
+    """
+    Get the names of all the known project files, in a single query
+
+    :param include_deleted:     Also include the files marked as deleted. Optional, default False
+    :type include_deleted:      bool
+    :return:                    The file names
+    :rtype:                     set[str]
+    """
+    query = "SELECT DISTINCT filename FROM project_files"
+    if not include_deleted:
+        query += " WHERE delete_date IS NULL"
+    g_db = core.api_util.DatabaseContext.get_conn()
+    return set(line['filename'] for line in g_db.execute(query).fetchall())
+
+
 @core.api_util.need_db_context
 def set_project_status(user_id, project_codename, status):
     g_db = core.api_util.DatabaseContext.get_conn()
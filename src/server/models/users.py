@@ -6,6 +6,9 @@ import hashlib
 import datetime
 import logging
 import urllib
+import json
+import time
+import threading
 
 # Third party libs
 import requests
@@ -14,6 +17,7 @@ import requests
 from lib import util
 from lib import type_util
 from lib import pg_util
+from lib import error_util
 import core.api_util
 import currencies
 
@@ -23,8 +27,16 @@ RANK_SILVER = 2
 RANK_GOLD = 3
 RANK_ROOT = 4
 
+AUTH_CACHE_TTL = 60                 # in seconds, for the entries shared in redis
+AUTH_CACHE_LOCAL_TTL = 5            # in seconds, for the entries in process memory
+AUTH_CACHE_STATS_FLUSH_DELAY = 10   # in seconds
+
 log = logging.getLogger("aziugo")
 
+_auth_cache = {}
+_auth_cache_lock = threading.Lock()
+_auth_cache_stats = {"local_hits": 0, "redis_hits": 0, "misses": 0, "flush_time": time.time()}
+
 
 def rank_to_str(rank):
     if rank == RANK_BRONZE:
@@ -140,6 +152,8 @@ def reset_pwd(user_id):
     g_db = core.api_util.DatabaseContext.get_conn()
     with g_db.cursor() as cur:
         cur.execute("UPDATE users SET pwd = %s, salt = %s WHERE id = %s", [str(hex_dig), salt, user_id])
+    g_db.commit()
+    invalidate_auth_cache(user_id)
     return new_password
 
 
@@ -195,6 +209,136 @@ def authenticate(login_or_email, password):
     return user
 
 
+def authenticate_with_cache(auth_header, login_or_email, password):
+    """
+    Same as authenticate, but the successful authentications are cached, keyed by a hash of the Authorization header:
+    for AUTH_CACHE_LOCAL_TTL seconds in this process, and for AUTH_CACHE_TTL seconds in redis.
+    The cached entries of a user are removed by invalidate_auth_cache, but the other processes may still use
+    their local entries for AUTH_CACHE_LOCAL_TTL seconds.
+
+    :param auth_header:         The raw Authorization header
+    :type auth_header:          str
+    :param login_or_email:      The user login or email
+    :type login_or_email:       str
+    :param password:            The user password
+    :type password:             str
+    :return:                    The user 'id' and 'user_rank', or None if the authentication failed
+    :rtype:                     dict[str, int]|None
+    """
+    cache_key = hashlib.sha256(auth_header).hexdigest()
+    now = time.time()
+    with _auth_cache_lock:
+        cached = _auth_cache.get(cache_key)
+    if cached and cached[1] > now:
+        _count_auth_cache_access("local_hits")
+        return cached[0]
+
+    user_data = None
+    try:
+        with core.api_util.RedisContext.using_data_conn() as r:
+            raw_data = r.get(core.api_util.RedisContext.get_channel("auth_cache:" + cache_key))
+        if raw_data:
+            user_data = json.loads(raw_data)
+    except error_util.abort_errors: raise
+    except error_util.all_errors as e:
+        log.warning("Unable to read the authentication cache: " + str(e))
+    if user_data:
+        _count_auth_cache_access("redis_hits")
+    else:
+        _count_auth_cache_access("misses")
+        user = authenticate(login_or_email, password)
+        if not user:
+            return None
+        user_data = {"id": user['id'], "user_rank": user['user_rank']}
+        try:
+            with core.api_util.RedisContext.using_data_conn() as r:
+                user_key = core.api_util.RedisContext.get_channel("auth_cache_user:" + str(user_data['id']))
+                pipe = r.pipeline()
+                pipe.setex(core.api_util.RedisContext.get_channel("auth_cache:" + cache_key), AUTH_CACHE_TTL,
+                           json.dumps(user_data))
+                pipe.sadd(user_key, cache_key)
+                pipe.expire(user_key, AUTH_CACHE_TTL)
+                pipe.execute()
+        except error_util.abort_errors: raise
+        except error_util.all_errors as e:
+            log.warning("Unable to save the authentication cache: " + str(e))
+
+    with _auth_cache_lock:
+        if len(_auth_cache) > 10000:
+            _auth_cache.clear()
+        _auth_cache[cache_key] = (user_data, now + AUTH_CACHE_LOCAL_TTL)
+    return user_data
+
+
+def invalidate_auth_cache(user_id):
+    """
+    Remove the cached authentications of a user, in this process and in redis.
+    Should be called after the user change is committed, otherwise a concurrent authentication may cache the old data
+
+    :param user_id:     The id of the user
+    :type user_id:      int
+    """
+    with _auth_cache_lock:
+        for key in [k for k, v in _auth_cache.items() if int(v[0]['id']) == int(user_id)]:
+            del _auth_cache[key]
+    try:
+        with core.api_util.RedisContext.using_data_conn() as r:
+            user_key = core.api_util.RedisContext.get_channel("auth_cache_user:" + str(user_id))
+            cache_keys = r.smembers(user_key)
+            pipe = r.pipeline()
+            for cache_key in cache_keys:
+                pipe.delete(core.api_util.RedisContext.get_channel("auth_cache:" + cache_key))
+            pipe.delete(user_key)
+            pipe.execute()
+    except error_util.abort_errors: raise
+    except error_util.all_errors as e:
+        log.warning("Unable to clean the authentication cache of user " + str(user_id) + ": " + str(e))
+
+
+def get_auth_cache_stats():
+    """
+    Get the authentication cache counters of all the api processes, since the counters creation
+
+    :return:        The 'local_hits', 'redis_hits', 'misses' counters and the 'start_time' timestamp
+    :rtype:         dict[str, int]
+    """
+    _flush_auth_cache_stats()
+    with core.api_util.RedisContext.using_data_conn() as r:
+        stats = r.hgetall(core.api_util.RedisContext.get_channel("auth_cache_stats"))
+    result = {"local_hits": 0, "redis_hits": 0, "misses": 0, "start_time": int(time.time())}
+    result.update(dict((key, int(value)) for key, value in stats.items()))
+    return result
+
+
+def _count_auth_cache_access(counter):
+    with _auth_cache_lock:
+        _auth_cache_stats[counter] += 1
+        should_flush = time.time() - _auth_cache_stats["flush_time"] > AUTH_CACHE_STATS_FLUSH_DELAY
+    if should_flush:
+        try:
+            _flush_auth_cache_stats()
+        except error_util.abort_errors: raise
+        except error_util.all_errors as e:
+            log.warning("Unable to save the authentication cache stats: " + str(e))
+
+
+def _flush_auth_cache_stats():
+    """ Add the counters of this process to the shared ones """
+    with _auth_cache_lock:
+        counters = dict((k, _auth_cache_stats[k]) for k in ("local_hits", "redis_hits", "misses"))
+        for key in counters.keys():
+            _auth_cache_stats[key] = 0
+        _auth_cache_stats["flush_time"] = time.time()
+    with core.api_util.RedisContext.using_data_conn() as r:
+        stats_key = core.api_util.RedisContext.get_channel("auth_cache_stats")
+        pipe = r.pipeline()
+        pipe.hsetnx(stats_key, "start_time", int(time.time()))
+        for key, value in counters.items():
+            if value:
+                pipe.hincrby(stats_key, key, value)
+        pipe.execute()
+
+
 @core.api_util.need_db_context
 def add_user_credits(amount, user_id, description):
     log.info("Adding "+str(amount)+" to user "+str(user_id)+". Reason: "+description)
@@ -211,35 +355,39 @@ def add_user_credits(amount, user_id, description):
 def get_credit(user_id):
     g_db = core.api_util.DatabaseContext.get_conn()
     with g_db.cursor() as cur:
-        cur.execute('SELECT COALESCE(SUM(amount), 0) as credit FROM user_accounts WHERE user_id = %s', [user_id])
+        cur.execute('SELECT balance FROM user_balances WHERE user_id = %s', [user_id])
         result = cur.fetchone()
     if result is None:
         return 0
-    return int(result["credit"])
+    return int(result["balance"])
 
 
 @core.api_util.need_db_context
 def delete_user(user_id):
     g_db = core.api_util.DatabaseContext.get_conn()
     pg_util.delete_with_date(g_db, "users", user_id)
+    g_db.commit()
+    invalidate_auth_cache(user_id)
 
 
 @core.api_util.need_db_context
 def set_user_rank(user_id, rank):
     g_db = core.api_util.DatabaseContext.get_conn()
     g_db.execute("UPDATE users SET user_rank = %s WHERE id = %s", [rank, user_id])
+    g_db.commit()
+    invalidate_auth_cache(user_id)
 
 
 @core.api_util.need_db_context
 def get_users_with_amounts(include_deleted=False, offset=0, limit=None, order=None, filter=None, rank=None):
     count_key = None
     query = """ SELECT users.id, users.login, users.user_rank, users.delete_date, users.create_date, users.email,
-                       COALESCE(SUM(user_accounts.amount), 0) as credit """
+                       COALESCE(user_balances.balance, 0) as credit """
     if offset or limit:
         query += "     , count(*) OVER() AS pagination_full_count"
         count_key = "pagination_full_count"
     query += """  FROM users
-                  LEFT JOIN user_accounts ON users.id = user_accounts.user_id\n"""
+                  LEFT JOIN user_balances ON users.id = user_balances.user_id\n"""
 
     conditions = []
     query_args = []
@@ -259,7 +407,6 @@ def get_users_with_amounts(include_deleted=False, offset=0, limit=None, order=No
     if conditions:
         query += " WHERE "+" AND ".join(conditions)+" "
 
-    query += " GROUP BY users.id"
     if order:
         query += " "+order.to_sql({"user_id": "users.id", "login": "users.login", "rank": "users.user_rank",
                                    "credit": "credit"})
@@ -306,45 +453,103 @@ def charge_user_fix_price(user_id, job_id, description):
 
 
 @core.api_util.need_db_context
-def charge_user_computing(user_id, job_id, description):
-    log.info("Charging user %s. Reason: %s" % (str(user_id), description))
+def charge_computing_jobs(description, job_ids):
+    """
+    Charge the computing time of jobs with a single statement, instead of a query per step of the computation.
+    A job is charged only if its last paid period is over, for the following period (or for the minimal period if
+    it was never charged). Each period ends after now, on the granularity of the job machine price.
+    Only the command loop running a job knows it is still computing, so each loop charges its own job
+
+    :param description:     The description of the transactions
+    :type description:      str
+    :param job_ids:         The ids of the jobs to charge
+    :type job_ids:          list[int]
+    :return:                The end of the new paid period of each charged job, by job id
+    :rtype:                 dict[int, datetime.datetime]
+    """
+    if not job_ids:
+        return {}
+    query_args = [description] + list(job_ids)
+    query = """INSERT INTO user_accounts (user_id, amount, description, job_id, price_snapshot,
+                                          computing_start, computing_end)
+                    SELECT c.user_id,
+                           EXTRACT(EPOCH FROM (c.end_time - c.start_time)) * c.sec_price * c.nbr_machines * -1,
+                           %s,
+                           c.job_id,
+                           json_build_object('price', c.price,
+                                             'start_time', EXTRACT(EPOCH FROM c.start_time)::bigint,
+                                             'end_time', EXTRACT(EPOCH FROM c.end_time)::bigint),
+                           c.start_time,
+                           c.end_time
+                      FROM (
+                            SELECT p.*,
+                                   p.first_end + INTERVAL '1 second' * p.sec_granularity
+                                        * CEIL(GREATEST(0, EXTRACT(EPOCH FROM (p.now - p.first_end)))
+                                               / p.sec_granularity) AS end_time
+                              FROM (
+                                    SELECT j.id AS job_id,
+                                           j.user_id,
+                                           j.nbr_machines,
+                                           mph.sec_price,
+                                           GREATEST(mph.sec_granularity, 1) AS sec_granularity,
+                                           n.now,
+                                           last.computing_end,
+                                           COALESCE(last.computing_end, j.start_time, n.now) AS start_time,
+                                           COALESCE(last.computing_end, j.start_time, n.now) + INTERVAL '1 second'
+                                                * CASE WHEN last.computing_end IS NULL THEN mph.min_sec_granularity
+                                                       ELSE mph.sec_granularity END AS first_end,
+                                           (to_jsonb(mph) || jsonb_build_object(
+                                                'start_time', EXTRACT(EPOCH FROM mph.start_time)::bigint,
+                                                'end_time', EXTRACT(EPOCH FROM mph.end_time)::bigint
+                                           ))::json AS price
+                                      FROM jobs AS j
+                                     CROSS JOIN (SELECT now()::timestamp AS now) AS n
+                                      JOIN machine_prices_history AS mph ON mph.id = j.machine_price_id
+                                      LEFT JOIN LATERAL (
+                                            SELECT MAX(ua.computing_end) AS computing_end
+                                              FROM user_accounts AS ua
+                                             WHERE ua.job_id = j.id
+                                               AND ua.computing_end IS NOT NULL
+                                      ) AS last ON TRUE
+                                     WHERE j.id IN (""" + ", ".join(["%s"] * len(job_ids)) + """)
+                              ) AS p
+                             WHERE p.computing_end IS NULL
+                                OR p.computing_end < p.now
+                      ) AS c
+                 RETURNING job_id, computing_end"""
     g_db = core.api_util.DatabaseContext.get_conn()
     with pg_util.Transaction(g_db):
+        # Two billings of the same job could charge the same period twice. The locks are taken in order, so
+        # concurrent calls never deadlock
+        for job_id in sorted(set(job_ids)):
+            g_db.execute("SELECT pg_advisory_xact_lock(%s)", [job_id])
         with g_db.cursor() as cur:
-            cur.execute("SELECT machine_price_id, start_time, nbr_machines FROM jobs WHERE id = %s", [job_id])
-            job = pg_util.row_to_dict(cur.fetchone())
-        with g_db.cursor() as cur:
-            cur.execute("SELECT * FROM machine_prices_history WHERE id = %s", [job["machine_price_id"]])
-            price = pg_util.row_to_dict(cur.fetchone())
-        now = pg_util.get_now(g_db)
-        with g_db.cursor() as cur:
-            cur.execute("SELECT MAX(computing_end) FROM user_accounts WHERE job_id = %s", [job_id])
-            last_comp = cur.fetchone()
-            if last_comp is not None:
-                last_comp = last_comp[0]
-
-        if last_comp is None:
-            start_time = job["start_time"] if job["start_time"] else now
-            end_time = start_time+datetime.timedelta(seconds=price["min_sec_granularity"])
-        else:
-            start_time = last_comp
-            end_time = start_time + datetime.timedelta(seconds=price["sec_granularity"])
+            cur.execute(query, query_args)
+            return {row["job_id"]: row["computing_end"] for row in cur.fetchall()}
 
-        while end_time < now:
-            end_time += datetime.timedelta(seconds=price["sec_granularity"])
 
-        charged_price = (end_time - start_time).total_seconds()*int(price["sec_price"])*int(job["nbr_machines"])
-        price_snapshot = {
-            "price": pg_util.row_to_dict(price),
-            "start_time": start_time,
-            "end_time": end_time
-        }
-        with g_db.cursor() as cur:
-            cur.execute("""INSERT INTO user_accounts (user_id, amount, description, job_id, price_snapshot, 
-                                                       computing_start, computing_end)
-                                  VALUES (%s, %s, %s, %s, %s, %s, %s)""",
-                        [user_id, charged_price * -1, description, job_id, price_snapshot, start_time, end_time])
-        return end_time
+@core.api_util.need_db_context
+def charge_user_computing(user_id, job_id, description):
+    """
+    Charge the computing time of a job, if its last paid period is over
+
+    :param user_id:         The id of the user to charge, only used for logging (the job owner is charged)
+    :type user_id:          int
+    :param job_id:          The id of the job to charge
+    :type job_id:           int
+    :param description:     The description of the transaction
+    :type description:      str
+    :return:                The end of the paid period of the job
+    :rtype:                 datetime.datetime
+    """
+    log.info("Charging user %s. Reason: %s" % (str(user_id), description))
+    end_times = charge_computing_jobs(description, [job_id])
+    if job_id in end_times:
+        return end_times[job_id]
+    # Already charged by a concurrent billing
+    g_db = core.api_util.DatabaseContext.get_conn()
+    return g_db.execute("""SELECT MAX(computing_end) FROM user_accounts
+                            WHERE job_id = %s AND computing_end IS NOT NULL""", [job_id]).fetchval()
 
 
 @core.api_util.need_db_context
@@ -400,38 +605,88 @@ def cancel_transactions(transaction_ids, reason):
         cur.execute(query, [reason] + transaction_ids)
 
 
+def _get_full_days(from_date, to_date):
+    """
+    Get the days entirely included in the period ]from_date, to_date], the ones which can be read from the daily
+    rollups of the user accounts
+
+    :param from_date:       The start of the period, excluded
+    :type from_date:        datetime.datetime
+    :param to_date:         The end of the period, included
+    :type to_date:          datetime.datetime
+    :return:                The first full day, and the day after the last full day. Both are equal if there is no
+                            full day
+    :rtype:                 tuple[datetime.date, datetime.date]
+    """
+    first_day = from_date.date() + datetime.timedelta(days=1)
+    end_day = max(first_day, to_date.date())
+    return first_day, end_day
+
+
 @core.api_util.need_db_context
 def get_report(from_date, to_date, user_id=None, order_by=None):
-    overview_query_args = [core.api_util.PRICE_PRECISION, from_date, core.api_util.PRICE_PRECISION, to_date]
+    # The balances are computed backward from the current ones. The full days come from the daily rollups, and
+    # only the partial days at the edges of the period are read from the user accounts
+    balance_query = """SELECT B.user_id,
+                              B.balance::numeric - COALESCE(D.amount, 0) - COALESCE(L.amount, 0) AS balance
+                         FROM user_balances AS B
+                         LEFT JOIN (
+                            SELECT user_id, SUM(amount) AS amount
+                              FROM user_account_days
+                             WHERE day >= %s
+                             GROUP BY user_id
+                         ) AS D ON D.user_id = B.user_id
+                         LEFT JOIN (
+                            SELECT user_id, SUM(amount) AS amount
+                              FROM user_accounts
+                             WHERE date >= %s
+                               AND date < %s
+                             GROUP BY user_id
+                         ) AS L ON L.user_id = B.user_id"""
+    overview_query_args = [core.api_util.PRICE_PRECISION, core.api_util.PRICE_PRECISION]
+    for balance_date in (from_date, to_date):
+        next_day = balance_date.date() + datetime.timedelta(days=1)
+        overview_query_args.extend([next_day, balance_date, next_day])
     overview_query = """SELECT U.id AS user_id, 
                                U.login, 
                                U.email,
-                               COALESCE(T1.previous_balance, 0) AS previous_balance,
-                               COALESCE(T2.current_balance, 0) AS current_balance
+                               COALESCE(T1.balance, 0) / %s AS previous_balance,
+                               COALESCE(T2.balance, 0) / %s AS current_balance
                         FROM users AS u
-                        LEFT JOIN (
-                            SELECT UA.user_id, SUM(UA.amount) / %s AS previous_balance
-                            FROM user_accounts AS UA 
-                            WHERE UA.date < %s
-                            GROUP BY UA.user_id
-                        ) AS T1 ON T1.user_id = U.id
-                        LEFT JOIN (
-                            SELECT UA.user_id, SUM(UA.amount) / %s AS current_balance
-                            FROM user_accounts AS UA 
-                            WHERE UA.date < %s
-                            GROUP BY UA.user_id
-                        ) AS T2 ON T2.user_id = U.id"""
-
-    details_query_args = [core.api_util.PRICE_PRECISION, from_date, to_date, from_date, to_date, from_date, to_date]
-    details_query = """SELECT UA.user_id, 
+                        LEFT JOIN (""" + balance_query + """) AS T1 ON T1.user_id = U.id
+                        LEFT JOIN (""" + balance_query + """) AS T2 ON T2.user_id = U.id"""
+
+    first_day, end_day = _get_full_days(from_date, to_date)
+    days_conditions = ["D.day >= %s", "D.day < %s"]
+    days_args = [first_day, end_day]
+    accounts_conditions = ["UA.date > %s", "UA.date <= %s", "(UA.date < %s OR UA.date >= %s)"]
+    accounts_args = [from_date, to_date, first_day, end_day]
+    if user_id is not None:
+        days_conditions.append("D.user_id = %s")
+        days_args.append(user_id)
+        accounts_conditions.append("UA.user_id = %s")
+        accounts_args.append(user_id)
+    ledger_args = days_args + accounts_args
+    ledger_query = """SELECT D.user_id, NULLIF(D.job_id, 0) AS job_id, D.description, D.amount, D.last_date AS date,
+                             D.nbr_transactions
+                        FROM user_account_days AS D
+                       WHERE """ + " AND ".join(days_conditions) + """
+                      UNION ALL
+                      SELECT UA.user_id, UA.job_id, UA.description, UA.amount, UA.date, 1 AS nbr_transactions
+                        FROM user_accounts AS UA
+                       WHERE """ + " AND ".join(accounts_conditions)
+
+    details_query_args = ledger_args + [core.api_util.PRICE_PRECISION, from_date, to_date, from_date, to_date]
+    details_query = """WITH ledger AS (""" + ledger_query + """)
+                       SELECT UA.user_id, 
                               MAX(UA.date) as date,
                               SUM(UA.amount) / %s AS amount,
                               UA.description, 
                               J.project_uid AS project,
-                              SUM(J.cores_per_sec) AS cores_per_sec,
+                              SUM(J.cores_per_sec * UA.nbr_transactions) AS cores_per_sec,
                               MAX(P.mesh_count) AS mesh_count,
                               MAX(P.calc_count) AS calc_count
-                         FROM user_accounts AS UA 
+                         FROM ledger AS UA 
                          LEFT JOIN (
                             SELECT jobs.*,
                               GREATEST(
@@ -443,6 +698,7 @@ def get_report(from_date, to_date, user_id=None, order_by=None):
                                    ON MPH.id = jobs.machine_price_id      
                               LEFT JOIN machines_history AS MH 
                                    ON MH.uid = MPH.machine_uid
+                             WHERE jobs.id IN (SELECT job_id FROM ledger)
                               GROUP BY jobs.id
                             ) AS J ON J.id = UA.job_id 
                          LEFT JOIN (
@@ -452,7 +708,10 @@ def get_report(from_date, to_date, user_id=None, order_by=None):
                               FROM projects 
                               LEFT JOIN meshes AS M ON M.project_uid = projects.uid 
                               LEFT JOIN calculations AS C ON C.project_uid = projects.uid
-                             WHERE M.status != 1
+                             WHERE projects.uid IN (SELECT project_uid
+                                                      FROM jobs
+                                                     WHERE id IN (SELECT job_id FROM ledger))
+                               AND M.status != 1
                                AND (M.delete_date IS NULL OR M.delete_date >= %s)
                                AND M.create_date <= %s
                                AND C.status != 1
@@ -460,13 +719,10 @@ def get_report(from_date, to_date, user_id=None, order_by=None):
                                AND C.create_date <= %s
                              GROUP BY projects.uid
                             ) AS P ON P.uid = J.project_uid
-                        WHERE UA.date > %s
-                          AND UA.date <= %s """
+                        """
     if user_id is not None:
         overview_query += " WHERE U.id = %s"
         overview_query_args.append(user_id)
-        details_query += " AND UA.user_id = %s "
-        details_query_args.append(user_id)
     details_query += """GROUP BY J.project_uid, UA.description, UA.user_id"""
     if order_by is None or order_by == "project":
         details_query += " ORDER BY user_id, project NULLS FIRST, date DESC, description"
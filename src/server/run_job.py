@@ -14,6 +14,10 @@ import argparse
 import exceptions
 import signal
 import subprocess
+import select
+import json
+import errno
+import collections
 
 # Third party libraries
 import colorlog
@@ -149,6 +153,191 @@ def run_toolchain(api_name, server_name, job_id, toolchain):
     sys.exit(0)
 
 
+def run_forked_job(api_name, server_name, job_id, toolchain):
+    """
+    Run a job in a process freshly forked from the job executor. This function never returns.
+
+    :param api_name:            The name of current API
+    :type api_name:             str
+    :param server_name:         The fqdn of current server
+    :type server_name:          str
+    :param job_id:              The is of the job to run
+    :type job_id:               int
+    :param toolchain:           The task to launch
+    :type toolchain:            str
+    """
+    exit_code = 0
+    try:
+        # The orders of the server are for the executor only
+        dev_null = os.open(os.devnull, os.O_RDWR)
+        os.dup2(dev_null, sys.stdin.fileno())
+        os.close(dev_null)
+        init_process(False, api_name, job_id, toolchain)
+        run_toolchain(api_name, server_name, job_id, toolchain)
+    except SystemExit as e:
+        exit_code = e.code if type_util.is_int(e.code) else 0
+    except KeyboardInterrupt:
+        log.info("Signal received, exiting")
+    except BaseException as e:
+        log.exception(str(e))
+        exit_code = 2
+    finally:
+        logging.shutdown()
+        os._exit(exit_code)
+
+
+class JobExecutor(object):
+    """
+    Long-lived and pre-warmed process running the jobs ordered by the server.
+    All the toolchain modules are already loaded, so each job is a simple fork of this process,
+    which keeps the jobs isolated from each other without paying the interpreter startup.
+
+    The server sends one order per line on the executor stdin: {"job_id": 42, "toolchain": "calc"}
+    The executor stops when its stdin is closed. Running jobs are not affected, and orders still queued
+    will be launched again by the server, because a task is only dequeued by the job itself.
+    """
+
+    STATS_DELAY = 30    # in seconds, maximum delay between two publications of the executor statistics
+    STATS_EXPIRE = 90   # in seconds
+    POLL_DELAY = 1      # in seconds
+
+    def __init__(self, api_name, server_name, max_jobs):
+        """
+        :param api_name:            The name of current API
+        :type api_name:             str
+        :param server_name:         The fqdn of current server
+        :type server_name:          str
+        :param max_jobs:            The maximum number of jobs running at the same time
+        :type max_jobs:             int
+        """
+        super(JobExecutor, self).__init__()
+        self._api_name = api_name
+        self._server_name = server_name
+        self._max_jobs = max(1, int(max_jobs))
+        self._queue = collections.deque()   # list of (job_id, toolchain)
+        self._running = {}                  # pid => job_id
+        self._last_stats = None
+        self._last_stats_time = 0
+
+    def run(self, input_stream):
+        """
+        Main loop: read the orders, launch the jobs when there is room for them and reap the finished ones
+
+        :param input_stream:        The stream where the orders come from
+        :type input_stream:         file
+        """
+        input_fd = input_stream.fileno()
+        buf = ""
+        while True:
+            try:
+                readable, _, _ = select.select([input_fd], [], [], JobExecutor.POLL_DELAY)
+            except select.error as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            if readable:
+                data = os.read(input_fd, 4096)
+                if not data:
+                    log.info("Server closed the order stream, stopping job executor")
+                    break
+                buf += data
+                while "\n" in buf:
+                    line, buf = buf.split("\n", 1)
+                    if line.strip():
+                        self._add_order(line)
+            self._reap_jobs()
+            self._launch_jobs()
+            self._publish_stats()
+        self._publish_stats(force=True, stopped=True)
+
+    def _add_order(self, line):
+        try:
+            order = json.loads(line)
+            job_id = int(order["job_id"])
+            toolchain = str(order["toolchain"])
+        except (ValueError, KeyError, TypeError) as e:
+            log.error("Invalid job order " + repr(line) + ": " + str(e))
+            return
+        if job_id in self._running.values() or any(queued_id == job_id for queued_id, _ in self._queue):
+            log.debug("Job " + str(job_id) + " is already handled by the job executor, skipping")
+            return
+        self._queue.append((job_id, toolchain))
+
+    def _launch_jobs(self):
+        while self._queue and len(self._running) < self._max_jobs:
+            job_id, toolchain = self._queue.popleft()
+            try:
+                pid = os.fork()
+            except OSError as e:
+                log.error("Unable to run job " + str(job_id) + ", fork failed, cause:")
+                error_util.log_error(log, e)
+                self._queue.appendleft((job_id, toolchain))
+                return
+            if pid == 0:
+                run_forked_job(self._api_name, self._server_name, job_id, toolchain)
+            self._running[pid] = job_id
+
+    def _reap_jobs(self):
+        while self._running:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except OSError as e:
+                if e.errno == errno.ECHILD:
+                    self._running.clear()
+                    return
+                raise
+            if pid == 0:
+                return
+            self._running.pop(pid, None)
+
+    def _publish_stats(self, force=False, stopped=False):
+        """
+        Save the queue depth and the number of running jobs into redis, see models.jobs.get_executor_stats
+        """
+        stats = {
+            "queued": len(self._queue),
+            "running": len(self._running),
+            "max_jobs": self._max_jobs,
+            "pid": os.getpid()
+        }
+        now = time.time()
+        if not force and stats == self._last_stats and now - self._last_stats_time < JobExecutor.STATS_DELAY:
+            return
+        try:
+            key = core.api_util.RedisContext.get_channel("job_executor")
+            with core.api_util.RedisContext.using_data_conn() as r:
+                if stopped:
+                    r.delete(key)
+                else:
+                    stats["update_time"] = int(now)
+                    r.hmset(key, stats)
+                    r.expire(key, JobExecutor.STATS_EXPIRE)
+            self._last_stats = stats
+            self._last_stats_time = now
+        except StandardError as e:
+            log.warning("Unable to publish job executor statistics: " + str(e))
+
+
+def run_executor(api_name, server_name, max_jobs):
+    """
+    Run the job executor until the server close its stdin
+
+    :param api_name:            The name of current API
+    :type api_name:             str
+    :param server_name:         The fqdn of current server
+    :type server_name:          str
+    :param max_jobs:            The maximum number of jobs running at the same time
+    :type max_jobs:             int
+    """
+    signal.signal(signal.SIGTERM, raise_keyboard_interrupt)
+    signal.signal(signal.SIGINT, raise_keyboard_interrupt)
+    try:
+        setproctitle.setproctitle(api_name + " job executor")
+    except StandardError as e:
+        log.warning(str(e))
+    JobExecutor(api_name, server_name, max_jobs).run(sys.stdin)
+
+
 def main():
     """
     Parse command arguments, initialize log and start the job
@@ -160,16 +349,22 @@ def main():
     # Initialise and parse command arguments
     parser = argparse.ArgumentParser(description="Run a specific job")
     parser.add_argument('--fork', "-f", action="store_true", help="Run double fork to daemonize the process")
+    parser.add_argument('--executor', "-e", action="store_true",
+                        help="Run as a job executor, reading job orders on stdin")
+    parser.add_argument('--max-jobs', "-m", type=int, default=32,
+                        help="Maximum number of jobs running at the same time in executor mode, default 32")
     parser.add_argument('--redis-host', '-H', help="Redis-server host")
     parser.add_argument('--redis-port', '-P', help='Redis-server connection port')
     parser.add_argument('--redis-data-db', '-i', help="Redis-server database index for data")
     parser.add_argument('--redis-pubsub-db', '-j', help="Redis-server database index for events")
     parser.add_argument('--log-level', '-l', help="log level (ex: info)")
     parser.add_argument('--log-output', help="log out, file path, 'syslog', 'stderr' or 'stdout'")
-    parser.add_argument('job_id', type=int, help="The id of the job to run")
-    parser.add_argument('toolchain', help="The toolchain to launch")
+    parser.add_argument('job_id', type=int, nargs="?", help="The id of the job to run")
+    parser.add_argument('toolchain', nargs="?", help="The toolchain to launch")
 
     args = parser.parse_args()
+    if not args.executor and (args.job_id is None or args.toolchain is None):
+        parser.error("job_id and toolchain are required, except in executor mode")
 
     # Load config
     conf = core.api_util.get_conf()
@@ -248,7 +443,10 @@ def main():
 
     # Launch the main function
     try:
-        if init_process(args.fork, api_name, int(args.job_id), args.toolchain):
+        if args.executor:
+            init_data_sources(api_name, server_name, redis_host, redis_port, data_db, pubsub_db)
+            run_executor(api_name, server_name, args.max_jobs)
+        elif init_process(args.fork, api_name, int(args.job_id), args.toolchain):
             init_data_sources(api_name, server_name, redis_host, redis_port, data_db, pubsub_db)
             run_toolchain(api_name, server_name, int(args.job_id), args.toolchain)
     except KeyboardInterrupt:
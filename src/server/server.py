@@ -14,6 +14,7 @@ import re
 import multiprocessing
 import signal
 import subprocess
+import json
 
 # Third party libraries
 import colorlog
@@ -35,6 +36,7 @@ import models.calc
 import models.provider_config
 import models.currencies
 import core.api_util
+import core.worker_pool
 
 
 # constants:
@@ -96,10 +98,12 @@ class PriceBurner(async_util.RecurringThread):
                 return
             now = datetime.datetime.utcnow()
             last_charge_limit = now - datetime.timedelta(minutes=1)
-            # FIXME: Disable because it lock the database: with core.api_util.DatabaseContext.using_conn():
-            models.projects.charge_all(last_charge_limit)
-            models.meshes.charge_all(last_charge_limit)
-            models.calc.charge_all(last_charge_limit)
+            batch_size = get_billing_batch_size()
+            with core.api_util.DatabaseContext.using_conn():
+                charged = models.projects.charge_all(last_charge_limit, batch_size)
+                charged += models.meshes.charge_all(last_charge_limit, batch_size)
+                charged += models.calc.charge_all(last_charge_limit, batch_size)
+            log.info("Storage charged for " + str(charged) + " projects, meshes and calculations")
         except StandardError as e:
             error_util.log_error(log, e)
 
@@ -229,10 +233,117 @@ class SourceChangeNotifier(async_util.AbstractThread):
             error_util.log_error(log, e)
 
 
-def run_task(api_name, server_name, task_order, job_id, log_level, log_output):
+class JobExecutorProcess(object):
+    """
+    Handle the job executor process (see run_job.py --executor), restarting it if needed.
+    The executor is pre-warmed: the jobs sent to it start by a simple fork instead of a new python interpreter.
+    """
+
+    STOP_TIMEOUT = 5  # in seconds
+
+    def __init__(self, max_jobs, log_level, log_output):
+        """
+        :param max_jobs:            The maximum number of jobs running at the same time
+        :type max_jobs:             int
+        :param log_level:           The level of log we want
+        :type log_level:            int
+        :param log_output:          Where do we should output the logs. Should be "stdout", "stderr", "syslog" or a file
+        :type log_output:           str
+        """
+        super(JobExecutorProcess, self).__init__()
+        self._max_jobs = int(max_jobs)
+        self._log_level = log_level
+        self._log_output = log_output
+        self._proc = None
+
+    def start(self):
+        log.info("Starting job executor")
+        self._proc = subprocess.Popen(["python",
+                                       os.path.join(API_PATH, "app", "run_job.py"),
+                                       "--executor",
+                                       "--max-jobs", str(self._max_jobs),
+                                       "--log-level", logging.getLevelName(self._log_level),
+                                       "--log-output", self._log_output,
+                                       '--redis-host', core.api_util.RedisContext.get_host(),
+                                       '--redis-port', str(core.api_util.RedisContext.get_port()),
+                                       '--redis-data-db', str(core.api_util.RedisContext.get_data_db()),
+                                       '--redis-pubsub-db', str(core.api_util.RedisContext.get_pubsub_db())],
+                                      stdin=subprocess.PIPE, close_fds=True)
+
+    def is_running(self):
+        return self._proc is not None and self._proc.poll() is None
+
+    def submit(self, job_id, task_order):
+        """
+        Send a job to the executor. The job will be started as soon as the executor has room for it
+
+        :param job_id:              The id of the job to run
+        :type job_id:               int
+        :param task_order:          The toolchain to launch
+        :type task_order:           str
+        """
+        order = json.dumps({"job_id": int(job_id), "toolchain": str(task_order)}) + "\n"
+        for attempt in range(2):
+            if not self.is_running():
+                if self._proc is not None:
+                    log.warning("Job executor stopped unexpectedly (exit code " + str(self._proc.returncode) + ")")
+                self.start()
+            try:
+                self._proc.stdin.write(order)
+                self._proc.stdin.flush()
+                return
+            except IOError as e:
+                if attempt > 0:
+                    raise
+                log.warning("Unable to send order to job executor: " + str(e))
+                proc_util.ensure_stop_proc(self._proc, JobExecutorProcess.STOP_TIMEOUT)
+                self._proc = None
+
+    def stop(self):
+        """ Stop the executor. The running jobs are not affected """
+        if self._proc is None:
+            return
+        try:
+            self._proc.stdin.close()
+        except IOError:
+            pass
+        try:
+            proc_util.wait_for_proc(self._proc, JobExecutorProcess.STOP_TIMEOUT)
+        except util.TimeoutError:
+            proc_util.ensure_stop_proc(self._proc, JobExecutorProcess.STOP_TIMEOUT)
+        self._proc = None
+
+
+def get_job_executor_size():
+    """
+    Get the maximum number of jobs the job executor can run at the same time
+
+    :return:        The maximum number of running jobs, 0 if jobs should be launched without executor
+    :rtype:         int
+    """
+    conf = core.api_util.get_conf()
+    if not conf.has_option("general", "job_executor_max_jobs"):
+        return 32
+    return max(0, conf.getint("general", "job_executor_max_jobs"))
+
+
+def get_billing_batch_size():
+    """
+    Get the maximum number of storage charges inserted by a single statement
+
+    :return:        The size of the billing batches. Default 500
+    :rtype:         int
+    """
+    conf = core.api_util.get_conf()
+    if not conf.has_option("general", "billing_batch_size"):
+        return 500
+    return max(1, conf.getint("general", "billing_batch_size"))
+
+
+def run_task(api_name, server_name, task_order, job_id, log_level, log_output, job_executor=None):
     """
     Execute a task, which could be to cancel a running toolchain or to launch a specific toolchain.
-    It will launch a separated subprocess and return before task is completed
+    It will launch a separated subprocess, or send it to the job executor, and return before task is completed
 
     :param api_name:            The name of current API
     :type api_name:             str
@@ -246,6 +357,8 @@ def run_task(api_name, server_name, task_order, job_id, log_level, log_output):
     :type log_level:            int
     :param log_output:          Where do we should output the logs. Should be "stdout", "stderr", "syslog" or a file
     :type log_output:           str
+    :param job_executor:        The job executor, if any. Optional, default None
+    :type job_executor:         JobExecutorProcess|None
     """
 
     if task_order == models.jobs.TASK_CANCEL:
@@ -257,6 +370,9 @@ def run_task(api_name, server_name, task_order, job_id, log_level, log_output):
                         models.jobs.TASK_MESH, models.jobs.TASK_CALC, models.jobs.TASK_RESTART_CALC]:
         try:
             # The task will be dequeued by the process to get the task parameters
+            if job_executor is not None:
+                job_executor.submit(job_id, task_order)
+                return
             subprocess.check_call(["python",
                                    os.path.join(API_PATH, "app", "run_job.py"),
                                    "--fork",
@@ -316,7 +432,7 @@ def cancel_job(api_name, server_name, job_id):
                     str(CANCEL_JOB_TIMEOUT)+" seconds, we killed it")
 
 
-def run_pending_jobs(api_name, server_name, log_level, log_output):
+def run_pending_jobs(api_name, server_name, log_level, log_output, job_executor=None):
     """
     Run all pending jobs. It is useful at script startup or when redis server is down.
 
@@ -328,11 +444,13 @@ def run_pending_jobs(api_name, server_name, log_level, log_output):
     :type log_level:            int
     :param log_output:          Where do we should output the logs. Should be "stdout", "stderr", "syslog" or a file
     :type log_output:           str
+    :param job_executor:        The job executor, if any. Optional, default None
+    :type job_executor:         JobExecutorProcess|None
     """
     task_lib = models.jobs.list_tasks()
     for task in task_lib:
         try:
-            run_task(api_name, server_name, task['task'], task['job_id'], log_level, log_output)
+            run_task(api_name, server_name, task['task'], task['job_id'], log_level, log_output, job_executor)
         except StandardError as e:
             error_util.log_error(log, e)
 
@@ -411,6 +529,12 @@ def run_server(api_name, server_name, redis_host="localhost", redis_port=6379, d
             running_threads.append(spot_thread)
             spot_thread.start()
 
+    for provider_name, machine in core.worker_pool.get_pool_names():
+        log.info("Starting warm worker pool " + provider_name + "/" + machine)
+        pool_thread = core.worker_pool.WorkerPoolKeeper(api_name, core.api_util.get_provider(provider_name), machine)
+        running_threads.append(pool_thread)
+        pool_thread.start()
+
     if auto_reload:
         change_thread = SourceChangeNotifier(queue)
         running_threads.append(change_thread)
@@ -431,8 +555,15 @@ def run_server(api_name, server_name, redis_host="localhost", redis_port=6379, d
     else:
         gc = None
 
+    job_executor_size = get_job_executor_size()
+    if job_executor_size > 0:
+        job_executor = JobExecutorProcess(job_executor_size, log_level, log_output)
+        job_executor.start()
+    else:
+        job_executor = None
+
     # Run all pending jobs we may have missed with a redis shutdown or a server.py shutdown
-    run_pending_jobs(api_name, server_name, log_level, log_output)
+    run_pending_jobs(api_name, server_name, log_level, log_output, job_executor)
 
     should_restart = False
     abort_exception = None
@@ -444,13 +575,14 @@ def run_server(api_name, server_name, redis_host="localhost", redis_port=6379, d
                 event = queue.get(block=True, timeout=60)
             except async_util.QueueEmpty:
                 # No events during 1min, perhaps redis is dead so we check pending tasks
-                run_pending_jobs(api_name, server_name, log_level, log_output)
+                run_pending_jobs(api_name, server_name, log_level, log_output, job_executor)
                 continue
             # Running
             msg_type = event['type']
             msg_data = event['data']
             if msg_type == REDIS_MESSAGE:
-                run_task(api_name, server_name, msg_data['task'], msg_data['jobid'], log_level, log_output)
+                run_task(api_name, server_name, msg_data['task'], msg_data['jobid'], log_level, log_output,
+                         job_executor)
             elif msg_type == SRC_CHANGED_MESSAGE:
                 should_restart = True
                 break
@@ -468,6 +600,8 @@ def run_server(api_name, server_name, redis_host="localhost", redis_port=6379, d
             thread.stop()
         if gc:
             proc_util.ensure_stop_proc(gc)
+        if job_executor:
+            job_executor.stop()
         for thread in running_threads:
             thread.join()
     finally:
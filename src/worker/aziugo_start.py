@@ -19,6 +19,15 @@ The task will run, and then a file called /home/aziugo/worker_scripts/outputs/fi
 The script finished when the file /home/aziugo/worker_scripts/inputs/output_flushed is
 created by the corker controller
 
+While the task runs, its progress and its final status are appended as events ("progress 0.42",
+"status success") to /home/aziugo/worker_scripts/outputs/events.log, which is followed by the server
+
+When direct upload is enabled in task_params.json ('direct_upload': '1'), the worker asks the server for upload
+targets with an 'upload_targets' event, waits for /home/aziugo/worker_scripts/inputs/upload_targets.json, uploads the
+result archives itself and leaves a <filename>.upload.json manifest next to each uploaded archive. The targets only
+cover the first parts of each archive: for a bigger archive, the worker sends an 'upload_parts' event and waits for
+/home/aziugo/worker_scripts/inputs/upload_parts/<filename>.json
+
 Everything should be logged both on /home/aziugo/worker_scripts/outputs/worker.log and stdout
 
 """
@@ -36,6 +45,9 @@ import threading
 import platform
 import contextlib
 import tempfile
+import base64
+import hashlib
+import urllib2
 
 # Project specific files
 import toolchain.zc_files
@@ -47,6 +59,11 @@ try:
 except ImportError:
     codecs = None
 
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
 try:
     unicode
     _unicode = True
@@ -57,7 +74,13 @@ except NameError:
 TASK_FOLDER = os.path.abspath(os.path.dirname(__file__))
 WORK_DIR = "/home/aziugo/worker_scripts/workdir"
 DOCKER_LOG_FILE = "/home/aziugo/docker_stdout.log"
+EVENTS_FILE = os.path.join(TASK_FOLDER, "outputs", "events.log")
+UPLOAD_TARGETS_FILE = os.path.join(TASK_FOLDER, "inputs", "upload_targets.json")
+UPLOAD_PARTS_FOLDER = os.path.join(TASK_FOLDER, "inputs", "upload_parts")
+TELEMETRY_FILE = os.path.join(TASK_FOLDER, "outputs", "telemetry.csv")
+STAGE_FILE = os.path.join(WORK_DIR, "stage.txt")
 log = logging.getLogger("aziugo")
+_events_lock = threading.Lock()
 
 
 def ll_float(var):
@@ -75,6 +98,202 @@ def ll_float(var):
     except (ValueError, TypeError):
         return False
 
+
+def emit_event(name, value):
+    """
+    Send an event to the server. Events are appended to the events file, which is followed by the server
+
+    :param name:        The name of the event, ex: 'progress' or 'status'
+    :type name:         str
+    :param value:       The value of the event
+    :type value:        any
+    """
+    with _events_lock:
+        try:
+            if not os.path.exists(os.path.dirname(EVENTS_FILE)):
+                os.makedirs(os.path.dirname(EVENTS_FILE))
+            with open(EVENTS_FILE, "a") as fh:
+                fh.write(str(name) + " " + str(value) + "\n")
+        except (OSError, IOError) as e:
+            log.warning("Unable to send event " + str(name) + ": " + str(e))
+
+
+class ProgressWatcher(threading.Thread):
+    """
+    Watch the progress file written by the toolchain, and send a progress event each time it changes
+
+    Usage:
+        watcher = ProgressWatcher()
+        try:
+            run_task()
+        finally:
+            watcher.stop()
+    """
+
+    CHECK_DELAY = 1  # in seconds
+
+    def __init__(self, progress_file=None):
+        """
+        :param progress_file:   The progress file to watch. Optional, default the one of the working directory
+        :type progress_file:    str|None
+        """
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.progress_file = progress_file if progress_file else os.path.join(WORK_DIR, "progress.txt")
+        self.stop_event = threading.Event()
+        self.progress = None
+        self.start()
+
+    def run(self):
+        """ Main thread loop. Check the progress file modification time and send the new value if it changed """
+        last_mtime = None
+        last_progress = None
+        while not self.stop_event.wait(ProgressWatcher.CHECK_DELAY):
+            try:
+                mtime = os.path.getmtime(self.progress_file)
+                if mtime == last_mtime:
+                    continue
+                last_mtime = mtime
+                with open(self.progress_file, "r") as fh:
+                    progress = fh.read().strip()
+            except (OSError, IOError):
+                continue  # The file doesn't exists yet, or is being written
+            if ll_float(progress) and progress != last_progress:
+                last_progress = progress
+                self.progress = progress
+                emit_event("progress", progress)
+
+    def stop(self):
+        """ Stop watching """
+        self.stop_event.set()
+
+
+class ResourceSampler(threading.Thread):
+    """
+    Sample the resources used by the task at a regular interval, and append them to the telemetry file.
+    Each sample is a csv line with the time since the start, the current stage, the progress, the cpu usage of the
+    machine, the memory used by the task processes, the disk and network rates and the disk usage of the working
+    directory.
+    The stage is the one written by the toolchain in its stage file, so it names the same operation on every job.
+    The samples taken outside of the toolchain stages, while the worker prepares the inputs or sends the results, are
+    in the 'worker' stage.
+
+    Usage:
+        sampler = ResourceSampler(10, progress_watcher)
+        try:
+            run_task()
+        finally:
+            sampler.stop()
+    """
+
+    COLUMNS = ["time", "stage", "progress", "cpu_percent", "rss_mb", "disk_read_mbps", "disk_write_mbps",
+               "net_recv_mbps", "net_sent_mbps", "disk_used_percent"]
+
+    WORKER_STAGE = "worker"
+
+    def __init__(self, interval, progress_watcher=None, telemetry_file=None, stage_file=None):
+        """
+        :param interval:            The time between two samples, in seconds
+        :type interval:             float
+        :param progress_watcher:    The watcher giving the task progress. Optional, default None
+        :type progress_watcher:     ProgressWatcher|None
+        :param telemetry_file:      The file to write. Optional, default the telemetry file of the output folder
+        :type telemetry_file:       str|None
+        :param stage_file:          The stage file of the toolchain. Optional, default the one of the working directory
+        :type stage_file:           str|None
+        """
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.interval = interval
+        self.progress_watcher = progress_watcher
+        self.telemetry_file = telemetry_file if telemetry_file else TELEMETRY_FILE
+        self.stage_file = stage_file if stage_file else STAGE_FILE
+        self.stop_event = threading.Event()
+        self._nbr_samples = 0
+        self.start()
+
+    def run(self):
+        """ Main thread loop. Write a sample every interval, until stopped """
+        try:
+            if not os.path.exists(os.path.dirname(self.telemetry_file)):
+                os.makedirs(os.path.dirname(self.telemetry_file))
+            with open(self.telemetry_file, "w") as fh:
+                fh.write(",".join(ResourceSampler.COLUMNS) + "\n")
+                start = time.time()
+                last_time = start
+                psutil.cpu_percent(None)
+                last_counters = self._get_io_counters()
+                while not self.stop_event.wait(self.interval):
+                    now = time.time()
+                    counters = self._get_io_counters()
+                    stage = self._get_stage()
+                    rss = self._get_task_rss()
+                    elapsed = max(now - last_time, 1e-3) * 1e6
+                    rates = [(new - old) / elapsed for new, old in zip(counters, last_counters)]
+                    progress = self.progress_watcher.progress if self.progress_watcher else None
+                    fh.write("%.1f,%s,%s,%.1f,%.1f,%.2f,%.2f,%.2f,%.2f,%.1f\n" % tuple(
+                        [now - start, stage, progress if progress is not None else "", psutil.cpu_percent(None),
+                         rss / 1e6] + rates + [self._get_disk_used()]))
+                    fh.flush()
+                    self._nbr_samples += 1
+                    last_time, last_counters = now, counters
+        except Exception as e:
+            log.warning("Resource sampling stopped: " + str(e))
+
+    def _get_stage(self):
+        """
+        Get the current stage of the toolchain
+
+        :return:        The stage written by the toolchain, or the worker stage if the toolchain is not in a stage
+        :rtype:         str
+        """
+        try:
+            with open(self.stage_file, "r") as fh:
+                stage = fh.read().strip().replace(",", " ")
+        except (OSError, IOError):
+            return ResourceSampler.WORKER_STAGE  # The toolchain didn't start yet
+        return stage if stage else ResourceSampler.WORKER_STAGE
+
+    @staticmethod
+    def _get_task_rss():
+        """
+        :return:        The resident memory used by all the task processes, in bytes
+        :rtype:         int
+        """
+        rss = 0
+        for child in psutil.Process().children(recursive=True):
+            try:
+                rss += child.memory_info().rss
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+        return rss
+
+    @staticmethod
+    def _get_io_counters():
+        """
+        :return:        The bytes read and written on the disks, then received and sent on the network
+        :rtype:         tuple[int, int, int, int]
+        """
+        disk = psutil.disk_io_counters()
+        net = psutil.net_io_counters()
+        # Some virtual machines expose no disk or no network counters
+        return (disk.read_bytes if disk else 0, disk.write_bytes if disk else 0,
+                net.bytes_recv if net else 0, net.bytes_sent if net else 0)
+
+    @staticmethod
+    def _get_disk_used():
+        try:
+            return psutil.disk_usage(WORK_DIR if os.path.exists(WORK_DIR) else TASK_FOLDER).percent
+        except OSError:
+            return 0.0
+
+    def stop(self):
+        """ Stop sampling """
+        self.stop_event.set()
+        self.join(self.interval + 5)
+        log.info("Resource telemetry: " + str(self._nbr_samples) + " samples written")
+
+
 class LogPipe(threading.Thread):
     """
     A Pipe like object. Every stream writen to this file will be logged line by line
@@ -507,6 +726,187 @@ def shutdown():
         os.system("sudo shutdown -h now")
 
 
+def upload_part(url, data, retries=3):
+    """
+    Send a part of a file on a presigned url. S3 checks the data against the given md5
+
+    :param url:         The presigned url of the part
+    :type url:          str
+    :param data:        The content of the part
+    :type data:         str
+    :param retries:     The number of attempts. Optional, default 3
+    :type retries:      int
+    :return:            The md5 of the part, in hexadecimal
+    :rtype:             str
+    """
+    digest = hashlib.md5(data)
+    for attempt in range(retries):
+        try:
+            request = urllib2.Request(url, data=data, headers={"Content-MD5": base64.b64encode(digest.digest()),
+                                                               "Content-Type": ""})
+            request.get_method = lambda: "PUT"
+            urllib2.urlopen(request, timeout=300).close()
+            return digest.hexdigest()
+        except (urllib2.URLError, IOError) as e:
+            if attempt == retries - 1:
+                raise
+            log.warning("Part upload failed, retrying: " + str(e))
+            time.sleep(2 ** attempt)
+
+
+def upload_multipart(local_path, target, max_parallel, extend_target=None):
+    """
+    Upload a file on a multipart upload target, several parts at the same time
+
+    :param local_path:      The file to upload
+    :type local_path:       str
+    :param target:          The target sent by the server: 'part_size', 'max_parts' and 'urls', the presigned url
+                            of the first parts
+    :type target:           dict[str, any]
+    :param max_parallel:    The maximum number of parts sent at the same time
+    :type max_parallel:     int
+    :param extend_target:   Called with the number of parts when the file needs more parts than the target urls,
+                            should return the urls of the missing parts. Optional, default None
+    :type extend_target:    callable|None
+    :return:                The upload manifest: 'size' and 'parts', a list of dict with 'number', 'size' and 'md5'
+    :rtype:                 dict[str, any]
+    """
+    size = os.path.getsize(local_path)
+    part_size = int(target["part_size"])
+    nbr_parts = max(1, -(-size // part_size))
+    if nbr_parts > int(target.get("max_parts", len(target["urls"]))):
+        raise RuntimeError("File " + local_path + " is too big for its upload target")
+    if nbr_parts > len(target["urls"]):
+        if extend_target is None:
+            raise RuntimeError("File " + local_path + " is too big for its upload target")
+        target["urls"].extend(extend_target(nbr_parts))
+        if nbr_parts > len(target["urls"]):
+            raise RuntimeError("Not enough upload urls for " + local_path)
+    pending = list(range(1, nbr_parts + 1))
+    parts = []
+    errors = []
+    lock = threading.Lock()
+
+    def _send_parts():
+        with open(local_path, "rb") as fh:
+            while True:
+                with lock:
+                    if not pending or errors:
+                        return
+                    number = pending.pop(0)
+                try:
+                    fh.seek((number - 1) * part_size)
+                    data = fh.read(part_size)
+                    md5 = upload_part(target["urls"][number - 1], data)
+                    with lock:
+                        parts.append({"number": number, "size": len(data), "md5": md5})
+                except Exception:
+                    with lock:
+                        errors.append(sys.exc_info())
+
+    threads = [threading.Thread(target=_send_parts) for _ in range(min(max_parallel, nbr_parts))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+    return {"size": size, "parts": sorted(parts, key=lambda part: part["number"])}
+
+
+class DirectUploader(object):
+    """
+    Upload the result archives on the targets sent by the server, as soon as each archive is ready.
+    The server only checks the uploaded files, using the manifest written next to each archive.
+    Each archive is announced to the server once its upload is over, succeeded or not.
+    Failures are only logged: the server fetches the files it can't check, as it always did.
+
+    Usage:
+        uploader = DirectUploader(output_folder)
+        uploader.upload(os.path.join(output_folder, "PROJECT-calc-12.zip"))
+        uploader.wait()
+    """
+
+    TARGETS_TIMEOUT = 120       # in seconds
+    MAX_PARALLEL_PARTS = 4
+
+    def __init__(self, output_folder):
+        """
+        :param output_folder:       The output folder of the task, where the archives and the manifests are
+        :type output_folder:        str
+        """
+        self._output_folder = output_folder
+        self._targets = None
+        self._lock = threading.Lock()
+        self._threads = []
+        emit_event("upload_targets", "request")
+
+    def upload(self, local_path):
+        """
+        Start uploading a file of the output folder in background
+
+        :param local_path:          The file to upload
+        :type local_path:           str
+        """
+        thread = threading.Thread(target=self._upload, args=(local_path, os.path.basename(local_path)))
+        thread.daemon = True
+        thread.start()
+        self._threads.append(thread)
+
+    def wait(self):
+        """ Wait for all uploads """
+        for thread in self._threads:
+            thread.join()
+
+    def _get_targets(self):
+        with self._lock:
+            if self._targets is None:
+                self._targets = {}
+                if wait_for_file(UPLOAD_TARGETS_FILE, DirectUploader.TARGETS_TIMEOUT):
+                    with open(UPLOAD_TARGETS_FILE, "r") as fh:
+                        self._targets = json.load(fh)
+                else:
+                    log.warning("No upload target received from the server")
+            return self._targets
+
+    def _extend_target(self, worker_filename, nbr_parts):
+        """
+        Ask the server for the urls of the parts not covered by the upload target of a file
+
+        :param worker_filename:     The name of the file in the output folder
+        :type worker_filename:      str
+        :param nbr_parts:           The number of parts of the file
+        :type nbr_parts:            int
+        :return:                    The urls of the missing parts
+        :rtype:                     list[str]
+        """
+        parts_file = os.path.join(UPLOAD_PARTS_FOLDER, worker_filename + ".json")
+        emit_event("upload_parts", worker_filename + " " + str(nbr_parts))
+        if not wait_for_file(parts_file, DirectUploader.TARGETS_TIMEOUT):
+            raise RuntimeError("No upload urls received for the parts of " + worker_filename)
+        with open(parts_file, "r") as fh:
+            return json.load(fh)["urls"]
+
+    def _upload(self, local_path, worker_filename):
+        try:
+            target = self._get_targets().get(worker_filename)
+            if not target:
+                return
+            if target.get("type") != "s3_multipart":
+                log.warning("Unknown upload target type " + repr(target.get("type")))
+                return
+            start = time.time()
+            manifest = upload_multipart(local_path, target, DirectUploader.MAX_PARALLEL_PARTS,
+                                        lambda nbr_parts: self._extend_target(worker_filename, nbr_parts))
+            with open(os.path.join(self._output_folder, worker_filename + ".upload.json"), "w") as fh:
+                json.dump(manifest, fh)
+            log.info("%s uploaded in %.1fs" % (worker_filename, time.time() - start))
+        except Exception as e:
+            log.warning("Unable to upload " + worker_filename + ", the server will fetch it: " + str(e))
+        finally:
+            emit_event("result_ready", worker_filename)
+
+
 def run_task():
     """ Look for run parameters and run the task accordingly """
     input_folder = os.path.join(TASK_FOLDER, "inputs")
@@ -536,6 +936,7 @@ def run_task():
     params = []
     if "params" in task_params.keys():
         params = json.loads(task_params["params"])
+    direct_upload = str(task_params.get("direct_upload", "0")) == "1"
 
     if "command" in task_params.keys():
         cmd = task_params["command"]
@@ -554,9 +955,9 @@ def run_task():
         elif task_params["toolchain"] == "mesh":
             run_mesh_toolchain(jobid, project_uid, new_env)
         elif task_params["toolchain"] == "calc":
-            run_calc_toolchain(jobid, project_uid, new_env, params[0])
+            run_calc_toolchain(jobid, project_uid, new_env, params[0], direct_upload)
         elif task_params["toolchain"] == "restart_calc":
-            run_recalc_toolchain(jobid, project_uid, new_env, params[0], params[1])
+            run_recalc_toolchain(jobid, project_uid, new_env, params[0], params[1], direct_upload)
         else:
             raise AbortError("Unknown toolchain "+repr(task_params["toolchain"])+" in task file "+task_params_file)
     else:
@@ -678,90 +1079,95 @@ def run_mesh_toolchain(jobid, project_uid, env):
         err_pipe.close()
 
     # Save the preview file
-    with temp_folder() as folder:
-        outfolder = os.path.join(folder, '%s-%s-%s' % (project_uid, chain, str(jobid)))
-        os.makedirs(outfolder)
-        mesh_workdir = os.path.join(WORK_DIR, "ZephyTOOLS", 'PROJECTS_CFD', project_uid, "MESH")
-        main_folder_name = None
-        for filename in os.listdir(mesh_workdir):
-            if os.path.isdir(os.path.join(mesh_workdir, filename)):
-                if not filename or filename.startswith("."):
-                    continue
-                if not main_folder_name:
-                    main_folder_name = filename
-                else:
-                    raise RuntimeError("To many folders in folder " + str(mesh_workdir))
-        if not main_folder_name:
-            raise RuntimeError("No main folder found in zip file " + str(mesh_workdir))
-        mesh_workdir = os.path.join(mesh_workdir, main_folder_name)
-        shutil.copytree(os.path.join(mesh_workdir, "FILES"), os.path.join(outfolder, "FILES"))
-        shutil.copy(os.path.join(mesh_workdir, "param.xml"), os.path.join(outfolder, "param.xml"))
-        toolchain.zc_files.ZipDir(outfolder, os.path.join(output_folder, "preview.zip"))
+    mesh_workdir = os.path.join(WORK_DIR, "ZephyTOOLS", 'PROJECTS_CFD', project_uid, "MESH")
+    main_folder_name = None
+    for filename in os.listdir(mesh_workdir):
+        if os.path.isdir(os.path.join(mesh_workdir, filename)):
+            if not filename or filename.startswith("."):
+                continue
+            if not main_folder_name:
+                main_folder_name = filename
+            else:
+                raise RuntimeError("To many folders in folder " + str(mesh_workdir))
+    if not main_folder_name:
+        raise RuntimeError("No main folder found in zip file " + str(mesh_workdir))
+    mesh_workdir = os.path.join(mesh_workdir, main_folder_name)
+    preview_folder = '%s-%s-%s' % (project_uid, chain, str(jobid))
+    entries = toolchain.zc_files.ListDirEntries(os.path.join(mesh_workdir, "FILES"), preview_folder + "/FILES")
+    entries.append((os.path.join(mesh_workdir, "param.xml"), preview_folder + "/param.xml"))
+    toolchain.zc_files.ZipEntries(entries, os.path.join(output_folder, "preview.zip"))
+    emit_event("result_ready", "preview.zip")
 
     out_filename = '%s-%s-%s' % (project_uid, chain, str(jobid))
     shutil.move(os.path.join(WORK_DIR, out_filename + ".zip"), os.path.join(output_folder, out_filename + ".zip"))
+    emit_event("result_ready", out_filename + ".zip")
     log.info("Results are ready to fetch")
 
 
-def store_calc_files(codename, jobid, split_results, call_args=None):
+def store_calc_files(codename, jobid, split_results, output_folder, uploader=None):
+    """
+    Build the result archives of a calculation in the output folder: the results, the workfiles and, if results are
+    split, the reduced results and the iterations.
+    Files are read directly from the project folder and all the archives are built at the same time.
+    Each archive is announced to the server with a 'result_ready' event as soon as it is ready, so the server can
+    fetch it while the other ones are still being built.
+
+    :param codename:        The project codename
+    :type codename:         str
+    :param jobid:           The id of the job
+    :type jobid:            str
+    :param split_results:   Do we want to split results ?
+    :type split_results:    bool
+    :param output_folder:   The output folder of the task
+    :type output_folder:    str
+    :param uploader:        Upload each archive as soon as it is built, then announce it. Optional, default None
+    :type uploader:         DirectUploader|None
+    """
     ch = "calc"
-    ztfold = os.path.abspath('ZephyTOOLS').rstrip("/")+"/"
-
-    if not call_args:
-        call_args = {}
+    project_path = os.path.join(WORK_DIR, 'ZephyTOOLS', 'PROJECTS_CFD', codename)
     outfolder = '%s-%s-%s' % (codename, ch, jobid)
-    subprocess.call(['mkdir', '-p', outfolder], **call_args)
-    for elem in toolchain.zc_files.ddout[ch]['tree']:
-        subprocess.call(['mkdir', '-p', outfolder+elem], **call_args)
+
+    results, reduced, iterations = [], [], []
     for elem in toolchain.zc_files.ddout[ch]['folders']:
-        subprocess.call(['cp', '-r', ztfold+'PROJECTS_CFD/'+codename+elem, outfolder], **call_args)
+        src_folder = os.path.join(project_path, elem.strip("/"))
+        if os.path.isdir(src_folder):
+            results.extend(toolchain.zc_files.ListDirEntries(src_folder, outfolder + "/" + elem.strip("/")))
     for elem in toolchain.zc_files.ddout[ch]['files']:
-        subprocess.call(['cp', '-r', ztfold+'PROJECTS_CFD/'+codename+'/'+elem, outfolder], **call_args)
-    for elem in toolchain.zc_files.ddout[ch]['remove']:
-        subprocess.call(['rm', '-f', outfolder+elem], **call_args)
-    res_folder = get_main_folder_of(os.path.join(outfolder, "CALC"))
-    comp_folder = os.path.basename(res_folder)
+        if os.path.isfile(os.path.join(project_path, elem.strip("/"))):
+            results.append((os.path.join(project_path, elem.strip("/")), outfolder + "/" + elem.strip("/")))
+    removed = set(outfolder + elem for elem in toolchain.zc_files.ddout[ch]['remove'])
+    results = [entry for entry in results if entry[1] not in removed]
 
     if split_results:
-        with temp_folder() as reduce_tmp_folder:
-            reduce_folder = os.path.join(reduce_tmp_folder, outfolder, "CALC", comp_folder)
-            os.makedirs(reduce_folder)
-            subprocess.call(['mv', os.path.join(res_folder, "REDUCED"),
-                             os.path.join(reduce_folder, "REDUCED")], **call_args)
-            os.chdir(reduce_tmp_folder)
-            toolchain.zc_files.ZipDir('./%s' % outfolder, 'reduced.zip')
-            shutil.move(os.path.join(reduce_tmp_folder, 'reduced.zip'), os.path.join(WORK_DIR, 'reduced.zip'))
-        with temp_folder() as iterations_tmp_folder:
-            iterations_folder = os.path.join(iterations_tmp_folder, outfolder, "CALC", comp_folder)
-            for calc_type in ("COARSE", "FINE"):
-                if not os.path.exists(os.path.join(res_folder, calc_type)):
-                    continue
-                os.makedirs(os.path.join(iterations_folder, calc_type))
-                targets=["constant", "system"]
-                for o in os.listdir(os.path.join(res_folder, calc_type)):
-                    if not os.path.isdir(os.path.join(res_folder, calc_type, o)): continue
-                    try:
-                        int(o)
-                        targets.append(o)
-                    except ValueError:
-                        continue
-                for target in targets:
-                    to_move = os.path.join(res_folder, calc_type, target)
-                    if not os.path.exists(os.path.join(to_move)):
-                        continue
-                    try:
-                        dest = os.path.join(iterations_folder, calc_type, target)
-                        subprocess.call(['mv', to_move, dest], **call_args)
-                    except StandardError as e:
-                        log.warning(str(e))
-            os.chdir(iterations_tmp_folder)
-            toolchain.zc_files.ZipDir('./%s' % outfolder, 'iterations.zip')
-            shutil.move(os.path.join(iterations_tmp_folder, 'iterations.zip'), os.path.join(WORK_DIR, 'iterations.zip'))
-    os.chdir(WORK_DIR)
-    toolchain.zc_files.ZipDir('./%s' % outfolder, "results.zip")
+        comp_folder = os.path.basename(get_main_folder_of(os.path.join(project_path, "CALC")))
+        comp_prefix = outfolder + "/CALC/" + comp_folder + "/"
+        all_entries, results = results, []
+        for entry in all_entries:
+            parts = entry[1][len(comp_prefix):].split("/") if entry[1].startswith(comp_prefix) else []
+            if len(parts) > 1 and parts[0] == "REDUCED":
+                reduced.append(entry)
+            elif len(parts) > 2 and parts[0] in ("COARSE", "FINE") and \
+                    (parts[1] in ("constant", "system") or parts[1].isdigit()):
+                iterations.append(entry)
+            else:
+                results.append(entry)
+
+    archives = [(results, os.path.join(output_folder, outfolder + ".zip"), True),
+                (toolchain.zc_files.ListDirEntries(project_path, outfolder + "/" + codename),
+                 os.path.join(output_folder, outfolder + "_workfiles.zip"), True)]
+    if split_results:
+        archives.append((reduced, os.path.join(output_folder, outfolder + "_reduce.zip"), True))
+        archives.append((iterations, os.path.join(output_folder, outfolder + "_iterations.zip"), True))
+    if uploader:
+        on_done = uploader.upload
+    else:
+        on_done = lambda zippath: emit_event("result_ready", os.path.basename(zippath))
+    start = time.time()
+    toolchain.zc_files.ZipParallel(archives, on_done=on_done)
+    log.info("Result archives built in %.1fs" % (time.time() - start))
 
 
-def run_calc_toolchain(jobid, project_uid, env, split_results):
+def run_calc_toolchain(jobid, project_uid, env, split_results, direct_upload=False):
     """
     Run the cfd calculation toolchain
 
@@ -773,6 +1179,8 @@ def run_calc_toolchain(jobid, project_uid, env, split_results):
     :type env:              dict[str, str]
     :param split_results:   Do we want  to split results ?
     :type split_results:    bool
+    :param direct_upload:   Do we upload the results on the targets sent by the server ? Optional, default False
+    :type direct_upload:    bool
     """
 
     input_folder = os.path.join(TASK_FOLDER, "inputs")
@@ -813,28 +1221,17 @@ def run_calc_toolchain(jobid, project_uid, env, split_results):
         if not toolchain_succeed:
             raise AbortError("Job failed: no " + str(result_file) + " file generated")
         log.info("Packaging results")
-        store_calc_files(project_uid, str(jobid), split_results, call_args={"stdout": out_pipe, "stderr": err_pipe})
-        with temp_folder() as tmp_folder:
-            out_folder = '%s-%s-%s' % (project_uid, chain, str(jobid))
-            out_path = os.path.join(tmp_folder, out_folder)
-            os.makedirs(out_path)
-            work_files = os.path.join('ZephyTOOLS', 'PROJECTS_CFD', project_uid)
-            shutil.copytree(work_files, os.path.join(out_path, project_uid))
-            toolchain.zc_files.ZipDir(out_path, "workfiles.zip")
+        uploader = DirectUploader(output_folder) if direct_upload else None
+        store_calc_files(project_uid, str(jobid), split_results, output_folder, uploader)
+        if uploader:
+            uploader.wait()
     finally:
         out_pipe.close()
         err_pipe.close()
-
-    out_filename = '%s-%s-%s' % (project_uid, chain, str(jobid))
-    shutil.move(os.path.join(WORK_DIR, "results.zip"), os.path.join(output_folder, out_filename + ".zip"))
-    shutil.move(os.path.join(WORK_DIR, "workfiles.zip"), os.path.join(output_folder, out_filename + "_workfiles.zip"))
-    if split_results:
-        shutil.move(os.path.join(WORK_DIR, "iterations.zip"), os.path.join(output_folder, out_filename + "_iterations.zip"))
-        shutil.move(os.path.join(WORK_DIR, "reduced.zip"), os.path.join(output_folder, out_filename + "_reduce.zip"))
     log.info("Results are ready to fetch")
 
 
-def run_recalc_toolchain(jobid, project_uid, env, nbr_iterations, split_results):
+def run_recalc_toolchain(jobid, project_uid, env, nbr_iterations, split_results, direct_upload=False):
     """
     Run the cfd calculation toolchain once again
 
@@ -848,6 +1245,8 @@ def run_recalc_toolchain(jobid, project_uid, env, nbr_iterations, split_results)
     :type nbr_iterations:   int
     :param split_results:   Do we want  to split results ?
     :type split_results:    bool
+    :param direct_upload:   Do we upload the results on the targets sent by the server ? Optional, default False
+    :type direct_upload:    bool
     """
 
     input_folder = os.path.join(TASK_FOLDER, "inputs")
@@ -902,24 +1301,13 @@ def run_recalc_toolchain(jobid, project_uid, env, nbr_iterations, split_results)
         if not toolchain_succeed:
             raise AbortError("Job failed: no " + str(result_file) + " file generated")
         log.info("Packaging results")
-        store_calc_files(project_uid, str(jobid), split_results, call_args={"stdout": out_pipe, "stderr": err_pipe})
-        with temp_folder() as tmp_folder:
-            out_folder = '%s-%s-%s' % (project_uid, chain, str(jobid))
-            out_path = os.path.join(tmp_folder, out_folder)
-            os.makedirs(out_path)
-            work_files = os.path.join('ZephyTOOLS', 'PROJECTS_CFD', project_uid)
-            shutil.copytree(work_files, os.path.join(out_path, project_uid))
-            toolchain.zc_files.ZipDir(out_path, "workfiles.zip")
+        uploader = DirectUploader(output_folder) if direct_upload else None
+        store_calc_files(project_uid, str(jobid), split_results, output_folder, uploader)
+        if uploader:
+            uploader.wait()
     finally:
         out_pipe.close()
         err_pipe.close()
-
-    out_filename = '%s-%s-%s' % (project_uid, chain, str(jobid))
-    shutil.move(os.path.join(WORK_DIR, "results.zip"), os.path.join(output_folder, out_filename + ".zip"))
-    shutil.move(os.path.join(WORK_DIR, "workfiles.zip"), os.path.join(output_folder, out_filename + "_workfiles.zip"))
-    if split_results:
-        shutil.move(os.path.join(WORK_DIR, "iterations.zip"), os.path.join(output_folder, out_filename + "_iterations.zip"))
-        shutil.move(os.path.join(WORK_DIR, "reduced.zip"), os.path.join(output_folder, out_filename + "_reduce.zip"))
     log.info("Results are ready to fetch")
 
 
@@ -929,6 +1317,7 @@ def save_state(status):
         try:
             with open(os.path.join(output_folder, "task_end.txt"), "wt") as fh:
                 fh.write(str(status)+"\n")
+            emit_event("status", status)
             return
         except OSError as e:
             if i > 0:
@@ -936,6 +1325,31 @@ def save_state(status):
     log.error("Unable to save status")
 
 
+def start_resource_sampler(input_folder, progress_watcher):
+    """
+    Start sampling the resources used by the task, at the interval given by 'telemetry_interval' in task_params.json
+
+    :param input_folder:        The input folder, containing task_params.json
+    :type input_folder:         str
+    :param progress_watcher:    The watcher giving the task progress
+    :type progress_watcher:     ProgressWatcher
+    :return:                    The sampler, or None if the telemetry is disabled or psutil is not installed
+    :rtype:                     ResourceSampler|None
+    """
+    try:
+        with open(os.path.join(input_folder, "task_params.json"), "r") as fh:
+            interval = json.load(fh).get("telemetry_interval", 0)
+    except (OSError, IOError, ValueError) as e:
+        log.warning("Unable to read the telemetry interval: " + str(e))
+        return None
+    if not ll_float(interval) or float(interval) <= 0:
+        return None
+    if psutil is None:
+        log.warning("psutil is not installed, no resource telemetry")
+        return None
+    return ResourceSampler(float(interval), progress_watcher)
+
+
 def should_shutdown(input_folder, default=True):
     task_params_file = os.path.join(input_folder, "task_params.json")
     if not os.path.exists(task_params_file):
@@ -968,7 +1382,14 @@ def main():
                 log.warning("Timeout for input expired, exiting...")
                 return 1
             log.info("Running task")
-            run_task()
+            progress_watcher = ProgressWatcher()
+            sampler = start_resource_sampler(input_folder, progress_watcher)
+            try:
+                run_task()
+            finally:
+                if sampler:
+                    sampler.stop()
+                progress_watcher.stop()
             if not os.path.exists(output_folder):
                 os.makedirs(output_folder)
             save_state("success")
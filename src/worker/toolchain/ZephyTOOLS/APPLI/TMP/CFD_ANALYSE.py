@@ -4,8 +4,8 @@
 from matplotlib.figure import Figure
 
 from ZS_VARIABLES	import *
-from ZS_COMMON		import FORTRAN_FILE,P_THREAD,CFD_PARAM,GetUITranslator
-from ZS_COMMON		import GetFolderSize,GetDirect,UpdateProgress,GetMachine,SortXmlData,SubprocessCall
+from ZS_COMMON		import FORTRAN_FILE,P_TASK_GRAPH,CFD_PARAM,GetUITranslator
+from ZS_COMMON		import GetFolderSize,GetDirect,UpdateProgress,ResetProgress,GetMachine,SortXmlData,SubprocessCall
 
 class PARAM(CFD_PARAM):
 	
@@ -83,8 +83,6 @@ if not os.path.isfile(progressfile):
 	if not LOCAL:
 		with open(PATH+'../../../progress.txt','w') as pf: pf.write('0')
 
-rootprogress=xml.parse(progressfile).getroot()
-
 NCALC=[360,180,120,90,72]
 NCALC2=[8,12,18,24,36]
 
@@ -92,79 +90,6 @@ figure=None
 subplot=None
 contour=None
 
-class THREAD_CalcOro(P_THREAD):
-	
-	def __init__(self,num):
-		
-		self.num=num
-		P_THREAD.__init__(self,p.p_pool,p.nproc)
-	
-	def run(self):
-		
-		ithread=self.prerun()
-		
-		CalcOro(ithread+1,self.num)
-		
-		self.postrun(ithread)
-
-class THREAD_CalcSlope(P_THREAD):
-	
-	def __init__(self,num):
-		
-		P_THREAD.__init__(self,p.p_pool,p.nproc)
-		self.num=num
-	
-	def run(self):
-		
-		ithread=self.prerun()
-		
-		CalcSlope(ithread+1,self.num)
-		
-		self.postrun(ithread)
-
-class THREAD_CalcRix(P_THREAD):
-	
-	def __init__(self,num):
-		
-		P_THREAD.__init__(self,p.p_pool,p.nproc)
-		self.num=num
-	
-	def run(self):
-		
-		ithread=self.prerun()
-		
-		CalcRix(ithread+1,self.num)
-		
-		self.postrun(ithread)
-
-class THREAD_ReconstructOro(P_THREAD):
-	
-	def __init__(self):
-		
-		P_THREAD.__init__(self,p.p_pool,p.nproc)
-	
-	def run(self):
-		
-		ithread=self.prerun()
-		
-		ReconstructOro(ithread+1)
-		
-		self.postrun(ithread)
-
-class THREAD_EvaluateSlopes(P_THREAD):
-	
-	def __init__(self):
-		
-		P_THREAD.__init__(self,p.p_pool,p.nproc)
-	
-	def run(self):
-
-		ithread=self.prerun()
-		
-		EvaluateSlopes(ithread+1)
-		
-		self.postrun(ithread)
-		
 def ReadParam():
 	"""
 	Reads the process input parameters
@@ -355,14 +280,7 @@ def CalcOro(ithread,num):
 
 		istep+=1
 		
-		rootprogress.find('progress_text').text='%i'%(100.*istep/nstep)
-		rootprogress.find('progress_frac').text=str(istep/nstep)
-		try: xml.ElementTree(rootprogress).write(progressfile)
-		except: pass
-		if not LOCAL:
-			try:
-				with open(PATH+'../../../progress.txt','w') as pf: pf.write(str(istep/nstep))
-			except: pass
+		p.UpdateMainProgress(istep/nstep)
 		
 		UpdateProgress(time2use,ithread,0.,msg("Evaluating Elevations on Result Points")+' - %s'%(num.split('_')[-1]))
 		
@@ -379,10 +297,7 @@ def CalcOro(ithread,num):
 		it=0
 		RES=False
 		while not RES and it<=itmax:
-			root=xml.Element('logout')
-			xml.SubElement(root,'progress_text').text='Evaluating Elevations'
-			xml.SubElement(root,'progress_frac').text=str(0)
-			xml.ElementTree(root).write(xmlfile)
+			ResetProgress(xmlfile,'Evaluating Elevations')
 			it+=1
 			SubprocessCall(appli,infile,elevationfile,outfile,xmlfile)
 			RES=eval(xml.parse(xmlfile).getroot().find('progress_frac').text)==1.0
@@ -406,12 +321,7 @@ def CalcSlope(ithread,num):
 	global istep
 	
 	istep+=1
-	rootprogress.find('progress_text').text='%i'%(100.*istep/nstep)
-	rootprogress.find('progress_frac').text=str(istep/nstep)
-	if not LOCAL:
-		try:
-			with open(PATH+'../../../progress.txt','w') as pf: pf.write(str(istep/nstep))
-		except: pass
+	p.UpdateMainProgress(istep/nstep)
 	
 	UpdateProgress(time2use,ithread,0.0,msg("Slope calculation process - Elevations")+' - '+num.split('_')[-1])
 
@@ -427,10 +337,7 @@ def CalcSlope(ithread,num):
 		it=0
 		RES=False
 		while not RES and it<=itmax:
-			root=xml.Element('logout')
-			xml.SubElement(root,'progress_text').text='Evaluating Slopes'
-			xml.SubElement(root,'progress_frac').text=str(0)
-			xml.ElementTree(root).write(xmlfile)
+			ResetProgress(xmlfile,'Evaluating Slopes')
 			it+=1
 			SubprocessCall(appli,infile,elevationfile,outfile,xmlfile)
 			RES=eval(xml.parse(xmlfile).getroot().find('progress_frac').text)==1.0
@@ -457,14 +364,7 @@ def CalcRix(ithread,num):
 	global istep
 	
 	istep+=1
-	rootprogress.find('progress_text').text='%i'%(100.*istep/nstep)
-	rootprogress.find('progress_frac').text=str(istep/nstep)
-	try: xml.ElementTree(rootprogress).write(progressfile)
-	except: pass
-	if not LOCAL:
-		try:
-			with open(PATH+'../../../progress.txt','w') as pf: pf.write(str(istep/nstep))
-		except: pass
+	p.UpdateMainProgress(istep/nstep)
 	
 	UpdateProgress(time2use,ithread,0.0,msg("RIX calculation process - Elevations")+' - '+num.split('_')[-1])
 
@@ -480,10 +380,7 @@ def CalcRix(ithread,num):
 		it=0
 		RES=False
 		while not RES and it<=itmax:
-			root=xml.Element('logout')
-			xml.SubElement(root,'progress_text').text='Evaluating RIX'
-			xml.SubElement(root,'progress_frac').text=str(0)
-			xml.ElementTree(root).write(xmlfile)
+			ResetProgress(xmlfile,'Evaluating RIX')
 			it+=1
 			SubprocessCall(appli,infile,elevationfile,outfile,xmlfile)
 			RES=eval(xml.parse(xmlfile).getroot().find('progress_frac').text)==1.0
@@ -507,45 +404,37 @@ def ReconstructOro(ithread):
 
 		istep+=1
 		
-		rootprogress.find('progress_text').text='%i'%(100.*istep/nstep)
-		rootprogress.find('progress_frac').text=str(istep/nstep)
-		try: xml.ElementTree(rootprogress).write(progressfile)
-		except: pass
-		if not LOCAL:
-			try:
-				with open(PATH+'../../../progress.txt','w') as pf: pf.write(str(istep/nstep))
-			except: pass
+		p.UpdateMainProgress(istep/nstep)
 		
 		UpdateProgress(time2use,ithread,0.,'ReconstructOro')
 		
-		x,y,z=[],[],[]
+		start=time.time()
 		
+		xyz=[]
 		for idiv in range(100):
 			
 			UpdateProgress(time2use,ithread,float(idiv+1)/100,'ReconstructOro')
 			
-			with open(p.projdir+'/DATA/loc_'+str(idiv).zfill(2)+'_z','r') as infile: lines=infile.readlines()
-			subprocess.call(['mv',p.projdir+'/DATA/loc_'+str(idiv).zfill(2)+'_z',p.projdir+'/DATA/loc_'+str(idiv).zfill(2)])
-			for line in lines:
-				vals=line.split()
-				x.append(eval(vals[0]))
-				y.append(eval(vals[1]))
-				z.append(eval(vals[2]))
+			num=p.projdir+'/DATA/loc_'+str(idiv).zfill(2)
+			xyz.append(np.loadtxt(num+'_z',usecols=(0,1,2)).reshape(-1,3))
+			subprocess.call(['mv',num+'_z',num])
+		xyz=np.concatenate(xyz)
 		
-		locdata=[]
-		itot=-1
+		duration_parse=time.time()-start
+		start=time.time()
+		
+		locdata=np.zeros(0)
+		itot=0
 		for elem in p.np_data:
 			name=elem[0]
 			npp=elem[1]
 			if npp>0:
-				with open(p.projdir+'/DATA/elevations_'+name,'w') as outfile:
-					for _ in range(npp):
-						itot+=1
-						outfile.write('%20.2f%20.2f%20.2f\n'%(x[itot],y[itot],z[itot]))
-						if name=='complex_glob': locdata.append(z[itot])
-		itot+=1
+				with open(p.projdir+'/DATA/elevations_'+name,'w') as outfile: np.savetxt(outfile,xyz[itot:itot+npp],fmt='%20.2f%20.2f%20.2f')
+				if name=='complex_glob': locdata=xyz[itot:itot+npp,2]
+				itot+=npp
+		
+		print('ReconstructOro: %i points parsed in %.2fs, written in %.2fs'%(len(xyz),duration_parse,time.time()-start))
 		
-		locdata=np.array(locdata)
 		p.elevation_moy=np.average(locdata)
 		p.elevation_deltamax=np.max(locdata)-np.min(locdata)
 		p.elevation_std=np.std(locdata)
@@ -564,80 +453,51 @@ def EvaluateSlopes(ithread):
 	global istep,figure,subplot,contour
 	
 	istep+=1
-	rootprogress.find('progress_text').text='%i'%(100.*istep/nstep)
-	rootprogress.find('progress_frac').text=str(istep/nstep)
-	try: xml.ElementTree(rootprogress).write(progressfile)
-	except: pass
-	if not LOCAL:
-		try:
-			with open(PATH+'../../../progress.txt','w') as pf: pf.write(str(istep/nstep))
-		except: pass
+	p.UpdateMainProgress(istep/nstep)
 	
 	UpdateProgress(time2use,ithread,0.05,msg("Slope calculation process - Construction"))
 
 	try:
 
-		with open(p.folder+'/slope_points_z','w') as outfile:
-			for idiv in range(p.nproc):
-				infile=open(p.folder+'/slope_points_'+str(idiv)+'_z','r')
-				lines=infile.readlines()
-				infile.close()
-				subprocess.call(['rm',p.folder+'/slope_points_'+str(idiv)])
-				subprocess.call(['rm',p.folder+'/slope_points_'+str(idiv)+'_z'])
-				for line in lines: outfile.write(line)
+		start=time.time()
 		
-		UpdateProgress(time2use,ithread,0.15,msg("Slope calculation process - Construction"))
-	
 		zf=[]
-		with open(p.folder+'/slope_points_z','r') as infile: lines=infile.readlines()
+		for idiv in range(p.nproc):
+			zf.append(np.loadtxt(p.folder+'/slope_points_'+str(idiv)+'_z',usecols=(2,)).reshape(-1))
+			subprocess.call(['rm',p.folder+'/slope_points_'+str(idiv)])
+			subprocess.call(['rm',p.folder+'/slope_points_'+str(idiv)+'_z'])
+		zf=np.concatenate(zf)
 		
-		for line in lines: zf.append(eval(line.split()[2]))
+		duration_parse=time.time()-start
+		start=time.time()
 	
 		UpdateProgress(time2use,ithread,0.20,msg("Slope calculation process - Construction"))
 		
-		itot=-1
-		slopes=[]
-		for _ in range(p.nsite):
-			slopes.append([])
-			for __ in range(p.rixncalc_site):
-				slopes[-1].append([])
-				for iseg in range(p.npl_site+1):
-					itot+=1
-					if iseg>0:
-						slope=(zf[itot]-zf[itot-1])/p.rixres_site
-						slopes[-1][-1].append(np.arctan((slope))*180./np.pi)
+		# one row per site, one line per direction, one slope per segment
+		zf=zf.reshape(p.nsite,p.rixncalc_site,p.npl_site+1)
+		slopes=np.abs(np.arctan(np.diff(zf,axis=2)/p.rixres_site)*180./np.pi)
 	
 		UpdateProgress(time2use,ithread,0.40,msg("Slope calculation process - Construction"))
 	
-		res=[]
-		for slope_point in slopes:
-			res.append([0.]*(p.rixncalc_site+1))
-			idir=-1
-			for slope_dir in slope_point:
-				idir+=1
-				direc=idir*360./p.rixncalc_site
-				idirec=GetDirect(p.rixncalc_site,direc)
-				for slope in slope_dir: res[-1][idirec]+=abs(slope)
-			for idir in range(p.rixncalc_site): res[-1][idir]=res[-1][idir]/p.npl_site
-			res[-1][-1]=np.average(res[-1][0:p.rixncalc_site])
+		idirecs=[GetDirect(p.rixncalc_site,idir*360./p.rixncalc_site) for idir in range(p.rixncalc_site)]
+		res=np.zeros((p.nsite,p.rixncalc_site))
+		np.add.at(res,(slice(None),idirecs),slopes.sum(axis=2))
+		resslopes=np.average(res/p.npl_site,axis=1)
 	
 		UpdateProgress(time2use,ithread,0.60,msg("Slope calculation process - Construction"))
-			
-		resslopes=[]
+		
+		xsite=np.array(p.xsite,dtype=float)
+		ysite=np.array(p.ysite,dtype=float)
+		border=np.abs(np.sqrt(xsite**2+ysite**2)-(p.diamin+1000.)/2.)<=5.
 		with open(PATH+'../../PROJECTS_CFD/'+p.site+'/DATA/slope_site','w') as f:
-			ip=-1
-			for result in res:
-				ip+=1
-				if abs(np.sqrt(p.xsite[ip]**2+p.ysite[ip]**2)-(p.diamin+1000.)/2.)>5.:	f.write('%15.2f%15.2f%15.2f\n'%(p.xsite[ip],p.ysite[ip],result[-1]))
-				else:																		f.write('%15.2f%15.2f%15.2f\n'%(p.xsite[ip],p.ysite[ip],0.))
-				resslopes.append(result[-1])
+			np.savetxt(f,np.column_stack((xsite,ysite,np.where(border,0.,resslopes))),fmt='%15.2f%15.2f%15.2f')
 		
-		resslopes=np.array(resslopes)
 		p.slope_moy=np.average(resslopes)
 		p.slope_max=np.max(resslopes)
 	
 		subprocess.call(['rm',p.folder+'/slope_points'])
-		subprocess.call(['rm',p.folder+'/slope_points_z'])
+		
+		print('EvaluateSlopes: %i points parsed in %.2fs, computed and written in %.2fs'%(zf.size,duration_parse,time.time()-start))
 	
 		x,y,z=np.loadtxt(PATH+'../../PROJECTS_CFD/'+p.site+'/DATA/slope_site',unpack=True)
 		
@@ -704,100 +564,61 @@ def EvaluateRix():
 	global istep
 	
 	istep+=1
-	rootprogress.find('progress_text').text='%i'%(100.*istep/nstep)
-	rootprogress.find('progress_frac').text=str(istep/nstep)
-	try: xml.ElementTree(rootprogress).write(progressfile)
-	except: pass
-	if not LOCAL:
-		try:
-			with open(PATH+'../../../progress.txt','w') as pf: pf.write(str(istep/nstep))
-		except: pass
+	p.UpdateMainProgress(istep/nstep)
 	
 	UpdateProgress(time2use,1,0.05,msg("RIX calculation process - Construction"))
 
 	try:
 	
-		with open(p.folder+'/rix_points_z','w') as outfile:
-			for idiv in range(p.nproc):
-				infile=open(p.folder+'/rix_points_'+str(idiv)+'_z','r')
-				lines=infile.readlines()
-				infile.close()
-				subprocess.call(['rm',p.folder+'/rix_points_'+str(idiv)])
-				subprocess.call(['rm',p.folder+'/rix_points_'+str(idiv)+'_z'])
-				for line in lines: outfile.write(line)
+		start=time.time()
 		
 		zf=[]
-		with open(p.folder+'/rix_points_z','r') as infile: lines=infile.readlines()
-		
-		for line in lines: zf.append(eval(line.split()[2]))
-		
-		itot=-1
-		slopes=[]
-		for _ in range(p.nloc):
-			slopes.append([])
-			for _ in range(p.rixncalc):
-				slopes[-1].append([])
-				for iseg in range(p.npl):
-					itot+=1
-					if iseg>0:
-						slope=(zf[itot]-zf[itot-1])/p.rixres
-						slopes[-1][-1].append(np.arctan((slope))*180./np.pi)
-		
-		res=[]
-		for slope_point in slopes:
-			res.append([0.]*(p.rixnsect+2))
-			nres=[0]*p.rixnsect
-			idir=-1
-			for slope_dir in slope_point:
-				idir+=1
-				direc=idir*360./p.rixncalc
-				idirec=GetDirect(p.rixnsect,direc)
-				nres[idirec]+=1
-				for slope in slope_dir:
-					if abs(slope)>p.rixslope: res[-1][idirec]+=1
-			for idir in range(p.rixnsect):
-				if nres[idir]>0: res[-1][idir]=res[-1][idir]/nres[idir]
-			
-			res[-1][-2]=np.average(res[-1][0:p.rixnsect])
-			if p.climato!='no': res[-1][-1]=np.sum((np.array(res[-1][0:p.rixnsect]))*np.array(p.fd))
-		
-		ip=-1
+		for idiv in range(p.nproc):
+			zf.append(np.loadtxt(p.folder+'/rix_points_'+str(idiv)+'_z',usecols=(2,)).reshape(-1))
+			subprocess.call(['rm',p.folder+'/rix_points_'+str(idiv)])
+			subprocess.call(['rm',p.folder+'/rix_points_'+str(idiv)+'_z'])
+		zf=np.concatenate(zf)
+		
+		duration_parse=time.time()-start
+		start=time.time()
+		
+		# one row per location, one line per direction, one slope per segment
+		zf=zf.reshape(p.nloc,p.rixncalc,p.npl)
+		slopes=np.arctan(np.diff(zf,axis=2)/p.rixres)*180./np.pi
+		
+		idirecs=[GetDirect(p.rixnsect,idir*360./p.rixncalc) for idir in range(p.rixncalc)]
+		nres=np.bincount(idirecs,minlength=p.rixnsect)
+		res=np.zeros((p.nloc,p.rixnsect+2))
+		np.add.at(res,(slice(None),idirecs),np.sum(np.abs(slopes)>p.rixslope,axis=2))
+		res[:,0:p.rixnsect]/=np.maximum(nres,1)
+		res[:,-2]=np.average(res[:,0:p.rixnsect],axis=1)
+		if p.climato!='no': res[:,-1]=np.sum(res[:,0:p.rixnsect]*np.array(p.fd),axis=1)
+		
+		ip=0
 		if p.n_mast>0:
-			with open(p.folder+'/rix_mast','w') as f:
-				for _ in range(p.n_mast):
-					ip+=1
-					resline=''
-					for elem in res[ip]: resline+=('%.1f'%elem).rjust(10)
-					f.write(resline+"\n")
-					p.rix_mes+=res[ip][-2]
-					p.rixclim_mes+=res[ip][-1]
+			with open(p.folder+'/rix_mast','w') as f: np.savetxt(f,res[ip:ip+p.n_mast],fmt='%10.1f',delimiter='')
+			p.rix_mes+=np.sum(res[ip:ip+p.n_mast,-2])
+			p.rixclim_mes+=np.sum(res[ip:ip+p.n_mast,-1])
+			ip+=p.n_mast
 		if  p.n_lidar>0:
-			with open(p.folder+'/rix_lidar','w') as f:
-				for _ in range(p.n_lidar):
-					ip+=1
-					resline=''
-					for elem in res[ip]: resline+=('%.1f'%elem).rjust(10)
-					f.write(resline+'\n')
-					p.rix_mes+=res[ip][-2]
-					p.rixclim_mes+=res[ip][-1]
+			with open(p.folder+'/rix_lidar','w') as f: np.savetxt(f,res[ip:ip+p.n_lidar],fmt='%10.1f',delimiter='')
+			p.rix_mes+=np.sum(res[ip:ip+p.n_lidar,-2])
+			p.rixclim_mes+=np.sum(res[ip:ip+p.n_lidar,-1])
+			ip+=p.n_lidar
 		if p.n_mast+p.n_lidar>0:
 			p.rix_mes/=(p.n_mast+p.n_lidar)
 			p.rixclim_mes/=(p.n_mast+p.n_lidar)
 		
 		if p.n_wt>0:
-			with open(p.folder+'/rix_wt','w') as f:
-				for _ in range(p.n_wt):
-					ip+=1
-					resline=''
-					for elem in res[ip]: resline+=('%.1f'%elem).rjust(10)
-					f.write(resline+'\n')
-					p.rix_mach+=res[ip][-2]
-					p.rixclim_mach+=res[ip][-1]
+			with open(p.folder+'/rix_wt','w') as f: np.savetxt(f,res[ip:ip+p.n_wt],fmt='%10.1f',delimiter='')
+			p.rix_mach+=np.sum(res[ip:ip+p.n_wt,-2])
+			p.rixclim_mach+=np.sum(res[ip:ip+p.n_wt,-1])
 			p.rix_mach/=p.n_wt
 			p.rixclim_mach/=p.n_wt
 		
 		subprocess.call(['rm',p.folder+'/rix_points'])
-		subprocess.call(['rm',p.folder+'/rix_points_z'])
+		
+		print('EvaluateRix: %i points parsed in %.2fs, computed and written in %.2fs'%(zf.size,duration_parse,time.time()-start))
 
 	except:
 		p.errors.append(msg("ERROR")+' '+msg("within process")+': EvaluateRix')
@@ -813,16 +634,20 @@ if not p.ANALYZED: nstep+=2*p.nproc
 
 start=time.time()
 
-threads=[]
-
 if not p.ANALYZED:
 
+	# the elevation tasks start while the slope points are prepared
+	# the reconstruction of the elevations only waits for them, and the slopes evaluation only for the slope tasks
+	graph=P_TASK_GRAPH(p.p_pool,p.nproc,p.SetStage)
+	graph.start()
+	
 	lines=[]
+	orotasks=[]
 	for idiv in range(100):
 		num='loc_%s'%(str(idiv).zfill(2))
 		with open(PATH+'../../PROJECTS_CFD/'+p.site+'/DATA/'+num,'r') as infile: lines+=infile.readlines()
-		threads.append(THREAD_CalcOro(num))
-		threads[-1].start()
+		graph.add('oro_'+num,CalcOro,(num,))
+		orotasks.append('oro_'+num)
 	
 	tot=0
 	for data in p.np_data:
@@ -858,6 +683,7 @@ if not p.ANALYZED:
 
 	np_first=p.npts_site/p.nproc
 	np_then=p.npts_site-(p.nproc-1)*np_first
+	slopetasks=[]
 	for idiv in range(p.nproc):
 		num='slope_points_%i'%idiv
 		with open(p.folder+'/'+num,'w') as outfile:
@@ -866,16 +692,12 @@ if not p.ANALYZED:
 			else: ilast=idiv*np_first+np_then
 			for il in range(ifirst,ilast): outfile.write(lines[il])
 		
-		threads.append(THREAD_CalcSlope(num))
-		threads[-1].start()
+		graph.add('slope_'+num,CalcSlope,(num,))
+		slopetasks.append('slope_'+num)
 	
-	for thread in threads: thread.join()
-
-	threads=[]
-	threads.append(THREAD_ReconstructOro())
-	threads.append(THREAD_EvaluateSlopes())
-	for thread in threads: thread.start()
-	for thread in threads: thread.join()
+	graph.add('reconstruct_oro',ReconstructOro,(),orotasks)
+	graph.add('evaluate_slopes',EvaluateSlopes,(),slopetasks)
+	graph.wait()
 	
 	p.duration_1+=time.time()-start
 
@@ -921,17 +743,9 @@ if not p.ANALYZED:
 
 start=time.time()
 
-threads=[]
-
 istep+=1
-rootprogress.find('progress_text').text='%i'%(100.*istep/nstep)
-rootprogress.find('progress_frac').text=str(istep/nstep)
-try: xml.ElementTree(rootprogress).write(progressfile)
-except: pass
-if not LOCAL:
-	try:
-		with open(PATH+'../../../progress.txt','w') as pf: pf.write(str(istep/nstep))
-	except: pass
+p.UpdateMainProgress(istep/nstep)
+p.SetStage('PrepareRix')
 
 UpdateProgress(time2use,1,0.15,msg("RIX calculation process - Preparation"))
 
@@ -996,6 +810,7 @@ if p.rixcalc:
 	
 	UpdateProgress(time2use,1,1.0,' ')
 	
+	graph=P_TASK_GRAPH(p.p_pool,p.nproc,p.SetStage)
 	np_first=p.npts/p.nproc
 	np_then=p.npts-(p.nproc-1)*np_first
 	for idiv in range(p.nproc):
@@ -1005,11 +820,10 @@ if p.rixcalc:
 			if idiv!=p.nproc-1: ilast=(idiv+1)*np_first
 			else: ilast=idiv*np_first+np_then
 			for il in range(ifirst,ilast): outfile.write(lines[il])
-		threads.append(THREAD_CalcRix(num))
-		threads[-1].start()
-	
-	for thread in threads: thread.join()
+		graph.add('rix_'+num,CalcRix,(num,))
+	graph.run()
 	
+	p.SetStage('EvaluateRix')
 	EvaluateRix()
 
 p.duration_2+=time.time()-start
@@ -2,12 +2,15 @@
 # -*- coding: utf-8 -*-
 
 from ZS_VARIABLES	import *
-from ZS_COMMON 		import P_THREAD,CFD_PARAM,GetUITranslator,InvestigateConvergence,WriteFvSolution
+from ZS_COMMON 		import P_THREAD,CFD_PARAM,GetUITranslator,InvestigateConvergenceArray,WriteFvSolution
+from ZS_COMMON		import ProbeFileCache,ReadProbeHistory,PROGRESS
 from ZS_COMMON		import GetFolderSize,ZipDir,GetMachine,SortXmlData,GetParamText
 import pandas as pd
 from scipy import interpolate
 import shutil,re,contextlib
 
+PROBES_CACHE=ProbeFileCache()
+
 class PARAM(CFD_PARAM):
 	
 	def __init__(self,time2use,LOCAL):
@@ -251,6 +254,55 @@ def Cart2WindDir(ux,uy):
 	
 	return direc
 
+def WrapDirArray(direc):
+	"""
+	Bring directions in degrees back in [0,360[, as Rect2Polar and Cart2WindDir do for a single value
+	"""
+	direc=np.where(direc<0.,direc+360.,direc)
+	return np.where(direc>=360.,direc-360.,direc)
+
+def Rect2PolarArray(ux,uy,uz):
+	"""
+	Array version of Rect2Polar
+	"""
+	direc=WrapDirArray(90.-np.degrees(np.arctan2(-uy,-ux)))
+	vh=np.sqrt(ux*ux+uy*uy)
+	inc=90.-np.degrees(np.arctan2(vh,uz))
+	return direc,inc
+
+def Cart2WindDirArray(ux,uy):
+	"""
+	Array version of Cart2WindDir
+	"""
+	return WrapDirArray(90.-np.degrees(np.arctan2(-uy,-ux)))
+
+def DirDeviationArray(direc1,direc2):
+	"""
+	Get the angular deviation direc2-direc1 in [-180,180], in degrees, for arrays of directions in [0,360[
+	"""
+	d1=np.where((direc1<90.)&(direc2>270.),direc1+360.,direc1)
+	d2=np.where((direc1>270.)&(direc2<90.),direc2+360.,direc2)
+	ecart=d2-d1
+	ecart=np.where(ecart>180.,ecart-360.,ecart)
+	return np.where(ecart<-180.,ecart+360.,ecart)
+
+def ReadSampleDictPoints(filename):
+	"""
+	Read the point list of a sampleDict written by the mapping preparation
+	
+	:param filename:	The sampleDict file
+	:type filename:		str
+	:return:			The points coordinates, x and y rounded to 0.1, shape (n,3)
+	:rtype:				np.ndarray
+	"""
+	with open(filename,'r') as f: content=f.read()
+	found=re.search(r'points\s*\((.*?)\)\s*;',content,re.DOTALL)
+	if found is None: return np.empty((0,3))
+	pts=np.array(re.sub(r'[()]',' ',found.group(1)).split(),dtype='float64').reshape(-1,3)
+	pts[:,0]=np.round(pts[:,0],1)
+	pts[:,1]=np.round(pts[:,1],1)
+	return pts
+
 def ReadParam():
 	
 	try:
@@ -2315,17 +2367,20 @@ def RunCase():
 	try:
 
 		if not LOCAL:
-			with open(PATH + '../../../progress.txt', 'w') as pf: pf.write('0.01')
+			PROGRESS.set_txt(PATH + '../../../progress.txt', '0.01')
 		if p.INIT:
+			p.SetStage('RunCoarse')
 			RunCoarse()
 			if not LOCAL:
-				with open(PATH + '../../../progress.txt', 'w') as pf: pf.write('0.10')
+				PROGRESS.set_txt(PATH + '../../../progress.txt', '0.10')
+			p.SetStage('RunMap')
 			RunMap()
 		if not LOCAL:
-			with open(PATH + '../../../progress.txt', 'w') as pf: pf.write('0.15')
+			PROGRESS.set_txt(PATH + '../../../progress.txt', '0.15')
+		p.SetStage('RunFine')
 		RunFine()
 		if not LOCAL:
-			with open(PATH + '../../../progress.txt', 'w') as pf: pf.write('1.00')
+			PROGRESS.set_txt(PATH + '../../../progress.txt', '1.00')
 
 	except (KeyboardInterrupt, SystemExit): raise
 	except:
@@ -2417,7 +2472,7 @@ def GetResults():
 	
 	ref_df['iu_smooth']=np.sqrt(ref_df['k_smooth'])/ref_df['vh_smooth']
 	
-	ref_df['dir_smooth']=ref_df.apply(lambda row: Cart2WindDir(row['vx_smooth'], row['vy_smooth']), axis=1)
+	ref_df['dir_smooth']=Cart2WindDirArray(ref_df['vx_smooth'].values,ref_df['vy_smooth'].values)
 	ref_df['inc_smooth']=np.degrees(np.arctan2(ref_df['vz_smooth'],ref_df['vh_smooth']))
 	
 	ref_df['deltadir_smooth']=ref_df['dir_smooth']-p.direcval
@@ -2522,26 +2577,8 @@ def GetResMeso(num):
 	vh_np=np.sqrt(vx*vx+vy*vy)
 	iu_np=np.sqrt(tke)/vh_np
 
-	tmp_np=np.sqrt(vx*vx+vy*vy)
-	direc_np=tmp_np
-	inc_np=tmp_np
-	
-	for ip in range(len(v_np)):
-		vvx=vx[ip]
-		vvy=vy[ip]
-		vvz=vz[ip]
-		direc,inc=Rect2Polar(vvx,vvy,vvz)
-		
-		direc1=p.direcval
-		direc2=direc
-		if direc1<90. and direc2>270:	direc1+=360.
-		elif direc1>270. and direc2<90:	direc2+=360.
-		ecart=direc2-direc1
-		if ecart>+180.:		ecart-=360
-		elif ecart<-180.:	ecart+=360
-		
-		direc_np[ip]=ecart
-		inc_np[ip]=inc
+	direc_np,inc_np=Rect2PolarArray(vx,vy,vz)
+	direc_np=DirDeviationArray(p.direcval,direc_np)
 	
 	v=np.average(v_np)
 	vh=np.average(vh_np)
@@ -2597,51 +2634,15 @@ def GetResMapping(num):
 	
 	# reference frame
 	
-	X,Y,Z=[],[],[]
-	with open(workdir+'/system/sampleDict_MAPPING_'+num,'r') as ref_file:
-		lines=ref_file.readlines()
-		for line in lines[38:]:
-			try:
-				s=line.lstrip('		( ').rstrip(' )\n')
-				x,y,z=s.split()
-				x,y,z=round(float(x),1),round(float(y),1),float(z)
-				X.append(x)
-				Y.append(y)
-				Z.append(z)
-			except:pass
-			
-	ref_df= pd.DataFrame({'x':X,'y':Y,'z':Z})
+	pts=ReadSampleDictPoints(workdir+'/system/sampleDict_MAPPING_'+num)
+	ref_df= pd.DataFrame({'x':pts[:,0],'y':pts[:,1],'z':pts[:,2]})
 	
-	X,Y,Z=[],[],[]
-	with open(workdir+'/system/sampleDict_MAPPING_'+num+'_down','r') as ref_file:
-		lines=ref_file.readlines()
-		for line in lines[38:]:
-			try:
-				s=line.lstrip('		( ').rstrip(' )\n')
-				x,y,z=s.split()
-				x,y,z=round(float(x),1),round(float(y),1),float(z)
-				X.append(x)
-				Y.append(y)
-				Z.append(z)
-			except:pass
-			
-	ref_down= pd.DataFrame({'x':X,'y':Y,'z_down':Z})
+	pts=ReadSampleDictPoints(workdir+'/system/sampleDict_MAPPING_'+num+'_down')
+	ref_down= pd.DataFrame({'x':pts[:,0],'y':pts[:,1],'z_down':pts[:,2]})
 	ref_df=ref_df.merge(ref_down,how='left',on=['x','y'])
 	
-	X,Y,Z=[],[],[]
-	with open(workdir+'/system/sampleDict_MAPPING_'+num+'_up','r') as ref_file:
-		lines=ref_file.readlines()
-		for line in lines[38:]:
-			try:
-				s=line.lstrip('		( ').rstrip(' )\n')
-				x,y,z=s.split()
-				x,y,z=round(float(x),1),round(float(y),1),float(z)
-				X.append(x)
-				Y.append(y)
-				Z.append(z)
-			except:pass
-			
-	ref_up= pd.DataFrame({'x':X,'y':Y,'z_up':Z})
+	pts=ReadSampleDictPoints(workdir+'/system/sampleDict_MAPPING_'+num+'_up')
+	ref_up= pd.DataFrame({'x':pts[:,0],'y':pts[:,1],'z_up':pts[:,2]})
 	ref_df=ref_df.merge(ref_up,how='left',on=['x','y'])
 	
 	# joining and gap filling
@@ -2685,7 +2686,7 @@ def GetResMapping(num):
 	ref_df['v']=np.sqrt(ref_df['vx']**2+ref_df['vy']**2+ref_df['vz']**2)
 	
 	ref_df['iu']=np.sqrt(ref_df['k'])/ref_df['vh']
-	ref_df['dir']=ref_df.apply(lambda row: Cart2WindDir(row['vx'], row['vy']), axis=1)
+	ref_df['dir']=Cart2WindDirArray(ref_df['vx'].values,ref_df['vy'].values)
 	ref_df['inc']=np.degrees(np.arctan2(ref_df['vz'],ref_df['vh']))
 	
 	ref_df['deltadir']=ref_df['dir']-p.direcval
@@ -3045,19 +3046,31 @@ def MakeLogs(folder,meshtype='FINE'):
 		
 		subprocess.call(['foamLog','-quiet','log2use'],cwd=workdir)#creates workdir/logs/ folder
 
-def GetLastResidual(infile):
+def GetLastResidual(infile,block_size=4096):
+	"""
+	Get the last residual of a foamLog file ("iteration value" lines), reading only the end of the file
+	
+	:param infile:			The foamLog file
+	:type infile:			str
+	:param block_size:		The size of the first block read from the end of the file, in bytes
+	:type block_size:		int
+	:return:				The last residual, 1. if none is found
+	:rtype:					float
+	"""
 	
-	res=1.
-	infile=open(infile,'r')
-	lines=infile.readlines()
-	infile.close()
-	nlines=len(lines)
-	for i in range(nlines):
-		try:
-			values=lines[i].split()
-			res=float(values[1])
-		except: break
-	return res
+	with open(infile,'rb') as f:
+		f.seek(0,2)
+		size=f.tell()
+		while True:
+			start=max(0,size-block_size)
+			f.seek(start)
+			lines=f.read(size-start).split('\n')
+			if start>0: lines=lines[1:]		# The first line may be incomplete
+			for line in reversed(lines):
+				try: return float(line.split()[1])
+				except: continue
+			if start==0: return 1.
+			block_size*=4
 
 def GetCvg():
 	
@@ -3090,32 +3103,10 @@ def GetCvg():
 
 def GetCvgRes():
 	
-	lv,lk=[],[]
-
-	xmlfile=os.path.join(p.folder,'history.xml')
-	root=xml.parse(xmlfile).getroot()
-	for bal in root:
-		if bal.attrib['type']=='calc':
-			with open(os.path.join(p.folder,'FINE','postProcessing','probes','U.%s'%bal.attrib['i']),'r') as f: lines=f.readlines()
-			for line in lines:
-				if line[0]!='#': lv.append(line)
-			with open(os.path.join(p.folder,'FINE','postProcessing','probes','k.%s'%bal.attrib['i']),'r') as f: lines=f.readlines()
-			for line in lines:
-				if line[0]!='#': lk.append(line)
-
-	with open(os.path.join(p.folder,'itstart_c'),'r') as f: it_prev=f.readline()
-	fname=os.path.join(p.folder,'FINE','postProcessing','probes',it_prev,'U')
-	if os.path.isfile(fname):
-		with open(fname,'r') as f: lines=f.readlines()
-		for line in lines:
-			if line[0]!='#': lv.append(line)
-		fname=os.path.join(p.folder,'FINE','postProcessing','probes',it_prev,'k')
-		with open(fname,'r') as f: lines=f.readlines()
-		for line in lines:
-			if line[0]!='#': lk.append(line)
-	
-	if len(lv)>0:
-		res_mt,res_wt,_=InvestigateConvergence(lv,lk,p.npoint,p.nmast,p.nlidar,p.nwt)
+	data_v,nk=ReadProbeHistory(PROBES_CACHE,p.folder,os.path.join(p.folder,'FINE'),'calc','c')
+	
+	if data_v.shape[0]>0:
+		res_mt,res_wt,_=InvestigateConvergenceArray(data_v,min(data_v.shape[0],nk),p.npoint,p.nmast,p.nlidar,p.nwt)
 		if len(res_mt[0])>CVGRES_NTMIN:
 			stdmax=0.
 			for ip in range(p.nmast):
@@ -3287,10 +3278,13 @@ if __name__ == '__main__':
 	nstep=8
 	
 	ReadParam()
+	p.SetStage('SetCase')
 	CalcBC()
 	SetCase()
 	RunCase()
+	p.SetStage('RunMapReduced')
 	RunMapReduced()
+	p.SetStage('RunPost')
 	RunPost()
 	
 	if not p.PAUSED:
@@ -7,7 +7,7 @@ Usage:
 """
 
 from ZS_VARIABLES	import *
-from ZS_COMMON	import KillCommand,InvestigateConvergence
+from ZS_COMMON	import KillCommand,ProbeFileCache,ReadProbeHistory,InvestigateConvergenceArray
 import argparse,shutil
 import traceback
 
@@ -82,6 +82,7 @@ def cfd_calc_01_survey(src_folder):
 	nsav=999
 	perc_mt,perc_wt=0.,0.
 
+	probes_cache=ProbeFileCache()
 	while True:
 		
 		time.sleep(wait1)
@@ -90,45 +91,13 @@ def cfd_calc_01_survey(src_folder):
 		
 		if not os.path.isfile(logof): return 1
 		
-		lv,lk=[],[]
+		data_v,nk=ReadProbeHistory(probes_cache,os.path.join(src_folder,'..'),src_folder,'init' if suf=='i' else 'calc',suf)
 		
-		xmlfile=os.path.join(src_folder,'..','history.xml')
-		root=xml.parse(xmlfile).getroot()
-		for bal in root:
-			if suf=='i':
-				if bal.attrib['type']=='init':
-					with open(os.path.join(src_folder,'postProcessing','probes','U.%s'%bal.attrib['i']),'r') as f: lines=f.readlines()
-					for line in lines:
-						if line[0]!='#': lv.append(line)
-					with open(os.path.join(src_folder,'postProcessing','probes','k.%s'%bal.attrib['i']),'r') as f: lines=f.readlines()
-					for line in lines:
-						if line[0]!='#': lk.append(line)
-			else:
-				if bal.attrib['type']=='calc':
-					with open(os.path.join(src_folder,'postProcessing','probes','U.%s'%bal.attrib['i']),'r') as f: lines=f.readlines()
-					for line in lines:
-						if line[0]!='#': lv.append(line)
-					with open(os.path.join(src_folder,'postProcessing','probes','k.%s'%bal.attrib['i']),'r') as f: lines=f.readlines()
-					for line in lines:
-						if line[0]!='#': lk.append(line)
-		
-		it_prev=0
-		with open(os.path.join(src_folder,'..','itstart_%s'%suf),'r') as f: it_prev=f.readline()
-		fname=os.path.join(src_folder,'postProcessing','probes',it_prev,'U')
-		if os.path.isfile(fname):
-			with open(fname,'r') as f: lines=f.readlines()
-			for line in lines:
-				if line[0]!='#': lv.append(line)
-			fname=os.path.join(src_folder,'postProcessing','probes',it_prev,'k')
-			with open(fname,'r') as f: lines=f.readlines()
-			for line in lines:
-				if line[0]!='#': lk.append(line)
-				
-		if len(lv)==0: continue
+		if data_v.shape[0]==0: continue
 		
 		res_mt,res_wt=[],[]
 		vmax=0.
-		res_mt,res_wt,vmax=InvestigateConvergence(lv,lk,npt,nmt,nld,nwt)
+		res_mt,res_wt,vmax=InvestigateConvergenceArray(data_v,min(data_v.shape[0],nk),npt,nmt,nld,nwt)
 		
 		if len(res_mt[0])>CVGRES_NTMIN:
 			cvgres_nt2use=min(len(res_mt[0]),CVGRES_NTMAX)
@@ -4,6 +4,10 @@
 Create a zip file from calculation status files
 Usage:
 	./CFD_CALC_ZIP_STATUS.py -i /path/to/calc -o output.zcp
+
+With --delta-state, only the data added since the last acknowledged call are zipped, with a delta.json manifest.
+The new state is written in STATE_FILE.new, and should be moved to STATE_FILE once the delta has been applied:
+	./CFD_CALC_ZIP_STATUS.py -i /path/to/calc -o delta.zip --delta-state state.json
 """
 
 # Python core libs
@@ -11,6 +15,8 @@ import sys
 import os
 import shutil
 import argparse
+import json
+import zipfile
 from distutils.dir_util import copy_tree
 
 # Third party libs
@@ -70,6 +76,99 @@ def zip_calc_status(src_folder, output_file):
 	ZipDir(os.path.join(src_folder, 'CVG'), output_file)
 
 
+def list_status_files(src_folder):
+	"""
+	List the calculation status files, the same way zip_calc_status copies them
+
+	:param src_folder:      The calculation folder where we will look for files
+	:type src_folder:       str
+	:return:                The path in the status tree, the source path, and if the file is only appended to
+	:rtype:                 list[tuple[str, str, bool]]
+	"""
+	result = []
+	for filename in ['actual.xml', 'history.xml', 'info.xml', 'itstart_c', 'itstart_i', 'param.xml', 'terminated',
+					 'log']:
+		if os.path.isfile(os.path.join(src_folder, filename)):
+			result.append((filename, os.path.join(src_folder, filename), False))
+
+	for calc_type in ['FINE', 'COARSE']:
+		for sub_folder in [os.path.join(calc_type, 'logs'), os.path.join(calc_type, 'postProcessing', 'probes')]:
+			for root, dirs, files in os.walk(os.path.join(src_folder, sub_folder)):
+				dirs[:] = [d for d in dirs if not d.startswith('.')]
+				for filename in files:
+					if filename.startswith('.') or filename.endswith('~'):
+						continue
+					file_path = os.path.join(root, filename)
+					result.append((os.path.relpath(file_path, src_folder), file_path, True))
+		for filename in ['launched', 'terminated', 'log_simpleFoam']:
+			if os.path.isfile(os.path.join(src_folder, calc_type, filename)):
+				result.append((os.path.join(calc_type, filename), os.path.join(src_folder, calc_type, filename),
+							   filename == 'log_simpleFoam'))
+
+	if os.path.exists(os.path.join(src_folder, 'history.xml')):
+		root = xml.parse(os.path.join(src_folder, "history.xml")).getroot()
+		for calc_type in ['FINE', 'COARSE']:
+			for bal in root:
+				if bal.attrib['type'] not in ('init', 'calc'):
+					continue
+				filename = 'log_simpleFoam.' + bal.attrib['i']
+				src_type = 'COARSE' if bal.attrib['type'] == 'init' else 'FINE'
+				result.append((os.path.join(calc_type, filename), os.path.join(src_folder, src_type, filename), True))
+	return result
+
+
+def zip_calc_status_delta(src_folder, output_file, state_file):
+	"""
+	Create a zip file containing only the status data created since the state saved in state_file.
+	Appended files are sent from their previous size, other modified files are sent entirely.
+	The zip contains a 'delta.json' manifest:
+		{"version": 1, "files": [{"path": ..., "offset": ..., "data": ...}], "deleted": [...]}
+	where 'data' is the name of the zip entry to write at 'offset' in 'path', the file being truncated after it.
+
+	:param src_folder:      The calculation folder where we will look for files to zip
+	:type src_folder:       str
+	:param output_file:     The output zip file we will generate
+	:type output_file:      str
+	:param state_file:      The state of the last acknowledged delta. The new state is saved in state_file + ".new"
+	:type state_file:       str
+	"""
+	old_state = {}
+	if os.path.isfile(state_file):
+		with open(state_file, 'r') as fh:
+			old_state = json.load(fh)
+	new_state = {}
+	manifest = {"version": 1, "files": [], "deleted": []}
+
+	if os.path.exists(output_file):
+		os.remove(output_file)
+	fzip = zipfile.ZipFile(output_file, 'w', zipfile.ZIP_DEFLATED, allowZip64=True)
+	try:
+		for status_path, file_path, append_only in list_status_files(src_folder):
+			try:
+				stats = os.stat(file_path)
+			except OSError:
+				continue
+			size, mtime = stats.st_size, stats.st_mtime
+			new_state[status_path] = [size, mtime]
+			previous = old_state.get(status_path)
+			if previous and previous[0] == size and previous[1] == mtime:
+				continue
+			offset = previous[0] if previous and append_only and size >= previous[0] else 0
+			with open(file_path, 'rb') as fh:
+				fh.seek(offset)
+				data = fh.read(size - offset)  # The file may grow meanwhile, but the state says 'size'
+			data_name = 'data/' + str(len(manifest["files"]))
+			fzip.writestr(data_name, data)
+			manifest["files"].append({"path": status_path, "offset": offset, "data": data_name})
+		manifest["deleted"] = sorted(set(old_state.keys()) - set(new_state.keys()))
+		fzip.writestr('delta.json', json.dumps(manifest))
+	finally:
+		fzip.close()
+
+	with open(state_file + ".new", 'w') as fh:
+		json.dump(new_state, fh)
+
+
 def main():
 	"""
 	Create a zip file from calculation status files
@@ -81,6 +180,7 @@ def main():
 		parser = argparse.ArgumentParser(description='Zip all the files about a calculation status')
 		parser.add_argument('--input', '-i', help='The calculation input folder')
 		parser.add_argument('--output', '-o', help="The file to generate")
+		parser.add_argument('--delta-state', '-d', help="Only zip the changes since this state file")
 		args = parser.parse_args()
 		if not args.input:
 			sys.stderr.write("You should provide the --input argument\n")
@@ -96,7 +196,10 @@ def main():
 			sys.stderr.flush()
 			return 1
 		output_file = os.path.abspath(args.output)
-		zip_calc_status(calc_folder, output_file)
+		if args.delta_state:
+			zip_calc_status_delta(calc_folder, output_file, os.path.abspath(args.delta_state))
+		else:
+			zip_calc_status(calc_folder, output_file)
 		return 0
 	except (KeyboardInterrupt, SystemExit):
 		print("\nAborting...")
@@ -2,9 +2,9 @@
 # -*- coding: utf-8 -*-
 
 from ZS_VARIABLES	import *
-from ZS_COMMON		import FORTRAN_FILE,P_THREAD,CFD_PARAM,GetUITranslator
-from ZS_COMMON		import SortXmlData,UpdateProgress,GetMachine,GetFolderSize,SubprocessCall
-from ZS_COMMON		import GenerateLines,WriteGeo
+from ZS_COMMON		import P_TASK_GRAPH,CFD_PARAM,GetUITranslator
+from ZS_COMMON		import SortXmlData,UpdateProgress,ResetProgress,GetMachine,GetFolderSize,SubprocessCall
+from ZS_COMMON		import GenerateLines,WriteGeo,MapFortranReals,ReadPoints,WritePoints
 from shapely.geometry import Polygon
 
 NEED_MEM=False
@@ -107,9 +107,6 @@ class PARAM(CFD_PARAM):
 		self.WARN_REDUCED		=False
 		self.WARN_FINE			=False
 
-		self.OK_coarse			=False
-		self.OK_fine			=False
-		self.OK_reduced			=False
 		self.OK					=True
 
 SetEnviron()
@@ -146,107 +143,7 @@ if not os.path.isfile(progressfile):
 	xml.ElementTree(root).write(progressfile)
 	if not LOCAL:
 		with open(PATH+'../../../progress.txt','w') as pf: pf.write('0')
-
-rootprogress=xml.parse(progressfile).getroot()
-	
-class THREAD_Prepa(P_THREAD):
 	
-	def __init__(self,code):
-		
-		self.code=code
-		P_THREAD.__init__(self,p.p_pool,p.nproc)
-	
-	def run(self):
-		
-		ithread=self.prerun()
-		
-		Mesh(ithread+1,self.code)
-		
-		AnalyseMesh(ithread+1,self.code)
-		CalcRou(ithread+1,self.code)
-		PropaRou(ithread+1,self.code)
-
-		infile=open(p.folder+'/FILES/'+self.code+'_ground_pts','r')
-		lines=infile.readlines()
-		npts=len(lines)
-		np_first=npts/p.nproc
-		np_then=npts-(p.nproc-1)*np_first
-		for idiv in range(p.nproc):
-			num=self.code+'_ground_pts_%i'%idiv
-			outfile=open(p.folder+'/FILES/'+num,'w')
-			ifirst=idiv*np_first
-			if idiv!=p.nproc-1: ilast=(idiv+1)*np_first
-			else: ilast=idiv*np_first+np_then
-			for il in range(ifirst,ilast): outfile.write(lines[il])
-			outfile.close()
-		
-		self.postrun(ithread)
-		
-		if self.code=='coarse':		p.OK_coarse=True
-		elif self.code=='fine':		p.OK_fine=True
-		elif self.code=='reduced':	p.OK_reduced=True
-
-class THREAD_Oro(P_THREAD):
-	
-	def __init__(self,code,num):
-		
-		self.code=code
-		self.num=num
-		P_THREAD.__init__(self,p.p_pool,p.nproc)
-	
-	def run(self):
-		
-		ithread=self.prerun()
-		
-		CalcOro(ithread+1,self.code,self.num)
-		
-		self.postrun(ithread)
-
-class THREAD_PropaOro(P_THREAD):
-	
-	def __init__(self,code):
-		
-		self.code=code
-		P_THREAD.__init__(self,p.p_pool,p.nproc)
-	
-	def run(self):
-		
-		ithread=self.prerun()
-		
-		PropaOro(ithread+1,self.code)
-		
-		self.postrun(ithread)
-
-class THREAD_Inout(P_THREAD):
-	
-	def __init__(self,code):
-		
-		self.code=code
-		P_THREAD.__init__(self,p.p_pool,p.nproc)
-	
-	def run(self):
-		
-		ithread=self.prerun()
-		
-		InOut(ithread+1,self.code)
-		
-		self.postrun(ithread)
-
-class THREAD_Foam(P_THREAD):
-	
-	def __init__(self,code):
-		
-		self.code=code
-		P_THREAD.__init__(self,p.p_pool,p.nproc)
-	
-	def run(self):
-		
-		ithread=self.prerun()
-		
-		Foam(ithread+1,self.code)
-		
-		self.postrun(ithread)
-
 def ReadParam():
 	"""
 	Reads the process input parameters
@@ -398,14 +295,7 @@ def EvaluateParam():
 		
 			istep+=1
 		
-			rootprogress.find('progress_text').text='%i'%(100.*istep/nstep)
-			rootprogress.find('progress_frac').text=str(istep/nstep)
-			try: xml.ElementTree(rootprogress).write(progressfile)
-			except: pass
-			if not LOCAL:
-				try:
-					with open(PATH+'../../../progress.txt','w') as pf: pf.write(str(istep/nstep))
-				except: pass
+			p.UpdateMainProgress(istep/nstep)
 		
 			message=msg("Evaluating automatic parameters")
 			UpdateProgress(time2use,1,0.05,message)
@@ -498,14 +388,7 @@ def EvaluateParam():
 		
 		istep+=1
 		
-		rootprogress.find('progress_text').text='%i'%(100.*istep/nstep)
-		rootprogress.find('progress_frac').text=str(istep/nstep)
-		try: xml.ElementTree(rootprogress).write(progressfile)
-		except: pass
-		if not LOCAL:
-			try:
-				with open(PATH+'../../../progress.txt','w') as pf: pf.write(str(istep/nstep))
-			except: pass
+		p.UpdateMainProgress(istep/nstep)
 		
 		UpdateProgress(time2use,1,0.,msg("Mesh resolution loop process")+' - 1/2')
 		
@@ -517,31 +400,15 @@ def EvaluateParam():
 				p.fileformat_rou=f.readline().rstrip()
 				p.n_rou=int(f.readline())
 
-			infile=FORTRAN_FILE(file1,mode='r')
-			
-			xx=infile.readReals()
-			yy=infile.readReals()
-			zz=infile.readReals()
-			for i in range(p.n_rou):
-				if i%200==0: UpdateProgress(time2use,1,float(i)/(p.n_rou),msg("Mesh resolution loop process")+' - 1/2')
-				x=xx[i]
-				y=yy[i]
-				r=zz[i]
-				d2=x*x+y*y
-				if d2<=dia2: rmax=max(rmax,r)
+			xx,yy,zz=[vals[:p.n_rou] for vals in MapFortranReals(file1,3)]
+			inside=zz[xx*xx+yy*yy<=dia2]
+			if len(inside)>0: rmax=max(rmax,np.max(inside))
 				
 			p.hcanop=max(10.,30*rmax)
 		
 		istep+=1
 		
-		rootprogress.find('progress_text').text='%i'%(100.*istep/nstep)
-		rootprogress.find('progress_frac').text=str(istep/nstep)
-		try: xml.ElementTree(rootprogress).write(progressfile)
-		except: pass
-		if not LOCAL:
-			try:
-				with open(PATH+'../../../progress.txt','w') as pf: pf.write(str(istep/nstep))
-			except: pass
+		p.UpdateMainProgress(istep/nstep)
 		
 		UpdateProgress(time2use,1,0.,msg("Mesh resolution loop process")+' - 2/2')
 		
@@ -560,21 +427,11 @@ def EvaluateParam():
 			p.fileformat_oro=f.readline().rstrip()
 			p.n_oro=int(f.readline())
 
-		infile=FORTRAN_FILE(file1,mode='r')
-		
-		xx=infile.readReals()
-		yy=infile.readReals()
-		zz=infile.readReals()
-		
-		for i in range(p.n_oro):
-			if i%100==0: UpdateProgress(time2use,1,float(i)/(2*p.n_oro),msg("Vertical discretization parameters"))
-			x=xx[i]
-			y=yy[i]
-			z=zz[i]
-			d2=x*x+y*y
-			if d2<=dia2:
-				zmin=min(zmin,z)
-				zmax=max(zmax,z)
+		xx,yy,zz=[vals[:p.n_oro] for vals in MapFortranReals(file1,3)]
+		inside=zz[xx*xx+yy*yy<=dia2]
+		if len(inside)>0:
+			zmin=min(zmin,np.min(inside))
+			zmax=max(zmax,np.max(inside))
 		
 		htopmin=5*(zmax-zmin)
 		
@@ -629,14 +486,7 @@ def EvaluateParam():
 		
 		istep+=1
 		
-		rootprogress.find('progress_text').text='%i'%(100.*istep/nstep)
-		rootprogress.find('progress_frac').text=str(istep/nstep)
-		try: xml.ElementTree(rootprogress).write(progressfile)
-		except: pass
-		if not LOCAL:
-			try:
-				with open(PATH+'../../../progress.txt','w') as pf: pf.write(str(istep/nstep))
-			except: pass
+		p.UpdateMainProgress(istep/nstep)
 		
 		if p.meshcrit=='1':
 			
@@ -750,14 +600,7 @@ def Mesh(ithread,code):
 
 		istep+=1
 	
-		rootprogress.find('progress_text').text='%i'%(100.*istep/nstep)
-		rootprogress.find('progress_frac').text=str(istep/nstep)
-		try: xml.ElementTree(rootprogress).write(progressfile)
-		except: pass
-		if not LOCAL:
-			try:
-				with open(PATH+'../../../progress.txt','w') as pf: pf.write(str(istep/nstep))
-			except: pass
+		p.UpdateMainProgress(istep/nstep)
 				
 		if code=='coarse':		message=msg("Generating ground mesh")+' ('+msg("coarse version")+')'
 		elif code=='fine':		message=msg("Generating ground mesh")+' ('+msg("fine version")+')'
@@ -786,11 +629,11 @@ def Mesh(ithread,code):
 		ngroups=int(float(lines[4]))
 		npts=int(float(lines[7+ngroups]))
 			
-		outfile=open(p.folder+'/FILES/'+code+'_ground_pts','w')
+		ground=[]
 		for i in range(npts):
 			values=lines[i+8+ngroups].split()
-			if float(values[3])<1e-6: outfile.write('%20.2f'%float(values[1])+'\t'+'%20.2f'%float(values[2])+'\t'+'%15i'%float(values[0])+'\n')
-		outfile.close()
+			if float(values[3])<1e-6: ground.append((float(values[1]),float(values[2]),float(values[0])))
+		WritePoints(p.folder+'/FILES/'+code+'_ground_pts',ground,'%20.2f\t%20.2f\t%15i')
 	
 		if code=='fine':
 			p.resfine_coarse=p.rescoarse
@@ -850,14 +693,7 @@ def AnalyseMesh(ithread,code):
 
 		istep+=1
 		
-		rootprogress.find('progress_text').text='%i'%(100.*istep/nstep)
-		rootprogress.find('progress_frac').text=str(istep/nstep)
-		try: xml.ElementTree(rootprogress).write(progressfile)
-		except: pass
-		if not LOCAL:
-			try:
-				with open(PATH+'../../../progress.txt','w') as pf: pf.write(str(istep/nstep))
-			except: pass
+		p.UpdateMainProgress(istep/nstep)
 		
 		if code=='coarse':		message=msg("Analysing ground nodes")+' ('+msg("coarse version")+')'
 		elif code=='fine':		message=msg("Analysing ground nodes")+' ('+msg("fine version")+')'
@@ -873,10 +709,7 @@ def AnalyseMesh(ithread,code):
 		it=0
 		RES=False
 		while not RES and it<=itmax:
-			root=xml.Element('logout')
-			xml.SubElement(root,'progress_text').text=message
-			xml.SubElement(root,'progress_frac').text=str(0)
-			xml.ElementTree(root).write(xmlfile)
+			ResetProgress(xmlfile,message)
 			it+=1
 			SubprocessCall(appli,code,p.folder,xmlfile,str(ithread))
 			RES=float(xml.parse(xmlfile).getroot().find('progress_frac').text)==1.0
@@ -909,14 +742,7 @@ def CalcRou(ithread,code):
 	
 		istep+=1
 	
-		rootprogress.find('progress_text').text='%i'%(100.*istep/nstep)
-		rootprogress.find('progress_frac').text=str(istep/nstep)
-		try: xml.ElementTree(rootprogress).write(progressfile)
-		except: pass
-		if not LOCAL:
-			try:
-				with open(PATH+'../../../progress.txt','w') as pf: pf.write(str(istep/nstep))
-			except: pass
+		p.UpdateMainProgress(istep/nstep)
 		
 		if code=='coarse':		message=msg("Evaluating ground roughness")+' ('+msg("coarse version")+')'
 		elif code=='fine':		message=msg("Evaluating ground roughness")+' ('+msg("fine version")+')'
@@ -938,10 +764,7 @@ def CalcRou(ithread,code):
 		it=0
 		RES=False
 		while not RES and it<=itmax:
-			root=xml.Element('logout')
-			xml.SubElement(root,'progress_text').text=message
-			xml.SubElement(root,'progress_frac').text=str(0)
-			xml.ElementTree(root).write(xmlfile)
+			ResetProgress(xmlfile,message)
 			it+=1
 			SubprocessCall(appli,infile,roufile,outfile,xmlfile)
 			RES=float(xml.parse(xmlfile).getroot().find('progress_frac').text)==1.0
@@ -974,14 +797,7 @@ def PropaRou(ithread,code):
 
 		istep+=1
 	
-		rootprogress.find('progress_text').text='%i'%(100.*istep/nstep)
-		rootprogress.find('progress_frac').text=str(istep/nstep)
-		try: xml.ElementTree(rootprogress).write(progressfile)
-		except: pass
-		if not LOCAL:
-			try:
-				with open(PATH+'../../../progress.txt','w') as pf: pf.write(str(istep/nstep))
-			except: pass
+		p.UpdateMainProgress(istep/nstep)
 		
 		if code=='coarse':		message=msg("Propagating ground roughness")+' ('+msg("coarse version")+')'
 		elif code=='fine':		message=msg("Propagating ground roughness")+' ('+msg("fine version")+')'
@@ -1004,10 +820,7 @@ def PropaRou(ithread,code):
 		it=0
 		RES=False
 		while not RES and it<=itmax:
-			root=xml.Element('logout')
-			xml.SubElement(root,'progress_text').text=message
-			xml.SubElement(root,'progress_frac').text=str(0)
-			xml.ElementTree(root).write(xmlfile)
+			ResetProgress(xmlfile,message)
 			it+=1
 			SubprocessCall(args)
 			RES=float(xml.parse(xmlfile).getroot().find('progress_frac').text)==1.0
@@ -1038,14 +851,7 @@ def CalcOro(ithread,code,num):
 
 		istep+=1
 	
-		rootprogress.find('progress_text').text='%i'%(100.*istep/nstep)
-		rootprogress.find('progress_frac').text=str(istep/nstep)
-		try: xml.ElementTree(rootprogress).write(progressfile)
-		except: pass
-		if not LOCAL:
-			try:
-				with open(PATH+'../../../progress.txt','w') as pf: pf.write(str(istep/nstep))
-			except: pass
+		p.UpdateMainProgress(istep/nstep)
 		
 		if code=='coarse':		message=msg("Evaluating ground elevations")+' ('+msg("coarse version")+')'
 		elif code=='fine':		message=msg("Evaluating ground elevations")+' ('+msg("fine version")+')'
@@ -1069,10 +875,7 @@ def CalcOro(ithread,code,num):
 		it=0
 		RES=False
 		while not RES and it<=itmax:
-			root=xml.Element('logout')
-			xml.SubElement(root,'progress_text').text=message
-			xml.SubElement(root,'progress_frac').text=str(0)
-			xml.ElementTree(root).write(xmlfile)
+			ResetProgress(xmlfile,message)
 			it+=1
 			SubprocessCall([appli,infile,orofile,outfile,xmlfile])
 			RES=float(xml.parse(xmlfile).getroot().find('progress_frac').text)==1.0
@@ -1105,14 +908,7 @@ def PropaOro(ithread,code):
 
 		istep+=1
 		
-		rootprogress.find('progress_text').text='%i'%(100.*istep/nstep)
-		rootprogress.find('progress_frac').text=str(istep/nstep)
-		try: xml.ElementTree(rootprogress).write(progressfile)
-		except: pass
-		if not LOCAL:
-			try:
-				with open(PATH+'../../../progress.txt','w') as pf: pf.write(str(istep/nstep))
-			except: pass
+		p.UpdateMainProgress(istep/nstep)
 		
 		if code=='coarse':		message=msg("Propagating ground elevations")+' ('+msg("coarse version")+')'
 		elif code=='fine':		message=msg("Propagating ground elevations")+' ('+msg("fine version")+')'
@@ -1165,10 +961,7 @@ def PropaOro(ithread,code):
 		it=0
 		RES=False
 		while not RES and it<=itmax:
-			root=xml.Element('logout')
-			xml.SubElement(root,'progress_text').text=message
-			xml.SubElement(root,'progress_frac').text=str(0)
-			xml.ElementTree(root).write(xmlfile)
+			ResetProgress(xmlfile,message)
 			it+=1
 			SubprocessCall(appli,infile0,infile1,infile2,outfile,xmlfile)
 			RES=float(xml.parse(xmlfile).getroot().find('progress_frac').text)==1.0
@@ -1210,14 +1003,7 @@ def InOut(ithread,code):
 
 		istep+=1
 		
-		rootprogress.find('progress_text').text='%i'%(100.*istep/nstep)
-		rootprogress.find('progress_frac').text=str(istep/nstep)
-		try: xml.ElementTree(rootprogress).write(progressfile)
-		except: pass
-		if not LOCAL:
-			try:
-				with open(PATH+'../../../progress.txt','w') as pf: pf.write(str(istep/nstep))
-			except: pass
+		p.UpdateMainProgress(istep/nstep)
 
 		if code=='coarse':		message=msg("Evaluating Boundary Conditions")+' ('+msg("coarse version")+')'
 		elif code=='fine':		message=msg("Evaluating Boundary Conditions")+' ('+msg("fine version")+')'
@@ -1268,14 +1054,7 @@ def Foam(ithread,code):
 
 		istep+=1
 		
-		rootprogress.find('progress_text').text='%i'%(100.*istep/nstep)
-		rootprogress.find('progress_frac').text=str(istep/nstep)
-		try: xml.ElementTree(rootprogress).write(progressfile)
-		except: pass
-		if not LOCAL:
-			try:
-				with open(PATH+'../../../progress.txt','w') as pf: pf.write(str(istep/nstep))
-			except: pass
+		p.UpdateMainProgress(istep/nstep)
 		
 		if code=='coarse':		message=msg("Generating OpenFOAM mesh files")+' ('+msg("coarse version")+')'
 		elif code=='fine':		message=msg("Generating OpenFOAM mesh files")+' ('+msg("fine version")+')'
@@ -1455,52 +1234,34 @@ def Foam(ithread,code):
 		p.errors.append(msg("ERROR")+' '+msg("within process")+': Foam(%s)'%code)
 		p.WriteLog(0)
 
-istep=0.
+def Prepa(ithread,code):
+	"""
+	Generates and analyses the ground mesh, then splits its ground points for the elevation tasks
+	"""
 	
-ReadParam()
-
-nstep=44.+3*p.nproc
-if p.resfine<0:		nstep+=1
-if p.resratio>1.:	nstep+=1
-
-EvaluateParam()
-
-threads=[]
-threads.append(THREAD_Prepa('coarse'))
-threads.append(THREAD_Prepa('reduced'))
-threads.append(THREAD_Prepa('fine'))
-for thread in threads: thread.start()
-
-threads=[]
-code='coarse'
-while not p.OK_coarse: time.sleep(0.33)
-for idiv in range(p.nproc):
-	num=code+'_ground_pts_%i'%idiv
-	threads.append(THREAD_Oro(code,num))
-	threads[-1].start()
-code='reduced'
-while not p.OK_reduced: time.sleep(0.33)
-for idiv in range(p.nproc):
-	num=code+'_ground_pts_%i'%idiv
-	threads.append(THREAD_Oro(code,num))
-	threads[-1].start()
-code='fine'
-while not p.OK_fine: time.sleep(0.33)
-for idiv in range(p.nproc):
-	num=code+'_ground_pts_%i'%idiv
-	threads.append(THREAD_Oro(code,num))
-	threads[-1].start()
-
-for thread in threads: thread.join()
-
-if p.nproc>3 and LOCAL:
-	root=xml.parse(xmlfileproc).getroot()
-	for bal in root:
-		if bal.attrib['name']==p.name:
-			bal.attrib['nproc']=str(3)
-			xml.ElementTree(root).write(xmlfileproc)
+	Mesh(ithread,code)
+	
+	AnalyseMesh(ithread,code)
+	CalcRou(ithread,code)
+	PropaRou(ithread,code)
+
+	# the elevation tools only read text
+	pts=ReadPoints(p.folder+'/FILES/'+code+'_ground_pts')
+	npts=len(pts)
+	np_first=npts/p.nproc
+	np_then=npts-(p.nproc-1)*np_first
+	for idiv in range(p.nproc):
+		num=code+'_ground_pts_%i'%idiv
+		ifirst=idiv*np_first
+		if idiv!=p.nproc-1: ilast=(idiv+1)*np_first
+		else: ilast=idiv*np_first+np_then
+		WritePoints(p.folder+'/FILES/'+num,pts[ifirst:ilast],'%20.2f\t%20.2f\t%15i',binary=False)
 
-for code in ['fine','reduced','coarse']:
+def MergeOro(ithread,code):
+	"""
+	Merges the ground elevations of the elevation tasks
+	"""
+	
 	outfile=open(p.folder+'/FILES/'+code+'_elevation','w')
 	for idiv in range(p.nproc):
 		infile=open(p.folder+'/FILES/'+code+'_elevation_'+str(idiv),'r')
@@ -1511,33 +1272,51 @@ for code in ['fine','reduced','coarse']:
 		for line in lines: outfile.write(line)
 	outfile.close()
 
-threads=[]
-threads.append(THREAD_PropaOro('fine'))
-threads.append(THREAD_PropaOro('reduced'))
-threads.append(THREAD_PropaOro('coarse'))
-
-for thread in threads: thread.start()
-for thread in threads: thread.join()
-
-threads=[]
-threads.append(THREAD_Inout('fine'))
-threads.append(THREAD_Inout('reduced'))
-threads.append(THREAD_Inout('coarse'))
-for thread in threads: thread.start()
-for thread in threads: thread.join()
-
-threads=[]
-threads.append(THREAD_Foam('reduced'))
-threads.append(THREAD_Foam('coarse'))
-if NEED_MEM:
-	for thread in threads: thread.start()
-	for thread in threads: thread.join()
-	threads=[]
-threads.append(THREAD_Foam('fine'))
-for thread in threads: thread.start()
-for thread in threads: thread.join()
-
-threads=[]
+def ReleaseCores(ithread):
+	"""
+	Only 3 processes are left once the elevations are computed
+	"""
+	
+	root=xml.parse(xmlfileproc).getroot()
+	for bal in root:
+		if bal.attrib['name']==p.name:
+			bal.attrib['nproc']=str(3)
+			xml.ElementTree(root).write(xmlfileproc)
+
+istep=0.
+	
+ReadParam()
+
+nstep=44.+3*p.nproc
+if p.resfine<0:		nstep+=1
+if p.resratio>1.:	nstep+=1
+
+EvaluateParam()
+
+# each version goes through its own chain of tasks, so the versions overlap instead of waiting for each other
+# the fine elevations are propagated once all the ground meshes are generated, as it updates p.rescoarse
+graph=P_TASK_GRAPH(p.p_pool,p.nproc,p.SetStage)
+codes=['coarse','reduced','fine']
+for code in codes:
+	graph.add('prepa_'+code,Prepa,(code,))
+oros=[]
+for code in codes:
+	for idiv in range(p.nproc):
+		num=code+'_ground_pts_%i'%idiv
+		graph.add('oro_'+num,CalcOro,(code,num),['prepa_'+code])
+		oros.append('oro_'+num)
+	graph.add('merge_'+code,MergeOro,(code,),['oro_'+code+'_ground_pts_%i'%idiv for idiv in range(p.nproc)])
+if p.nproc>3 and LOCAL:
+	graph.add('release_cores',ReleaseCores,(),oros)
+for code in codes:
+	deps=['merge_'+code]
+	if code=='fine': deps+=['prepa_coarse','prepa_reduced']
+	graph.add('propa_'+code,PropaOro,(code,),deps)
+	graph.add('inout_'+code,InOut,(code,),['propa_'+code])
+	deps=['inout_'+code]
+	if code=='fine' and NEED_MEM: deps+=['foam_coarse','foam_reduced']
+	graph.add('foam_'+code,Foam,(code,),deps)
+graph.run()
 
 for code in ['fine','reduced','coarse']:
 	subprocess.call(['rm','-rf',p.folder+'/FILES/'+code+'.msh2'])
@@ -16,7 +16,7 @@ import requests
 import urllib3
 import slumber
 import shutil,calendar, tempfile, contextlib, re
-import copy,pickle,platform,stat, threading
+import copy,pickle,platform,stat, threading, atexit
 import re,gettext
 
 
@@ -785,19 +785,95 @@ def VerifIndividualStates(xmlfile,time2use=None):
 	
 	return True
 	
+PROGRESS_PERIOD=1.
+
+class PROGRESS_CHANNEL(object):
+	"""
+	progress of all the threads of a process, kept in memory and written to the files by a single thread
+	the files are rewritten at most every PROGRESS_PERIOD seconds, with the last value only
+	the logout xml files stay as the view of the desktop application, progress.txt is the one read by the worker
+	"""
+	def __init__(self,period=PROGRESS_PERIOD):
+		self.period=period
+		self.lock=threading.Lock()
+		self.write_lock=threading.Lock()
+		self.pending=OrderedDict()
+		self.closed=False
+		self.thread=None
+	
+	def set_xml(self,xmlfile,frac,text):
+		self.set(xmlfile,('xml',str(frac),text))
+	
+	def set_txt(self,txtfile,value):
+		self.set(txtfile,('txt',str(value)))
+	
+	def set(self,fname,content):
+		with self.lock:
+			if self.closed: return
+			self.pending.pop(fname,None)
+			self.pending[fname]=content
+			if self.thread is None:
+				self.thread=threading.Thread(target=self.run,name='progress')
+				self.thread.daemon=True
+				self.thread.start()
+	
+	def claim(self,fname):
+		"""
+		drops the pending update of fname and waits for the current write, before another process writes fname
+		"""
+		with self.write_lock:
+			with self.lock: self.pending.pop(fname,None)
+	
+	def run(self):
+		while not self.closed:
+			time.sleep(self.period)
+			self.flush()
+	
+	def flush(self):
+		with self.write_lock:
+			with self.lock:
+				pending=self.pending
+				self.pending=OrderedDict()
+			for fname,content in pending.items():
+				try:
+					tmpfile=fname+'.tmp'
+					if content[0]=='xml':
+						root=xml.Element('logout')
+						xml.SubElement(root,'progress_text').text=content[2]
+						xml.SubElement(root,'progress_frac').text=content[1]
+						xml.ElementTree(root).write(tmpfile,encoding="UTF-8",xml_declaration=False)
+					else:
+						with open(tmpfile,'w') as pf: pf.write(content[1])
+					os.rename(tmpfile,fname)
+				except Exception as e:
+					print("Error UpdateProgress of {}: {}".format(fname,e))
+	
+	def close(self):
+		"""
+		writes the pending updates and ignores the next ones, before the process files are cleaned
+		"""
+		with self.lock: self.closed=True
+		self.flush()
+
+PROGRESS=PROGRESS_CHANNEL()
+atexit.register(PROGRESS.flush)
+
 def UpdateProgress(time2use,ithread,val,text):
 	try:
 		xmlfile = PATH + '../../APPLI/TMP/logout_' + time2use + '_' + str(ithread) + '.xml'
+		PROGRESS.set_xml(xmlfile,min(val,1.),UnixSanitizeStr(text, to_unicode=True))
 	except Exception as e:
 		print("Error UpdateProgress: {}".format(e))
-		return
-	try:
-		root=xml.parse(xmlfile).getroot()
-		root.find('progress_text').text=UnixSanitizeStr(text, to_unicode=True)
-		root.find('progress_frac').text=str(min(val,1.))
-		xml.ElementTree(root).write(xmlfile,encoding="UTF-8",xml_declaration=False)
-	except Exception as e:
-		print("Error UpdateProgress of {}: {}".format(xmlfile,e))
+
+def ResetProgress(xmlfile,text):
+	"""
+	Writes the initial progress of a compiled tool, which then updates xmlfile itself
+	"""
+	PROGRESS.claim(xmlfile)
+	root=xml.Element('logout')
+	xml.SubElement(root,'progress_text').text=text
+	xml.SubElement(root,'progress_frac').text=str(0)
+	xml.ElementTree(root).write(xmlfile)
 
 
 class TimeoutError(RuntimeError):
@@ -1711,7 +1787,9 @@ class P_PARAM(object):
 			if status==0:	val=9.99
 			else:			val=1.01
 			if not self.LOCAL:
-				with open(PATH+'../../../progress.txt','w') as pf: pf.write(str(val))
+				PROGRESS.set_txt(PATH+'../../../progress.txt',val)
+				PROGRESS.set_txt(PATH+'../../../stage.txt','')
+			PROGRESS.close()
 			
 			self.SetXmlFiles(status)
 			
@@ -1757,26 +1835,22 @@ class P_PARAM(object):
 			frac = max(0.,min(1.,float(frac)))
 			
 			progressfile=PATH+'../../APPLI/TMP/logout_'+self.time2use+'.xml'
-			if not os.path.isfile(progressfile):
-				root=xml.Element('logout')
-				xml.SubElement(root,'progress_text')
-				xml.SubElement(root,'progress_frac').text='0'
-				xml.ElementTree(root).write(progressfile)
-				if not self.LOCAL:
-					with open(PATH+'../../../progress.txt','w') as pf: pf.write('0')
 			
 			self._prog_frac=frac
 			
-			rootprogress=xml.parse(progressfile).getroot()
-			rootprogress.find('progress_text').text='%i'%(100.*self._prog_frac)
-			rootprogress.find('progress_frac').text=str(self._prog_frac)
-			xml.ElementTree(rootprogress).write(progressfile)
-			if not self.LOCAL:
-				with open(PATH + '../../../progress.txt', 'w') as pf: pf.write(str(self._prog_frac))
+			PROGRESS.set_xml(progressfile,self._prog_frac,'%i'%(100.*self._prog_frac))
+			if not self.LOCAL: PROGRESS.set_txt(PATH + '../../../progress.txt',self._prog_frac)
 		
 		except Exception as e:
 			print("Error UpdateMainProgress: {}".format(e))
 	
+	def SetStage(self,stage):
+		"""
+		Writes the current stage of the process, read by the worker to label its resource samples
+		stage must not change from a job to another: a function name, not a translated or numbered text
+		"""
+		if not self.LOCAL: PROGRESS.set_txt(PATH+'../../../stage.txt',stage)
+	
 	def IncrMainProgress(self,frac):
 		try:
 			frac = max(0.,min(1.,self._prog_frac+float(frac)))
@@ -1788,17 +1862,7 @@ class P_PARAM(object):
 		xmlfile = PATH + '../../APPLI/TMP/logout_' + self.time2use + '_' + str(ithread) + '.xml'
 		try:
 			frac = max(0.,min(1.,float(frac)))
-			
-			if not os.path.isfile(xmlfile):
-				root=xml.Element('logout')
-				xml.SubElement(root,'progress_text')
-				xml.SubElement(root,'progress_frac').text='0'
-				xml.ElementTree(root).write(xmlfile)
-		
-			root=xml.parse(xmlfile).getroot()
-			root.find('progress_text').text=UnixSanitizeStr(text, to_unicode=True)
-			root.find('progress_frac').text=str(min(frac,1.))
-			xml.ElementTree(root).write(xmlfile,encoding="UTF-8",xml_declaration=False)
+			PROGRESS.set_xml(xmlfile,frac,UnixSanitizeStr(text, to_unicode=True))
 		
 		except Exception as e:
 			print("Error UpdateProgress of {}: {}".format(xmlfile,e))
@@ -2616,31 +2680,170 @@ class P_THREAD(threading.Thread):
 	def prerun(self):
 		"""
 		function to avoid running more than nproc processes at the same time, for a given P_POOL object
-		it will be executed by several threads at the same time so we must avoid any race condition
+		it blocks until a core is free, then returns its index
 		"""
-		# add to queue
-		self.p_pool.queue.append(self)
-		# wait until we are in the first nproc authorized processes
-		while self.p_pool.queue.index(self)>=self.nproc: time.sleep(0.5)
-		# get ithread number
-		ithread=self.p_pool.busy.index(False)
-		# tag ithread as busy
-		self.p_pool.busy[ithread]=True
-		return ithread
+		return self.p_pool.acquire(self,self.nproc)[0]
 	
 	def postrun(self,ithread):
-		# tag ithread as not busy
-		self.p_pool.busy[ithread]=False
-		# remove from queue
-		self.p_pool.queue.remove(self)
+		self.p_pool.release(self)
 
 class P_POOL(object):
 	"""
 	little class to hold a queue of P_THREAD and a core availability index
+	the waiting threads sleep on a condition and are woken up when cores are released
 	"""
 	def __init__(self):
 		self.queue=[]
 		self.busy=[False]*NCPU
+		self.slots={}
+		self.cond=threading.Condition()
+	
+	def acquire(self,owner,nproc,weight=1):
+		"""
+		wait until owner can run with weight cores, among the first nproc cores of the queue
+		the queue is served in order, so a heavy task is not starved by the light ones
+		returns the list of core indexes given to owner
+		"""
+		weight=min(max(1,weight),nproc)
+		with self.cond:
+			self.queue.append((owner,weight))
+			while True:
+				ahead=0
+				for entry in self.queue:
+					if entry[0] is owner: break
+					ahead+=entry[1]
+				if ahead+weight<=nproc and self.busy.count(False)>=weight: break
+				self.cond.wait()
+			slots=[i for i in range(len(self.busy)) if not self.busy[i]][:weight]
+			for i in slots: self.busy[i]=True
+			self.slots[owner]=slots
+			return slots
+	
+	def release(self,owner):
+		with self.cond:
+			for i in self.slots.pop(owner,[]): self.busy[i]=False
+			self.queue=[entry for entry in self.queue if entry[0] is not owner]
+			self.cond.notify_all()
+
+class P_TASK(threading.Thread):
+	"""
+	one task of a P_TASK_GRAPH, run once all its dependencies succeeded
+	"""
+	def __init__(self,graph,name,func,args,deps,weight):
+		threading.Thread.__init__(self,name=name)
+		self.daemon=True
+		self.graph=graph
+		self.func=func
+		self.args=args
+		self.deps=deps
+		self.weight=min(max(1,weight),graph.nproc)
+		self.done=threading.Event()
+		self.error=None
+		self.skipped=False
+		self.start_time=None
+		self.end_time=None
+	
+	def run(self):
+		try:
+			for dep in self.deps:
+				dep.done.wait()
+				if dep.error is not None or dep.skipped:
+					self.skipped=True
+					return
+			slots=self.graph.p_pool.acquire(self,self.graph.nproc,self.weight)
+			try:
+				self.start_time=time.time()
+				self.graph.set_running(self,True)
+				self.func(slots[0]+1,*self.args)
+			finally:
+				self.end_time=time.time()
+				self.graph.set_running(self,False)
+				self.graph.p_pool.release(self)
+		except BaseException as e:
+			# SystemExit included: WriteLog exits the calling thread only
+			self.error=(e,traceback.format_exc())
+		finally:
+			self.done.set()
+
+class P_TASK_GRAPH(object):
+	"""
+	run a set of tasks with declared dependencies on a P_POOL
+	a task starts as soon as its dependencies are done and enough cores are free, instead of waiting for a whole stage
+	p_pool: P_POOL object
+	nproc: the maximum number of processors allowed
+	on_stage: optional, called with the function names of the running tasks each time they change, ex: p.SetStage
+	"""
+	def __init__(self,p_pool,nproc,on_stage=None):
+		self.p_pool=p_pool
+		self.nproc=min(NCPU,max(1,nproc))
+		self.on_stage=on_stage
+		self.tasks=[]
+		self.names={}
+		self.running=[]
+		self.stage=None
+		self.lock=threading.Lock()
+		self.started=False
+		self.t0=None
+	
+	def add(self,name,func,args=(),deps=[],weight=1):
+		"""
+		add the task name, which calls func(ithread,*args) once the tasks named in deps are done
+		weight is the number of cores used by the task
+		tasks can be added after start, as long as their dependencies are already known
+		"""
+		if name in self.names: raise ValueError('Task '+name+' already defined')
+		for dep in deps:
+			if not dep in self.names: raise ValueError('Unknown dependency '+dep+' for task '+name)
+		task=P_TASK(self,name,func,tuple(args),[self.names[dep] for dep in deps],weight)
+		self.tasks.append(task)
+		self.names[name]=task
+		if self.started: task.start()
+		return task
+	
+	def set_running(self,task,running):
+		"""
+		the stage is named after the functions of the running tasks, not the task names which hold the sub-domains
+		it keeps the last value while no task runs
+		"""
+		with self.lock:
+			if running: self.running.append(task)
+			else: self.running.remove(task)
+			stage='+'.join(sorted(set(t.func.__name__ for t in self.running)))
+			if self.on_stage is None or not stage or stage==self.stage: return
+			self.stage=stage
+			try: self.on_stage(stage)
+			except Exception as e: print("Error SetStage: {}".format(e))
+	
+	def start(self):
+		self.started=True
+		self.t0=time.time()
+		for task in self.tasks: task.start()
+	
+	def wait(self):
+		"""
+		wait for all the tasks, print the timing trace and raise the first error if any
+		"""
+		for task in self.tasks:
+			while task.is_alive(): task.join(3600)
+		self.trace()
+		for task in self.tasks:
+			if task.error is not None:
+				if not isinstance(task.error[0],SystemExit): sys.stdout.write(task.error[1])
+				raise task.error[0]
+	
+	def run(self):
+		self.start()
+		self.wait()
+	
+	def trace(self):
+		print('Task trace (start, duration, cores):')
+		for task in sorted(self.tasks,key=lambda t:t.start_time if t.start_time is not None else float('inf')):
+			if task.start_time is None:
+				print('   %-30s %s'%(task.name,'skipped' if task.skipped else 'not run'))
+				continue
+			status=' failed' if task.error is not None else ''
+			print('   %-30s %+9.2fs %9.2fs %3d%s'%(task.name,task.start_time-self.t0,task.end_time-task.start_time,task.weight,status))
+		sys.stdout.flush()
 
 def parse_nproc(nproc):
 	nproc=int(nproc)
@@ -2811,6 +3014,61 @@ class FORTRAN_FILE(file):
 	real_precisions='df'
 	int_precisions='hilq'
 
+def MapFortranReals(fname,nrec,prec='f',endian='@',header_prec='i'):
+	"""
+	Memory-maps the first nrec real records of a FORTRAN_FILE, without reading or copying them
+	returns a list of read-only numpy arrays
+	"""
+	
+	dtype=np.dtype({'@':'=','=':'=','<':'<','>':'>'}[endian]+prec)
+	header=endian+header_prec
+	header_length=struct.calcsize(header)
+	records=[]
+	offset=0
+	with open(fname,'rb') as f:
+		for _ in range(nrec):
+			f.seek(offset)
+			length=struct.unpack(header,f.read(header_length))[0]
+			if length>0: records.append(np.memmap(fname,dtype=dtype,mode='r',offset=offset+header_length,shape=(length/dtype.itemsize,)))
+			else: records.append(np.zeros(0,dtype=dtype))
+			offset+=2*header_length+length
+	return records
+
+# point clouds exchanged between python stages can be written as raw little-endian float64 instead of text
+# the 24 bytes header gives the magic, the number of rows and the number of columns
+BINARY_POINTS="ZS_BINARY_POINTS" in os.environ and os.environ["ZS_BINARY_POINTS"].strip()=="1"
+POINTS_MAGIC='ZSPTS001'
+POINTS_HEADER='<8sqq'
+
+def WritePoints(fname,points,fmt,binary=None):
+	"""
+	Writes a point cloud, one row per point
+	fmt is the format of a row in the text version
+	binary overrides the ZS_BINARY_POINTS environment setting
+	"""
+	
+	if binary is None: binary=BINARY_POINTS
+	points=np.asarray(points,dtype=np.float64)
+	points=points.reshape(len(points),-1) if len(points) else points.reshape(0,fmt.count('%'))
+	with open(fname,'wb') as outfile:
+		if binary:
+			outfile.write(struct.pack(POINTS_HEADER,POINTS_MAGIC,points.shape[0],points.shape[1]))
+			points.astype('<f8').tofile(outfile)
+		else: np.savetxt(outfile,points,fmt=fmt)
+
+def ReadPoints(fname):
+	"""
+	Reads a point cloud written by WritePoints, the binary files are memory-mapped
+	"""
+	
+	header_length=struct.calcsize(POINTS_HEADER)
+	with open(fname,'rb') as infile: header=infile.read(header_length)
+	if len(header)==header_length and header[:len(POINTS_MAGIC)]==POINTS_MAGIC:
+		_,nrows,ncols=struct.unpack(POINTS_HEADER,header)
+		if nrows==0: return np.zeros((0,ncols))
+		return np.memmap(fname,dtype='<f8',mode='r',offset=header_length,shape=(nrows,ncols))
+	return np.loadtxt(fname,ndmin=2)
+
 def Iterable(obj):
 
 	try:
@@ -3810,62 +4068,176 @@ def GetParamText(typeset,paramname, language='EN'):
 	
 	return dd[typeset][paramname]
 
-def InvestigateConvergence(lv,lk,npt,nmt,nld,nwt):
+def ParseProbeLines(lines):
+	"""
+	Parse OpenFOAM probe lines ("time (x y z) (x y z) ..." or "time v v ...") into a 2D array, one row per line.
+	Missing or invalid values are NaN.
+	
+	:param lines:		The probe lines, without the comment lines
+	:type lines:		list[str]
+	:return:			The values, time included
+	:rtype:				np.ndarray
+	"""
+	rows=[line.translate(None,'()').split() for line in lines]
+	if len(rows)==0: return np.zeros((0,0))
+	ncols=max(len(row) for row in rows)
+	if all(len(row)==ncols for row in rows):
+		try: return np.array(rows,dtype=float)
+		except ValueError: pass
+	data=np.empty((len(rows),ncols))
+	data.fill(np.nan)
+	for i,row in enumerate(rows):
+		for j,value in enumerate(row):
+			try: data[i,j]=float(value)
+			except ValueError: pass
+	return data
+
+def ConcatProbeData(arrays):
+	"""
+	Concatenate probe data arrays, row-wise. Rows are padded with NaN if the widths differ.
+	
+	:param arrays:		The arrays to concatenate
+	:type arrays:		list[np.ndarray]
+	:return:			The concatenated array
+	:rtype:				np.ndarray
+	"""
+	arrays=[a for a in arrays if a.shape[0]>0]
+	if len(arrays)==0: return np.zeros((0,0))
+	ncols=max(a.shape[1] for a in arrays)
+	padded=[]
+	for a in arrays:
+		if a.shape[1]<ncols:
+			padding=np.empty((a.shape[0],ncols-a.shape[1]))
+			padding.fill(np.nan)
+			a=np.hstack([a,padding])
+		padded.append(a)
+	return np.vstack(padded)
+
+class ProbeFileCache(object):
+	"""
+	Incremental reader of OpenFOAM probe files.
+	The parsed rows and the parsed offset of each file are kept, so each read only parses the lines added since the
+	previous one. Incomplete last lines are left for the next read.
+	"""
+	
+	def __init__(self):
+		self._files={}
+		self._lock=threading.Lock()
+	
+	def read(self,path):
+		"""
+		Get all the data rows of a probe file
+		
+		:param path:		The probe file
+		:type path:			str
+		:return:			The values, one row per line, time included
+		:rtype:				np.ndarray
+		"""
+		with self._lock:
+			size=os.path.getsize(path)
+			entry=self._files.get(path)
+			if entry is None or size<entry['offset']:
+				entry={'offset':0,'data':np.zeros((0,0))}
+				self._files[path]=entry
+			if size>entry['offset']:
+				with open(path,'rb') as f:
+					f.seek(entry['offset'])
+					chunk=f.read(size-entry['offset'])
+				end=chunk.rfind('\n')+1
+				if end>0:
+					lines=[line for line in chunk[:end].splitlines() if line and line[0]!='#']
+					entry['data']=ConcatProbeData([entry['data'],ParseProbeLines(lines)])
+					entry['offset']+=end
+			return entry['data']
+
+def ReadProbeHistory(cache,case_folder,calc_folder,bal_type,suffix):
+	"""
+	Read the U probes of all the runs of a calculation, as InvestigateConvergenceArray expects them
+	
+	:param cache:			The probe reader
+	:type cache:			ProbeFileCache
+	:param case_folder:		The calculation folder, containing history.xml and the itstart files
+	:type case_folder:		str
+	:param calc_folder:		The folder of the probed case (FINE or COARSE)
+	:type calc_folder:		str
+	:param bal_type:		The type of the runs to read in history.xml: 'init' or 'calc'
+	:type bal_type:			str
+	:param suffix:			The suffix of the itstart file of the current run: 'i' or 'c'
+	:type suffix:			str
+	:return:				The U probe values, and the number of available k probe lines
+	:rtype:					tuple[np.ndarray, int]
+	"""
+	probes_folder=os.path.join(calc_folder,'postProcessing','probes')
+	files=[]
+	root=xml.parse(os.path.join(case_folder,'history.xml')).getroot()
+	for bal in root:
+		if bal.attrib['type']==bal_type:
+			files.append(('U.%s'%bal.attrib['i'],'k.%s'%bal.attrib['i']))
+	with open(os.path.join(case_folder,'itstart_%s'%suffix),'r') as f: it_prev=f.readline()
+	if os.path.isfile(os.path.join(probes_folder,it_prev,'U')):
+		files.append((os.path.join(it_prev,'U'),os.path.join(it_prev,'k')))
+	
+	data_v,nk=[],0
+	for fu,fk in files:
+		data_v.append(cache.read(os.path.join(probes_folder,fu)))
+		nk+=cache.read(os.path.join(probes_folder,fk)).shape[0]
+	return ConcatProbeData(data_v),nk
+
+def InvestigateConvergenceArray(data,lmax,npt,nmt,nld,nwt):
+	"""
+	Compute the wind shear coefficient history of each mast, lidar and wind turbine from the U probes
+	
+	:param data:		The U probe values, as parsed by ParseProbeLines
+	:type data:			np.ndarray
+	:param lmax:		The number of lines to use
+	:type lmax:			int
+	:param npt:			The number of single probe points, before the masts
+	:type npt:			int
+	:param nmt:			The number of masts (3 probe points each)
+	:type nmt:			int
+	:param nld:			The number of lidars (3 probe points each)
+	:type nld:			int
+	:param nwt:			The number of wind turbines (3 probe points each)
+	:type nwt:			int
+	:return:			The alpha history of the masts and lidars, of the wind turbines, and the maximum speed
+	:rtype:				tuple[list[list[float]], list[list[float]], float]
+	"""
 	
 	res_mt,res_wt,vmax=[],[],0.
-	if len(lv)>0:
-		lmax=min(len(lv),len(lk))
-		for ip in range(nmt):
-			res_mt.append([])
-			icol1=npt*3+ip*9+1;icol2=icol1+1
-			icol3=npt*3+ip*9+4;icol4=icol3+1
-			icol5=npt*3+ip*9+7;icol6=icol5+1
-			for il in range(lmax):
-				values=string.translate(lv[il],None,'()').split()
-				try: vh1=sqrt(eval(values[icol1])**2+eval(values[icol2])**2)
-				except: vh1=0.
-				try: vh2=sqrt(eval(values[icol3])**2+eval(values[icol4])**2)
-				except: vh2=0.
-				try: vh3=sqrt(eval(values[icol5])**2+eval(values[icol6])**2)
-				except: vh3=0.
-				alpha=AlphaCalc(vh1,vh2,vh3)
-				res_mt[-1].append(alpha)
-				vmax=max(vmax,vh1,vh2,vh3)
-		for ip in range(nld):
-			res_mt.append([])
-			icol1=npt*3+nmt*9+ip*9+1;icol2=icol1+1
-			icol3=npt*3+nmt*9+ip*9+4;icol4=icol3+1
-			icol5=npt*3+nmt*9+ip*9+7;icol6=icol5+1
-			for il in range(lmax):
-				values=string.translate(lv[il],None,'()').split()
-				try: vh1=sqrt(eval(values[icol1])**2+eval(values[icol2])**2)
-				except: vh1=0.
-				try: vh2=sqrt(eval(values[icol3])**2+eval(values[icol4])**2)
-				except: vh2=0.
-				try: vh3=sqrt(eval(values[icol5])**2+eval(values[icol6])**2)
-				except: vh3=0.
-				alpha=AlphaCalc(vh1,vh2,vh3)
-				res_mt[-1].append(alpha)
-				vmax=max(vmax,vh1,vh2,vh3)
-		for ip in range(nwt):
-			res_wt.append([])
-			icol1=npt*3+(nmt+nld)*9+ip*9+1;icol2=icol1+1
-			icol3=npt*3+(nmt+nld)*9+ip*9+4;icol4=icol3+1
-			icol5=npt*3+(nmt+nld)*9+ip*9+7;icol6=icol5+1
-			for il in range(lmax):
-				values=string.translate(lv[il],None,'()').split()
-				try: vh1=sqrt(eval(values[icol1])**2+eval(values[icol2])**2)
-				except: vh1=0.
-				try: vh2=sqrt(eval(values[icol3])**2+eval(values[icol4])**2)
-				except: vh2=0.
-				try: vh3=sqrt(eval(values[icol5])**2+eval(values[icol6])**2)
-				except: vh3=0.
-				alpha=AlphaCalc(vh1,vh2,vh3)
-				res_wt[-1].append(alpha)
-				vmax=max(vmax,vh1,vh2,vh3)
+	lmax=min(lmax,data.shape[0])
+	data=data[:lmax]
+	
+	def _hspeed(icol):
+		if icol+1>=data.shape[1]: return np.zeros(lmax)
+		vh=np.sqrt(data[:,icol]**2+data[:,icol+1]**2)
+		vh[~np.isfinite(vh)]=0.
+		return vh
+	
+	def _alpha(icol):
+		vh1,vh2,vh3=_hspeed(icol),_hspeed(icol+3),_hspeed(icol+6)
+		alpha=np.asarray(AlphaCalc(vh1,vh2,vh3),dtype=float)
+		if alpha.shape!=(lmax,):
+			alpha=np.empty(lmax)
+			alpha.fill(np.nan)
+		return alpha.tolist(),max(vh1.max(),vh2.max(),vh3.max())
+	
+	for ip in range(nmt+nld):
+		alphas,vh_max=_alpha(npt*3+ip*9+1) if lmax>0 else ([],0.)
+		res_mt.append(alphas)
+		vmax=max(vmax,vh_max)
+	for ip in range(nwt):
+		alphas,vh_max=_alpha(npt*3+(nmt+nld)*9+ip*9+1) if lmax>0 else ([],0.)
+		res_wt.append(alphas)
+		vmax=max(vmax,vh_max)
 	
 	return res_mt,res_wt,vmax
 
+def InvestigateConvergence(lv,lk,npt,nmt,nld,nwt):
+	
+	if len(lv)==0: return [],[],0.
+	lmax=min(len(lv),len(lk))
+	return InvestigateConvergenceArray(ParseProbeLines(lv[:lmax]),lmax,npt,nmt,nld,nwt)
+
 def WriteFvSolution(fvpth,dd,lines):
 	
 	with open(fvpth,'w') as f:
@@ -1,11 +1,15 @@
 #!/usr/bin/env python2
 # -*- coding: utf-8 -*-
 
-import os,sys,subprocess,zipfile, shutil, tempfile, contextlib, logging, distutils.dir_util
+import os,sys,subprocess,zipfile, shutil, tempfile, contextlib, logging, distutils.dir_util, re, threading, multiprocessing
 from zc_variables import *
 
 ztfold='ZephyTOOLS/'
 
+# Files which would not gain anything from being compressed again
+STORED_EXTENSIONS=('.zip','.gz','.tgz','.bz2','.xz','.7z','.png','.jpg','.jpeg','.gif')
+FOAM_BINARY_HEADER=re.compile(r'FoamFile\s*\{[^}]*\bformat\s+binary\s*;')
+
 
 @contextlib.contextmanager
 def temp_folder(parent_folder=None):
@@ -79,18 +83,115 @@ def ExtractMainFolder(zip_file, dest_folder):
 	return os.path.abspath(os.path.join(dest_folder, main_folder_name))
 
 
-def ZipDir(dirpath, zippath, compression=True):
+def IsBinaryFoamFile(filepath):
+	"""
+	Check if a file is an OpenFOAM file written in binary format
+
+	:param filepath:    The file to check
+	:type filepath:     str
+	:return:            True if the OpenFOAM header of the file declares the binary format
+	:rtype:             bool
+	"""
+	with open(filepath, 'rb') as f:
+		header=f.read(2048)
+	return FOAM_BINARY_HEADER.search(header) is not None
+
+
+def GetCompressType(filepath):
+	"""
+	Choose the zip compression of a file: already compressed files and binary OpenFOAM fields are stored as is
+
+	:param filepath:    The file to add to an archive
+	:type filepath:     str
+	:return:            zipfile.ZIP_STORED or zipfile.ZIP_DEFLATED
+	:rtype:             int
+	"""
+	ext=os.path.splitext(filepath)[1].lower()
+	if ext in STORED_EXTENSIONS: return zipfile.ZIP_STORED
+	if not ext and IsBinaryFoamFile(filepath): return zipfile.ZIP_STORED
+	return zipfile.ZIP_DEFLATED
+
 
-	if compression is True: fzip=zipfile.ZipFile(zippath, 'w', zipfile.ZIP_DEFLATED,allowZip64=True)
-	else: fzip=zipfile.ZipFile(zippath, 'w', zipfile.ZIP_STORED,allowZip64=True)
-	basedir=os.path.dirname(dirpath)+'/'
+def ListDirEntries(dirpath, arcpath):
+	"""
+	List the files of a folder as zip entries, skipping hidden and backup files like ZipDir always did
+
+	:param dirpath:     The folder to list
+	:type dirpath:      str
+	:param arcpath:     The path of the folder inside the archive
+	:type arcpath:      str
+	:return:            The list of (file path, path inside the archive)
+	:rtype:             list[tuple[str, str]]
+	"""
+	entries=[]
+	dirpath=dirpath.rstrip('/')
 	for root,_,files in os.walk(dirpath):
 		if os.path.basename(root)[0]=='.': continue
-		dirname=root.replace(basedir,'')
+		rel=os.path.relpath(root,dirpath)
+		arcdir=arcpath if rel=='.' else arcpath+'/'+rel
 		for f in files:
 			if f[-1]=='~' or f[0]=='.': continue
-			fzip.write(root+'/'+f,dirname+'/'+f)
-	fzip.close()
+			entries.append((root+'/'+f,arcdir+'/'+f))
+	return entries
+
+
+def ZipEntries(entries, zippath, compression=True):
+	"""
+	Write files into a zip archive, reading them directly from their location
+
+	:param entries:     The list of (file path, path inside the archive)
+	:type entries:      list[tuple[str, str]]
+	:param zippath:     The archive to create
+	:type zippath:      str
+	:param compression: Compress the files which benefit from it. Optional, default True
+	:type compression:  bool
+	"""
+	fzip=zipfile.ZipFile(zippath, 'w', zipfile.ZIP_DEFLATED if compression else zipfile.ZIP_STORED, allowZip64=True)
+	try:
+		for filepath,arcname in entries:
+			fzip.write(filepath,arcname,GetCompressType(filepath) if compression else zipfile.ZIP_STORED)
+	finally:
+		fzip.close()
+
+
+def ZipParallel(archives, max_workers=None, on_done=None):
+	"""
+	Build several zip archives at the same time.
+	zlib releases the GIL while compressing, so the archives are built in threads, one per core at most
+
+	:param archives:    The list of (entries, zip path, compression), as ZipEntries expects them
+	:type archives:     list[tuple[list[tuple[str, str]], str, bool]]
+	:param max_workers: The maximum number of archives built at the same time. Optional, default the number of cores
+	:type max_workers:  int|None
+	:param on_done:     A function called with the zip path as soon as each archive is built. Optional, default None
+	:type on_done:      callable|None
+	"""
+	if not max_workers: max_workers=multiprocessing.cpu_count()
+	pending=list(archives)
+	errors=[]
+	lock=threading.Lock()
+
+	def _worker():
+		while True:
+			with lock:
+				if not pending or errors: return
+				entries,zippath,compression=pending.pop(0)
+			try:
+				ZipEntries(entries,zippath,compression)
+				if on_done: on_done(zippath)
+			except Exception:
+				with lock: errors.append(sys.exc_info())
+
+	threads=[threading.Thread(target=_worker) for _ in range(min(max_workers,len(pending)))]
+	for t in threads: t.start()
+	for t in threads: t.join()
+	if errors:
+		raise errors[0][0], errors[0][1], errors[0][2]
+
+
+def ZipDir(dirpath, zippath, compression=True):
+	dirpath=dirpath.rstrip('/')
+	ZipEntries(ListDirEntries(dirpath,os.path.basename(dirpath)),zippath,compression)
 
 
 def InitFiles(i, filename, ch, codename, log=None):
@@ -160,12 +261,24 @@ def InitFiles(i, filename, ch, codename, log=None):
 				log.warning("Unable to remove " + to_remove + ": " + str(e))
 
 def StoreFiles(codename,ch,jobid, call_args=None):
-	if not call_args:
-		call_args = {}
+	"""
+	Zip the output files of a toolchain straight from the project folder
+
+	:param codename:    The project codename
+	:type codename:     str
+	:param ch:          The toolchain name
+	:type ch:           str
+	:param jobid:       The id of the job
+	:type jobid:        str
+	:param call_args:   Unused, kept for compatibility. Optional, default None
+	:type call_args:    dict|None
+	"""
 	outfolder='%s-%s-%s'%(codename,ch,jobid)
-	subprocess.call(['mkdir','-p',outfolder], **call_args)
-	for elem in ddout[ch]['tree']:		subprocess.call(['mkdir','-p',outfolder+elem], **call_args)
-	for elem in ddout[ch]['folders']:	subprocess.call(['cp','-r',ztfold+'PROJECTS_CFD/'+codename+elem,outfolder], **call_args)
-	for elem in ddout[ch]['files']:		subprocess.call(['cp','-r',ztfold+'PROJECTS_CFD/'+codename+'/'+elem,outfolder], **call_args)
-	for elem in ddout[ch]['remove']:		subprocess.call(['rm','-f',outfolder+elem], **call_args)
-	ZipDir('./%s'%outfolder,outfolder+'.zip')
+	project=ztfold+'PROJECTS_CFD/'+codename
+	entries=[]
+	for elem in ddout[ch]['folders']:
+		if os.path.isdir(project+elem): entries.extend(ListDirEntries(project+elem,outfolder+'/'+elem.strip('/')))
+	for elem in ddout[ch]['files']:
+		if os.path.isfile(project+'/'+elem): entries.append((project+'/'+elem,outfolder+'/'+elem.strip('/')))
+	removed=set(outfolder+elem for elem in ddout[ch]['remove'])
+	ZipEntries([e for e in entries if e[1] not in removed],outfolder+'.zip')
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: set tabstop=4:softtabstop=4:shiftwidth=4:expandtab:textwidth=120
+
+"""
+This script compares the previous billing queries with the set-based ones, on a synthetic year of transactions:
+ - the credit of a user, summed over the whole ledger before, read from the materialized balance after
+ - the computing charge of each running job, as done by its command loop: 4 queries and an insert before, a single
+   statement after
+It needs a scratch database migrated to the last version: the synthetic users, jobs and transactions are committed,
+then deleted at the end.
+
+Example:
+    python tools/benchmarks/billing.py "dbname='zephycloud_bench' host='localhost' user='postgres'" -u 500 -t 2000
+"""
+
+# Core libs
+import os
+import sys
+import time
+import datetime
+import argparse
+
+# Third party libs
+import psycopg2
+import psycopg2.extras
+
+# Project specific libs
+script_path = os.path.dirname(os.path.abspath(__file__))
+project_path = os.path.abspath(os.path.join(script_path, "..", ".."))
+sys.path.append(os.path.join(project_path, 'src', 'server'))
+
+import core.api_util
+import models.jobs
+import models.users
+
+BENCH_PREFIX = "billing_bench_"
+DESCRIPTION = "Billing benchmark"
+
+
+def create_dataset(conn, nbr_users, nbr_transactions, nbr_jobs):
+    """
+    Create the synthetic users, a year of transactions for each of them, and the running jobs to charge
+
+    :param conn:                The database connection
+    :type conn:                 psycopg2.extensions.connection
+    :param nbr_users:           The number of users to create
+    :type nbr_users:            int
+    :param nbr_transactions:    The number of transactions per user
+    :type nbr_transactions:     int
+    :param nbr_jobs:            The number of running jobs to create
+    :type nbr_jobs:             int
+    :return:                    The ids of the users and the ids of the jobs
+    :rtype:                     tuple[list[int], list[int]]
+    """
+    with conn.cursor() as cur:
+        cur.execute("""INSERT INTO users (login, pwd, salt, email)
+                            SELECT %s || i, '', '', %s || i || '@example.com'
+                              FROM generate_series(1, %s) AS i
+                         RETURNING id""", [BENCH_PREFIX, BENCH_PREFIX, nbr_users])
+        user_ids = [row[0] for row in cur.fetchall()]
+        cur.execute("""INSERT INTO user_accounts (user_id, amount, description, date)
+                            SELECT u, (random() * 2000)::bigint - 1000, %s,
+                                   now() - random() * INTERVAL '365 days'
+                              FROM unnest(%s) AS u, generate_series(1, %s)""",
+                    [DESCRIPTION, user_ids, nbr_transactions])
+        cur.execute("""INSERT INTO operations_history (operation_name, provider_code, user_rank)
+                            VALUES (%s, 'bench', 1) RETURNING id""", [BENCH_PREFIX + "calc"])
+        operation_id = cur.fetchone()[0]
+        cur.execute("""INSERT INTO machine_prices_history (user_rank, machine_uid, sec_price, sec_granularity,
+                                                           min_sec_granularity)
+                            VALUES (1, '00000000-0000-0000-0000-000000000000', 3, 300, 3600) RETURNING id""")
+        price_id = cur.fetchone()[0]
+        cur.execute("""INSERT INTO jobs (user_id, project_uid, status, operation_id, machine_price_id, nbr_machines,
+                                         start_time)
+                            SELECT user_ids[1 + i %% array_length(user_ids, 1)], %s, %s, %s, %s, 1 + i %% 4,
+                                   now() - INTERVAL '2 hours'
+                              FROM generate_series(1, %s) AS i, (SELECT %s::bigint[] AS user_ids) AS u
+                         RETURNING id""", [BENCH_PREFIX + "project", models.jobs.JOB_STATUS_RUNNING, operation_id,
+                                           price_id, nbr_jobs, user_ids])
+        job_ids = [row[0] for row in cur.fetchall()]
+        # Every job was already charged once, and its paid period is over
+        cur.execute("""INSERT INTO user_accounts (user_id, amount, description, job_id, computing_start,
+                                                  computing_end)
+                            SELECT user_id, -1000, %s, id, start_time, start_time + INTERVAL '1 hour'
+                              FROM jobs WHERE id = ANY(%s)""", [DESCRIPTION, job_ids])
+    conn.commit()
+    return user_ids, job_ids
+
+
+def delete_dataset(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT id FROM users WHERE login LIKE %s", [BENCH_PREFIX + "%"])
+        user_ids = [row[0] for row in cur.fetchall()]
+        cur.execute("DELETE FROM user_accounts WHERE user_id = ANY(%s)", [user_ids])
+        cur.execute("DELETE FROM user_balances WHERE user_id = ANY(%s)", [user_ids])
+        cur.execute("SELECT DISTINCT machine_price_id FROM jobs WHERE project_uid = %s", [BENCH_PREFIX + "project"])
+        price_ids = [row[0] for row in cur.fetchall()]
+        cur.execute("DELETE FROM jobs WHERE project_uid = %s", [BENCH_PREFIX + "project"])
+        cur.execute("DELETE FROM machine_prices_history WHERE id = ANY(%s)", [price_ids])
+        cur.execute("DELETE FROM operations_history WHERE operation_name = %s", [BENCH_PREFIX + "calc"])
+        cur.execute("DELETE FROM users WHERE id = ANY(%s)", [user_ids])
+    conn.commit()
+
+
+def legacy_get_credit(cur, user_id):
+    cur.execute('SELECT COALESCE(SUM(amount), 0) as credit FROM user_accounts WHERE user_id = %s', [user_id])
+    return int(cur.fetchone()["credit"])
+
+
+def legacy_charge(cur, job_id):
+    """ The previous charge_user_computing, without the transaction handling """
+    cur.execute("SELECT user_id, machine_price_id, start_time, nbr_machines FROM jobs WHERE id = %s", [job_id])
+    job = cur.fetchone()
+    cur.execute("SELECT * FROM machine_prices_history WHERE id = %s", [job["machine_price_id"]])
+    price = cur.fetchone()
+    cur.execute("SELECT now()")
+    now = cur.fetchone()[0].replace(tzinfo=None)
+    cur.execute("SELECT MAX(computing_end) FROM user_accounts WHERE job_id = %s", [job_id])
+    start_time = cur.fetchone()[0]
+    end_time = start_time + datetime.timedelta(seconds=price["sec_granularity"])
+    while end_time < now:
+        end_time += datetime.timedelta(seconds=price["sec_granularity"])
+    charged_price = (end_time - start_time).total_seconds() * int(price["sec_price"]) * int(job["nbr_machines"])
+    cur.execute("""INSERT INTO user_accounts (user_id, amount, description, job_id, computing_start, computing_end)
+                        VALUES (%s, %s, %s, %s, %s, %s)""",
+                [job["user_id"], charged_price * -1, DESCRIPTION, job_id, start_time, end_time])
+    return end_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the previous billing queries with the set-based ones")
+    parser.add_argument("dsn", help="The libpq connection string of a scratch database")
+    parser.add_argument("-u", "--users", type=int, default=200, help="Number of users, default 200")
+    parser.add_argument("-t", "--transactions", type=int, default=2000,
+                        help="Number of transactions per user over the year, default 2000")
+    parser.add_argument("-j", "--jobs", type=int, default=200, help="Number of running jobs to charge, default 200")
+    args = parser.parse_args()
+
+    core.api_util.DatabaseContext.set_dsn(args.dsn)
+    conn = psycopg2.connect(args.dsn, cursor_factory=psycopg2.extras.DictCursor)
+    try:
+        delete_dataset(conn)
+        start = time.time()
+        user_ids, job_ids = create_dataset(conn, args.users, args.transactions, args.jobs)
+        print("%d transactions created in %.1fs" % (args.users * args.transactions, time.time() - start))
+
+        with conn.cursor() as cur:
+            start = time.time()
+            expected = [legacy_get_credit(cur, user_id) for user_id in user_ids]
+            before = time.time() - start
+        conn.rollback()
+        start = time.time()
+        result = [models.users.get_credit(user_id) for user_id in user_ids]
+        after = time.time() - start
+        print("%-16s %10s %10s %10s %8s" % ("entity", "before", "after", "speedup", "same"))
+        print("%-16s %9.3fs %9.3fs %9.1fx %8s" % ("get_credit", before, after, before / max(after, 1e-6),
+                                                 expected == result))
+
+        # The previous charges are rolled back, so both implementations charge the same periods
+        with conn.cursor() as cur:
+            start = time.time()
+            expected = {job_id: legacy_charge(cur, job_id) for job_id in job_ids}
+            before = time.time() - start
+        conn.rollback()
+        start = time.time()
+        result = {}
+        for job_id in job_ids:
+            result.update(models.users.charge_computing_jobs(DESCRIPTION, [job_id]))
+        after = time.time() - start
+        print("%-16s %9.3fs %9.3fs %9.1fx %8s" % ("computing charge", before, after, before / max(after, 1e-6),
+                                                 expected == result))
+    finally:
+        conn.rollback()
+        delete_dataset(conn)
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: set tabstop=4:softtabstop=4:shiftwidth=4:expandtab:textwidth=120
+
+"""
+This script measures the latency of the calculation/show endpoint, the one polled by the clients while a calculation
+is running. Run it against a server before and after a change to compare the percentiles.
+
+Example:
+    python tools/benchmarks/calculation_show.py https://localhost/api/v1 some_login some_password PROJECT_UID calc_1 \
+        -n 500 -c 8
+"""
+
+# Core libs
+import sys
+import time
+import json
+import ssl
+import base64
+import urllib
+import urllib2
+import argparse
+import threading
+
+
+def percentile(sorted_values, ratio):
+    index = min(len(sorted_values) - 1, int(round(ratio * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def call_endpoint(api_url, auth_header, params, ssl_context):
+    """
+    Call calculation/show once
+
+    :param api_url:         The url of the api, ex: https://localhost/api/v1
+    :type api_url:          str
+    :param auth_header:     The Authorization header value
+    :type auth_header:      str
+    :param params:          The request parameters
+    :type params:           dict[str, str]
+    :param ssl_context:     The ssl context to use
+    :type ssl_context:      ssl.SSLContext
+    :return:                The duration of the call, in milliseconds
+    :rtype:                 float
+    """
+    request = urllib2.Request(api_url.rstrip("/") + "/calculation/show/", data=urllib.urlencode(params))
+    request.add_header("Authorization", auth_header)
+    start = time.time()
+    response = urllib2.urlopen(request, context=ssl_context)
+    content = response.read()
+    duration = (time.time() - start) * 1000
+    if not json.loads(content).get("success", True):
+        raise RuntimeError("Request failed: " + content)
+    return duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the latency of the calculation/show endpoint")
+    parser.add_argument("api_url", help="The url of the api v1, ex: https://localhost/api/v1")
+    parser.add_argument("login", help="The user login")
+    parser.add_argument("password", help="The user password")
+    parser.add_argument("project_codename", help="The project uid")
+    parser.add_argument("calculation_name", help="The calculation name")
+    parser.add_argument("-n", "--count", type=int, default=200, help="Number of calls, default 200")
+    parser.add_argument("-c", "--concurrency", type=int, default=1, help="Number of parallel clients, default 1")
+    parser.add_argument("-k", "--insecure", action="store_true", help="Do not check the server certificate")
+    args = parser.parse_args()
+
+    auth_header = "Basic " + base64.b64encode(args.login + ":" + args.password)
+    params = {"project_codename": args.project_codename, "calculation_name": args.calculation_name}
+    ssl_context = ssl.create_default_context()
+    if args.insecure:
+        ssl_context.check_hostname = False
+        ssl_context.verify_mode = ssl.CERT_NONE
+
+    call_endpoint(args.api_url, auth_header, params, ssl_context)  # Warm up
+    durations = []
+    errors = []
+    lock = threading.Lock()
+
+    def _client(count):
+        for _ in range(count):
+            try:
+                duration = call_endpoint(args.api_url, auth_header, params, ssl_context)
+                with lock:
+                    durations.append(duration)
+            except Exception as e:
+                with lock:
+                    errors.append(e)
+
+    start = time.time()
+    threads = []
+    for i in range(args.concurrency):
+        count = args.count // args.concurrency + (1 if i < args.count % args.concurrency else 0)
+        threads.append(threading.Thread(target=_client, args=(count,)))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    total_duration = time.time() - start
+
+    if not durations:
+        print("All the requests failed, first error: " + str(errors[0]))
+        return 1
+    durations.sort()
+    print("%-10s %10s %10s %10s %10s %12s %8s" % ("requests", "p50", "p95", "p99", "max", "throughput", "errors"))
+    print("%-10d %8.1fms %8.1fms %8.1fms %8.1fms %9.1freq/s %8d" % (len(durations), percentile(durations, 0.5),
+                                                                     percentile(durations, 0.95),
+                                                                     percentile(durations, 0.99), durations[-1],
+                                                                     len(durations) / total_duration, len(errors)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
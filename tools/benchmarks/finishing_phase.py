@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: set tabstop=4:softtabstop=4:shiftwidth=4:expandtab:textwidth=120
+
+"""
+This script measures the finishing phase of a calculation, from the end of the toolchain to the moment the workers
+can be released, with the previous sequential steps and with the ResultPipeline.
+The worker can be any sshd, for example a worker container created by the DockerProvider:
+    docker inspect -f '{{range .NetworkSettings.Networks}}{{.IPAddress}}{{end}}' CONTAINER_ID
+
+Both runs do the same work:
+ - the worker packages the result archives one after the other (random data written on its disk)
+ - the server fetches the worker log and the calculation status files (a file of --status-size MB)
+ - the server saves every archive on a local storage, as the DockerProvider setups do
+Before, the server waited for all the archives, then fetched the log, saved the archives and fetched the status
+files one step after the other. After, each archive is saved as soon as it is written, and the log and status files
+are fetched while the last archives are saved.
+
+Example:
+    python tools/benchmarks/finishing_phase.py 172.17.0.2 aziugo cloud_ssh_keys/id_rsa_docker -n 4 -s 200
+"""
+
+# Core libs
+import os
+import sys
+import time
+import argparse
+import tempfile
+import shutil
+
+# Project specific libs
+script_path = os.path.dirname(os.path.abspath(__file__))
+project_path = os.path.abspath(os.path.join(script_path, "..", ".."))
+sys.path.append(os.path.join(project_path, 'src', 'server'))
+
+from lib import ssh
+import core.api_util
+import core.cmd_util
+import core.storages
+
+MB = 1024 * 1024
+
+
+def package_archive(conn, remote_folder, filename, size_mb):
+    """ Write an archive on the worker the way the packaging does: in a temporary file, renamed when complete """
+    path = remote_folder.rstrip("/") + "/" + filename
+    conn.run("head -c " + str(int(size_mb * MB)) + " /dev/urandom > '" + path + ".tmp' && mv -f '" + path + ".tmp' '" +
+             path + "'", shell=True)
+
+
+def fetch_file(conn, remote_path, tmp_folder):
+    """ Fetch a file of the worker, like the log and status files fetching """
+    local_path = os.path.join(tmp_folder, os.path.basename(remote_path) + "." + str(time.time()))
+    conn.get_file(remote_path, local_path)
+    os.remove(local_path)
+
+
+def run_sequential(conn, remote_folder, result_files, dest_storage, tmp_folder, size_mb, max_parallel):
+    """ The finishing phase before the ResultPipeline """
+    worker_out_storage = core.storages.SshStorage(conn, remote_folder, True)
+    start = time.time()
+    for result_file in result_files:
+        package_archive(conn, remote_folder, str(result_file), size_mb)
+    packaged = time.time()
+    fetch_file(conn, remote_folder.rstrip("/") + "/worker.log", tmp_folder)
+    for result_file in result_files:
+        if not result_file.exists(worker_out_storage):
+            raise RuntimeError("No file " + str(result_file) + " on worker")
+    core.cmd_util.save_result_files(result_files, worker_out_storage, dest_storage, tmp_folder, max_parallel)
+    fetch_file(conn, remote_folder.rstrip("/") + "/status.zip", tmp_folder)
+    return packaged - start, time.time() - start
+
+
+def run_pipelined(conn, remote_folder, result_files, dest_storage, tmp_folder, size_mb, max_parallel):
+    """ The finishing phase with the ResultPipeline, the archives are announced as soon as they are written """
+    worker_out_storage = core.storages.SshStorage(conn, remote_folder, True)
+    pipeline = core.cmd_util.ResultPipeline(result_files, worker_out_storage, dest_storage, tmp_folder, max_parallel)
+    start = time.time()
+    try:
+        for result_file in result_files:
+            package_archive(conn, remote_folder, str(result_file), size_mb)
+            pipeline.on_result_ready(str(result_file))
+        packaged = time.time()
+        pipeline.run_in_background(fetch_file, conn, remote_folder.rstrip("/") + "/worker.log", tmp_folder)
+        pipeline.run_in_background(fetch_file, conn, remote_folder.rstrip("/") + "/status.zip", tmp_folder)
+        pipeline.finish(result_files)
+    except:
+        pipeline.close()
+        raise
+    return packaged - start, time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the sequential and pipelined finishing phase of a job")
+    parser.add_argument("ip", help="The ip of the worker sshd")
+    parser.add_argument("user", help="The ssh user")
+    parser.add_argument("key_file", help="The private key file")
+    parser.add_argument("-n", "--archives", type=int, default=4, help="Number of result archives, default 4")
+    parser.add_argument("-s", "--size", type=float, default=200, help="Size of each archive in MB, default 200")
+    parser.add_argument("--status-size", type=float, default=20, help="Size of the status files in MB, default 20")
+    parser.add_argument("-p", "--parallel", type=int, default=4, help="Simultaneous transfers, default 4")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="Number of runs per implementation, default 3")
+    parser.add_argument("-f", "--folder", default="/tmp/finishing_bench", help="Distant writable folder")
+    args = parser.parse_args()
+
+    # The background steps of this benchmark never query the database, so no connection is opened
+    core.api_util.DatabaseContext.set_dsn("dbname='finishing_bench'")
+    conn = ssh.SshConnection(args.ip, args.user, args.key_file, multiplexed=True)
+    conn.wait_for_connection(timeout=60)
+    tmp_folder = tempfile.mkdtemp(prefix="finishing_bench_")
+    try:
+        conn.run(["mkdir", "-p", args.folder])
+        conn.run("head -c " + str(MB) + " /dev/urandom | base64 > '" + args.folder + "/worker.log'", shell=True)
+        conn.run("head -c " + str(int(args.status_size * MB)) + " /dev/urandom > '" + args.folder + "/status.zip'",
+                 shell=True)
+        results = {"before": [], "after": []}
+        for i in range(args.repeat):
+            for name, func in (("before", run_sequential), ("after", run_pipelined)):
+                dest_storage = core.storages.LocalFsStorage("bench", os.path.join(tmp_folder, "dest_" + name), "eu")
+                result_files = [core.cmd_util.ResultFile("BENCH", "BENCH-calc-%d-%d.zip" % (i, n))
+                                for n in range(args.archives)]
+                results[name].append(func(conn, args.folder, result_files, dest_storage, tmp_folder, args.size,
+                                          args.parallel))
+                conn.run("rm -f '" + args.folder + "'/BENCH-calc-*", shell=True)
+                shutil.rmtree(os.path.join(tmp_folder, "dest_" + name), ignore_errors=True)
+    finally:
+        conn.run(["rm", "-rf", args.folder], can_fail=True)
+        conn.close()
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+
+    before = min(total for _, total in results["before"])
+    after = min(total for _, total in results["after"])
+    print("%d archives of %.0f MB, status files of %.0f MB, best of %d runs" % (args.archives, args.size,
+                                                                              args.status_size, args.repeat))
+    print("%-8s %12s %12s" % ("entity", "packaging", "total"))
+    for name in ("before", "after"):
+        packaging, total = min(results[name], key=lambda result: result[1])
+        print("%-8s %11.2fs %11.2fs" % (name, packaging, total))
+    print("speedup: %.2fx, %.1fs less between the toolchain exit and the workers release" % (
+        before / max(after, 1e-6), before - after))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+"""
+The point by point post-processing of CFD_CALC_01 as it was before the vectorization, used as the reference of
+mapping_postprocessing.py.
+The function bodies are copied verbatim from src/worker/toolchain/ZephyTOOLS/APPLI/TMP/CFD_CALC_01.py at the
+baseline commit (5fb3447), only wrapped in functions returning the computed values. Don't fix them.
+"""
+
+from math import atan2,degrees,sqrt
+import numpy as np
+import pandas as pd
+
+# CFD_CALC_01.py lines 228-252
+def Rect2Polar(ux,uy,uz):
+	"""
+	IEC 61400-12-1:
+	Wind direction is defined as the direction from which the wind blows,
+	and it is measured clockwise from true geographical north.
+	"""
+	
+	direc=90.-degrees(atan2(-uy,-ux))
+	while direc<0: direc+=360.
+	while direc>=360: direc-=360.
+	vh=sqrt(ux*ux+uy*uy)
+	inc=90.-degrees(atan2(vh,uz))
+	return direc,inc
+
+def Cart2WindDir(ux,uy):
+	"""
+	IEC 61400-12-1:
+	Wind direction is defined as the direction from which the wind blows,
+	and it is measured clockwise from true geographical north.
+	"""
+	direc=90.-degrees(atan2(-uy,-ux))
+	while direc<0: direc+=360.
+	while direc>=360: direc-=360.
+	
+	return direc
+
+def GetResMesoPolar(p,vx,vy,vz,tke):
+	# CFD_CALC_01.py GetResMeso, lines 2521-2544
+	v_np=np.sqrt(vx*vx+vy*vy+vz*vz)
+	vh_np=np.sqrt(vx*vx+vy*vy)
+	iu_np=np.sqrt(tke)/vh_np
+
+	tmp_np=np.sqrt(vx*vx+vy*vy)
+	direc_np=tmp_np
+	inc_np=tmp_np
+	
+	for ip in range(len(v_np)):
+		vvx=vx[ip]
+		vvy=vy[ip]
+		vvz=vz[ip]
+		direc,inc=Rect2Polar(vvx,vvy,vvz)
+		
+		direc1=p.direcval
+		direc2=direc
+		if direc1<90. and direc2>270:	direc1+=360.
+		elif direc1>270. and direc2<90:	direc2+=360.
+		ecart=direc2-direc1
+		if ecart>+180.:		ecart-=360
+		elif ecart<-180.:	ecart+=360
+		
+		direc_np[ip]=ecart
+		inc_np[ip]=inc
+	return direc_np,inc_np
+
+def GetResMappingRefFrame(workdir,num):
+	# CFD_CALC_01.py GetResMapping, lines 2598-2645
+	# reference frame
+	
+	X,Y,Z=[],[],[]
+	with open(workdir+'/system/sampleDict_MAPPING_'+num,'r') as ref_file:
+		lines=ref_file.readlines()
+		for line in lines[38:]:
+			try:
+				s=line.lstrip('		( ').rstrip(' )\n')
+				x,y,z=s.split()
+				x,y,z=round(float(x),1),round(float(y),1),float(z)
+				X.append(x)
+				Y.append(y)
+				Z.append(z)
+			except:pass
+			
+	ref_df= pd.DataFrame({'x':X,'y':Y,'z':Z})
+	
+	X,Y,Z=[],[],[]
+	with open(workdir+'/system/sampleDict_MAPPING_'+num+'_down','r') as ref_file:
+		lines=ref_file.readlines()
+		for line in lines[38:]:
+			try:
+				s=line.lstrip('		( ').rstrip(' )\n')
+				x,y,z=s.split()
+				x,y,z=round(float(x),1),round(float(y),1),float(z)
+				X.append(x)
+				Y.append(y)
+				Z.append(z)
+			except:pass
+			
+	ref_down= pd.DataFrame({'x':X,'y':Y,'z_down':Z})
+	ref_df=ref_df.merge(ref_down,how='left',on=['x','y'])
+	
+	X,Y,Z=[],[],[]
+	with open(workdir+'/system/sampleDict_MAPPING_'+num+'_up','r') as ref_file:
+		lines=ref_file.readlines()
+		for line in lines[38:]:
+			try:
+				s=line.lstrip('		( ').rstrip(' )\n')
+				x,y,z=s.split()
+				x,y,z=round(float(x),1),round(float(y),1),float(z)
+				X.append(x)
+				Y.append(y)
+				Z.append(z)
+			except:pass
+			
+	ref_up= pd.DataFrame({'x':X,'y':Y,'z_up':Z})
+	ref_df=ref_df.merge(ref_up,how='left',on=['x','y'])
+	return ref_df
+
+def GetResMappingDir(ref_df):
+	# CFD_CALC_01.py GetResMapping, line 2688
+	ref_df['dir']=ref_df.apply(lambda row: Cart2WindDir(row['vx'], row['vy']), axis=1)
+	return ref_df['dir'].values
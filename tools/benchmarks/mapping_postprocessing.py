@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: set tabstop=4:softtabstop=4:shiftwidth=4:expandtab:textwidth=120
+
+"""
+This script compares the previous point by point implementation of the mesoscale and mapping post-processing steps
+of CFD_CALC_01 with the array based one, on a synthetic mapping grid.
+The previous implementation is the baseline code copied verbatim in legacy_cfd_calc_01.py.
+For each step it checks the values of both implementations, then prints their durations. It exits with 1 if any
+value differs outside of the intended changes:
+ - meso direction: the previous loop stored the direction deviation and the inclination in the same array, so the
+   reported direction was the inclination. The new direction is the deviation from the reference direction: it is
+   checked against the direction of the previous Rect2Polar, modulo 360 and within [-180, 180].
+ - sampleDict points: x and y are now rounded to 0.1 by numpy, like the sampled results they are merged with
+   (pandas round), instead of the python round. Only the coordinates where both roundings differ may change.
+It imports the worker toolchain, so it should be run on a worker image (or any host with the toolchain dependencies).
+
+Example:
+    python tools/benchmarks/mapping_postprocessing.py -n 500
+"""
+
+# Core libs
+import os
+import sys
+import time
+import argparse
+import tempfile
+import shutil
+
+# Project specific libs
+script_path = os.path.dirname(os.path.abspath(__file__))
+project_path = os.path.abspath(os.path.join(script_path, "..", ".."))
+sys.path.append(os.path.join(project_path, 'src', 'worker', 'toolchain', 'ZephyTOOLS', 'APPLI', 'TMP'))
+
+import numpy as np
+import pandas as pd
+import CFD_CALC_01
+import legacy_cfd_calc_01
+
+
+class MesoParams(object):
+    """ The part of the CFD_CALC_01 parameters used by the meso post-processing """
+    def __init__(self, direcval):
+        self.direcval = direcval
+
+
+def write_sample_dict(filename, xs, ys, zs):
+    """
+    Write a sampleDict the way the mapping preparation of CFD_CALC_01 does
+
+    :param filename:    The file to write
+    :type filename:     str
+    :param xs:          The x coordinates of the points
+    :type xs:           np.ndarray
+    :param ys:          The y coordinates of the points
+    :type ys:           np.ndarray
+    :param zs:          The z coordinates of the points
+    :type zs:           np.ndarray
+    """
+    with open(filename, "w") as fh:
+        for i in range(30):
+            fh.write("// header line " + str(i) + "\n")
+        fh.write("sets\n(\n  results\n  {\n    type    points;\n    functionObjectLibs (\"libsampling.so\");\n")
+        fh.write("    axis    xyz;\n    ordered yes;\n    points (\n")
+        for x, y, z in zip(xs, ys, zs):
+            fh.write('        ( ' + str(x) + ' ' + str(y) + ' ' + str(z) + ' )\n')
+        fh.write("    );\n  }\n);\n")
+        fh.write("fields ( U p nut k epsilon );\n")
+
+
+def vectorized_ref_frame(workdir, num):
+    """ The reference frame of CFD_CALC_01.GetResMapping """
+    pts = CFD_CALC_01.ReadSampleDictPoints(workdir + '/system/sampleDict_MAPPING_' + num)
+    ref_df = pd.DataFrame({'x': pts[:, 0], 'y': pts[:, 1], 'z': pts[:, 2]})
+    pts = CFD_CALC_01.ReadSampleDictPoints(workdir + '/system/sampleDict_MAPPING_' + num + '_down')
+    ref_down = pd.DataFrame({'x': pts[:, 0], 'y': pts[:, 1], 'z_down': pts[:, 2]})
+    ref_df = ref_df.merge(ref_down, how='left', on=['x', 'y'])
+    pts = CFD_CALC_01.ReadSampleDictPoints(workdir + '/system/sampleDict_MAPPING_' + num + '_up')
+    ref_up = pd.DataFrame({'x': pts[:, 0], 'y': pts[:, 1], 'z_up': pts[:, 2]})
+    return ref_df.merge(ref_up, how='left', on=['x', 'y'])
+
+
+def vectorized_polar(p, vx, vy, vz):
+    """ The direction and inclination of CFD_CALC_01.GetResMeso """
+    direc_np, inc_np = CFD_CALC_01.Rect2PolarArray(vx, vy, vz)
+    return CFD_CALC_01.DirDeviationArray(p.direcval, direc_np), inc_np
+
+
+def vectorized_wind_dir(df):
+    return CFD_CALC_01.Cart2WindDirArray(df['vx'].values, df['vy'].values)
+
+
+def measure(func, repeat):
+    """
+    Run a function several times and get its best duration and its result
+
+    :param func:        The function to run
+    :type func:         callable
+    :param repeat:      The number of calls
+    :type repeat:       int
+    :return:            The best duration in seconds, and the result of the last call
+    :rtype:             tuple[float, any]
+    """
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.time()
+        result = func()
+        duration = time.time() - start
+        best = duration if best is None else min(best, duration)
+    return best, result
+
+
+def same_values(a, b):
+    a = np.asarray(a)
+    b = np.asarray(b)
+    return a.shape == b.shape and np.array_equal(np.isnan(a), np.isnan(b)) and \
+        np.array_equal(a[~np.isnan(a)], b[~np.isnan(b)])
+
+
+def check_ref_frame(expected, result, coords):
+    """
+    Check the reference frames are the same, except for the coordinates rounded differently by numpy and python
+
+    :param expected:    The reference frame of the baseline implementation
+    :type expected:     pd.DataFrame
+    :param result:      The reference frame of the new implementation
+    :type result:       pd.DataFrame
+    :param coords:      The unrounded x and y of the points, in the file order
+    :type coords:       tuple[np.ndarray, np.ndarray]
+    :return:            True if the frames only differ by the intended change
+    :rtype:             bool
+    """
+    if sorted(expected.columns) != sorted(result.columns) or len(expected) != len(result):
+        return False
+    changed = np.zeros(len(result), dtype=bool)
+    for values in coords:
+        changed |= np.round(values, 1) != np.array([round(v, 1) for v in values])
+    print("sampleDict points: %d points rounded differently by numpy and python" % changed.sum())
+    for col in expected.columns:
+        if not same_values(expected[col].values[~changed], result[col].values[~changed]):
+            return False
+    return same_values(result['x'].values[changed], np.round(coords[0][changed], 1)) and \
+        same_values(result['y'].values[changed], np.round(coords[1][changed], 1))
+
+
+def check_polar(p, vx, vy, vz, expected, result):
+    """
+    Check the meso inclination is the same, and that the new direction is the deviation from the reference direction
+
+    :param p:           The meso parameters
+    :type p:            MesoParams
+    :param vx:          The x velocities
+    :type vx:           np.ndarray
+    :param vy:          The y velocities
+    :type vy:           np.ndarray
+    :param vz:          The z velocities
+    :type vz:           np.ndarray
+    :param expected:    The direction and inclination of the baseline implementation
+    :type expected:     tuple[np.ndarray, np.ndarray]
+    :param result:      The direction and inclination of the new implementation
+    :type result:       tuple[np.ndarray, np.ndarray]
+    :return:            True if the values only differ by the intended change
+    :rtype:             bool
+    """
+    if not same_values(expected[1], result[1]):
+        return False
+    # The baseline direction array is the inclination array
+    if not same_values(expected[0], expected[1]):
+        return False
+    direc = np.array([legacy_cfd_calc_01.Rect2Polar(x, y, z)[0] for x, y, z in zip(vx, vy, vz)])
+    gap = np.mod(result[0] + p.direcval - direc + 180., 360.) - 180.
+    valid = ~np.isnan(direc)
+    return np.array_equal(np.isnan(result[0]), ~valid) and bool(np.all(np.abs(gap[valid]) < 1e-9)) and \
+        bool(np.all(np.abs(result[0][valid]) <= 180.))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the point by point and array based post-processing")
+    parser.add_argument("-n", "--grid-size", type=int, default=300, help="Points per side of the grid, default 300")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="Number of runs per implementation, default 3")
+    parser.add_argument("-d", "--direction", type=float, default=350., help="Reference direction, default 350")
+    args = parser.parse_args()
+
+    rand = np.random.RandomState(42)
+    grid_x, grid_y = np.meshgrid(np.arange(args.grid_size) * 25. + 654321.05, np.arange(args.grid_size) * 25. + 1e6)
+    # Coordinates with 2 decimals, so a lot of them are near the rounding ties
+    xs = np.round(grid_x.ravel() + rand.uniform(-1, 1, grid_x.size), 2)
+    ys = np.round(grid_y.ravel() + rand.uniform(-1, 1, grid_y.size), 2)
+    zs = rand.uniform(0, 800, xs.shape)
+    vx = rand.normal(0, 8, xs.shape)
+    vy = rand.normal(0, 8, xs.shape)
+    vz = rand.normal(0, 1, xs.shape)
+    tke = rand.uniform(0.1, 2, xs.shape)
+    vx[::97] = np.nan
+    df = pd.DataFrame({'vx': vx, 'vy': vy})
+    meso_params = MesoParams(args.direction)
+
+    tmp_folder = tempfile.mkdtemp(prefix="mapping_bench_")
+    try:
+        os.mkdir(os.path.join(tmp_folder, "system"))
+        sample_dict = os.path.join(tmp_folder, "system", "sampleDict_MAPPING_0")
+        write_sample_dict(sample_dict, xs, ys, zs)
+        write_sample_dict(sample_dict + "_down", xs, ys, zs - 5.)
+        write_sample_dict(sample_dict + "_up", xs, ys, zs + 5.)
+        entities = [
+            ("sampleDict points", lambda: legacy_cfd_calc_01.GetResMappingRefFrame(tmp_folder, "0"),
+             lambda: vectorized_ref_frame(tmp_folder, "0"),
+             lambda expected, result: check_ref_frame(expected, result, (xs, ys))),
+            ("meso polar", lambda: legacy_cfd_calc_01.GetResMesoPolar(meso_params, vx, vy, vz, tke),
+             lambda: vectorized_polar(meso_params, vx, vy, vz),
+             lambda expected, result: check_polar(meso_params, vx, vy, vz, expected, result)),
+            ("wind direction", lambda: legacy_cfd_calc_01.GetResMappingDir(df.copy()),
+             lambda: vectorized_wind_dir(df), same_values),
+        ]
+
+        print("%d points" % len(xs))
+        lines = []
+        all_same = True
+        for name, legacy_func, vectorized_func, check in entities:
+            before, expected = measure(legacy_func, args.repeat)
+            after, result = measure(vectorized_func, args.repeat)
+            same = check(expected, result)
+            all_same = all_same and same
+            lines.append("%-20s %9.3fs %9.3fs %9.1fx %8s" % (name, before, after, before / max(after, 1e-6), same))
+        print("%-20s %10s %10s %10s %8s" % ("entity", "before", "after", "speedup", "expected"))
+        for line in lines:
+            print(line)
+    finally:
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+    return 0 if all_same else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
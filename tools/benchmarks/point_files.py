@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: set tabstop=4:softtabstop=4:shiftwidth=4:expandtab:textwidth=120
+
+"""
+This script compares the text and the binary point files exchanged between the stages of the worker toolchain, on a
+synthetic cloud of ground points as large as the ones of a big site.
+For each format it prints the write and read throughputs and the size on disk, and checks that the points read back
+are the same (the text version is rounded to 2 decimals, so the comparison uses this tolerance).
+It imports the worker toolchain, so it should be run on a worker image (or any host with the toolchain dependencies).
+
+Example:
+    python tools/benchmarks/point_files.py -n 5000000
+"""
+
+# Core libs
+import os
+import sys
+import time
+import argparse
+import tempfile
+import shutil
+
+# Project specific libs
+script_path = os.path.dirname(os.path.abspath(__file__))
+project_path = os.path.abspath(os.path.join(script_path, "..", ".."))
+sys.path.append(os.path.join(project_path, 'src', 'worker', 'toolchain', 'ZephyTOOLS', 'APPLI', 'TMP'))
+
+import numpy as np
+import ZS_COMMON
+
+GROUND_PTS_FORMAT = '%20.2f\t%20.2f\t%15i'
+
+
+def legacy_read_points(filename):
+    """ The previous parsing of the point files, line by line """
+    points = []
+    with open(filename, 'r') as infile:
+        for line in infile.readlines():
+            points.append([float(val) for val in line.split()])
+    return np.array(points)
+
+
+def measure(func):
+    start = time.time()
+    result = func()
+    return time.time() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the text and binary point files of the worker toolchain")
+    parser.add_argument("-n", "--points", type=int, default=2000000, help="Number of points, default 2000000")
+    args = parser.parse_args()
+
+    rand = np.random.RandomState(42)
+    points = np.column_stack((rand.uniform(-20000, 20000, args.points), rand.uniform(-20000, 20000, args.points),
+                              np.arange(args.points, dtype=np.float64) + 1))
+    nbr_mb = points.nbytes / 1e6
+
+    tmp_folder = tempfile.mkdtemp(prefix="point_files_bench_")
+    try:
+        text_file = os.path.join(tmp_folder, "ground_pts_text")
+        binary_file = os.path.join(tmp_folder, "ground_pts_binary")
+        text_write, _ = measure(lambda: ZS_COMMON.WritePoints(text_file, points, GROUND_PTS_FORMAT, binary=False))
+        binary_write, _ = measure(lambda: ZS_COMMON.WritePoints(binary_file, points, GROUND_PTS_FORMAT, binary=True))
+        legacy_read, legacy_points = measure(lambda: legacy_read_points(text_file))
+        text_read, text_points = measure(lambda: np.array(ZS_COMMON.ReadPoints(text_file)))
+        # The memory-mapped points are copied, so the pages are really read
+        binary_read, binary_points = measure(lambda: np.array(ZS_COMMON.ReadPoints(binary_file)))
+
+        same = (np.allclose(legacy_points, points, rtol=0, atol=0.005) and
+                np.allclose(text_points, points, rtol=0, atol=0.005) and
+                np.array_equal(binary_points, points))
+        print("%d points, %.1f MB in memory" % (args.points, nbr_mb))
+        print("%-20s %10s %12s %10s" % ("entity", "duration", "throughput", "size"))
+        for name, duration, filename in [("write text", text_write, text_file),
+                                         ("write binary", binary_write, binary_file),
+                                         ("read text, lines", legacy_read, text_file),
+                                         ("read text, loadtxt", text_read, text_file),
+                                         ("read binary, mmap", binary_read, binary_file)]:
+            print("%-20s %9.3fs %8.1fMB/s %8.1fMB" % (name, duration, nbr_mb / max(duration, 1e-6),
+                                                     os.path.getsize(filename) / 1e6))
+        print("same points: %s" % same)
+    finally:
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+    return 0 if same else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
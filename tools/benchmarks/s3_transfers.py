@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: set tabstop=4:softtabstop=4:shiftwidth=4:expandtab:textwidth=120
+
+"""
+This script compare the upload time of a set of result-like files on an S3Storage, between the previous behaviour
+(boto default transfer configuration, one file after the other) and the tuned one (configured part size and
+concurrency, several files at the same time).
+The target can be any S3 compatible server, for example a local minio:
+    docker run -d -p 9000:9000 -e MINIO_ACCESS_KEY=minio -e MINIO_SECRET_KEY=minio123 minio/minio server /data
+    (and create the bucket with the minio client or the web interface)
+
+Example:
+    python tools/benchmarks/s3_transfers.py http://127.0.0.1:9000 bench minio minio123 -n 4 -s 200
+"""
+
+# Core libs
+import os
+import sys
+import time
+import argparse
+import tempfile
+import shutil
+import threading
+
+# Project specific libs
+script_path = os.path.dirname(os.path.abspath(__file__))
+project_path = os.path.abspath(os.path.join(script_path, "..", ".."))
+sys.path.append(os.path.join(project_path, 'src', 'server'))
+
+from core import storages
+
+
+def create_files(folder, count, size_mb):
+    """
+    Create some random files
+
+    :param folder:      The folder where to create the files
+    :type folder:       str
+    :param count:       The number of files
+    :type count:        int
+    :param size_mb:     The size of each file, in MB
+    :type size_mb:      int
+    :return:            The created file paths
+    :rtype:             list[str]
+    """
+    filenames = []
+    for i in range(count):
+        filename = os.path.join(folder, "result_" + str(i) + ".zip")
+        with open(filename, "wb") as fh:
+            for _ in range(size_mb):
+                fh.write(os.urandom(1024 * 1024))
+        filenames.append(filename)
+    return filenames
+
+
+def upload_sequential(storage, filenames):
+    for filename in filenames:
+        storage.upload_file(filename, "bench/" + os.path.basename(filename))
+
+
+def upload_parallel(storage, filenames, max_parallel):
+    errors = []
+    semaphore = threading.Semaphore(max_parallel)
+
+    def _upload(filename):
+        with semaphore:
+            try:
+                storage.upload_file(filename, "bench/" + os.path.basename(filename))
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=_upload, args=(filename,)) for filename in filenames]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+
+def measure(func, count):
+    """
+    Run a function several times and get the duration of each call
+
+    :param func:        The function to run
+    :type func:         callable
+    :param count:       The number of calls
+    :type count:        int
+    :return:            The durations, in seconds, sorted
+    :rtype:             list[float]
+    """
+    durations = []
+    for _ in range(count):
+        start = time.time()
+        func()
+        durations.append(time.time() - start)
+    return sorted(durations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare S3 uploads with default and tuned transfer configuration")
+    parser.add_argument("endpoint_url", help="The url of the S3 compatible server")
+    parser.add_argument("bucket", help="An existing bucket")
+    parser.add_argument("key_id", help="The access key id")
+    parser.add_argument("key_secret", help="The access key secret")
+    parser.add_argument("-n", "--files", type=int, default=4, help="Number of files to upload, default 4")
+    parser.add_argument("-s", "--size", type=int, default=100, help="Size of each file in MB, default 100")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="Number of runs per mode, default 3")
+    parser.add_argument("-p", "--part-size", type=int, default=storages.S3Storage.TRANSFER_PART_SIZE,
+                        help="Tuned part size in bytes, default " + str(storages.S3Storage.TRANSFER_PART_SIZE))
+    parser.add_argument("-c", "--concurrency", type=int, default=storages.S3Storage.TRANSFER_MAX_CONCURRENCY,
+                        help="Tuned concurrency per file, default " + str(storages.S3Storage.TRANSFER_MAX_CONCURRENCY))
+    parser.add_argument("-j", "--parallel", type=int, default=4, help="Files uploaded at the same time, default 4")
+    args = parser.parse_args()
+
+    # boto3 defaults: 8MB parts and 10 threads per transfer
+    default_storage = storages.S3Storage(args.bucket, "", "bench", "us-east-1", args.key_id, args.key_secret,
+                                         transfer_config={"part_size": 8 * 1024 * 1024, "max_concurrency": 10},
+                                         endpoint_url=args.endpoint_url)
+    tuned_storage = storages.S3Storage(args.bucket, "", "bench", "us-east-1", args.key_id, args.key_secret,
+                                       transfer_config={"part_size": args.part_size,
+                                                        "max_concurrency": args.concurrency},
+                                       endpoint_url=args.endpoint_url)
+
+    tmp_folder = tempfile.mkdtemp(prefix="s3_bench_")
+    try:
+        filenames = create_files(tmp_folder, args.files, args.size)
+        before = measure(lambda: upload_sequential(default_storage, filenames), args.repeat)
+        after = measure(lambda: upload_parallel(tuned_storage, filenames, args.parallel), args.repeat)
+        for filename in filenames:
+            tuned_storage.delete_file("bench/" + os.path.basename(filename))
+    finally:
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+
+    total_mb = float(args.files * args.size)
+    print("%-12s %10s %10s %12s" % ("mode", "best", "median", "throughput"))
+    for name, durations in (("sequential", before), ("parallel", after)):
+        median = durations[len(durations) // 2]
+        print("%-12s %9.2fs %9.2fs %9.1fMB/s" % (name, durations[0], median, total_mb / max(median, 0.001)))
+    print("speedup: %.1fx" % (before[len(before) // 2] / max(after[len(after) // 2], 0.001)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
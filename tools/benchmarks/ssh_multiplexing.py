@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: set tabstop=4:softtabstop=4:shiftwidth=4:expandtab:textwidth=120
+
+"""
+This script compare the latency of the SshConnection commands with and without ssh multiplexing.
+The target can be any sshd, for example a local one or a worker container created by the DockerProvider:
+    docker inspect -f '{{range .NetworkSettings.Networks}}{{.IPAddress}}{{end}}' CONTAINER_ID
+
+Example:
+    python tools/benchmarks/ssh_multiplexing.py 172.17.0.2 aziugo cloud_ssh_keys/id_rsa_docker -n 50
+"""
+
+# Core libs
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+# Project specific libs
+script_path = os.path.dirname(os.path.abspath(__file__))
+project_path = os.path.abspath(os.path.join(script_path, "..", ".."))
+sys.path.append(os.path.join(project_path, 'src', 'server'))
+
+from lib import ssh
+
+
+def measure(func, count):
+    """
+    Run a function several times and get the duration of each call
+
+    :param func:        The function to run
+    :type func:         callable
+    :param count:       The number of calls
+    :type count:        int
+    :return:            The durations, in milliseconds, sorted
+    :rtype:             list[float]
+    """
+    durations = []
+    for _ in range(count):
+        start = time.time()
+        func()
+        durations.append((time.time() - start) * 1000)
+    return sorted(durations)
+
+
+def percentile(sorted_values, ratio):
+    index = min(len(sorted_values) - 1, int(round(ratio * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def bench_connection(conn, count, remote_folder):
+    """
+    Run the usual monitoring commands on a connection
+
+    :param conn:            The connection to use
+    :type conn:             ssh.SshConnection
+    :param count:           The number of calls for each command
+    :type count:            int
+    :param remote_folder:   A distant folder where we can write
+    :type remote_folder:    str
+    :return:                The duration of each command, per command name
+    :rtype:                 dict[str, list[float]]
+    """
+    remote_file = remote_folder.rstrip("/") + "/bench_file.txt"
+    with tempfile.NamedTemporaryFile(suffix=".txt") as local_file:
+        local_file.write("x" * 1024)
+        local_file.flush()
+        conn.send_file(local_file.name, remote_file)
+
+        results = {
+            "run": measure(lambda: conn.run(["true"]), count),
+            "file_exists": measure(lambda: conn.file_exists(remote_file), count),
+            "folder_exists": measure(lambda: conn.folder_exists(remote_folder), count),
+            "get_file_size": measure(lambda: conn.get_file_size(remote_file), count),
+            "send_file": measure(lambda: conn.send_file(local_file.name, remote_file), count),
+        }
+    conn.run(["rm", "-f", remote_file])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare ssh command latency with and without multiplexing")
+    parser.add_argument("ip", help="The ip of the target sshd")
+    parser.add_argument("user", help="The ssh user")
+    parser.add_argument("key_file", help="The private key file")
+    parser.add_argument("-n", "--count", type=int, default=20, help="Number of calls per command, default 20")
+    parser.add_argument("-f", "--folder", default="/tmp", help="Distant writable folder, default /tmp")
+    args = parser.parse_args()
+
+    plain_conn = ssh.SshConnection(args.ip, args.user, args.key_file)
+    plain_conn.wait_for_connection(timeout=60)
+    multiplexed_conn = ssh.SshConnection(args.ip, args.user, args.key_file, multiplexed=True)
+
+    try:
+        before = bench_connection(plain_conn, args.count, args.folder)
+        after = bench_connection(multiplexed_conn, args.count, args.folder)
+    finally:
+        multiplexed_conn.close()
+
+    print("%-15s %12s %12s %12s %12s %9s" % ("command", "plain p50", "plain p95", "mux p50", "mux p95", "speedup"))
+    for name in sorted(before.keys()):
+        plain_median = percentile(before[name], 0.5)
+        mux_median = percentile(after[name], 0.5)
+        print("%-15s %10.1fms %10.1fms %10.1fms %10.1fms %8.1fx" % (name, plain_median, percentile(before[name], 0.95),
+                                                                  mux_median, percentile(after[name], 0.95),
+                                                                  plain_median / max(mux_median, 0.001)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())